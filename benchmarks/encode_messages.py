@@ -0,0 +1,164 @@
+"""Benchmark encoding a page of messages as the JSON response body.
+
+Compares the previous paths (sqlite3.Row -> dict -> json.dumps, and the
+Flask LoraMessage detour) with the two paths the servers now use: objects
+rendered by SQLite's json_object(), or RowEncoder when SQLite lacks the JSON
+functions. A whole page built by json_group_array() is included as a
+reference point.
+
+Usage:
+    python benchmarks/encode_messages.py [--rows 1000] [--repeat 20]
+"""
+
+import argparse
+import json
+import os
+import sqlite3
+import sys
+import tempfile
+import timeit
+from typing import Callable
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "mlinux-7", "src"))
+
+from webapi_example.compact import PAYLOAD_SQL, TIMESTAMP_SQL  # noqa: E402
+from webapi_example.database import (  # noqa: E402
+    INSERT_MESSAGE,
+    MESSAGE_COLUMNS,
+    init_db,
+    register_functions,
+)
+from webapi_example.ingest import message_row  # noqa: E402
+from webapi_example.models.data import LoraMessage  # noqa: E402
+from webapi_example.storage import (  # noqa: E402
+    JSON_IN_SQLITE,
+    MESSAGE_ENCODER,
+    PageRequest,
+    message_page,
+)
+
+# The payload and timestamp are expressions, read by position below
+SELECT = f"SELECT {MESSAGE_COLUMNS} FROM lora_messages ORDER BY id DESC LIMIT ?"
+
+SELECT_JSON = f"""
+    SELECT json_object('messages', json_group_array(json_object(
+        'id', id, 'deviceName', device_name, 'deveui', deveui, 'appeui', appeui,
+        'data', {PAYLOAD_SQL}, 'size', size, 'timestamp', {TIMESTAMP_SQL},
+        'sqn', sequence_number)))
+    FROM (SELECT * FROM lora_messages ORDER BY id DESC LIMIT ?)
+"""
+
+
+def dict_dumps(conn: sqlite3.Connection, limit: int) -> bytes:
+    """Previous stdlib server path."""
+    conn.row_factory = sqlite3.Row
+    messages = [
+        {
+            "id": row["id"],
+            "deviceName": row["device_name"],
+            "deveui": row["deveui"],
+            "appeui": row["appeui"],
+            "data": row[4],
+            "size": row["size"],
+            "timestamp": row[6],
+            "sqn": row["sequence_number"],
+        }
+        for row in conn.execute(SELECT, (limit,))
+    ]
+    return json.dumps({"messages": messages}).encode()
+
+
+def dataclass_dumps(conn: sqlite3.Connection, limit: int) -> bytes:
+    """Previous Flask path."""
+    conn.row_factory = sqlite3.Row
+    messages = [
+        LoraMessage(
+            id=row["id"],
+            device_name=row["device_name"],
+            deveui=row["deveui"],
+            appeui=row["appeui"],
+            data=row[4],
+            size=row["size"],
+            timestamp=row[6],
+            sequence_number=row["sequence_number"],
+        ).to_dict()
+        for row in conn.execute(SELECT, (limit,))
+    ]
+    return json.dumps({"messages": messages}).encode()
+
+
+def sqlite_group_array(conn: sqlite3.Connection, limit: int) -> bytes:
+    """Whole page built inside SQLite."""
+    conn.row_factory = None
+    return conn.execute(SELECT_JSON, (limit,)).fetchone()[0].encode()
+
+
+def row_encoder(conn: sqlite3.Connection, limit: int) -> bytes:
+    """Template encoder over plain tuples (fallback path)."""
+    conn.row_factory = None
+    rows = conn.execute(SELECT, (limit,)).fetchall()
+    return ('{"messages":[' + MESSAGE_ENCODER.encode_rows(rows) + "]}").encode()
+
+
+def current(conn: sqlite3.Connection, limit: int) -> bytes:
+    """Path used by the servers: message_page().encode()."""
+    return message_page(conn, "/messages", PageRequest(limit=limit)).encode()
+
+
+def main() -> None:
+    """Run the benchmark and print the time per page."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=1000, help="messages per page")
+    parser.add_argument("--repeat", type=int, default=20, help="pages encoded per method")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = os.path.join(tmpdir, "bench.db")
+        init_db(path)
+        conn = sqlite3.connect(path)
+        register_functions(conn)
+        with conn:
+            conn.executemany(
+                INSERT_MESSAGE,
+                (
+                    message_row(
+                        {
+                            "deviceName": "Sensor",
+                            "deveui": "0011223344556677",
+                            "appeui": "70B3D57ED0000000",
+                            "data": "SGVsbG8gd29ybGQ=",
+                            "size": 11,
+                            "timestamp": "2024-01-15T10:00:00.000Z",
+                            "sqn": sqn,
+                        }
+                    )
+                    for sqn in range(args.rows)
+                ),
+            )
+
+        methods: list[tuple[str, Callable[[sqlite3.Connection, int], bytes]]] = [
+            ("Row -> dict -> json.dumps", dict_dumps),
+            ("Row -> LoraMessage -> dict -> json.dumps", dataclass_dumps),
+            ("SQLite json_group_array()", sqlite_group_array),
+            ("tuple -> RowEncoder", row_encoder),
+            ("message_page() " + ("(json_object)" if JSON_IN_SQLITE else "(RowEncoder)"), current),
+        ]
+        reference = json.loads(dict_dumps(conn, args.rows))
+        baseline = 0.0
+        for name, method in methods:
+            result = json.loads(method(conn, args.rows))
+            result.pop("next", None)
+            assert result == reference, name
+            elapsed = min(
+                timeit.repeat(
+                    lambda method=method: method(conn, args.rows), number=args.repeat, repeat=3
+                )
+            )
+            per_page = elapsed / args.repeat * 1000
+            baseline = baseline or per_page
+            print(f"{name:<42} {per_page:8.2f} ms/page  {baseline / per_page:5.2f}x")
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""Measure the database size saved by compact payload and timestamp storage.
+
+Fills a database with the text layout of schema version 3, then upgrades it
+with init_db() (migration 4) and compares the file sizes after VACUUM.
+Payloads are random bytes sent as base64 or hex, like network servers do.
+
+Usage:
+    python benchmarks/storage_size.py [--rows 100000] [--payload 12]
+"""
+
+import argparse
+import base64
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "mlinux-7", "src"))
+
+from webapi_example.database import MIGRATIONS, init_db  # noqa: E402
+
+
+def text_rows(count: int, payload: int) -> list[tuple[object, ...]]:
+    """Messages as stored before migration 4, a few seconds apart."""
+    start = datetime(2024, 1, 15, tzinfo=timezone.utc)
+    rows = []
+    for n in range(count):
+        raw = random.randbytes(payload)
+        data = base64.b64encode(raw).decode() if n % 2 else raw.hex()
+        timestamp = (start + timedelta(seconds=n * 3.7)).isoformat().replace("+00:00", "Z")
+        deveui = f"00112233445566{n % 50:02x}"
+        rows.append(
+            (f"sensor-{n % 50}", deveui, "70b3d57ed0000000", data, payload, timestamp, n % 65536)
+        )
+    return rows
+
+
+def vacuumed_size(path: str) -> int:
+    """VACUUM the database and return its file size."""
+    conn = sqlite3.connect(path, isolation_level=None)
+    conn.execute("VACUUM")
+    conn.close()
+    return os.path.getsize(path)
+
+
+def main() -> None:
+    """Build the text layout database, migrate it and print both sizes."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=100_000, help="messages stored")
+    parser.add_argument("--payload", type=int, default=12, help="payload bytes per message")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = os.path.join(tmpdir, "bench.db")
+        conn = sqlite3.connect(path, isolation_level=None)
+        for number, migration in enumerate(MIGRATIONS[:3], start=1):
+            migration(conn)
+            conn.execute(f"PRAGMA user_version = {number}")
+        conn.execute("BEGIN")
+        conn.executemany(
+            "INSERT INTO lora_messages (device_name, deveui, appeui, data, size, timestamp, "
+            "sequence_number) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            text_rows(args.rows, args.payload),
+        )
+        conn.execute("COMMIT")
+        conn.close()
+        before = vacuumed_size(path)
+
+        started = time.perf_counter()
+        init_db(path)
+        elapsed = time.perf_counter() - started
+        after = vacuumed_size(path)
+
+    print(f"text layout     {before / 1e6:8.2f} MB  {before / args.rows:6.1f} B/message")
+    print(f"compact layout  {after / 1e6:8.2f} MB  {after / args.rows:6.1f} B/message")
+    print(f"saved           {(before - after) / before:8.1%}")
+    print(f"migration       {elapsed:8.2f} s for {args.rows} messages")
+
+
+if __name__ == "__main__":
+    main()
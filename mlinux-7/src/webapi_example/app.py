@@ -3,12 +3,16 @@
 import logging
 import os
 import sqlite3
+import weakref
 from contextlib import contextmanager
 from typing import Generator
 
-from flask import Flask, g
+from flask import Flask, Response, g, request
 
+from webapi_example import database
+from webapi_example.compression import body_slices, choose_encoding, compress_chunks, encoded_etag
 from webapi_example.models.config import AppConfig
+from webapi_example.state import AppState
 
 logger = logging.getLogger(__name__)
 
@@ -36,9 +40,25 @@ def create_app(config: AppConfig | None = None) -> Flask:
     # Store config in app context
     app.config["APP_CONFIG"] = config
 
+    # The schema must be up to date before the state's threads use it
+    database.init_db(
+        db_path,
+        int(config.database.dedup_window * 1000),
+        config.database.partitioning != "none",
+    )
+
+    # Shared state holds the connection pool used by get_db(); it is closed
+    # when the application is collected or the interpreter exits
+    state = AppState(config, db_path)
+    app.extensions["state"] = state
+    weakref.finalize(app, state.close)
+
     # Register database functions
     app.teardown_appcontext(_close_db)
 
+    if config.server.compression.enabled:
+        app.after_request(_compress_response)
+
     # Register routes
     from webapi_example.routes import register_routes
 
@@ -51,22 +71,60 @@ def create_app(config: AppConfig | None = None) -> Flask:
 def get_db() -> sqlite3.Connection:
     """Get database connection for current request context.
 
+    The connection is borrowed from the shared pool and returned to it
+    when the request context ends.
+
     Returns:
         SQLite database connection.
     """
     from flask import current_app
 
     if "db" not in g:
-        g.db = sqlite3.connect(current_app.config["DATABASE"])
-        g.db.row_factory = sqlite3.Row
+        g.db = current_app.extensions["state"].pool.acquire()
     return g.db
 
 
+def _compress_response(response: Response) -> Response:
+    """Compress a JSON response for clients accepting gzip or deflate.
+
+    Streamed responses are compressed piece by piece as they are sent;
+    others only from ``compression.min_size`` bytes.
+    """
+    from flask import current_app
+
+    compression = current_app.extensions["state"].config.server.compression
+    response.vary.add("Accept-Encoding")
+    encoding = choose_encoding(request.headers.get("Accept-Encoding"))
+    if (
+        encoding is None
+        or response.status_code != 200
+        or response.mimetype != "application/json"
+        or "Content-Encoding" in response.headers
+    ):
+        return response
+
+    if response.is_streamed:
+        chunks = compress_chunks(response.iter_encoded(), encoding, compression.level, flush=True)
+    else:
+        body = response.get_data()
+        if len(body) < compression.min_size:
+            return response
+        chunks = compress_chunks(body_slices(body), encoding, compression.level)
+    response.response = chunks
+    response.headers.pop("Content-Length", None)
+    response.headers["Content-Encoding"] = encoding
+    if "ETag" in response.headers:
+        response.headers["ETag"] = encoded_etag(response.headers["ETag"], encoding)
+    return response
+
+
 def _close_db(exception: BaseException | None = None) -> None:
-    """Close database connection at end of request."""
+    """Return the database connection to the pool at end of request."""
+    from flask import current_app
+
     db = g.pop("db", None)
     if db is not None:
-        db.close()
+        current_app.extensions["state"].pool.release(db)
 
 
 @contextmanager
@@ -88,35 +146,18 @@ def get_db_connection(db_path: str) -> Generator[sqlite3.Connection, None, None]
 
 
 def init_db(app: Flask) -> None:
-    """Initialize the database schema.
+    """Initialize the database schema and load the device summaries.
+
+    create_app() already does this; calling it again reloads the device
+    summaries from the database.
 
     Args:
         app: Flask application instance.
     """
-    db_path = app.config["DATABASE"]
-
-    # Ensure directory exists
-    os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
-
-    with get_db_connection(db_path) as conn:
-        conn.execute("""
-            CREATE TABLE IF NOT EXISTS users (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                username TEXT UNIQUE NOT NULL,
-                password_hash TEXT NOT NULL
-            )
-        """)
-        conn.execute("""
-            CREATE TABLE IF NOT EXISTS lora_messages (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                device_name TEXT,
-                deveui TEXT NOT NULL,
-                appeui TEXT,
-                data TEXT,
-                size INTEGER,
-                timestamp TEXT,
-                sequence_number INTEGER
-            )
-        """)
-        conn.commit()
-        logger.info("Database initialized at %s", db_path)
+    config = app.config["APP_CONFIG"]
+    database.init_db(
+        app.config["DATABASE"],
+        int(config.database.dedup_window * 1000),
+        config.database.partitioning != "none",
+    )
+    app.extensions["state"].load_devices()
@@ -0,0 +1,360 @@
+"""asyncio HTTP engine serving the APIHandler routes on a single event loop.
+
+Connections, keep-alive idling and request framing live on the event loop,
+so an idle dashboard connection costs a coroutine rather than a thread.
+Each complete request is then run through the regular request handler on
+a small thread pool, which keeps SQLite work off the loop and guarantees
+both engines serve exactly the same routes.
+"""
+
+import asyncio
+import io
+import logging
+import socket
+import ssl
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler
+from typing import Any, Callable
+
+from webapi_example.state import AppState
+
+logger = logging.getLogger(__name__)
+
+# Seconds allowed for the TLS handshake
+_HANDSHAKE_TIMEOUT = 10.0
+
+# Largest request head and body accepted, in bytes
+_MAX_HEADER_SIZE = 64 * 1024
+_MAX_BODY_SIZE = 4 * 1024 * 1024
+
+# Handler output is sent to the loop once this many bytes are buffered
+_WRITE_BUFFER_SIZE = 64 * 1024
+
+# Interim response to clients sending "Expect: 100-continue"
+_CONTINUE = b"HTTP/1.1 100 Continue\r\n\r\n"
+
+# Seconds running handlers get to finish their response at shutdown
+_SHUTDOWN_GRACE = 2.0
+
+
+def _error_response(status: int, reason: str) -> bytes:
+    """Build a minimal JSON error response that closes the connection."""
+    body = f'{{"error": "{reason}"}}'.encode()
+    return (
+        f"HTTP/1.1 {status} {reason}\r\n"
+        "Content-Type: application/json\r\n"
+        f"Content-Length: {len(body)}\r\n"
+        "Connection: close\r\n\r\n"
+    ).encode() + body
+
+
+def _content_length(head: bytes) -> int | None:
+    """Return the request body length declared in the request head.
+
+    Args:
+        head: Request line and headers, including the blank line.
+
+    Returns:
+        Body length in bytes, or None if the body is not framed by
+        Content-Length (e.g. chunked transfer encoding).
+
+    Raises:
+        ValueError: If Content-Length is not a non-negative integer.
+    """
+    length = 0
+    for line in head.split(b"\r\n")[1:]:
+        name, _, value = line.partition(b":")
+        name = name.strip().lower()
+        if name == b"content-length":
+            length = int(value.strip())
+            if length < 0:
+                raise ValueError(f"Negative Content-Length: {length}")
+        elif name == b"transfer-encoding":
+            return None
+    return length
+
+
+def _expects_continue(head: bytes) -> bool:
+    """Return whether an HTTP/1.1 client waits for ``100 Continue`` before its body.
+
+    Args:
+        head: Request line and headers, including the blank line.
+    """
+    lines = head.split(b"\r\n")
+    if not lines[0].endswith(b"HTTP/1.1"):
+        return False
+    for line in lines[1:]:
+        name, _, value = line.partition(b":")
+        if name.strip().lower() == b"expect":
+            return value.strip().lower() == b"100-continue"
+    return False
+
+
+class _LoopWriter(io.RawIOBase):
+    """Writable file handing handler output to the event loop.
+
+    Output is buffered and sent from the loop in large pieces, so a
+    typical response costs a single hop between the worker thread and
+    the loop.
+    """
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, writer: asyncio.StreamWriter) -> None:
+        """Initialize the writer.
+
+        Args:
+            loop: Event loop owning the connection.
+            writer: Stream writer of the connection.
+        """
+        super().__init__()
+        self._loop = loop
+        self._writer = writer
+        self._buffer: list[bytes] = []
+        self._buffered = 0
+
+    def writable(self) -> bool:
+        """Return True; this file only supports writing."""
+        return True
+
+    def write(self, data: Any) -> int:
+        """Buffer data, sending it to the loop when the buffer is full."""
+        data = bytes(data)
+        self._buffer.append(data)
+        self._buffered += len(data)
+        if self._buffered >= _WRITE_BUFFER_SIZE:
+            self.flush()
+        return len(data)
+
+    def flush(self) -> None:
+        """Send buffered data and wait until the loop has drained it."""
+        if not self._buffered:
+            return
+        data = b"".join(self._buffer)
+        self._buffer.clear()
+        self._buffered = 0
+        asyncio.run_coroutine_threadsafe(self._send(data), self._loop).result()
+
+    async def _send(self, data: bytes) -> None:
+        """Write data on the loop, applying transport backpressure.
+
+        Raises:
+            ConnectionResetError: If the connection is closing, which a
+                long-running stream would otherwise never notice.
+        """
+        if self._writer.is_closing():
+            raise ConnectionResetError("Connection closed")
+        self._writer.write(data)
+        await self._writer.drain()
+
+
+def _bridge_handler(
+    handler_class: type[BaseHTTPRequestHandler],
+) -> Callable[..., BaseHTTPRequestHandler]:
+    """Adapt a request handler class to in-memory, single-request use.
+
+    The returned class takes ``(rfile, wfile, served)`` as its request,
+    where ``served`` counts earlier requests on the connection, and handles
+    exactly one request from it; the engine owns the connection itself.
+    """
+
+    class BridgedHandler(handler_class):  # type: ignore[valid-type, misc]
+        def setup(self) -> None:
+            self.rfile, self.wfile, self._requests_served = self.request
+
+        def handle(self) -> None:
+            self.handle_one_request()
+
+        def handle_expect_100(self) -> bool:
+            # The engine answered before reading the body
+            return True
+
+        def finish(self) -> None:
+            self.wfile.flush()
+
+    return BridgedHandler
+
+
+class AsyncHTTPServer:
+    """HTTP server running all connections on one asyncio event loop.
+
+    Exposes the same ``serve_forever()``/``shutdown()``/``server_close()``
+    interface as ``http.server.HTTPServer`` so the two are interchangeable.
+
+    Attributes:
+        server_address: (host, port) the server is listening on.
+        state: Shared application state, reached by handlers as
+            ``self.server.state``.
+    """
+
+    def __init__(
+        self,
+        server_address: tuple[str, int],
+        handler_class: type[BaseHTTPRequestHandler],
+        state: AppState,
+        workers: int = 4,
+        listen_backlog: int = 32,
+        ssl_context: ssl.SSLContext | None = None,
+        idle_timeout: float = 5.0,
+    ) -> None:
+        """Bind the listening socket and create the handler thread pool.
+
+        Args:
+            server_address: (host, port) to bind to.
+            handler_class: Request handler class serving the routes.
+            state: Shared application state, closed with the server.
+            workers: Threads running request handlers (and their SQLite work).
+            listen_backlog: Backlog passed to listen().
+            ssl_context: TLS context, or None for plain HTTP.
+            idle_timeout: Seconds an idle keep-alive connection is kept open.
+        """
+        self._handler_class = _bridge_handler(handler_class)
+        self.state = state
+        self._ssl_context = ssl_context
+        self._idle_timeout = idle_timeout
+        self._socket = socket.create_server(server_address, backlog=listen_backlog)
+        self.server_address: tuple[str, int] = self._socket.getsockname()[:2]
+        self._executor = ThreadPoolExecutor(
+            max_workers=max(workers, 1), thread_name_prefix="http-async"
+        )
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._stop: asyncio.Event | None = None
+        self._connections: set[asyncio.Task[Any]] = set()
+        self._handlers: set[asyncio.Future[bool]] = set()
+        self._started = threading.Event()
+        self._stopped = threading.Event()
+
+    def serve_forever(self) -> None:
+        """Run the event loop until shutdown() is called."""
+        self._loop = asyncio.new_event_loop()
+        try:
+            self._loop.run_until_complete(self._serve())
+        finally:
+            self._loop.close()
+            self._stopped.set()
+
+    def shutdown(self) -> None:
+        """Stop serve_forever() and wait for it to return."""
+        self._started.wait()
+        if self._loop is not None and self._stop is not None:
+            self._loop.call_soon_threadsafe(self._stop.set)
+        self._stopped.wait()
+
+    def busy(self) -> bool:
+        """Return False; idle connections cost no worker thread here."""
+        return False
+
+    def server_close(self) -> None:
+        """Close the listening socket, the handler thread pool and shared state."""
+        self._socket.close()
+        self._executor.shutdown(wait=False)
+        self.state.close()
+
+    async def _serve(self) -> None:
+        """Accept connections until the stop event is set."""
+        self._stop = asyncio.Event()
+        server = await asyncio.start_server(
+            self._handle_connection,
+            sock=self._socket,
+            ssl=self._ssl_context,
+            ssl_handshake_timeout=_HANDSHAKE_TIMEOUT if self._ssl_context else None,
+            limit=_MAX_HEADER_SIZE,
+        )
+        self._started.set()
+        try:
+            await self._stop.wait()
+        finally:
+            server.close()
+            # Let running handlers send their last bytes while the loop still
+            # runs; live streams and long polls only end when told to
+            self.state.disconnect_clients()
+            if self._handlers:
+                await asyncio.wait(self._handlers, timeout=_SHUTDOWN_GRACE)
+            # Idle keep-alive connections would otherwise outlive the loop
+            for task in list(self._connections):
+                task.cancel()
+            await asyncio.gather(*self._connections, return_exceptions=True)
+            await server.wait_closed()
+
+    async def _handle_connection(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        """Serve requests on one connection until it is closed or idles out."""
+        peer = writer.get_extra_info("peername") or ("", 0)
+        task = asyncio.current_task()
+        if task is not None:
+            self._connections.add(task)
+        served = 0
+        try:
+            while True:
+                try:
+                    head = await asyncio.wait_for(
+                        reader.readuntil(b"\r\n\r\n"), self._idle_timeout
+                    )
+                except asyncio.LimitOverrunError:
+                    writer.write(_error_response(431, "Request Header Fields Too Large"))
+                    break
+                except (asyncio.IncompleteReadError, asyncio.TimeoutError):
+                    break
+
+                try:
+                    length = _content_length(head)
+                except ValueError:
+                    writer.write(_error_response(400, "Invalid Content-Length"))
+                    break
+                if length is None:
+                    writer.write(_error_response(411, "Length Required"))
+                    break
+                if length > _MAX_BODY_SIZE:
+                    writer.write(_error_response(413, "Payload Too Large"))
+                    break
+                if length and _expects_continue(head):
+                    writer.write(_CONTINUE)
+                    await writer.drain()
+                body = await reader.readexactly(length) if length else b""
+
+                handler = asyncio.get_running_loop().run_in_executor(
+                    self._executor, self._run_handler, head + body, served, peer, writer
+                )
+                self._handlers.add(handler)
+                try:
+                    keep_alive = await handler
+                finally:
+                    self._handlers.discard(handler)
+                if not keep_alive:
+                    break
+                served += 1
+        except (ConnectionError, asyncio.IncompleteReadError, ssl.SSLError) as e:
+            logger.debug("Connection from %s failed: %s", peer[0], e)
+        finally:
+            if task is not None:
+                self._connections.discard(task)
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except (ConnectionError, ssl.SSLError, asyncio.CancelledError):
+                pass
+
+    def _run_handler(
+        self, request: bytes, served: int, peer: Any, writer: asyncio.StreamWriter
+    ) -> bool:
+        """Run the request handler for one request on a worker thread.
+
+        Args:
+            request: Complete request (head and body).
+            served: Requests already served on this connection.
+            peer: Client address.
+            writer: Stream writer the response is sent to.
+
+        Returns:
+            True if the connection may be kept alive.
+        """
+        assert self._loop is not None
+        wfile = _LoopWriter(self._loop, writer)
+        try:
+            handler = self._handler_class((io.BytesIO(request), wfile, served), peer, self)
+        except ConnectionError:
+            return False
+        except Exception:
+            logger.exception("Error handling request from %s", peer[0])
+            return False
+        return not handler.close_connection
@@ -0,0 +1,272 @@
+"""In-memory fan-out of committed messages to live stream clients.
+
+Every committed message is encoded once as a Server-Sent Events frame and
+handed to each subscriber's bounded queue, so N viewers of
+``GET /messages/stream`` cost one encode plus N socket writes per message
+and no database reads. The most recent rows are kept in a ring buffer,
+from which a reconnecting client (``Last-Event-ID``) is caught up; only a
+client that fell further behind has to be caught up from the database.
+Rows are only encoded once someone subscribes, so the history costs ingest
+next to nothing. A subscriber whose queue overflows is dropped and must
+reconnect.
+"""
+
+import logging
+import threading
+from collections import deque
+from dataclasses import dataclass
+from typing import Any
+
+from webapi_example.storage import encode_stored_message
+
+logger = logging.getLogger(__name__)
+
+
+def sse_frame(message_id: int, data: str) -> bytes:
+    """Build the Server-Sent Events frame of one message.
+
+    Args:
+        message_id: Message id, sent as the event id.
+        data: JSON text of the message, on a single line.
+
+    Returns:
+        Encoded frame, including the blank line ending it.
+    """
+    return b"id: %d\ndata: %s\n\n" % (message_id, data.encode())
+
+
+@dataclass(frozen=True)
+class MessageEvent:
+    """One committed message, encoded once for every subscriber.
+
+    Attributes:
+        id: Message id.
+        deveui: Device EUI, for filtered subscriptions.
+        frame: Server-Sent Events frame of the message.
+    """
+
+    id: int
+    deveui: str
+    frame: bytes
+
+
+def message_event(message_id: int, row: tuple[Any, ...]) -> MessageEvent:
+    """Encode a stored message row as an event.
+
+    Args:
+        message_id: Message id.
+        row: INSERT_MESSAGE parameters of the message.
+
+    Returns:
+        The event, with its Server-Sent Events frame.
+    """
+    return MessageEvent(
+        message_id, row[1], sse_frame(message_id, encode_stored_message(message_id, row))
+    )
+
+
+class Subscription:
+    """Bounded queue of events for one live stream client.
+
+    Attributes:
+        deveui: Only events of this device are queued, or None for all.
+        max_events: Most events queued; one more ends the subscription.
+        catch_up_after: Set by ``MessageBroker.subscribe()`` when the
+            client asked to resume from an id the broker's history no
+            longer reaches: messages after it must first be read from the
+            database. None otherwise.
+    """
+
+    def __init__(self, deveui: str | None, max_events: int) -> None:
+        """Initialize an empty subscription.
+
+        Args:
+            deveui: Only queue events of this device, or None for all.
+            max_events: Most events queued.
+        """
+        self.deveui = deveui
+        self.max_events = max_events
+        self.catch_up_after: int | None = None
+        self._events: deque[MessageEvent] = deque()
+        self._cond = threading.Condition()
+        self._ended = False
+
+    def get(self, timeout: float) -> list[MessageEvent] | None:
+        """Take the queued events, waiting for some if there are none.
+
+        Args:
+            timeout: Seconds to wait for an event.
+
+        Returns:
+            Queued events, oldest first; an empty list if none arrived in
+            time; None once the subscription has ended, because the broker
+            closed or dropped it.
+        """
+        with self._cond:
+            if not self._events and not self._ended:
+                self._cond.wait(timeout)
+            if self._ended:
+                return None
+            events = list(self._events)
+            self._events.clear()
+            return events
+
+    def offer(self, events: list[MessageEvent]) -> bool:
+        """Queue the events this subscription wants.
+
+        Args:
+            events: Events in id order.
+
+        Returns:
+            False if the queue overflowed, which ends the subscription.
+        """
+        if self.deveui is not None:
+            events = [event for event in events if event.deveui == self.deveui]
+            if not events:
+                return True
+        with self._cond:
+            if len(self._events) + len(events) > self.max_events:
+                self._end()
+                return False
+            self._events.extend(events)
+            self._cond.notify()
+            return True
+
+    def end(self) -> None:
+        """End the subscription, waking a waiting reader."""
+        with self._cond:
+            self._end()
+
+    def _end(self) -> None:
+        """End the subscription; the condition's lock must be held."""
+        self._ended = True
+        self._events.clear()
+        self._cond.notify_all()
+
+
+class MessageBroker:
+    """Fan-out of committed messages to live stream subscriptions.
+
+    Thread-safe. Publishing and subscribing are serialized, so a
+    subscription resumed from the history neither misses nor repeats an
+    event published meanwhile.
+
+    Attributes:
+        max_subscribers: Most subscriptions open at once.
+        queue_size: Most events queued per subscription.
+    """
+
+    def __init__(
+        self, history: int = 1000, max_subscribers: int = 2, queue_size: int = 1000
+    ) -> None:
+        """Initialize a broker without subscribers.
+
+        Args:
+            history: Most recent events kept for resuming clients.
+            max_subscribers: Most subscriptions open at once.
+            queue_size: Most events queued per subscription.
+        """
+        self.max_subscribers = max_subscribers
+        self.queue_size = max(queue_size, 1)
+        # (id, row) pairs; encoded only when replayed
+        self._history: deque[tuple[int, tuple[Any, ...]]] = deque(maxlen=max(history, 0))
+        self._subscribers: list[Subscription] = []
+        self._lock = threading.Lock()
+        self._closed = False
+        self._published = 0
+        self._dropped = 0
+
+    def publish(self, rows: list[tuple[Any, ...]], ids: list[int]) -> None:
+        """Hand committed messages to the history and every subscription.
+
+        Subscriptions whose queue overflows are dropped.
+
+        Args:
+            rows: INSERT_MESSAGE parameters of the committed rows.
+            ids: Id of each row.
+        """
+        # Encode outside the lock unless nobody is listening
+        events = None
+        if self._subscribers:
+            events = [message_event(id_, row) for id_, row in zip(ids, rows, strict=True)]
+        with self._lock:
+            self._history.extend(zip(ids, rows, strict=True))
+            self._published += len(ids)
+            if not self._subscribers:
+                return
+            if events is None:
+                events = [message_event(id_, row) for id_, row in zip(ids, rows, strict=True)]
+            for subscription in list(self._subscribers):
+                if not subscription.offer(events):
+                    self._subscribers.remove(subscription)
+                    self._dropped += 1
+                    logger.warning("Dropped a live stream client that fell behind")
+
+    def subscribe(self, deveui: str | None = None, last_id: int | None = None) -> Subscription:
+        """Open a subscription to messages committed from now on.
+
+        Args:
+            deveui: Only deliver messages of this device, or None for all.
+            last_id: Id of the last message the client has seen; the
+                messages after it are queued first. When the history does
+                not reach back that far, ``catch_up_after`` is set instead.
+
+        Returns:
+            The subscription; pass it to ``unsubscribe()`` when done.
+
+        Raises:
+            RuntimeError: If the broker is closed, ``max_subscribers`` is 0
+                or that many subscriptions are open.
+        """
+        subscription = Subscription(deveui, self.queue_size)
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("Live stream closed")
+            if self.max_subscribers <= 0:
+                raise RuntimeError("Live stream disabled")
+            if len(self._subscribers) >= self.max_subscribers:
+                raise RuntimeError("Too many live stream clients")
+            if last_id is not None:
+                if self._history and self._history[0][0] <= last_id + 1:
+                    missed = [
+                        message_event(id_, row)
+                        for id_, row in self._history
+                        if id_ > last_id and deveui in (None, row[1])
+                    ]
+                    if not subscription.offer(missed):
+                        subscription = Subscription(deveui, self.queue_size)
+                        subscription.catch_up_after = last_id
+                else:
+                    subscription.catch_up_after = last_id
+            self._subscribers.append(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        """Close a subscription.
+
+        Args:
+            subscription: Subscription returned by ``subscribe()``.
+        """
+        with self._lock:
+            if subscription in self._subscribers:
+                self._subscribers.remove(subscription)
+        subscription.end()
+
+    def close(self) -> None:
+        """End every subscription and refuse new ones, e.g. at shutdown."""
+        with self._lock:
+            self._closed = True
+            subscribers, self._subscribers = self._subscribers, []
+        for subscription in subscribers:
+            subscription.end()
+
+    def stats(self) -> dict[str, int]:
+        """Return the subscriber count and the published and dropped counters."""
+        with self._lock:
+            return {
+                "clients": len(self._subscribers),
+                "max_clients": self.max_subscribers,
+                "published": self._published,
+                "dropped": self._dropped,
+                "history": len(self._history),
+            }
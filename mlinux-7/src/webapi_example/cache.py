@@ -0,0 +1,220 @@
+"""Write generations, ETags and the encoded response cache."""
+
+import threading
+from collections import OrderedDict
+from collections.abc import Hashable, Iterable
+from typing import Any
+
+# Generation of a cached response: (epoch, counter). The epoch changes on
+# bulk changes such as deletes and invalidates everything at once.
+Generation = tuple[int, int]
+
+
+class WriteGenerations:
+    """Counters identifying the state of lora_messages.
+
+    Every committed insert bumps the global counter and the counter of each
+    device involved; bulk changes bump the epoch. A response computed at a
+    given generation is still current while the generation is unchanged,
+    which is how cached responses and ETags are validated without touching
+    the database. Counters must be bumped after the commit and read before
+    the query, so a race can only make a response look stale, never fresh.
+    The same counters let requests wait for new messages (``wait()``).
+    """
+
+    def __init__(self) -> None:
+        """Initialize all counters at zero."""
+        self._cond = threading.Condition()
+        self._epoch = 0
+        self._global = 0
+        self._devices: dict[str, int] = {}
+        self._closed = False
+
+    def get(self, deveui: str | None = None) -> Generation:
+        """Return the generation of all messages or of one device's messages.
+
+        Args:
+            deveui: Device EUI, or None for the whole table.
+
+        Returns:
+            Current generation.
+        """
+        with self._cond:
+            return self._get(deveui)
+
+    def _get(self, deveui: str | None) -> Generation:
+        """Return a generation; the condition's lock must be held."""
+        if deveui is None:
+            return (self._epoch, self._global)
+        return (self._epoch, self._devices.get(deveui, 0))
+
+    def bump(self, deveuis: Iterable[str]) -> None:
+        """Record that messages of these devices were committed.
+
+        Args:
+            deveuis: EUIs of the devices whose messages changed.
+        """
+        with self._cond:
+            self._global += 1
+            for deveui in set(deveuis):
+                self._devices[deveui] = self._devices.get(deveui, 0) + 1
+            self._cond.notify_all()
+
+    def bump_all(self) -> None:
+        """Record a change that may affect any device, e.g. deleted messages."""
+        with self._cond:
+            self._epoch += 1
+            self._global += 1
+            self._cond.notify_all()
+
+    def wait(self, deveui: str | None, generation: Generation, timeout: float) -> Generation:
+        """Wait until a generation moves on from the one given.
+
+        Args:
+            deveui: Device EUI, or None for the whole table.
+            generation: Generation the caller last read.
+            timeout: Most seconds to wait.
+
+        Returns:
+            Current generation; equal to ``generation`` if the wait timed
+            out or the counters were closed.
+        """
+        with self._cond:
+            self._cond.wait_for(
+                lambda: self._closed or self._get(deveui) != generation, timeout
+            )
+            return self._get(deveui)
+
+    def close(self) -> None:
+        """End every wait and make later ones return at once, e.g. at shutdown."""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+
+def make_etag(prefix: str, generation: Generation) -> str:
+    """Build a strong entity tag from a write generation.
+
+    Args:
+        prefix: Token unique to the running process, so tags from before a
+            restart (when counters start over) never match.
+        generation: Generation of the data behind the response.
+
+    Returns:
+        Quoted entity tag, ready for the ETag header.
+    """
+    return f'"{prefix}-{generation[0]}-{generation[1]}"'
+
+
+def etag_matches(if_none_match: str | None, etag: str) -> bool:
+    """Check an If-None-Match header against the current entity tag.
+
+    Uses the weak comparison RFC 9110 prescribes for If-None-Match.
+
+    Args:
+        if_none_match: Header value, or None if absent.
+        etag: Current quoted entity tag.
+
+    Returns:
+        True if the client's copy is current and 304 may be sent.
+    """
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    return any(
+        candidate.strip().removeprefix("W/") == etag for candidate in if_none_match.split(",")
+    )
+
+
+class ResponseCache:
+    """LRU cache of encoded response bodies bounded by their total size.
+
+    Each entry carries the generation it was computed at; ``get()`` only
+    returns it while the caller's current generation is the same, so
+    entries never have to be purged when data changes. Thread-safe.
+
+    Attributes:
+        max_bytes: Largest total size of cached bodies.
+    """
+
+    def __init__(self, max_bytes: int) -> None:
+        """Initialize an empty cache.
+
+        Args:
+            max_bytes: Largest total size of cached bodies.
+        """
+        self.max_bytes = max_bytes
+        self._entries: OrderedDict[Hashable, tuple[Generation, bytes]] = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._invalidations = 0
+
+    def get(self, key: Hashable, generation: Generation) -> bytes | None:
+        """Return the cached body for a key if it is still current.
+
+        Args:
+            key: Cache key, e.g. route and parameters.
+            generation: Current generation of the data behind the response.
+
+        Returns:
+            Cached body, or None on a miss.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._misses += 1
+                return None
+            if entry[0] != generation:
+                self._invalidations += 1
+                self._misses += 1
+                self._remove(key)
+                return None
+            self._entries.move_to_end(key)
+            self._hits += 1
+            return entry[1]
+
+    def put(self, key: Hashable, generation: Generation, body: bytes) -> None:
+        """Store a body, evicting least recently used entries to make room.
+
+        Bodies larger than a quarter of the cache are not stored, so one
+        big page cannot flush every other entry.
+
+        Args:
+            key: Cache key.
+            generation: Generation the body was computed at.
+            body: Encoded response body.
+        """
+        if len(body) > self.max_bytes // 4:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (generation, body)
+            self._bytes += len(body)
+            while self._bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self._evictions += 1
+
+    def _remove(self, key: Hashable) -> None:
+        """Drop an entry; the lock must be held."""
+        _, body = self._entries.pop(key)
+        self._bytes -= len(body)
+
+    def stats(self) -> dict[str, Any]:
+        """Return size and hit/miss/eviction counters."""
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self._hits,
+                "misses": self._misses,
+                "hit_ratio": round(self._hits / lookups, 3) if lookups else 0.0,
+                "evictions": self._evictions,
+                "invalidations": self._invalidations,
+            }
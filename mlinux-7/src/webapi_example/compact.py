@@ -0,0 +1,155 @@
+"""Compact storage representation of message payloads and timestamps.
+
+Payloads arrive as base64 or hex text and are stored as the decoded bytes
+with a format code saying how to re-encode them; text in neither encoding
+is stored as it is. Encoding is only chosen when re-encoding gives back
+exactly the received text, so the API always returns the original string.
+Timestamps in the form the API itself produces, ISO 8601 UTC with
+milliseconds such as "2024-01-15T10:00:00.123Z", are stored as integer
+milliseconds since the Unix epoch; any other text is stored as it is.
+"""
+
+import base64
+import binascii
+import re
+from datetime import datetime, timedelta, timezone
+from typing import Any
+
+# Payload format codes stored in data_format
+PAYLOAD_TEXT = 0
+PAYLOAD_BASE64 = 1
+PAYLOAD_HEX = 2
+PAYLOAD_HEX_UPPER = 3
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+_MILLISECOND = timedelta(milliseconds=1)
+_HEX = re.compile(r"(?:[0-9a-f]{2})+|(?:[0-9A-F]{2})+")
+
+
+def pack_payload(text: str | None) -> tuple[bytes | str | None, int | None]:
+    """Convert a payload to its stored value and format code.
+
+    Hex is tried before base64 because it packs into fewer bytes when a
+    string is valid in both.
+
+    Args:
+        text: Payload as received, or None.
+
+    Returns:
+        Stored value (bytes, or the text itself if it is neither hex nor
+        canonical base64) and its format code; (None, None) for None.
+    """
+    if text is None:
+        return None, None
+    if not text:
+        return text, PAYLOAD_TEXT
+    if _HEX.fullmatch(text):
+        # Digits alone are the same in either case
+        upper = text != text.lower()
+        return bytes.fromhex(text), PAYLOAD_HEX_UPPER if upper else PAYLOAD_HEX
+    try:
+        raw = base64.b64decode(text, validate=True)
+    except (binascii.Error, ValueError):
+        return text, PAYLOAD_TEXT
+    if base64.b64encode(raw).decode("ascii") != text:
+        return text, PAYLOAD_TEXT
+    return raw, PAYLOAD_BASE64
+
+
+def unpack_payload(value: bytes | str | None, data_format: int | None) -> str | None:
+    """Convert a stored payload back to the text it was received as.
+
+    Args:
+        value: Stored value.
+        data_format: Format code from pack_payload().
+
+    Returns:
+        Payload text, or None.
+    """
+    if value is None or isinstance(value, str):
+        return value
+    if data_format == PAYLOAD_BASE64:
+        return base64.b64encode(value).decode("ascii")
+    if data_format == PAYLOAD_HEX_UPPER:
+        return value.hex().upper()
+    return value.hex()
+
+
+def sql_base64(value: Any) -> Any:
+    """SQLite function base64(blob), used to render stored payloads."""
+    if not isinstance(value, bytes):
+        return value
+    return base64.b64encode(value).decode("ascii")
+
+
+def epoch_ms(when: datetime) -> int:
+    """Return a time as milliseconds since the Unix epoch; naive times are UTC."""
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=timezone.utc)
+    return (when - _EPOCH) // _MILLISECOND
+
+
+def parse_timestamp(text: str) -> int:
+    """Parse an ISO 8601 timestamp into epoch milliseconds.
+
+    Args:
+        text: Timestamp such as "2024-01-15T10:00:00.123456Z"; without an
+            offset it is taken as UTC. Sub-millisecond digits are dropped.
+
+    Returns:
+        Milliseconds since the Unix epoch.
+
+    Raises:
+        ValueError: If the text is not an ISO 8601 timestamp from 1970 on.
+    """
+    if not isinstance(text, str):
+        raise ValueError("timestamp must be an ISO 8601 string")
+    value = text[:-1] + "+00:00" if text[-1:] in ("Z", "z") else text
+    try:
+        ms = epoch_ms(datetime.fromisoformat(value))
+    except ValueError:
+        raise ValueError(f"Invalid timestamp: {text!r}") from None
+    if ms < 0:
+        raise ValueError(f"Timestamp before 1970: {text!r}")
+    return ms
+
+
+def pack_timestamp(text: str) -> int | str:
+    """Convert a timestamp to its stored value.
+
+    Args:
+        text: Timestamp as received.
+
+    Returns:
+        Epoch milliseconds if format_timestamp() gives back exactly the
+        text, otherwise the text itself.
+    """
+    try:
+        ms = parse_timestamp(text)
+    except ValueError:
+        return text
+    return ms if format_timestamp(ms) == text else text
+
+
+def format_timestamp(ms: int) -> str:
+    """Format epoch milliseconds as an ISO 8601 UTC timestamp.
+
+    Must match TIMESTAMP_SQL, which renders stored timestamps in queries.
+    """
+    when = _EPOCH + timedelta(milliseconds=ms)
+    return when.strftime("%Y-%m-%dT%H:%M:%S") + f".{ms % 1000:03d}Z"
+
+
+# SQL rendering the stored payload and timestamp columns as the API text;
+# values stored before the compact format that could not be converted are
+# kept as text and returned unchanged
+PAYLOAD_SQL = (
+    f"CASE data_format WHEN {PAYLOAD_BASE64} THEN base64(data) "
+    f"WHEN {PAYLOAD_HEX} THEN lower(hex(data)) "
+    f"WHEN {PAYLOAD_HEX_UPPER} THEN hex(data) ELSE data END"
+)
+TIMESTAMP_SQL = (
+    "CASE typeof(timestamp) WHEN 'integer' THEN "
+    "strftime('%Y-%m-%dT%H:%M:%S', timestamp / 1000, 'unixepoch') "
+    "|| printf('.%03dZ', timestamp % 1000) ELSE timestamp END"
+)
@@ -0,0 +1,97 @@
+"""Negotiated gzip/deflate compression of response bodies.
+
+Bodies are compressed incrementally with ``zlib.compressobj``, piece by
+piece as they are written, so neither a full-size body nor a full
+compressed copy has to be held alongside it.
+"""
+
+import zlib
+from collections.abc import Iterable, Iterator
+
+# zlib window bits of each supported content coding: gzip wraps the
+# deflate stream in a gzip header, HTTP "deflate" means the zlib format
+_WBITS = {"gzip": 16 + zlib.MAX_WBITS, "deflate": zlib.MAX_WBITS}
+
+# Bytes of an in-memory body fed to the compressor at a time
+_SLICE_SIZE = 64 * 1024
+
+
+def choose_encoding(accept_encoding: str | None) -> str | None:
+    """Pick the content coding for a response from an Accept-Encoding header.
+
+    Args:
+        accept_encoding: Header value, or None if absent.
+
+    Returns:
+        "gzip" or "deflate", whichever the client ranks highest (gzip on a
+        tie), or None if the client accepts neither.
+    """
+    if not accept_encoding:
+        return None
+    weights: dict[str, float] = {}
+    for item in accept_encoding.split(","):
+        coding, _, params = item.partition(";")
+        coding = coding.strip().lower()
+        weight = 1.0
+        params = params.strip().lower()
+        if params.startswith("q="):
+            try:
+                weight = float(params[2:])
+            except ValueError:
+                weight = 0.0
+        weights[coding] = weight
+
+    best: str | None = None
+    best_weight = 0.0
+    for coding in _WBITS:
+        weight = weights.get(coding, weights.get("*", 0.0))
+        if weight > best_weight:
+            best, best_weight = coding, weight
+    return best
+
+
+def encoded_etag(etag: str, encoding: str) -> str:
+    """Return the entity tag of the compressed variant of a response.
+
+    A strong tag names exact bytes, so each content coding needs its own.
+
+    Args:
+        etag: Quoted entity tag of the uncompressed response.
+        encoding: Content coding, as returned by choose_encoding().
+
+    Returns:
+        Quoted entity tag of the compressed response.
+    """
+    return f'{etag[:-1]}-{encoding}"'
+
+
+def compress_chunks(
+    chunks: Iterable[bytes | memoryview], encoding: str, level: int = 6, flush: bool = False
+) -> Iterator[bytes]:
+    """Compress a body incrementally.
+
+    Args:
+        chunks: Pieces of the uncompressed body.
+        encoding: "gzip" or "deflate".
+        level: zlib compression level, 1 (fastest) to 9 (smallest).
+        flush: Emit everything compressed so far after each piece, so a
+            streaming client can decode each piece as it arrives.
+
+    Yields:
+        Pieces of the compressed body; empty pieces are skipped.
+    """
+    compressor = zlib.compressobj(level, zlib.DEFLATED, _WBITS[encoding])
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if flush:
+            data += compressor.flush(zlib.Z_SYNC_FLUSH)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def body_slices(body: bytes) -> Iterator[memoryview]:
+    """Split an in-memory body into compressor-sized views without copying."""
+    view = memoryview(body)
+    for start in range(0, len(view), _SLICE_SIZE):
+        yield view[start:start + _SLICE_SIZE]
@@ -0,0 +1,831 @@
+"""SQLite schema, shared SQL statements and connection pooling."""
+
+import logging
+import os
+import queue
+import sqlite3
+import threading
+from contextlib import contextmanager
+from typing import Any, Callable, Iterator, Sequence
+
+from webapi_example.compact import (
+    PAYLOAD_SQL,
+    TIMESTAMP_SQL,
+    pack_payload,
+    parse_timestamp,
+    sql_base64,
+)
+
+logger = logging.getLogger(__name__)
+
+# Statements shared by the stdlib server and the Flask routes. The sqlite3
+# statement cache is keyed by SQL text, so both must use these exact strings.
+SELECT_USERS = "SELECT id, username FROM users"
+SELECT_USER = "SELECT id, username FROM users WHERE username = ?"
+INSERT_USER = "INSERT INTO users (username, password_hash) VALUES (?, ?)"
+DELETE_USER = "DELETE FROM users WHERE username = ?"
+
+# Message pages, newest first or (after a cursor) oldest first; all are
+# answered from the primary key or the (deveui, id) index without sorting.
+# Payloads and timestamps are stored compactly and rendered back to the API
+# text by the column expressions.
+MESSAGE_COLUMN_EXPRESSIONS = (
+    "id",
+    "device_name",
+    "deveui",
+    "appeui",
+    PAYLOAD_SQL,
+    "size",
+    TIMESTAMP_SQL,
+    "sequence_number",
+)
+MESSAGE_COLUMNS = ", ".join(MESSAGE_COLUMN_EXPRESSIONS)
+SELECT_MESSAGES = f"""
+    SELECT {MESSAGE_COLUMNS}
+    FROM lora_messages ORDER BY id DESC LIMIT ?
+"""
+SELECT_MESSAGES_BEFORE = f"""
+    SELECT {MESSAGE_COLUMNS}
+    FROM lora_messages WHERE id < ? ORDER BY id DESC LIMIT ?
+"""
+SELECT_MESSAGES_AFTER = f"""
+    SELECT {MESSAGE_COLUMNS}
+    FROM lora_messages WHERE id > ? ORDER BY id ASC LIMIT ?
+"""
+SELECT_DEVICE_MESSAGES = f"""
+    SELECT {MESSAGE_COLUMNS}
+    FROM lora_messages WHERE deveui = ? ORDER BY id DESC LIMIT ?
+"""
+SELECT_DEVICE_MESSAGES_BEFORE = f"""
+    SELECT {MESSAGE_COLUMNS}
+    FROM lora_messages WHERE deveui = ? AND id < ? ORDER BY id DESC LIMIT ?
+"""
+SELECT_DEVICE_MESSAGES_AFTER = f"""
+    SELECT {MESSAGE_COLUMNS}
+    FROM lora_messages WHERE deveui = ? AND id > ? ORDER BY id ASC LIMIT ?
+"""
+INSERT_MESSAGE = """
+    INSERT INTO lora_messages
+    (device_name, deveui, appeui, data, data_format, size, timestamp, sequence_number)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+"""
+# Skips a message the deduplication index rejects (see dedup_index_sql())
+INSERT_MESSAGE_UNIQUE = INSERT_MESSAGE.replace("INSERT INTO", "INSERT OR IGNORE INTO", 1)
+
+# Per-device summary, maintained in the transaction that stores the messages
+# from one aggregated row per device (see webapi_example.devices). Counters
+# cover every message stored, including those retention deleted since.
+DEVICE_COLUMNS = (
+    "deveui, device_name, appeui, first_seen, last_seen, message_count, total_bytes, "
+    "last_sqn, last_data, last_data_format"
+)
+SELECT_DEVICES = f"SELECT {DEVICE_COLUMNS} FROM devices"
+# Merges an aggregated row into the summary of an already known device
+_MERGE_DEVICE = """
+    ON CONFLICT (deveui) DO UPDATE SET
+        device_name = coalesce(nullif(excluded.device_name, ''), device_name),
+        appeui = coalesce(nullif(excluded.appeui, ''), appeui),
+        first_seen = coalesce(
+            min(first_seen, excluded.first_seen), first_seen, excluded.first_seen
+        ),
+        last_seen = coalesce(max(last_seen, excluded.last_seen), last_seen, excluded.last_seen),
+        message_count = message_count + excluded.message_count,
+        total_bytes = total_bytes + excluded.total_bytes,
+        last_sqn = excluded.last_sqn,
+        last_data = excluded.last_data,
+        last_data_format = excluded.last_data_format
+"""
+UPSERT_DEVICE = f"""
+    INSERT INTO devices ({DEVICE_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    {_MERGE_DEVICE}
+"""
+
+# Traffic rollups: messages and payload bytes per time bucket, one table per
+# resolution (bucket length in milliseconds). Each bucket is counted per
+# device (scope "deveui"), per application ("appeui") and for the whole
+# gateway ("all", key ""), in the transaction that stores the messages (see
+# webapi_example.rollups). Reads are primary key ranges.
+TRAFFIC_RESOLUTIONS = {"minute": 60_000, "hour": 3_600_000, "day": 86_400_000}
+_MERGE_TRAFFIC = """
+    ON CONFLICT (scope, key, bucket) DO UPDATE SET
+        messages = messages + excluded.messages,
+        bytes = bytes + excluded.bytes
+"""
+UPSERT_TRAFFIC = {
+    resolution: f"""
+        INSERT INTO traffic_{resolution} (scope, key, bucket, messages, bytes)
+        VALUES (?, ?, ?, ?, ?) {_MERGE_TRAFFIC}
+    """
+    for resolution in TRAFFIC_RESOLUTIONS
+}
+SELECT_TRAFFIC = {
+    resolution: f"""
+        SELECT bucket, messages, bytes FROM traffic_{resolution}
+        WHERE scope = ? AND key = ? AND bucket >= ? AND bucket < ? ORDER BY bucket
+    """
+    for resolution in TRAFFIC_RESOLUTIONS
+}
+DELETE_TRAFFIC_OLDER_THAN = {
+    resolution: f"""
+        DELETE FROM traffic_{resolution} WHERE (scope, key, bucket) IN
+        (SELECT scope, key, bucket FROM traffic_{resolution} WHERE bucket < ? LIMIT ?)
+    """
+    for resolution in TRAFFIC_RESOLUTIONS
+}
+
+# Retention: delete a bounded chunk of the oldest messages, by timestamp in
+# epoch milliseconds (through its index) or by id, so no single transaction holds the write
+# lock for long
+COUNT_MESSAGES = "SELECT count(*) FROM lora_messages"
+DELETE_MESSAGES_OLDER_THAN = """
+    DELETE FROM lora_messages WHERE id IN
+    (SELECT id FROM lora_messages WHERE timestamp < ? LIMIT ?)
+"""
+DELETE_OLDEST_MESSAGES = """
+    DELETE FROM lora_messages WHERE id IN
+    (SELECT id FROM lora_messages ORDER BY id LIMIT ?)
+"""
+
+# Hot read statements prepared on every new pooled connection
+WARM_STATEMENTS: tuple[tuple[str, tuple[Any, ...]], ...] = (
+    (SELECT_USER, ("",)),
+    (SELECT_MESSAGES, (1,)),
+    (SELECT_DEVICE_MESSAGES, ("", 1)),
+)
+
+# Tuning presets applied to every pooled connection. All use WAL so readers
+# never block the writer; they trade commit durability (synchronous) against
+# flash syncs and spend progressively more memory on caching.
+PROFILES: dict[str, dict[str, Any]] = {
+    # Sync the WAL on every commit: nothing acknowledged is lost on power failure
+    "durable": {
+        "journal_mode": "WAL",
+        "synchronous": "FULL",
+        "cache_size": -2000,
+        "mmap_size": 0,
+        "temp_store": "DEFAULT",
+    },
+    # Sync only at checkpoints: the last commits may roll back on power failure,
+    # but the database is never corrupted
+    "balanced": {
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "cache_size": -8000,
+        "mmap_size": 64 * 1024 * 1024,
+        "temp_store": "MEMORY",
+    },
+    # Never sync: a power failure may corrupt the database
+    "fast": {
+        "journal_mode": "WAL",
+        "synchronous": "OFF",
+        "cache_size": -16000,
+        "mmap_size": 256 * 1024 * 1024,
+        "temp_store": "MEMORY",
+    },
+    # SQLite's own defaults (rollback journal)
+    "none": {},
+}
+
+
+def resolve_pragmas(
+    profile: str, overrides: dict[str, Any] | None = None, timeout: float = 5.0
+) -> dict[str, Any]:
+    """Combine a tuning profile with explicitly configured pragmas.
+
+    Args:
+        profile: Name of a preset in PROFILES.
+        overrides: PRAGMA name/value pairs taking precedence over the profile.
+        timeout: Seconds to wait for a database lock, applied as busy_timeout.
+
+    Returns:
+        PRAGMA name/value pairs in the order they should be applied.
+
+    Raises:
+        ValueError: If the profile is unknown.
+    """
+    if profile not in PROFILES:
+        raise ValueError(
+            f"Unknown database profile: {profile} (expected one of {', '.join(PROFILES)})"
+        )
+    pragmas = {"busy_timeout": int(timeout * 1000), **PROFILES[profile]}
+    pragmas.update(overrides or {})
+    return pragmas
+
+
+# Column definitions of lora_messages as first created, with payloads and
+# timestamps as text; migration 4 converts them to _MESSAGE_TABLE_COLUMNS
+_TEXT_MESSAGE_TABLE_COLUMNS = """
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    device_name TEXT,
+    deveui TEXT NOT NULL,
+    appeui TEXT,
+    data TEXT,
+    size INTEGER,
+    timestamp TEXT,
+    sequence_number INTEGER
+"""
+
+# Column definitions of lora_messages and of its partitions. data holds the
+# decoded payload bytes and data_format how to re-encode them (see
+# webapi_example.compact); timestamp holds epoch milliseconds.
+_MESSAGE_TABLE_COLUMNS = """
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    device_name TEXT,
+    deveui TEXT NOT NULL,
+    appeui TEXT,
+    data BLOB,
+    data_format INTEGER,
+    size INTEGER,
+    timestamp INTEGER,
+    sequence_number INTEGER
+"""
+
+
+def register_functions(conn: sqlite3.Connection) -> None:
+    """Register the SQL functions the message queries use.
+
+    Pooled connections have them already; call this on connections opened
+    directly that read messages.
+
+    Args:
+        conn: Database connection.
+    """
+    conn.create_function("base64", 1, sql_base64, deterministic=True)
+
+
+def _create_message_indexes(conn: sqlite3.Connection, table: str) -> None:
+    """Create the (deveui, id) and timestamp indexes of a message table."""
+    # Covers WHERE deveui = ? ORDER BY id without a sort step
+    conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_deveui_id ON {table} (deveui, id)")
+    conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_timestamp ON {table} (timestamp)")
+
+
+def _create_application_index(conn: sqlite3.Connection, table: str) -> None:
+    """Create the (appeui, id) index of a message table (migration 6)."""
+    # Covers WHERE appeui = ? ORDER BY id without a sort step
+    conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_appeui_id ON {table} (appeui, id)")
+
+
+def create_message_table(conn: sqlite3.Connection, table: str, dedup_window_ms: int = 0) -> None:
+    """Create a message partition with the layout and indexes of lora_messages.
+
+    Args:
+        conn: Database connection.
+        table: Table name; must be a trusted identifier.
+        dedup_window_ms: Window of the deduplication index, or 0 for none.
+    """
+    conn.execute(f"CREATE TABLE IF NOT EXISTS {table} ({_MESSAGE_TABLE_COLUMNS})")
+    _create_message_indexes(conn, table)
+    _create_application_index(conn, table)
+    if dedup_window_ms > 0:
+        conn.execute(dedup_index_sql(table, dedup_window_ms))
+
+
+def dedup_index_sql(table: str, window_ms: int) -> str:
+    """Return the statement creating the deduplication index of a message table.
+
+    The index allows one message per device, sequence number and
+    ``window_ms`` long timestamp bucket (or text timestamp). A frame
+    counter that rolls over or restarts after a device reset repeats its
+    values in later buckets, so those messages are still stored.
+
+    Args:
+        table: Table name; must be a trusted identifier.
+        window_ms: Bucket length in milliseconds.
+    """
+    return (
+        f"CREATE UNIQUE INDEX idx_{table}_dedup "
+        f"ON {table} (deveui, sequence_number, {_dedup_bucket(window_ms)})"
+    )
+
+
+def _dedup_bucket(window_ms: int) -> str:
+    """Return the deduplication key expression of a message's timestamp.
+
+    Integer timestamps fall into ``window_ms`` long buckets; a text
+    timestamp is its own key, so only identical text counts as a duplicate.
+    """
+    return (
+        f"CASE typeof(timestamp) WHEN 'integer' THEN timestamp / {window_ms} "
+        "ELSE timestamp END"
+    )
+
+
+def configure_dedup_index(conn: sqlite3.Connection, table: str, window_ms: int) -> int:
+    """Bring the deduplication index of a message table in line with the configuration.
+
+    The index is created when deduplication is enabled, rebuilt when the
+    window changed and dropped when it is disabled, so plain inserts never
+    hit it. Messages that already duplicate each other are deleted first,
+    keeping the oldest copy.
+
+    Args:
+        conn: Connection inside a write transaction.
+        table: Table name; must be a trusted identifier.
+        window_ms: Bucket length in milliseconds, or 0 to drop the index.
+
+    Returns:
+        Number of duplicate messages deleted.
+    """
+    sql = dedup_index_sql(table, window_ms) if window_ms > 0 else None
+    row = conn.execute(
+        "SELECT sql FROM sqlite_master WHERE type = 'index' AND name = ?",
+        (f"idx_{table}_dedup",),
+    ).fetchone()
+    if row is not None and row[0] == sql:
+        return 0
+    if row is not None:
+        conn.execute(f"DROP INDEX idx_{table}_dedup")
+    if sql is None:
+        return 0
+    deleted = conn.execute(
+        f"DELETE FROM {table} WHERE id NOT IN (SELECT min(id) FROM {table} "
+        f"GROUP BY deveui, sequence_number, {_dedup_bucket(window_ms)})"
+    ).rowcount
+    conn.execute(sql)
+    return deleted
+
+
+def align_legacy_ids(conn: sqlite3.Connection, partitioned: bool) -> int:
+    """Keep the ids of lora_messages apart from the partitions' after a layout switch.
+
+    Partitions hold contiguous id ranges, and lora_messages only the ids
+    below the first one. Without partitioning, new messages go to
+    lora_messages, so its id sequence is raised above every partition's;
+    otherwise they would reuse partitioned messages' ids. With
+    partitioning, messages stored that way (ids from the first partition's
+    first_id on) move to the newest partition, keeping their ids.
+
+    Args:
+        conn: Connection inside a write transaction.
+        partitioned: Whether messages are stored in partitions.
+
+    Returns:
+        Number of messages moved to the newest partition.
+
+    Raises:
+        RuntimeError: If lora_messages holds ids a partition may also hold,
+            from unpartitioned writes before its sequence was raised.
+    """
+    partitions = conn.execute(
+        "SELECT name, first_id FROM message_partitions ORDER BY first_id"
+    ).fetchall()
+    if not partitions:
+        return 0
+    sequences = dict(conn.execute("SELECT name, seq FROM sqlite_sequence").fetchall())
+    last_id = max(sequences.get(name, 0) for name, _ in partitions)
+    if not partitioned:
+        if sequences.get("lora_messages", 0) < last_id:
+            conn.execute(
+                "UPDATE sqlite_sequence SET seq = ? WHERE name = 'lora_messages'", (last_id,)
+            )
+            if "lora_messages" not in sequences:
+                conn.execute(
+                    "INSERT INTO sqlite_sequence (name, seq) VALUES ('lora_messages', ?)",
+                    (last_id,),
+                )
+        return 0
+    first_id, newest = partitions[0][1], partitions[-1][0]
+    integer = "CASE typeof(timestamp) WHEN 'integer' THEN timestamp END"
+    low, oldest, latest = conn.execute(
+        f"SELECT min(id), min({integer}), max({integer}) FROM lora_messages WHERE id >= ?",
+        (first_id,),
+    ).fetchone()
+    if low is None:
+        return 0
+    if low <= last_id:
+        raise RuntimeError(
+            f"lora_messages holds message ids from {low} on, which partitions also use; "
+            "they were stored without partitioning and cannot be moved to a partition"
+        )
+    columns = "id, device_name, deveui, appeui, data, data_format, size, timestamp, sequence_number"
+    # A message the partition's deduplication index rejects was a duplicate
+    moved = conn.execute(
+        f"INSERT OR IGNORE INTO {newest} ({columns}) "
+        f"SELECT {columns} FROM lora_messages WHERE id >= ?",
+        (first_id,),
+    ).rowcount
+    conn.execute("DELETE FROM lora_messages WHERE id >= ?", (first_id,))
+    conn.execute(
+        "UPDATE sqlite_sequence SET seq = ? WHERE name = ?",
+        (sequences["lora_messages"], newest),
+    )
+    if oldest is not None:
+        conn.execute(
+            "UPDATE message_partitions SET min_timestamp = min(coalesce(min_timestamp, ?1), ?1), "
+            "max_timestamp = max(coalesce(max_timestamp, ?2), ?2) WHERE name = ?3",
+            (oldest, latest, newest),
+        )
+    return moved
+
+
+def _create_base_schema(conn: sqlite3.Connection) -> None:
+    """Migration 1: users and lora_messages tables.
+
+    Uses IF NOT EXISTS so databases created before versioning are adopted.
+    """
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            username TEXT UNIQUE NOT NULL,
+            password_hash TEXT NOT NULL
+        )
+    """)
+    conn.execute(f"CREATE TABLE IF NOT EXISTS lora_messages ({_TEXT_MESSAGE_TABLE_COLUMNS})")
+
+
+def _add_message_indexes(conn: sqlite3.Connection) -> None:
+    """Migration 2: indexes for per-device and time range message queries."""
+    _create_message_indexes(conn, "lora_messages")
+
+
+def _add_partition_catalog(conn: sqlite3.Connection) -> None:
+    """Migration 3: catalog of time partitions of lora_messages."""
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS message_partitions (
+            name TEXT PRIMARY KEY,
+            period_start TEXT NOT NULL,
+            first_id INTEGER NOT NULL
+        )
+    """)
+
+
+def _compact_row(row: Sequence[Any]) -> tuple[Any, ...]:
+    """Convert a text layout message row to the compact layout.
+
+    Timestamps that do not parse are kept as text; reads return them as
+    they are.
+    """
+    id_, device_name, deveui, appeui, data, size, timestamp, sqn = row
+    data, data_format = pack_payload(data) if isinstance(data, str) else (data, None)
+    if isinstance(timestamp, str):
+        try:
+            timestamp = parse_timestamp(timestamp)
+        except ValueError:
+            pass
+    return (id_, device_name, deveui, appeui, data, data_format, size, timestamp, sqn)
+
+
+def _compact_message_storage(conn: sqlite3.Connection) -> None:
+    """Migration 4: store payloads as bytes and timestamps as epoch milliseconds.
+
+    Rebuilds lora_messages and every partition with the compact layout,
+    keeping ids and the AUTOINCREMENT counter. Run VACUUM afterwards to
+    give the freed pages back to the file system.
+    """
+    tables = ["lora_messages"] + [
+        name for (name,) in conn.execute("SELECT name FROM message_partitions ORDER BY name")
+    ]
+    for table in tables:
+        seq = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = ?", (table,)).fetchone()
+        conn.execute(f"CREATE TABLE {table}_compact ({_MESSAGE_TABLE_COLUMNS})")
+        rows = conn.execute(
+            f"SELECT id, device_name, deveui, appeui, data, size, timestamp, sequence_number "
+            f"FROM {table}"
+        )
+        conn.executemany(
+            f"INSERT INTO {table}_compact (id, device_name, deveui, appeui, data, data_format, "
+            f"size, timestamp, sequence_number) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            map(_compact_row, rows),
+        )
+        conn.execute(f"DROP TABLE {table}")
+        conn.execute(f"ALTER TABLE {table}_compact RENAME TO {table}")
+        _create_message_indexes(conn, table)
+        conn.execute("DELETE FROM sqlite_sequence WHERE name = ?", (table,))
+        if seq is not None:
+            conn.execute("INSERT INTO sqlite_sequence (name, seq) VALUES (?, ?)", (table, seq[0]))
+
+
+def _add_device_summary(conn: sqlite3.Connection) -> None:
+    """Migration 5: devices summary table, filled from the stored messages.
+
+    Only integer (epoch millisecond) timestamps count towards first and
+    last seen; the last sequence number and payload are those of each
+    device's newest message, and the name and application EUI the newest
+    non-empty ones, as for inserts.
+    """
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS devices (
+            deveui TEXT PRIMARY KEY,
+            device_name TEXT,
+            appeui TEXT,
+            first_seen INTEGER,
+            last_seen INTEGER,
+            message_count INTEGER NOT NULL,
+            total_bytes INTEGER NOT NULL,
+            last_sqn INTEGER,
+            last_data BLOB,
+            last_data_format INTEGER
+        )
+    """)
+    tables = ["lora_messages"] + [
+        name for (name,) in conn.execute("SELECT name FROM message_partitions ORDER BY first_id")
+    ]
+    integer = "CASE typeof(timestamp) WHEN 'integer' THEN timestamp END"
+    for table in tables:
+        latest = (
+            f"coalesce((SELECT {{0}} FROM {table} WHERE deveui = totals.deveui AND {{0}} <> '' "
+            "ORDER BY id DESC LIMIT 1), '')"
+        )
+        conn.execute(f"""
+            INSERT INTO devices ({DEVICE_COLUMNS})
+            SELECT totals.deveui, {latest.format("device_name")}, {latest.format("appeui")},
+                first_seen, last_seen,
+                message_count, total_bytes, last.sequence_number, last.data, last.data_format
+            FROM (
+                SELECT deveui, min({integer}) AS first_seen, max({integer}) AS last_seen,
+                    count(*) AS message_count, coalesce(sum(size), 0) AS total_bytes,
+                    max(id) AS last_id
+                FROM {table} GROUP BY deveui
+            ) AS totals JOIN {table} AS last ON last.id = totals.last_id
+            -- An upsert from a SELECT needs a WHERE clause to parse
+            WHERE true
+            {_MERGE_DEVICE}
+        """)
+
+
+def _add_application_index(conn: sqlite3.Connection) -> None:
+    """Migration 6: (appeui, id) index for listings filtered by application."""
+    tables = ["lora_messages"] + [
+        name for (name,) in conn.execute("SELECT name FROM message_partitions ORDER BY name")
+    ]
+    for table in tables:
+        _create_application_index(conn, table)
+
+
+def _add_traffic_rollups(conn: sqlite3.Connection) -> None:
+    """Migration 7: traffic rollup tables, filled from the stored messages.
+
+    Messages without an integer (epoch millisecond) timestamp are not
+    counted, as on insert.
+    """
+    tables = ["lora_messages"] + [
+        name for (name,) in conn.execute("SELECT name FROM message_partitions ORDER BY first_id")
+    ]
+    for resolution, bucket_ms in TRAFFIC_RESOLUTIONS.items():
+        conn.execute(f"""
+            CREATE TABLE IF NOT EXISTS traffic_{resolution} (
+                scope TEXT NOT NULL,
+                key TEXT NOT NULL,
+                bucket INTEGER NOT NULL,
+                messages INTEGER NOT NULL,
+                bytes INTEGER NOT NULL,
+                PRIMARY KEY (scope, key, bucket)
+            ) WITHOUT ROWID
+        """)
+        for table in tables:
+            timed = (
+                f"SELECT deveui, appeui, size, timestamp - timestamp % {bucket_ms} AS bucket "
+                f"FROM {table} WHERE typeof(timestamp) = 'integer'"
+            )
+            conn.execute(f"""
+                INSERT INTO traffic_{resolution} (scope, key, bucket, messages, bytes)
+                SELECT scope, key, bucket, count(*), coalesce(sum(size), 0) FROM (
+                    SELECT 'deveui' AS scope, deveui AS key, bucket, size FROM ({timed})
+                    UNION ALL
+                    SELECT 'appeui', appeui, bucket, size FROM ({timed}) WHERE appeui <> ''
+                    UNION ALL
+                    SELECT 'all', '', bucket, size FROM ({timed})
+                )
+                -- An upsert from a SELECT needs a WHERE clause to parse
+                WHERE true
+                GROUP BY scope, key, bucket
+                {_MERGE_TRAFFIC}
+            """)
+        # For retention, which deletes by age across all keys; created after
+        # the backfill, which is faster than updating it row by row
+        conn.execute(
+            f"CREATE INDEX IF NOT EXISTS idx_traffic_{resolution}_bucket "
+            f"ON traffic_{resolution} (bucket)"
+        )
+
+
+def _add_partition_timestamps(conn: sqlite3.Connection) -> None:
+    """Migration 8: oldest and newest integer timestamp of each partition.
+
+    Lets time range listings skip partitions without a message in range.
+    """
+    conn.execute("ALTER TABLE message_partitions ADD COLUMN min_timestamp INTEGER")
+    conn.execute("ALTER TABLE message_partitions ADD COLUMN max_timestamp INTEGER")
+    integer = "CASE typeof(timestamp) WHEN 'integer' THEN timestamp END"
+    for (name,) in conn.execute("SELECT name FROM message_partitions").fetchall():
+        conn.execute(
+            "UPDATE message_partitions SET (min_timestamp, max_timestamp) = "
+            f"(SELECT min({integer}), max({integer}) FROM {name}) WHERE name = ?",
+            (name,),
+        )
+
+
+# Schema migrations in order; the database's PRAGMA user_version counts how
+# many have been applied. Only ever append to this list.
+MIGRATIONS: list[Callable[[sqlite3.Connection], None]] = [
+    _create_base_schema,
+    _add_message_indexes,
+    _add_partition_catalog,
+    _compact_message_storage,
+    _add_device_summary,
+    _add_application_index,
+    _add_traffic_rollups,
+    _add_partition_timestamps,
+]
+
+SCHEMA_VERSION = len(MIGRATIONS)
+
+
+def migrate(conn: sqlite3.Connection) -> int:
+    """Apply pending schema migrations.
+
+    Each migration runs in its own transaction together with the
+    user_version update, so an interrupted upgrade resumes where it stopped.
+
+    Args:
+        conn: Connection in autocommit mode (isolation_level None).
+
+    Returns:
+        Schema version of the database after migrating.
+
+    Raises:
+        RuntimeError: If the database was created by a newer release.
+    """
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    if version > SCHEMA_VERSION:
+        raise RuntimeError(
+            f"Database schema version {version} is newer than supported ({SCHEMA_VERSION})"
+        )
+    for number in range(version + 1, SCHEMA_VERSION + 1):
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            MIGRATIONS[number - 1](conn)
+            conn.execute(f"PRAGMA user_version = {number}")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+        logger.info("Applied database migration %d (%s)", number, MIGRATIONS[number - 1].__name__)
+    return SCHEMA_VERSION
+
+
+def init_db(db_path: str, dedup_window_ms: int = 0, partitioned: bool = False) -> None:
+    """Create the database if needed and bring its schema up to date.
+
+    Args:
+        db_path: Path to SQLite database file.
+        dedup_window_ms: Window of the deduplication index on every message
+            table, or 0 to have none (see configure_dedup_index()).
+        partitioned: Whether messages are stored in time partitions (see
+            align_legacy_ids()).
+
+    Raises:
+        RuntimeError: If the database was created by a newer release, or its
+            message ids cannot be aligned with the partitions.
+    """
+    os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+    conn = sqlite3.connect(db_path, isolation_level=None)
+    try:
+        version = migrate(conn)
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            tables = ["lora_messages"] + [
+                name for (name,) in conn.execute("SELECT name FROM message_partitions")
+            ]
+            deleted = sum(configure_dedup_index(conn, table, dedup_window_ms) for table in tables)
+            moved = align_legacy_ids(conn, partitioned)
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+        if deleted:
+            logger.info("Deleted %d duplicate messages to enable deduplication", deleted)
+        if moved:
+            logger.info("Moved %d messages stored without partitioning to a partition", moved)
+        logger.info("Database initialized at %s (schema version %d)", db_path, version)
+    finally:
+        conn.close()
+
+
+class ConnectionPool:
+    """Bounded pool of SQLite connections shared between threads.
+
+    Connections are opened lazily, configured once (row factory, pragmas,
+    warmed statement cache) and then reused, so requests no longer pay for
+    opening the file and re-preparing statements. At most ``size``
+    connections exist; callers wait up to ``timeout`` seconds for one.
+
+    Attributes:
+        db_path: Path to SQLite database file.
+        size: Maximum number of open connections.
+        timeout: Seconds to wait for a free connection, also used as the
+            SQLite busy timeout.
+    """
+
+    def __init__(
+        self,
+        db_path: str,
+        size: int = 4,
+        timeout: float = 5.0,
+        pragmas: dict[str, Any] | None = None,
+        warm_statements: Sequence[tuple[str, tuple[Any, ...]]] = WARM_STATEMENTS,
+    ) -> None:
+        """Initialize the pool without opening any connection.
+
+        Args:
+            db_path: Path to SQLite database file.
+            size: Maximum number of open connections.
+            timeout: Seconds to wait for a free connection.
+            pragmas: PRAGMA name/value pairs applied to each new connection.
+            warm_statements: (sql, params) read statements executed once on
+                each new connection to prime its statement cache.
+        """
+        self.db_path = db_path
+        self.size = max(size, 1)
+        self.timeout = timeout
+        self._pragmas = dict(pragmas or {})
+        self._warm_statements = tuple(warm_statements)
+        # LIFO keeps the most recently used (warmest) connections in play
+        self._idle: queue.LifoQueue[sqlite3.Connection] = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(self.size)
+        self._closed = False
+
+    def _connect(self) -> sqlite3.Connection:
+        """Open and configure a new connection."""
+        conn = sqlite3.connect(self.db_path, timeout=self.timeout, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        register_functions(conn)
+        for name, value in self._pragmas.items():
+            conn.execute(f"PRAGMA {name} = {value}")
+        for sql, params in self._warm_statements:
+            try:
+                conn.execute(sql, params).close()
+            except sqlite3.OperationalError as e:
+                # Schema not created yet; the statement is prepared on first use
+                logger.debug("Could not warm statement: %s", e)
+        return conn
+
+    def acquire(self) -> sqlite3.Connection:
+        """Take a connection from the pool, opening one if needed.
+
+        Returns:
+            SQLite connection for exclusive use until release().
+
+        Raises:
+            TimeoutError: If no connection became free within the timeout.
+            RuntimeError: If the pool is closed.
+        """
+        if self._closed:
+            raise RuntimeError("Connection pool is closed")
+        if not self._slots.acquire(timeout=self.timeout):
+            raise TimeoutError("Timed out waiting for a database connection")
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        try:
+            return self._connect()
+        except BaseException:
+            self._slots.release()
+            raise
+
+    def release(self, conn: sqlite3.Connection) -> None:
+        """Return a connection to the pool.
+
+        Any open transaction is rolled back; a connection that cannot be
+        reset is closed instead of being reused.
+
+        Args:
+            conn: Connection obtained from acquire().
+        """
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error as e:
+            logger.warning("Discarding broken database connection: %s", e)
+            conn.close()
+        else:
+            if self._closed:
+                conn.close()
+            else:
+                self._idle.put(conn)
+        finally:
+            self._slots.release()
+
+    @contextmanager
+    def connection(self) -> Iterator[sqlite3.Connection]:
+        """Borrow a connection for the duration of a with block.
+
+        Yields:
+            SQLite connection.
+        """
+        conn = self.acquire()
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    def close(self) -> None:
+        """Close idle connections; borrowed ones are closed on release."""
+        self._closed = True
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
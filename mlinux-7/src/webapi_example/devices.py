@@ -0,0 +1,127 @@
+"""Per-device summaries of stored messages and their in-memory mirror.
+
+Every write aggregates its rows per device (device_updates()) and merges
+the result into the devices table in the same transaction, so the table
+is always in step with the messages. DeviceRegistry mirrors the table in
+memory, applying the same aggregates after each commit, so device lookups
+never touch the database.
+"""
+
+import sqlite3
+import threading
+from typing import Any
+
+from webapi_example.compact import unpack_payload
+from webapi_example.database import SELECT_DEVICES
+from webapi_example.models.data import Device
+
+
+def device_updates(rows: list[tuple[Any, ...]]) -> list[tuple[Any, ...]]:
+    """Aggregate message rows into one UPSERT_DEVICE row per device.
+
+    Args:
+        rows: INSERT_MESSAGE parameters, in the order they are stored.
+
+    Returns:
+        Parameters in DEVICE_COLUMNS order: counts and bytes summed, first
+        and last seen over the rows' integer timestamps (text timestamps
+        are not compared), the last sequence number and payload taken from
+        each device's last row.
+    """
+    updates: dict[str, list[Any]] = {}
+    for name, deveui, appeui, data, data_format, size, timestamp, sqn in rows:
+        if type(timestamp) is not int:
+            timestamp = None
+        update = updates.get(deveui)
+        if update is None:
+            updates[deveui] = [
+                deveui, name, appeui, timestamp, timestamp, 1, size or 0, sqn, data, data_format
+            ]
+            continue
+        if name:
+            update[1] = name
+        if appeui:
+            update[2] = appeui
+        update[3] = _earliest(update[3], timestamp)
+        update[4] = _latest(update[4], timestamp)
+        update[5] += 1
+        update[6] += size or 0
+        update[7:] = [sqn, data, data_format]
+    return [tuple(update) for update in updates.values()]
+
+
+def _earliest(a: Any, b: Any) -> Any:
+    """Return the smaller of two optional timestamps."""
+    return b if a is None else a if b is None else min(a, b)
+
+
+def _latest(a: Any, b: Any) -> Any:
+    """Return the larger of two optional timestamps."""
+    return b if a is None else a if b is None else max(a, b)
+
+
+class DeviceRegistry:
+    """In-memory mirror of the devices table. Thread-safe."""
+
+    def __init__(self) -> None:
+        """Initialize an empty registry; call load() to fill it."""
+        self._devices: dict[str, Device] = {}
+        self._lock = threading.Lock()
+
+    def load(self, conn: sqlite3.Connection) -> None:
+        """Replace the mirror with the contents of the devices table.
+
+        Args:
+            conn: Database connection.
+
+        Raises:
+            sqlite3.OperationalError: If the table does not exist yet.
+        """
+        cur = conn.cursor()
+        cur.row_factory = None
+        devices: dict[str, Device] = {}
+        try:
+            for deveui, name, appeui, first, last, count, size, sqn, data, fmt in cur.execute(
+                SELECT_DEVICES
+            ):
+                devices[deveui] = Device(
+                    deveui, name, appeui, first, last, count, size, sqn, unpack_payload(data, fmt)
+                )
+        finally:
+            cur.close()
+        with self._lock:
+            self._devices = devices
+
+    def update(self, rows: list[tuple[Any, ...]]) -> None:
+        """Apply committed message rows, like UPSERT_DEVICE does to the table.
+
+        Args:
+            rows: INSERT_MESSAGE parameters of the committed rows.
+        """
+        updates = device_updates(rows)
+        with self._lock:
+            for deveui, name, appeui, first, last, count, size, sqn, data, fmt in updates:
+                device = self._devices.get(deveui)
+                if device is None:
+                    device = self._devices[deveui] = Device(deveui, name, appeui)
+                if name:
+                    device.device_name = name
+                if appeui:
+                    device.appeui = appeui
+                device.first_seen = _earliest(device.first_seen, first)
+                device.last_seen = _latest(device.last_seen, last)
+                device.message_count += count
+                device.total_bytes += size
+                device.last_sqn = sqn
+                device.last_data = unpack_payload(data, fmt)
+
+    def get(self, deveui: str) -> dict[str, Any] | None:
+        """Return one device's summary as a dictionary, or None if unknown."""
+        with self._lock:
+            device = self._devices.get(deveui)
+            return device.to_dict() if device is not None else None
+
+    def list(self) -> list[dict[str, Any]]:
+        """Return every device's summary as a dictionary, ordered by EUI."""
+        with self._lock:
+            return [self._devices[deveui].to_dict() for deveui in sorted(self._devices)]
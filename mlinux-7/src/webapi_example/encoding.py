@@ -0,0 +1,99 @@
+"""Direct row-to-JSON encoding for hot listing endpoints.
+
+Building a dict per row and passing it to ``json.dumps`` costs several
+allocations and a generic type dispatch per value. ``RowEncoder`` instead
+compiles the object layout (key names, separators) into a format string
+once and fills it straight from row tuples, escaping strings with the C
+accelerated encoder ``json.dumps`` itself uses.
+
+The output is compact, with UTF-8 text left unescaped: identical to
+``json.dumps(obj, separators=(",", ":"), ensure_ascii=False)`` of the
+equivalent dict, and to SQLite's json_object() for text, integer and NULL
+values, so message listings are the same bytes whichever renders them.
+"""
+
+from json.encoder import encode_basestring
+from typing import Any, Callable, Iterable, Sequence
+
+# Escapes and quotes a str like json.dumps (ensure_ascii=False) and SQLite
+encode_string = encode_basestring
+
+# JSON encoder of each type SQLite returns; SQLite stores neither NaN nor
+# infinities, so float repr is always valid JSON
+_ENCODERS: dict[type, Callable[[Any], str]] = {
+    str: encode_basestring,
+    int: int.__repr__,
+    float: float.__repr__,
+    type(None): lambda value: "null",
+}
+
+
+def encode_value(value: Any) -> str:
+    """Encode a SQLite column value (str, int, float or None) as JSON.
+
+    Args:
+        value: Column value.
+
+    Returns:
+        JSON text of the value.
+
+    Raises:
+        TypeError: If the value is not a str, int, float or None.
+    """
+    try:
+        return _ENCODERS[type(value)](value)
+    except KeyError:
+        raise TypeError(f"Cannot encode {type(value).__name__} column value as JSON") from None
+
+
+class RowEncoder:
+    """Encode row tuples as JSON objects with a fixed key layout.
+
+    Attributes:
+        keys: JSON key of each row position.
+    """
+
+    def __init__(self, keys: Sequence[str]) -> None:
+        """Compile the object template.
+
+        Args:
+            keys: JSON key of each row position, in column order.
+        """
+        self.keys = tuple(keys)
+        members = ",".join(encode_basestring(key).replace("%", "%%") + ":%s" for key in self.keys)
+        self._template = "{" + members + "}"
+
+    def encode(self, row: Sequence[Any]) -> str:
+        """Encode one row as a JSON object.
+
+        Args:
+            row: Column values in key order.
+
+        Returns:
+            JSON text of the object.
+
+        Raises:
+            TypeError: If a value is not a str, int, float or None.
+        """
+        return self._template % tuple([encode_value(value) for value in row])
+
+    def encode_rows(self, rows: Iterable[Sequence[Any]]) -> str:
+        """Encode rows as the comma-separated members of a JSON array.
+
+        Args:
+            rows: Rows to encode.
+
+        Returns:
+            JSON objects joined by ",", without the surrounding brackets.
+
+        Raises:
+            TypeError: If a value is not a str, int, float or None.
+        """
+        template = self._template
+        encoders = _ENCODERS
+        try:
+            return ",".join(
+                [template % tuple([encoders[type(value)](value) for value in row]) for row in rows]
+            )
+        except KeyError as e:
+            raise TypeError(f"Cannot encode {e.args[0].__name__} column value as JSON") from None
@@ -0,0 +1,624 @@
+"""Message ingest: validation and batched inserts."""
+
+import json
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import AbstractContextManager, nullcontext
+from typing import Any, Callable
+
+from webapi_example.compact import pack_payload, pack_timestamp
+from webapi_example.database import (
+    INSERT_MESSAGE,
+    INSERT_MESSAGE_UNIQUE,
+    UPSERT_DEVICE,
+    ConnectionPool,
+)
+from webapi_example.devices import device_updates
+from webapi_example.models.data import LoraMessage
+from webapi_example.partitions import PartitionLayout, table_sql
+from webapi_example.rollups import update_traffic
+
+logger = logging.getLogger(__name__)
+
+# Content types treated as newline-delimited JSON
+NDJSON_TYPES = ("application/x-ndjson", "application/ndjson", "application/jsonl")
+
+
+def message_row(item: Any) -> tuple[Any, ...]:
+    """Validate a message object and convert it to INSERT_MESSAGE parameters.
+
+    The payload and timestamp are converted to their stored form, see
+    webapi_example.compact.
+
+    Args:
+        item: Decoded JSON message.
+
+    Returns:
+        Parameters in INSERT_MESSAGE column order.
+
+    Raises:
+        ValueError: If the message is not an object or a field is invalid.
+    """
+    if not isinstance(item, dict):
+        raise ValueError("message must be an object")
+    message = LoraMessage.from_dict(item)
+    if not message.deveui or not isinstance(message.deveui, str):
+        raise ValueError("deveui is required")
+    for name, text in (("deviceName", message.device_name), ("appeui", message.appeui)):
+        if not isinstance(text, str):
+            raise ValueError(f"{name} must be a string")
+    for name, value in (("size", message.size), ("sqn", message.sequence_number)):
+        if not isinstance(value, int) or isinstance(value, bool):
+            raise ValueError(f"{name} must be an integer")
+        # SQLite integers are 64-bit
+        if not -(2**63) <= value < 2**63:
+            raise ValueError(f"{name} is out of range")
+    if message.data is not None and not isinstance(message.data, str):
+        raise ValueError("data must be a string")
+    if not isinstance(message.timestamp, str):
+        raise ValueError("timestamp must be a string")
+    data, data_format = pack_payload(message.data)
+    return (
+        message.device_name,
+        message.deveui,
+        message.appeui,
+        data,
+        data_format,
+        message.size,
+        pack_timestamp(message.timestamp),
+        message.sequence_number,
+    )
+
+
+def decode_batch(body: bytes, content_type: str = "") -> list[Any]:
+    """Decode a batch request body into a list of message objects.
+
+    Accepts a JSON array, a JSON object with a "messages" array, or
+    newline-delimited JSON (one message per line). NDJSON is used when the
+    content type says so or when the body is not a single JSON document.
+
+    Args:
+        body: Raw request body.
+        content_type: Value of the Content-Type header.
+
+    Returns:
+        Decoded items, not yet validated.
+
+    Raises:
+        ValueError: If the body is not valid JSON in any accepted layout.
+    """
+    text = body.decode("utf-8")
+    if content_type.split(";", 1)[0].strip().lower() not in NDJSON_TYPES:
+        try:
+            data = json.loads(text)
+        except json.JSONDecodeError as e:
+            if e.msg != "Extra data":
+                raise ValueError(f"Invalid JSON: {e}") from None
+        else:
+            messages = data.get("messages") if isinstance(data, dict) else None
+            if isinstance(messages, list):
+                return messages
+            if isinstance(data, list):
+                return data
+            # A lone object is a one-line NDJSON batch
+            return [data]
+
+    items = []
+    for number, line in enumerate(text.splitlines(), start=1):
+        if not line.strip():
+            continue
+        try:
+            items.append(json.loads(line))
+        except json.JSONDecodeError as e:
+            raise ValueError(f"Invalid JSON on line {number}: {e}") from None
+    return items
+
+
+def validate_batch(items: list[Any]) -> tuple[list[tuple[Any, ...]], list[dict[str, Any]]]:
+    """Validate decoded messages, collecting per-item results.
+
+    Args:
+        items: Decoded message objects.
+
+    Returns:
+        INSERT_MESSAGE parameters of the valid items, and a result per item
+        holding its "index" and "status" ("ok" or "error", the latter with
+        an "error" description). Callers replace "ok" with what happened
+        to the row.
+    """
+    rows = []
+    results: list[dict[str, Any]] = []
+    for index, item in enumerate(items):
+        try:
+            rows.append(message_row(item))
+        except ValueError as e:
+            results.append({"index": index, "status": "error", "error": str(e)})
+        else:
+            results.append({"index": index, "status": "ok"})
+    return rows, results
+
+
+def batch_result(results: list[dict[str, Any]], status: str) -> dict[str, Any]:
+    """Build the response body of a batch request.
+
+    Args:
+        results: Per-item results from validate_batch(), with duplicates
+            marked by drop_duplicates().
+        status: Status given to the valid items, "created" or "queued".
+
+    Returns:
+        Batch result with the number of stored or queued rows (under the
+        key given by ``status``), the numbers of duplicate and failed items
+        and the per-item results.
+    """
+    counts = {status: 0, "duplicate": 0, "error": 0}
+    for result in results:
+        if result["status"] == "ok":
+            result["status"] = status
+        counts[result["status"]] += 1
+    return {
+        status: counts[status],
+        "duplicates": counts["duplicate"],
+        "failed": counts["error"],
+        "results": results,
+    }
+
+
+class DuplicateFilter:
+    """Recently stored messages, to drop repeated uplinks without a query.
+
+    Several packet forwarders, or a collector retrying, deliver the same
+    uplink more than once. A message is a duplicate when a message from
+    the same device with the same sequence number and a timestamp less
+    than ``window`` apart was stored. Comparing timestamps keeps frame
+    counters that roll over or restart after a device reset working: a
+    counter value only comes back long after the window.
+
+    Messages are remembered once committed, for ``window`` seconds and at
+    most ``max_entries`` of them; the unique index from
+    database.dedup_index_sql() catches what the filter no longer knows,
+    e.g. after a restart. Thread-safe.
+
+    Attributes:
+        window_ms: Window in milliseconds.
+        max_entries: Most messages remembered.
+    """
+
+    def __init__(self, window: float, max_entries: int = 10000) -> None:
+        """Initialize an empty filter.
+
+        Args:
+            window: Window in seconds.
+            max_entries: Most messages remembered.
+        """
+        self.window_ms = int(window * 1000)
+        self.max_entries = max(max_entries, 1)
+        # (deveui, sequence number) -> (timestamp, monotonic time stored)
+        self._seen: OrderedDict[tuple[str, int], tuple[Any, float]] = OrderedDict()
+        self._lock = threading.Lock()
+        self._dropped = 0
+        self._ignored = 0
+
+    def fresh(self, rows: list[tuple[Any, ...]]) -> list[bool]:
+        """Check rows against the stored messages and against each other.
+
+        Args:
+            rows: INSERT_MESSAGE parameters.
+
+        Returns:
+            False for each row duplicating a stored message or an earlier
+            row of the list, True otherwise.
+        """
+        batch: dict[tuple[str, int], Any] = {}
+        flags = []
+        with self._lock:
+            self._expire(time.monotonic())
+            for row in rows:
+                key = (row[1], row[7])
+                duplicate = self._close(batch.get(key), row[6])
+                if not duplicate:
+                    seen = self._seen.get(key)
+                    duplicate = seen is not None and self._close(seen[0], row[6])
+                if not duplicate:
+                    batch[key] = row[6]
+                flags.append(not duplicate)
+            self._dropped += flags.count(False)
+        return flags
+
+    def record(self, rows: list[tuple[Any, ...]], ignored: int = 0) -> None:
+        """Remember committed rows.
+
+        Args:
+            rows: INSERT_MESSAGE parameters of the stored rows.
+            ignored: Rows of the same write the unique index rejected.
+        """
+        with self._lock:
+            now = time.monotonic()
+            for row in rows:
+                key = (row[1], row[7])
+                self._seen.pop(key, None)
+                self._seen[key] = (row[6], now)
+            self._ignored += ignored
+            self._expire(now)
+
+    def stats(self) -> dict[str, Any]:
+        """Return the window, the number of remembered messages and drop counters."""
+        with self._lock:
+            return {
+                "window": self.window_ms / 1000,
+                "tracked": len(self._seen),
+                "duplicates": self._dropped + self._ignored,
+                "dropped_in_memory": self._dropped,
+                "dropped_by_index": self._ignored,
+            }
+
+    def _close(self, seen: Any, timestamp: Any) -> bool:
+        """Return True if two timestamps are within the window."""
+        if seen is None:
+            return False
+        if isinstance(seen, int) and isinstance(timestamp, int):
+            return abs(seen - timestamp) < self.window_ms
+        return bool(seen == timestamp)
+
+    def _expire(self, now: float) -> None:
+        """Forget the oldest entries; the lock must be held."""
+        limit = now - self.window_ms / 1000
+        while self._seen:
+            key, (_, stored) = next(iter(self._seen.items()))
+            if stored >= limit and len(self._seen) <= self.max_entries:
+                break
+            del self._seen[key]
+
+
+def drop_duplicates(
+    rows: list[tuple[Any, ...]], results: list[dict[str, Any]], fresh: list[bool]
+) -> list[tuple[Any, ...]]:
+    """Remove duplicate rows of a batch, marking their results "duplicate".
+
+    Args:
+        rows: INSERT_MESSAGE parameters from validate_batch().
+        results: Per-item results from validate_batch().
+        fresh: Per row, False if it is a duplicate.
+
+    Returns:
+        The rows to keep.
+    """
+    pending = [result for result in results if result["status"] == "ok"]
+    for result, keep in zip(pending, fresh, strict=True):
+        if not keep:
+            result["status"] = "duplicate"
+    return [row for row, keep in zip(rows, fresh, strict=True) if keep]
+
+
+def write_messages(
+    conn: sqlite3.Connection,
+    rows: list[tuple[Any, ...]],
+    layout: PartitionLayout | None = None,
+    dedup: DuplicateFilter | None = None,
+) -> tuple[list[tuple[Any, ...]], list[int], list[bool]]:
+    """Insert message rows in one transaction.
+
+    The devices table and the traffic rollups are updated from the stored
+    rows in the same transaction, one upsert per device and per bucket in
+    the batch.
+
+    Args:
+        conn: Database connection, not inside a transaction.
+        rows: INSERT_MESSAGE parameters.
+        layout: Partition layout, or None to write to lora_messages.
+        dedup: Duplicate filter, if deduplication is enabled. Rows the
+            unique index rejects are then skipped, and the stored rows are
+            recorded in the filter after the commit.
+
+    Returns:
+        The rows stored, the id of each, and per row given True if it was
+        stored or False if the unique index rejected it as a duplicate.
+    """
+    if layout is None and dedup is None:
+        with conn:
+            conn.executemany(INSERT_MESSAGE, rows)
+            ids = _inserted_ids(conn, len(rows))
+            conn.executemany(UPSERT_DEVICE, device_updates(rows))
+            update_traffic(conn, rows)
+        return rows, ids, [True] * len(rows)
+    # Take the write lock first, so the partition cannot change before the insert
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        sql = INSERT_MESSAGE if dedup is None else INSERT_MESSAGE_UNIQUE
+        if layout is not None:
+            table = layout.write_table(conn)
+            sql = table_sql(sql, table)
+        if dedup is None:
+            conn.executemany(sql, rows)
+            stored, ids, fresh = rows, _inserted_ids(conn, len(rows)), [True] * len(rows)
+        else:
+            # One statement per row, whose rowcount is 0 if the row was ignored
+            cur = conn.cursor()
+            stored, ids, fresh = [], [], []
+            for row in rows:
+                inserted = cur.execute(sql, row).rowcount > 0
+                if inserted:
+                    # Set by every INSERT that stored a row
+                    assert cur.lastrowid is not None
+                    stored.append(row)
+                    ids.append(cur.lastrowid)
+                fresh.append(inserted)
+            cur.close()
+        if layout is not None:
+            layout.record_timestamps(conn, table, stored)
+        conn.executemany(UPSERT_DEVICE, device_updates(stored))
+        update_traffic(conn, stored)
+    except BaseException:
+        conn.rollback()
+        raise
+    conn.commit()
+    if dedup is not None:
+        dedup.record(stored, len(rows) - len(stored))
+    return stored, ids, fresh
+
+
+def _inserted_ids(conn: sqlite3.Connection, count: int) -> list[int]:
+    """Return the ids of the rows the last executemany() inserted.
+
+    One statement inserting into an AUTOINCREMENT table, inside the write
+    transaction, assigns consecutive ids ending with last_insert_rowid().
+    """
+    last = conn.execute("SELECT last_insert_rowid()").fetchone()[0]
+    return list(range(last - count + 1, last + 1))
+
+
+def insert_batch(
+    conn: sqlite3.Connection,
+    items: list[Any],
+    on_commit: Callable[[list[tuple[Any, ...]], list[int]], None] | None = None,
+    layout: PartitionLayout | None = None,
+    dedup: DuplicateFilter | None = None,
+    commit_lock: AbstractContextManager[Any] | None = None,
+) -> dict[str, Any]:
+    """Validate messages and insert the valid ones in a single transaction.
+
+    All valid rows are written in one transaction, so a batch costs a
+    single fsync however many messages it carries. Invalid items are
+    skipped and reported, and so are duplicates when deduplicating.
+
+    Args:
+        conn: Database connection.
+        items: Decoded message objects.
+        on_commit: Called with the inserted rows and their ids after the
+            commit.
+        layout: Partition layout, or None to write to lora_messages.
+        dedup: Duplicate filter, if deduplication is enabled.
+        commit_lock: Held from the write until on_commit returns, so that
+            writers sharing it report their commits in id order.
+
+    Returns:
+        Batch result with "created", "duplicates" and "failed" counts and a
+        "results" list holding, per item, its "index" and "status"
+        ("created", "duplicate" or "error", the latter with an "error"
+        description).
+    """
+    rows, results = validate_batch(items)
+    if dedup is not None:
+        rows = drop_duplicates(rows, results, dedup.fresh(rows))
+    if rows:
+        with commit_lock or nullcontext():
+            stored, ids, fresh = write_messages(conn, rows, layout, dedup)
+            if on_commit is not None and stored:
+                on_commit(stored, ids)
+        if len(stored) < len(rows):
+            drop_duplicates(rows, results, fresh)
+        logger.info("Created %d messages in batch", len(stored))
+    return batch_result(results, "created")
+
+
+class GroupCommitWriter:
+    """Write-behind queue committing messages in groups from one thread.
+
+    Ingest requests hand rows to ``submit()`` and return at once; a
+    dedicated writer thread inserts them with one transaction per group.
+    A group is committed when it reaches ``max_rows`` rows or when its
+    oldest row has waited ``max_delay`` seconds, which bounds how much
+    acknowledged data a power loss can take. When ``queue_size`` rows are
+    waiting, ``submit()`` refuses new rows so callers can push back.
+
+    Attributes:
+        max_rows: Largest group committed in one transaction.
+        max_delay: Seconds the oldest queued row may wait for its commit.
+        queue_size: Most rows waiting to be written.
+    """
+
+    def __init__(
+        self,
+        pool: ConnectionPool,
+        max_rows: int = 100,
+        max_delay: float = 0.05,
+        queue_size: int = 1000,
+        on_commit: Callable[[list[tuple[Any, ...]], list[int]], None] | None = None,
+        layout: PartitionLayout | None = None,
+        dedup: DuplicateFilter | None = None,
+        commit_lock: AbstractContextManager[Any] | None = None,
+    ) -> None:
+        """Initialize the writer without starting its thread.
+
+        Args:
+            pool: Connection pool the writer borrows a connection from.
+            max_rows: Largest group committed in one transaction.
+            max_delay: Seconds the oldest queued row may wait for its commit.
+            queue_size: Most rows waiting to be written.
+            on_commit: Called from the writer thread with each committed
+                group and the ids of its rows.
+            layout: Partition layout, or None to write to lora_messages.
+            dedup: Duplicate filter, if deduplication is enabled.
+            commit_lock: Held from each write until on_commit returns, so
+                that writers sharing it report their commits in id order.
+        """
+        self.max_rows = max(max_rows, 1)
+        self.max_delay = max_delay
+        self.queue_size = max(queue_size, 1)
+        self._pool = pool
+        self._on_commit = on_commit
+        self._layout = layout
+        self._dedup = dedup
+        self._commit_lock: AbstractContextManager[Any] = commit_lock or nullcontext()
+        self._rows: deque[tuple[Any, ...]] = deque()
+        self._oldest = 0.0
+        self._writing = 0
+        self._flushing = 0
+        self._running = False
+        self._cond = threading.Condition()
+        self._thread: threading.Thread | None = None
+        self._committed = 0
+        self._failed = 0
+        self._groups = 0
+
+    def start(self) -> None:
+        """Start the writer thread."""
+        self._running = True
+        self._thread = threading.Thread(target=self._write_loop, name="group-commit", daemon=True)
+        self._thread.start()
+        logger.info(
+            "Group commit writer started: %d rows / %.0f ms per commit",
+            self.max_rows,
+            self.max_delay * 1000,
+        )
+
+    def stop(self) -> None:
+        """Commit everything still queued, then stop the writer thread."""
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+
+    def submit(self, rows: list[tuple[Any, ...]]) -> bool:
+        """Queue rows for the writer thread.
+
+        Rows of one call are queued together or not at all.
+
+        Args:
+            rows: INSERT_MESSAGE parameters.
+
+        Returns:
+            False if the queue has no room for the rows or the writer is
+            stopped; the caller should ask the client to retry later.
+        """
+        with self._cond:
+            if not self._running or len(self._rows) + len(rows) > self.queue_size:
+                return False
+            if not self._rows:
+                self._oldest = time.monotonic()
+            self._rows.extend(rows)
+            self._cond.notify_all()
+        return True
+
+    def flush(self, timeout: float | None = None) -> bool:
+        """Commit queued rows now and wait until they are written.
+
+        Args:
+            timeout: Seconds to wait, or None to wait indefinitely.
+
+        Returns:
+            True if everything queued before the call has been written.
+        """
+        with self._cond:
+            self._flushing += 1
+            self._cond.notify_all()
+            try:
+                return self._cond.wait_for(
+                    lambda: not self._rows and not self._writing, timeout
+                )
+            finally:
+                self._flushing -= 1
+
+    def stats(self) -> dict[str, int]:
+        """Return queue depth and commit counters."""
+        with self._cond:
+            return {
+                "queued": len(self._rows) + self._writing,
+                "committed": self._committed,
+                "failed": self._failed,
+                "groups": self._groups,
+            }
+
+    def _next_group(self) -> list[tuple[Any, ...]] | None:
+        """Wait until a group is due and take it off the queue.
+
+        Returns:
+            Rows to commit, or None once stopped with nothing left.
+        """
+        with self._cond:
+            while True:
+                if self._rows:
+                    due = self._oldest + self.max_delay - time.monotonic()
+                    if (
+                        len(self._rows) >= self.max_rows
+                        or due <= 0
+                        or self._flushing
+                        or not self._running
+                    ):
+                        break
+                    self._cond.wait(due)
+                elif not self._running:
+                    return None
+                else:
+                    self._cond.wait()
+
+            count = min(len(self._rows), self.max_rows)
+            group = [self._rows.popleft() for _ in range(count)]
+            # Rows left over are already late; commit them next without waiting
+            self._oldest = time.monotonic() - self.max_delay if self._rows else 0.0
+            self._writing = count
+            return group
+
+    def _write_loop(self) -> None:
+        """Commit groups of queued rows until stopped and drained."""
+        try:
+            while True:
+                group = self._next_group()
+                if group is None:
+                    return
+                self._write_group(group)
+        finally:
+            with self._cond:
+                # Should the thread die, refuse rows nobody would write
+                self._running = False
+                self._failed += len(self._rows)
+                self._rows.clear()
+                self._writing = 0
+                self._cond.notify_all()
+
+    def _write_group(self, group: list[tuple[Any, ...]]) -> None:
+        """Commit one group, counting its rows as failed if it cannot be written."""
+        try:
+            with self._pool.connection() as conn, self._commit_lock:
+                stored, ids, _ = write_messages(conn, group, self._layout, self._dedup)
+                self._committed_group(stored, ids)
+        except (sqlite3.Error, TimeoutError, RuntimeError) as e:
+            logger.error("Failed to write %d queued messages: %s", len(group), e)
+            committed = False
+        except Exception:
+            logger.exception("Failed to write %d queued messages", len(group))
+            committed = False
+        else:
+            committed = True
+        with self._cond:
+            if committed:
+                self._committed += len(stored)
+                self._groups += 1
+            else:
+                self._failed += len(group)
+            self._writing = 0
+            self._cond.notify_all()
+
+    def _committed_group(self, stored: list[tuple[Any, ...]], ids: list[int]) -> None:
+        """Hand a committed group to on_commit, logging rather than raising its errors."""
+        if self._on_commit is None or not stored:
+            return
+        try:
+            self._on_commit(stored, ids)
+        except Exception:
+            logger.exception("Commit callback failed for %d messages", len(stored))
@@ -73,7 +73,7 @@ def main() -> None:
         logger.info(
             "Starting server on %s:%d", config.server.host, config.server.port
         )
-        run_server(config, db_path)
+        run_server(config, db_path, _status_writer)
     except Exception as e:
         logger.error("Application error: %s", e)
         if _status_writer:
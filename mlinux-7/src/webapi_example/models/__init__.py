@@ -1,6 +1,6 @@
 """Data models for the Web API Example application."""
 
 from webapi_example.models.config import AppConfig, ServerConfig
-from webapi_example.models.data import User, LoraMessage
+from webapi_example.models.data import Device, User, LoraMessage
 
-__all__ = ["AppConfig", "ServerConfig", "User", "LoraMessage"]
+__all__ = ["AppConfig", "ServerConfig", "User", "LoraMessage", "Device"]
@@ -35,6 +35,105 @@ class TlsConfig:
         )
 
 
+@dataclass
+class CacheConfig:
+    """Response cache configuration.
+
+    Attributes:
+        enabled: Cache encoded message listing responses.
+        max_bytes: Largest total size of cached responses.
+    """
+
+    enabled: bool = True
+    max_bytes: int = 4 * 1024 * 1024
+
+    @classmethod
+    def from_dict(cls, data: dict[str, Any]) -> "CacheConfig":
+        """Create CacheConfig from dictionary.
+
+        Args:
+            data: Configuration dictionary.
+
+        Returns:
+            CacheConfig instance.
+        """
+        return cls(
+            enabled=data.get("enabled", True),
+            max_bytes=data.get("max_bytes", 4 * 1024 * 1024),
+        )
+
+
+@dataclass
+class CompressionConfig:
+    """Response compression configuration.
+
+    Attributes:
+        enabled: Compress responses for clients accepting gzip or deflate.
+        min_size: Smallest response body compressed, in bytes; streamed
+            responses are always compressed.
+        level: zlib compression level, 1 (fastest) to 9 (smallest).
+    """
+
+    enabled: bool = True
+    min_size: int = 1024
+    level: int = 6
+
+    @classmethod
+    def from_dict(cls, data: dict[str, Any]) -> "CompressionConfig":
+        """Create CompressionConfig from dictionary.
+
+        Args:
+            data: Configuration dictionary.
+
+        Returns:
+            CompressionConfig instance.
+        """
+        return cls(
+            enabled=data.get("enabled", True),
+            min_size=data.get("min_size", 1024),
+            level=data.get("level", 6),
+        )
+
+
+@dataclass
+class StreamConfig:
+    """Live message stream (GET /messages/stream) configuration.
+
+    Attributes:
+        max_clients: Most stream clients connected at once; each holds a
+            worker thread, see ServerConfig.max_waiters. 0 disables the
+            stream.
+        queue_size: Most messages waiting to be sent to one client before
+            it is disconnected as too slow.
+        history: Most recent messages kept in memory for clients resuming
+            with Last-Event-ID.
+        keepalive: Seconds between comments sent on an idle stream, which
+            also detect closed connections.
+    """
+
+    max_clients: int = 1
+    queue_size: int = 1000
+    history: int = 1000
+    keepalive: float = 15.0
+
+    @classmethod
+    def from_dict(cls, data: dict[str, Any]) -> "StreamConfig":
+        """Create StreamConfig from dictionary.
+
+        Args:
+            data: Configuration dictionary.
+
+        Returns:
+            StreamConfig instance.
+        """
+        return cls(
+            max_clients=data.get("max_clients", 1),
+            queue_size=data.get("queue_size", 1000),
+            history=data.get("history", 1000),
+            keepalive=data.get("keepalive", 15.0),
+        )
+
+
 @dataclass
 class ServerConfig:
     """HTTP server configuration.
@@ -44,12 +143,46 @@ class ServerConfig:
         port: Port number to listen on.
         debug: Enable debug mode.
         tls: TLS/SSL configuration.
+        cache: Response cache configuration.
+        compression: Response compression configuration.
+        stream: Live message stream configuration.
+        concurrency: Request handling mode, "threads" (bounded worker pool),
+            "asyncio" (event loop) or "single" (one request at a time).
+        workers: Number of worker threads serving requests.
+        queue_depth: Accepted connections allowed to wait for a free worker.
+        listen_backlog: Pending connections queued by the kernel before accept.
+        keepalive_timeout: Seconds an idle persistent connection is kept open.
+        keepalive_max_requests: Requests served on one connection before
+            it is closed.
+        max_batch_size: Most messages accepted by one POST /messages/batch.
+        page_size: Messages per page of a listing when no limit is given.
+        max_page_size: Largest limit a client may request for one page.
+        max_wait: Longest ``wait`` a client may request for new messages,
+            in seconds; longer waits are capped.
+        max_waiters: Most requests waiting for new messages at once; each
+            holds a worker thread. Waiting requests and stream clients
+            together never hold more than ``workers - 1`` workers, so one is
+            always left for short requests such as ingest.
     """
 
     host: str = "0.0.0.0"
     port: int = 5000
     debug: bool = False
     tls: TlsConfig = field(default_factory=TlsConfig)
+    cache: CacheConfig = field(default_factory=CacheConfig)
+    compression: CompressionConfig = field(default_factory=CompressionConfig)
+    stream: StreamConfig = field(default_factory=StreamConfig)
+    concurrency: str = "threads"
+    workers: int = 4
+    queue_depth: int = 16
+    listen_backlog: int = 32
+    keepalive_timeout: float = 5.0
+    keepalive_max_requests: int = 100
+    max_batch_size: int = 1000
+    page_size: int = 100
+    max_page_size: int = 1000
+    max_wait: float = 30.0
+    max_waiters: int = 1
 
     @classmethod
     def from_dict(cls, data: dict[str, Any]) -> "ServerConfig":
@@ -66,6 +199,52 @@ class ServerConfig:
             port=data.get("port", 5000),
             debug=data.get("debug", False),
             tls=TlsConfig.from_dict(data.get("tls", {})),
+            cache=CacheConfig.from_dict(data.get("cache", {})),
+            compression=CompressionConfig.from_dict(data.get("compression", {})),
+            stream=StreamConfig.from_dict(data.get("stream", {})),
+            concurrency=data.get("concurrency", "threads"),
+            workers=data.get("workers", 4),
+            queue_depth=data.get("queue_depth", 16),
+            listen_backlog=data.get("listen_backlog", 32),
+            keepalive_timeout=data.get("keepalive_timeout", 5.0),
+            keepalive_max_requests=data.get("keepalive_max_requests", 100),
+            max_batch_size=data.get("max_batch_size", 1000),
+            page_size=data.get("page_size", 100),
+            max_page_size=data.get("max_page_size", 1000),
+            max_wait=data.get("max_wait", 30.0),
+            max_waiters=data.get("max_waiters", 1),
+        )
+
+
+@dataclass
+class RollupConfig:
+    """Traffic rollup retention, per resolution.
+
+    Attributes:
+        minute_days: Delete minute buckets older than this many days.
+        hour_days: Delete hour buckets older than this many days.
+        day_days: Delete day buckets older than this many days; 0 keeps
+            them regardless of age, as for the other resolutions.
+    """
+
+    minute_days: float = 2
+    hour_days: float = 90
+    day_days: float = 0
+
+    @classmethod
+    def from_dict(cls, data: dict[str, Any]) -> "RollupConfig":
+        """Create RollupConfig from dictionary.
+
+        Args:
+            data: Configuration dictionary.
+
+        Returns:
+            RollupConfig instance.
+        """
+        return cls(
+            minute_days=data.get("minute_days", 2),
+            hour_days=data.get("hour_days", 90),
+            day_days=data.get("day_days", 0),
         )
 
 
@@ -75,9 +254,51 @@ class DatabaseConfig:
 
     Attributes:
         path: Path to SQLite database file.
+        pool_size: Maximum number of pooled SQLite connections.
+        timeout: Seconds to wait for a pooled connection or a database lock.
+        profile: SQLite tuning preset applied to every new connection,
+            "durable", "balanced", "fast" or "none".
+        pragmas: PRAGMA name/value pairs applied to every new connection,
+            overriding the profile.
+        write_behind: Queue ingested messages for a writer thread that
+            commits them in groups instead of committing per request.
+        group_commit_rows: Largest group committed in one transaction.
+        group_commit_ms: Milliseconds a queued message may wait for its
+            commit; the durability window of write-behind mode.
+        write_queue_size: Most messages waiting to be written before ingest
+            requests are refused.
+        max_age_days: Delete messages whose timestamp is older than this
+            many days; 0 keeps them regardless of age.
+        max_rows: Delete the oldest messages beyond this many; 0 for no limit.
+        max_bytes: Delete the oldest messages while the stored data exceeds
+            this many bytes; 0 for no limit.
+        retention_interval: Seconds between retention passes.
+        retention_chunk_rows: Most messages deleted per transaction.
+        partitioning: Store messages in one table per "day" or "week", or
+            in lora_messages alone ("none").
+        dedup_window: Drop a message when the same device already sent one
+            with the same sequence number less than this many seconds
+            apart; 0 stores every message.
+        rollups: Traffic rollup retention.
     """
 
     path: str = "data.db"
+    pool_size: int = 4
+    timeout: float = 5.0
+    profile: str = "balanced"
+    pragmas: dict[str, Any] = field(default_factory=dict)
+    write_behind: bool = False
+    group_commit_rows: int = 100
+    group_commit_ms: int = 50
+    write_queue_size: int = 1000
+    max_age_days: float = 0
+    max_rows: int = 0
+    max_bytes: int = 0
+    retention_interval: float = 300.0
+    retention_chunk_rows: int = 500
+    partitioning: str = "none"
+    dedup_window: float = 0
+    rollups: RollupConfig = field(default_factory=RollupConfig)
 
     @classmethod
     def from_dict(cls, data: dict[str, Any]) -> "DatabaseConfig":
@@ -91,6 +312,22 @@ class DatabaseConfig:
         """
         return cls(
             path=data.get("path", "data.db"),
+            pool_size=data.get("pool_size", 4),
+            timeout=data.get("timeout", 5.0),
+            profile=data.get("profile", "balanced"),
+            pragmas=data.get("pragmas", {}),
+            write_behind=data.get("write_behind", False),
+            group_commit_rows=data.get("group_commit_rows", 100),
+            group_commit_ms=data.get("group_commit_ms", 50),
+            write_queue_size=data.get("write_queue_size", 1000),
+            max_age_days=data.get("max_age_days", 0),
+            max_rows=data.get("max_rows", 0),
+            max_bytes=data.get("max_bytes", 0),
+            retention_interval=data.get("retention_interval", 300.0),
+            retention_chunk_rows=data.get("retention_chunk_rows", 500),
+            partitioning=data.get("partitioning", "none"),
+            dedup_window=data.get("dedup_window", 0),
+            rollups=RollupConfig.from_dict(data.get("rollups", {})),
         )
 
 
@@ -122,6 +359,70 @@ class LogConfig:
         )
 
 
+@dataclass
+class MqttConfig:
+    """Uplink ingest from the local MQTT broker.
+
+    Attributes:
+        enabled: Subscribe to uplinks and store them.
+        host: Broker host.
+        port: Broker port.
+        topic: Topic filter of the uplinks; a "+" level stands for the
+            device EUI.
+        client_id: MQTT client identifier.
+        username: User name, or "" to connect anonymously.
+        password: Password, used with a user name.
+        qos: Subscription QoS, 0 or 1. QoS 1 keeps the session across
+            reconnects so no uplink is lost while the listener is down.
+        keepalive: Seconds between keep-alive pings.
+        reconnect_max: Longest wait between reconnection attempts, in seconds.
+        batch_rows: Largest group of uplinks committed in one transaction.
+        batch_ms: Milliseconds the oldest uplink may wait for its commit.
+        queue_size: Most uplinks waiting to be written before reading
+            from the broker pauses.
+    """
+
+    enabled: bool = False
+    host: str = "127.0.0.1"
+    port: int = 1883
+    topic: str = "lora/+/up"
+    client_id: str = "webapi-example"
+    username: str = ""
+    password: str = ""
+    qos: int = 0
+    keepalive: int = 60
+    reconnect_max: float = 30.0
+    batch_rows: int = 100
+    batch_ms: int = 50
+    queue_size: int = 1000
+
+    @classmethod
+    def from_dict(cls, data: dict[str, Any]) -> "MqttConfig":
+        """Create MqttConfig from dictionary.
+
+        Args:
+            data: Configuration dictionary.
+
+        Returns:
+            MqttConfig instance.
+        """
+        return cls(
+            enabled=data.get("enabled", False),
+            host=data.get("host", "127.0.0.1"),
+            port=data.get("port", 1883),
+            topic=data.get("topic", "lora/+/up"),
+            client_id=data.get("client_id", "webapi-example"),
+            username=data.get("username", ""),
+            password=data.get("password", ""),
+            qos=data.get("qos", 0),
+            keepalive=data.get("keepalive", 60),
+            reconnect_max=data.get("reconnect_max", 30.0),
+            batch_rows=data.get("batch_rows", 100),
+            batch_ms=data.get("batch_ms", 50),
+            queue_size=data.get("queue_size", 1000),
+        )
+
+
 @dataclass
 class AppConfig:
     """Main application configuration.
@@ -130,11 +431,13 @@ class AppConfig:
         server: HTTP server configuration.
         database: Database configuration.
         log: Logging configuration.
+        mqtt: MQTT uplink ingest configuration.
     """
 
     server: ServerConfig = field(default_factory=ServerConfig)
     database: DatabaseConfig = field(default_factory=DatabaseConfig)
     log: LogConfig = field(default_factory=LogConfig)
+    mqtt: MqttConfig = field(default_factory=MqttConfig)
 
     @classmethod
     def from_dict(cls, data: dict[str, Any]) -> "AppConfig":
@@ -150,4 +453,5 @@ class AppConfig:
             server=ServerConfig.from_dict(data.get("server", {})),
             database=DatabaseConfig.from_dict(data.get("database", {})),
             log=LogConfig.from_dict(data.get("log", {})),
+            mqtt=MqttConfig.from_dict(data.get("mqtt", {})),
         )
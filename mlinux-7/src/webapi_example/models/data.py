@@ -1,9 +1,11 @@
 """Data models for API resources."""
 
 from dataclasses import dataclass, field
-from datetime import datetime
+from datetime import datetime, timezone
 from typing import Any
 
+from webapi_example.compact import epoch_ms, format_timestamp
+
 
 @dataclass
 class User:
@@ -74,7 +76,7 @@ class LoraMessage:
     appeui: str = ""
     data: str = ""
     size: int = 0
-    timestamp: str = field(default_factory=lambda: datetime.utcnow().isoformat() + "Z")
+    timestamp: str = field(default_factory=lambda: _now())
     sequence_number: int = 0
 
     def to_dict(self) -> dict[str, Any]:
@@ -111,6 +113,61 @@ class LoraMessage:
             appeui=data.get("appeui", ""),
             data=data.get("data", ""),
             size=data.get("size", 0),
-            timestamp=data.get("timestamp", datetime.utcnow().isoformat() + "Z"),
+            timestamp=data.get("timestamp", _now()),
             sequence_number=data.get("sqn", data.get("sequence_number", 0)),
         )
+
+
+@dataclass
+class Device:
+    """Summary of a device's stored messages.
+
+    Attributes:
+        deveui: Device EUI.
+        device_name: Latest non-empty friendly device name.
+        appeui: Latest non-empty application EUI.
+        first_seen: Earliest message timestamp, epoch milliseconds.
+        last_seen: Latest message timestamp, epoch milliseconds.
+        message_count: Messages stored for the device.
+        total_bytes: Sum of the payload sizes of those messages.
+        last_sqn: Sequence number of the newest message.
+        last_data: Payload of the newest message.
+    """
+
+    deveui: str = ""
+    device_name: str = ""
+    appeui: str = ""
+    first_seen: int | None = None
+    last_seen: int | None = None
+    message_count: int = 0
+    total_bytes: int = 0
+    last_sqn: int | None = None
+    last_data: str | None = None
+
+    def to_dict(self) -> dict[str, Any]:
+        """Convert to dictionary.
+
+        Returns:
+            Dictionary representation, with ISO 8601 timestamps.
+        """
+        return {
+            "deveui": self.deveui,
+            "deviceName": self.device_name,
+            "appeui": self.appeui,
+            "firstSeen": _iso(self.first_seen),
+            "lastSeen": _iso(self.last_seen),
+            "messageCount": self.message_count,
+            "totalBytes": self.total_bytes,
+            "lastSqn": self.last_sqn,
+            "lastData": self.last_data,
+        }
+
+
+def _iso(ms: int | None) -> str | None:
+    """Format an optional epoch millisecond timestamp."""
+    return format_timestamp(ms) if ms is not None else None
+
+
+def _now() -> str:
+    """Return the current time in the timestamp form stored compactly."""
+    return format_timestamp(epoch_ms(datetime.now(timezone.utc)))
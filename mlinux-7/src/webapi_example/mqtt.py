@@ -0,0 +1,423 @@
+"""Built-in ingest of uplinks from the gateway's local MQTT broker.
+
+On mPower the LoRa network server publishes every uplink on the local
+broker (``lora/<deveui>/up``). MqttListener subscribes to it and hands the
+messages to a GroupCommitWriter in batches, so uplinks reach the database
+without a bridge process re-posting each one to ``POST /messages``. It
+speaks the part of MQTT 3.1.1 a subscriber needs over a plain socket,
+which keeps the gateway build free of third-party packages.
+"""
+
+import json
+import logging
+import socket
+import struct
+import threading
+import time
+from typing import Any
+
+from webapi_example.compact import format_timestamp, parse_timestamp
+from webapi_example.ingest import GroupCommitWriter, message_row
+from webapi_example.models.config import MqttConfig
+
+logger = logging.getLogger(__name__)
+
+# Control packet types (high nibble of the first byte)
+_CONNECT = 1
+_CONNACK = 2
+_PUBLISH = 3
+_PUBACK = 4
+_SUBSCRIBE = 8
+_SUBACK = 9
+_PINGREQ = 12
+_PINGRESP = 13
+_DISCONNECT = 14
+
+# Largest packet accepted from the broker, in bytes
+_MAX_PACKET_SIZE = 1024 * 1024
+
+# Seconds allowed to connect and to receive CONNACK
+_CONNECT_TIMEOUT = 10.0
+
+# Uplink fields of the network server, by the message field they provide
+_UPLINK_FIELDS = {"deviceName": "name", "timestamp": "time", "sqn": "fcnt"}
+
+
+def _packet(first_byte: int, body: bytes) -> bytes:
+    """Frame a control packet: fixed header with remaining length, then body."""
+    header = bytearray([first_byte])
+    length = len(body)
+    while True:
+        byte, length = length % 128, length // 128
+        header.append(byte | 0x80 if length else byte)
+        if not length:
+            return bytes(header) + body
+
+
+def _string(text: str) -> bytes:
+    """Encode a length-prefixed UTF-8 string."""
+    data = text.encode()
+    return struct.pack("!H", len(data)) + data
+
+
+def connect_packet(config: MqttConfig) -> bytes:
+    """Build the CONNECT packet.
+
+    QoS 0 subscriptions use a clean session. QoS 1 subscriptions keep
+    their session, so the broker queues uplinks while the listener is
+    down and sends unacknowledged ones again.
+
+    Args:
+        config: MQTT configuration.
+
+    Returns:
+        Encoded packet.
+    """
+    flags = 0x02 if config.qos == 0 else 0
+    payload = _string(config.client_id)
+    if config.username:
+        flags |= 0x80
+        payload += _string(config.username)
+        if config.password:
+            flags |= 0x40
+            payload += _string(config.password)
+    header = _string("MQTT") + struct.pack("!BBH", 4, flags, config.keepalive)
+    return _packet(_CONNECT << 4, header + payload)
+
+
+def subscribe_packet(packet_id: int, topic: str, qos: int) -> bytes:
+    """Build a SUBSCRIBE packet for one topic filter.
+
+    Args:
+        packet_id: Packet identifier, echoed by SUBACK.
+        topic: Topic filter.
+        qos: Maximum QoS of the subscription.
+
+    Returns:
+        Encoded packet.
+    """
+    body = struct.pack("!H", packet_id) + _string(topic) + bytes([qos])
+    return _packet(_SUBSCRIBE << 4 | 0x02, body)
+
+
+def parse_publish(flags: int, body: bytes) -> tuple[str, int | None, bytes]:
+    """Split a PUBLISH packet into its topic, packet identifier and payload.
+
+    Args:
+        flags: Low nibble of the packet's first byte.
+        body: Packet after the fixed header.
+
+    Returns:
+        (topic, packet id or None for QoS 0, payload).
+
+    Raises:
+        ValueError: If the packet is truncated.
+    """
+    if len(body) < 2:
+        raise ValueError("Truncated PUBLISH packet")
+    (length,) = struct.unpack_from("!H", body)
+    offset = 2 + length
+    topic = body[2:offset].decode("utf-8", "replace")
+    packet_id = None
+    if flags & 0x06:
+        if len(body) < offset + 2:
+            raise ValueError("Truncated PUBLISH packet")
+        (packet_id,) = struct.unpack_from("!H", body, offset)
+        offset += 2
+    return topic, packet_id, body[offset:]
+
+
+def uplink_row(topic_filter: str, topic: str, payload: bytes) -> tuple[Any, ...]:
+    """Convert an uplink published by the network server to INSERT_MESSAGE parameters.
+
+    The network server's ``name``, ``time`` and ``fcnt`` fields stand in
+    for ``deviceName``, ``timestamp`` and ``sqn``; ``time`` is converted
+    to the millisecond UTC form timestamps are stored compactly in.
+    Uplinks already in the ``POST /messages`` format are taken as they are. A missing ``deveui``
+    is taken from the topic level matched by ``+`` in the topic filter.
+
+    Args:
+        topic_filter: Subscribed topic filter, e.g. "lora/+/up".
+        topic: Topic the uplink was published on.
+        payload: JSON uplink object.
+
+    Returns:
+        Parameters in INSERT_MESSAGE column order.
+
+    Raises:
+        ValueError: If the payload is not a valid message object.
+    """
+    item = json.loads(payload)
+    if not isinstance(item, dict):
+        raise ValueError("message must be an object")
+    for name, uplink_name in _UPLINK_FIELDS.items():
+        if name not in item and uplink_name in item:
+            item[name] = item[uplink_name]
+            if name == "timestamp":
+                item[name] = _uplink_time(item[name])
+    if "deveui" not in item:
+        levels = topic_filter.split("/")
+        if "+" in levels and len(levels) == topic.count("/") + 1:
+            item["deveui"] = topic.split("/")[levels.index("+")]
+    return message_row(item)
+
+
+def _uplink_time(value: Any) -> Any:
+    """Convert the network server's uplink time to a millisecond UTC timestamp.
+
+    Values that are not ISO 8601 timestamps are returned unchanged.
+    """
+    try:
+        return format_timestamp(parse_timestamp(value))
+    except ValueError:
+        return value
+
+
+class _PacketReader:
+    """Reads control packets from a socket, keeping partial packets buffered.
+
+    A socket timeout never loses data, so reads may be retried after one.
+    """
+
+    def __init__(self, sock: socket.socket) -> None:
+        """Initialize the reader.
+
+        Args:
+            sock: Connected socket.
+        """
+        self._sock = sock
+        self._buffer = bytearray()
+
+    def buffered(self) -> tuple[int, bytes] | None:
+        """Take the next packet if it was received completely.
+
+        Returns:
+            (first byte, body), or None if no complete packet is buffered.
+
+        Raises:
+            ValueError: If the packet length is malformed or too large.
+        """
+        length = 0
+        for i in range(1, min(len(self._buffer), 5)):
+            byte = self._buffer[i]
+            length |= (byte & 0x7F) << (7 * (i - 1))
+            if not byte & 0x80:
+                break
+        else:
+            if len(self._buffer) >= 5:
+                raise ValueError("Malformed packet length")
+            return None
+        if length > _MAX_PACKET_SIZE:
+            raise ValueError(f"Packet of {length} bytes is too large")
+        end = i + 1 + length
+        if len(self._buffer) < end:
+            return None
+        first_byte, body = self._buffer[0], bytes(self._buffer[i + 1 : end])
+        del self._buffer[:end]
+        return first_byte, body
+
+    def read(self) -> tuple[int, bytes]:
+        """Wait for the next packet.
+
+        Returns:
+            (first byte, body).
+
+        Raises:
+            TimeoutError: If the socket timed out first.
+            ConnectionError: If the broker closed the connection.
+            ValueError: If the packet length is malformed or too large.
+        """
+        while (packet := self.buffered()) is None:
+            data = self._sock.recv(65536)
+            if not data:
+                raise ConnectionError("Connection closed by the broker")
+            self._buffer += data
+        return packet
+
+
+class MqttListener:
+    """Subscribes to uplinks on an MQTT broker and feeds them to a writer.
+
+    A background thread keeps one session open, reconnecting with
+    exponential backoff when the broker is unavailable. Uplinks that arrive
+    together are submitted as one batch; while the writer's queue is full,
+    reading pauses, which pushes back on the broker through TCP. QoS 1
+    uplinks are acknowledged once the writer has accepted them.
+    """
+
+    def __init__(self, config: MqttConfig, writer: GroupCommitWriter) -> None:
+        """Initialize the listener without connecting.
+
+        Args:
+            config: MQTT configuration.
+            writer: Writer the uplinks are handed to; started and stopped
+                with the listener.
+        """
+        self.config = config
+        self._writer = writer
+        self._stopping = threading.Event()
+        self._thread: threading.Thread | None = None
+        self._lock = threading.Lock()
+        self._sock: socket.socket | None = None
+        self._connected = False
+        self._connections = 0
+        self._received = 0
+        self._invalid = 0
+
+    def start(self) -> None:
+        """Start the writer and the listener thread."""
+        self._writer.start()
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, name="mqtt-ingest", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Disconnect, then commit the uplinks still queued and stop the writer."""
+        self._stopping.set()
+        with self._lock:
+            if self._sock is not None:
+                # Wake a blocked recv(), leaving room to send DISCONNECT
+                try:
+                    self._sock.shutdown(socket.SHUT_RD)
+                except OSError:
+                    pass
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self._writer.stop()
+
+    def stats(self) -> dict[str, Any]:
+        """Return the connection state and the uplink counters."""
+        with self._lock:
+            return {
+                "connected": self._connected,
+                "connections": self._connections,
+                "received": self._received,
+                "invalid": self._invalid,
+                **self._writer.stats(),
+            }
+
+    def _run(self) -> None:
+        """Keep a session open until stopped."""
+        delay = 1.0
+        while not self._stopping.is_set():
+            address = (self.config.host, self.config.port)
+            try:
+                sock = socket.create_connection(address, timeout=_CONNECT_TIMEOUT)
+            except OSError as e:
+                logger.warning("Cannot connect to MQTT broker %s:%d: %s", *address, e)
+            else:
+                with self._lock:
+                    self._sock = sock
+                try:
+                    self._session(sock)
+                    delay = 1.0
+                except (OSError, ValueError) as e:
+                    if not self._stopping.is_set():
+                        logger.warning("MQTT session with %s:%d ended: %s", *address, e)
+                finally:
+                    with self._lock:
+                        self._sock = None
+                        self._connected = False
+                    sock.close()
+            if self._stopping.wait(delay):
+                break
+            delay = min(delay * 2, self.config.reconnect_max)
+
+    def _session(self, sock: socket.socket) -> None:
+        """Connect, subscribe and ingest uplinks until the connection ends.
+
+        Returns after a clean DISCONNECT once the listener is stopped.
+
+        Raises:
+            OSError: On connection errors, including timeouts and a
+                refused connection or subscription.
+            ValueError: If the broker sends a malformed packet.
+        """
+        config = self.config
+        reader = _PacketReader(sock)
+        sock.sendall(connect_packet(config))
+        first_byte, body = reader.read()
+        if first_byte >> 4 != _CONNACK or len(body) != 2:
+            raise ConnectionError("Expected CONNACK")
+        if body[1]:
+            raise ConnectionRefusedError(f"Broker refused the connection (code {body[1]})")
+        sock.sendall(subscribe_packet(1, config.topic, min(config.qos, 1)))
+        with self._lock:
+            self._connected = True
+            self._connections += 1
+        logger.info("Subscribed to %s on %s:%d", config.topic, config.host, config.port)
+
+        keepalive = config.keepalive
+        sock.settimeout(keepalive / 2 if keepalive > 0 else None)
+        last_sent = last_received = time.monotonic()
+        while not self._stopping.is_set():
+            try:
+                packets = [reader.read()]
+            except TimeoutError:
+                packets = []
+            except ConnectionError:
+                if self._stopping.is_set():
+                    break
+                raise
+            now = time.monotonic()
+            if packets:
+                last_received = now
+                while len(packets) < self._writer.max_rows and (
+                    packet := reader.buffered()
+                ):
+                    packets.append(packet)
+                if self._handle(sock, packets):
+                    last_sent = now
+            elif keepalive > 0 and now - last_received > keepalive * 1.5:
+                raise TimeoutError("Broker stopped responding")
+            if keepalive > 0 and now - last_sent >= keepalive / 2:
+                sock.sendall(_packet(_PINGREQ << 4, b""))
+                last_sent = now
+        try:
+            sock.sendall(_packet(_DISCONNECT << 4, b""))
+        except OSError:
+            pass
+
+    def _handle(self, sock: socket.socket, packets: list[tuple[int, bytes]]) -> bool:
+        """Ingest the uplinks among received packets.
+
+        Returns:
+            True if acknowledgements were sent.
+
+        Raises:
+            ConnectionError: If the broker refused the subscription or sent
+                a packet a client must not receive.
+            ValueError: If a PUBLISH packet is truncated.
+        """
+        rows = []
+        acks = []
+        invalid = 0
+        for first_byte, body in packets:
+            kind = first_byte >> 4
+            if kind == _PUBLISH:
+                topic, packet_id, payload = parse_publish(first_byte & 0x0F, body)
+                if packet_id is not None:
+                    acks.append(_packet(_PUBACK << 4, struct.pack("!H", packet_id)))
+                try:
+                    rows.append(uplink_row(self.config.topic, topic, payload))
+                except ValueError as e:
+                    invalid += 1
+                    logger.debug("Ignoring invalid uplink on %s: %s", topic, e)
+            elif kind == _SUBACK:
+                if body[2:3] == b"\x80":
+                    raise ConnectionRefusedError(
+                        f"Broker refused the subscription to {self.config.topic}"
+                    )
+            elif kind != _PINGRESP:
+                raise ConnectionError(f"Unexpected packet type {kind}")
+        with self._lock:
+            self._received += len(rows) + invalid
+            self._invalid += invalid
+        while rows and not self._writer.submit(rows):
+            if self._stopping.wait(0.05):
+                # Left unacknowledged, QoS 1 uplinks are sent again next session
+                return False
+        if acks:
+            sock.sendall(b"".join(acks))
+        return bool(acks)
@@ -0,0 +1,190 @@
+"""Optional time partitioning of stored messages.
+
+In partitioned mode new messages go to one table per day or week, named
+after the period's first day (``lora_messages_20240115``) and listed in the
+``message_partitions`` catalog. The original ``lora_messages`` table is
+kept as the oldest partition. Ids continue one sequence across partitions,
+so each partition holds a contiguous id range starting at its
+``first_id``; keyset queries visit only the partitions their cursor can
+reach, and retention expires a period by dropping its table.
+
+Messages are assigned to the period in which they are stored, not by their
+own timestamp, so partitions never overlap in ids but may in time. The
+catalog therefore also keeps the oldest and newest timestamp each partition
+holds, so time range queries skip partitions without a message in range.
+
+Switching an existing database back to the unpartitioned layout hides the
+partitioned messages. Messages stored meanwhile go to lora_messages with
+ids above the partitions', and move to the newest partition once
+partitioning is enabled again (see database.init_db()).
+"""
+
+import re
+import sqlite3
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable
+
+from webapi_example.database import create_message_table
+
+# Table of the unpartitioned layout, the oldest partition in partitioned mode
+LEGACY_TABLE = "lora_messages"
+
+SELECT_PARTITIONS = """
+    SELECT name, period_start, first_id, min_timestamp, max_timestamp
+    FROM message_partitions ORDER BY first_id
+"""
+SELECT_NEWEST_PARTITION = """
+    SELECT name, period_start FROM message_partitions ORDER BY first_id DESC LIMIT 1
+"""
+INSERT_PARTITION = (
+    "INSERT INTO message_partitions (name, period_start, first_id) VALUES (?, ?, ?)"
+)
+DELETE_PARTITION = "DELETE FROM message_partitions WHERE name = ?"
+WIDEN_PARTITION_TIMESTAMPS = """
+    UPDATE message_partitions SET
+        min_timestamp = min(coalesce(min_timestamp, ?1), ?1),
+        max_timestamp = max(coalesce(max_timestamp, ?2), ?2)
+    WHERE name = ?3
+"""
+
+_TABLE_NAME = re.compile(rf"\b{LEGACY_TABLE}\b")
+
+
+@dataclass(frozen=True)
+class Partition:
+    """One table of the partitioned layout.
+
+    Attributes:
+        name: Table name.
+        period_start: First day of the period, "YYYY-MM-DD"; "" for
+            lora_messages.
+        first_id: Lowest id the partition can hold; it holds every id below
+            the next partition's first_id.
+        min_timestamp: Oldest integer timestamp stored in the partition, or
+            None if there is none or it is not tracked (lora_messages).
+        max_timestamp: Newest integer timestamp stored in the partition, or
+            None like min_timestamp. Deleting messages does not narrow the
+            range, so it may be wider than the messages left.
+    """
+
+    name: str
+    period_start: str
+    first_id: int
+    min_timestamp: int | None = None
+    max_timestamp: int | None = None
+
+    def overlaps(self, since: int, until: int) -> bool:
+        """Return False if the partition holds no integer timestamp in [since, until)."""
+        if self.min_timestamp is None or self.max_timestamp is None:
+            return True
+        return self.min_timestamp < until and self.max_timestamp >= since
+
+
+def table_sql(sql: str, table: str) -> str:
+    """Return a lora_messages statement rewritten for a partition table."""
+    return _TABLE_NAME.sub(table, sql)
+
+
+class PartitionLayout:
+    """Maps the current time to the partition receiving new messages.
+
+    Attributes:
+        period: Partition length, "day" or "week" (starting Monday).
+        dedup_window_ms: Window of the deduplication index created on new
+            partitions, or 0 for none.
+    """
+
+    def __init__(
+        self,
+        period: str,
+        clock: Callable[[], datetime] | None = None,
+        dedup_window_ms: int = 0,
+    ) -> None:
+        """Initialize the layout.
+
+        Args:
+            period: Partition length, "day" or "week".
+            clock: Returns the current UTC time; for tests.
+            dedup_window_ms: Window of the deduplication index created on
+                new partitions, or 0 for none.
+
+        Raises:
+            ValueError: If the period is unknown.
+        """
+        if period not in ("day", "week"):
+            raise ValueError(f"Unknown partitioning: {period}")
+        self.period = period
+        self.dedup_window_ms = dedup_window_ms
+        self._clock = clock or (lambda: datetime.now(timezone.utc))
+
+    def period_start(self, when: datetime) -> str:
+        """Return the first day of the period containing a time, "YYYY-MM-DD"."""
+        day = when.date()
+        if self.period == "week":
+            day -= timedelta(days=day.weekday())
+        return day.isoformat()
+
+    def partitions(self, conn: sqlite3.Connection) -> list[Partition]:
+        """Return all partitions, oldest first, starting with lora_messages."""
+        rows = conn.execute(SELECT_PARTITIONS).fetchall()
+        return [Partition(LEGACY_TABLE, "", 0)] + [Partition(*row) for row in rows]
+
+    def write_table(self, conn: sqlite3.Connection) -> str:
+        """Return the table new messages go to, creating it when a period starts.
+
+        Must be called inside the write transaction that inserts the
+        messages, so no message can land in a partition after its
+        successor was created.
+
+        Args:
+            conn: Connection holding the write lock (BEGIN IMMEDIATE).
+
+        Returns:
+            Name of the newest partition.
+        """
+        start = self.period_start(self._clock())
+        newest = conn.execute(SELECT_NEWEST_PARTITION).fetchone()
+        # A clock set back never reopens an older period
+        if newest is not None and newest[1] >= start:
+            return str(newest[0])
+
+        previous = newest[0] if newest is not None else LEGACY_TABLE
+        row = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = ?", (previous,)).fetchone()
+        last_id = row[0] if row is not None else 0
+        name = f"{LEGACY_TABLE}_{start.replace('-', '')}"
+        create_message_table(conn, name, self.dedup_window_ms)
+        # Continue the id sequence where the previous partition stopped
+        conn.execute("INSERT INTO sqlite_sequence (name, seq) VALUES (?, ?)", (name, last_id))
+        conn.execute(INSERT_PARTITION, (name, start, last_id + 1))
+        return name
+
+    def record_timestamps(
+        self, conn: sqlite3.Connection, table: str, rows: list[tuple[Any, ...]]
+    ) -> None:
+        """Widen a partition's catalogued timestamp range to cover stored rows.
+
+        Args:
+            conn: Connection inside the write transaction that stored the rows.
+            table: Partition the rows were stored in, from write_table().
+            rows: INSERT_MESSAGE parameters of the stored rows.
+        """
+        timestamps = [row[6] for row in rows if type(row[6]) is int]
+        if timestamps:
+            conn.execute(WIDEN_PARTITION_TIMESTAMPS, (min(timestamps), max(timestamps), table))
+
+    def drop(self, conn: sqlite3.Connection, partition: Partition) -> None:
+        """Delete a partition with all its messages.
+
+        lora_messages is emptied rather than dropped, which SQLite also does
+        without visiting rows.
+
+        Args:
+            conn: Connection inside a write transaction.
+            partition: Partition to drop.
+        """
+        if partition.name == LEGACY_TABLE:
+            conn.execute(f"DELETE FROM {LEGACY_TABLE}")
+            return
+        conn.execute(f"DROP TABLE IF EXISTS {partition.name}")
+        conn.execute(DELETE_PARTITION, (partition.name,))
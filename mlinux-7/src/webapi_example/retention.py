@@ -0,0 +1,313 @@
+"""Background enforcement of message retention limits."""
+
+import logging
+import os
+import sqlite3
+import threading
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable
+
+from webapi_example.compact import epoch_ms
+from webapi_example.database import (
+    COUNT_MESSAGES,
+    DELETE_MESSAGES_OLDER_THAN,
+    DELETE_OLDEST_MESSAGES,
+    DELETE_TRAFFIC_OLDER_THAN,
+    TRAFFIC_RESOLUTIONS,
+    ConnectionPool,
+)
+from webapi_example.partitions import LEGACY_TABLE, PartitionLayout, table_sql
+
+logger = logging.getLogger(__name__)
+
+# Seconds between two delete chunks, leaving the write lock to ingest
+_CHUNK_PAUSE = 0.01
+
+
+class RetentionWorker:
+    """Thread deleting old messages so the database stays within its limits.
+
+    Every ``interval`` seconds one pass deletes messages older than
+    ``max_age``, then the oldest messages beyond ``max_rows``, then the
+    oldest messages until the data (file size minus free pages) fits in
+    ``max_bytes``. A limit of 0 is not enforced. Deletes run as short
+    transactions of at most ``chunk_rows`` rows, each on a briefly borrowed
+    connection with a pause in between, so ingest never waits long for the
+    write lock. Freed pages are reused by later inserts, so the file stops
+    growing rather than shrinking. With partitioned storage whole
+    partitions are dropped instead, see ``_expire_partitions()``. Traffic
+    rollup buckets are pruned by their own ages, so charts can outlive the
+    messages they count.
+
+    Attributes:
+        max_age: Seconds a message is kept, by its timestamp.
+        max_rows: Most messages kept.
+        max_bytes: Most bytes of data kept in the database.
+        interval: Seconds between passes.
+        chunk_rows: Most rows deleted per transaction.
+        rollup_max_age: Seconds the buckets of each traffic rollup
+            resolution are kept; resolutions missing or at 0 are kept
+            regardless of age.
+    """
+
+    def __init__(
+        self,
+        pool: ConnectionPool,
+        db_path: str,
+        max_age: float = 0,
+        max_rows: int = 0,
+        max_bytes: int = 0,
+        interval: float = 300.0,
+        chunk_rows: int = 500,
+        on_delete: Callable[[], None] | None = None,
+        layout: PartitionLayout | None = None,
+        rollup_max_age: dict[str, float] | None = None,
+    ) -> None:
+        """Initialize the worker without starting its thread.
+
+        Args:
+            pool: Connection pool the worker borrows connections from.
+            db_path: Path to the database file, for its size.
+            max_age: Seconds a message is kept, by its timestamp.
+            max_rows: Most messages kept.
+            max_bytes: Most bytes of data kept in the database.
+            interval: Seconds between passes.
+            chunk_rows: Most rows deleted per transaction.
+            on_delete: Called after every committed delete chunk.
+            layout: Partition layout; whole partitions are dropped when
+                given.
+            rollup_max_age: Seconds the buckets of each traffic rollup
+                resolution are kept.
+        """
+        self.max_age = max_age
+        self.max_rows = max_rows
+        self.max_bytes = max_bytes
+        self.interval = interval
+        self.chunk_rows = max(chunk_rows, 1)
+        self.rollup_max_age = rollup_max_age or {}
+        self._pool = pool
+        self._db_path = db_path
+        self._on_delete = on_delete
+        self._layout = layout
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+        self._lock = threading.Lock()
+        self._purged = 0
+        self._buckets_purged = 0
+        self._passes = 0
+        self._db_bytes = 0
+
+    def start(self) -> None:
+        """Start the worker thread; the first pass runs at once."""
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="retention", daemon=True)
+        self._thread.start()
+        logger.info(
+            "Retention enabled: max age %.0f s, max rows %d, max bytes %d, "
+            "rollup max ages %s (0 = no limit)",
+            self.max_age,
+            self.max_rows,
+            self.max_bytes,
+            self.rollup_max_age,
+        )
+
+    def stop(self) -> None:
+        """Stop the worker thread, interrupting a pass between chunks."""
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+
+    def run_once(self) -> int:
+        """Run one retention pass.
+
+        Returns:
+            Number of messages deleted.
+        """
+        if self._layout is not None:
+            purged = self._expire_partitions(self._layout)
+        else:
+            purged = self._expire_rows()
+        buckets = self._expire_rollups()
+
+        db_bytes = self.db_bytes()
+        with self._lock:
+            self._purged += purged
+            self._buckets_purged += buckets
+            self._passes += 1
+            self._db_bytes = db_bytes
+        if purged:
+            logger.info("Retention purged %d messages; database is %d bytes", purged, db_bytes)
+        return purged
+
+    def _expire_rows(self) -> int:
+        """Enforce the limits on lora_messages by deleting rows in chunks."""
+        purged = 0
+        if self.max_age > 0:
+            purged += self._delete_chunks(DELETE_MESSAGES_OLDER_THAN, (epoch_ms(self._cutoff()),))
+        if self.max_rows > 0:
+            with self._pool.connection() as conn:
+                excess = conn.execute(COUNT_MESSAGES).fetchone()[0] - self.max_rows
+            purged += self._delete_chunks(DELETE_OLDEST_MESSAGES, (), most=excess)
+        if self.max_bytes > 0:
+            purged += self._delete_chunks(DELETE_OLDEST_MESSAGES, (), until=self._fits)
+        return purged
+
+    def _expire_rollups(self) -> int:
+        """Delete traffic rollup buckets older than their resolution's age.
+
+        Message listings are unaffected, so no delete is reported to
+        ``on_delete``.
+        """
+        purged = 0
+        now = datetime.now(timezone.utc)
+        for resolution in TRAFFIC_RESOLUTIONS:
+            max_age = self.rollup_max_age.get(resolution, 0)
+            if max_age > 0 and not self._stop.is_set():
+                cutoff = epoch_ms(now - timedelta(seconds=max_age))
+                purged += self._delete_chunks(
+                    DELETE_TRAFFIC_OLDER_THAN[resolution], (cutoff,), notify=False
+                )
+        return purged
+
+    def _expire_partitions(self, layout: PartitionLayout) -> int:
+        """Enforce the limits by dropping whole partitions, oldest first.
+
+        The newest partition, which receives new messages, is never
+        dropped. Ages are enforced per partition: a partition goes once
+        the following one started before the cutoff. Row and byte limits
+        drop partitions while the rest still exceeds them, then delete the
+        remainder from the oldest partition in chunks.
+        """
+        purged = 0
+        with self._pool.connection() as conn:
+            partitions = layout.partitions(conn)
+            counts: list[int] = [
+                conn.execute(table_sql(COUNT_MESSAGES, partition.name)).fetchone()[0]
+                for partition in partitions
+            ]
+        # lora_messages is always listed; once emptied it has nothing to drop
+        if len(partitions) > 1 and partitions[0].name == LEGACY_TABLE and counts[0] == 0:
+            partitions.pop(0)
+            counts.pop(0)
+        cutoff = layout.period_start(self._cutoff()) if self.max_age > 0 else ""
+        while len(partitions) > 1:
+            with self._pool.connection() as conn:
+                if not (
+                    partitions[1].period_start <= cutoff
+                    or (self.max_rows > 0 and sum(counts[1:]) >= self.max_rows)
+                    or (self.max_bytes > 0 and not self._fits(conn))
+                ):
+                    break
+                # DDL does not open a transaction implicitly; the drop and
+                # its catalog entry must commit together
+                conn.execute("BEGIN IMMEDIATE")
+                try:
+                    layout.drop(conn, partitions[0])
+                except BaseException:
+                    conn.rollback()
+                    raise
+                conn.commit()
+            logger.info("Retention dropped partition %s", partitions[0].name)
+            purged += counts.pop(0)
+            partitions.pop(0)
+            if self._on_delete is not None:
+                self._on_delete()
+            if self._stop.wait(_CHUNK_PAUSE):
+                return purged
+
+        oldest = partitions[0].name
+        if self.max_rows > 0:
+            purged += self._delete_chunks(
+                table_sql(DELETE_OLDEST_MESSAGES, oldest), (), most=sum(counts) - self.max_rows
+            )
+        if self.max_bytes > 0:
+            purged += self._delete_chunks(
+                table_sql(DELETE_OLDEST_MESSAGES, oldest), (), until=self._fits
+            )
+        return purged
+
+    def _cutoff(self) -> datetime:
+        """Return the time before which messages are too old."""
+        return datetime.now(timezone.utc) - timedelta(seconds=self.max_age)
+
+    def db_bytes(self) -> int:
+        """Return the size of the database file and its WAL."""
+        size = 0
+        for path in (self._db_path, self._db_path + "-wal"):
+            try:
+                size += os.path.getsize(path)
+            except OSError:
+                pass
+        return size
+
+    def stats(self) -> dict[str, int]:
+        """Return the messages and rollup buckets purged so far and the database size."""
+        with self._lock:
+            return {
+                "purged": self._purged,
+                "rollup_buckets_purged": self._buckets_purged,
+                "passes": self._passes,
+                "db_bytes": self._db_bytes,
+            }
+
+    def summary(self) -> str:
+        """Return a one-line retention status for status.json."""
+        stats = self.stats()
+        return f"purged {stats['purged']} msgs, db {stats['db_bytes'] / 1e6:.1f} MB"
+
+    def _run(self) -> None:
+        """Run passes until stopped."""
+        while not self._stop.is_set():
+            try:
+                self.run_once()
+            except (sqlite3.Error, TimeoutError, RuntimeError) as e:
+                logger.error("Retention pass failed: %s", e)
+            except Exception:
+                # A bug must not end retention for the life of the process
+                logger.exception("Retention pass failed")
+            self._stop.wait(self.interval)
+
+    def _delete_chunks(
+        self,
+        sql: str,
+        params: tuple[Any, ...],
+        most: int | None = None,
+        until: Callable[[sqlite3.Connection], bool] | None = None,
+        notify: bool = True,
+    ) -> int:
+        """Delete chunks until a chunk comes back short or the worker stops.
+
+        Args:
+            sql: Delete statement whose last parameter is the chunk size.
+            params: Parameters before the chunk size.
+            most: Most rows to delete, or None for no limit.
+            until: Checked before each chunk; deleting stops once it
+                returns True.
+            notify: Call on_delete after every chunk that deleted rows.
+
+        Returns:
+            Number of rows deleted.
+        """
+        deleted = 0
+        while True:
+            count = self.chunk_rows if most is None else min(most - deleted, self.chunk_rows)
+            if count <= 0:
+                return deleted
+            with self._pool.connection() as conn:
+                if until is not None and until(conn):
+                    return deleted
+                with conn:
+                    rowcount = conn.execute(sql, params + (count,)).rowcount
+            deleted += rowcount
+            if rowcount and notify and self._on_delete is not None:
+                self._on_delete()
+            if rowcount < count or self._stop.wait(_CHUNK_PAUSE):
+                return deleted
+
+    def _fits(self, conn: sqlite3.Connection) -> bool:
+        """Return True if the data (pages in use) fits in max_bytes."""
+        page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+        pages = conn.execute("PRAGMA page_count").fetchone()[0]
+        free = conn.execute("PRAGMA freelist_count").fetchone()[0]
+        return bool((pages - free) * page_size <= self.max_bytes)
@@ -0,0 +1,161 @@
+"""Traffic rollups: message and byte counts per time bucket.
+
+Every write aggregates its rows per bucket (traffic_updates()) and merges
+the counts into the rollup table of each resolution in the same
+transaction, per device, per application and for the whole gateway. Chart
+queries then read one primary key range of a rollup table, so they cost
+the same however much history is stored.
+"""
+
+import sqlite3
+import time
+from collections.abc import Mapping
+from dataclasses import dataclass
+from typing import Any
+
+from webapi_example.compact import format_timestamp
+from webapi_example.database import SELECT_TRAFFIC, TRAFFIC_RESOLUTIONS, UPSERT_TRAFFIC
+from webapi_example.storage import timestamp_param
+
+# Buckets covered by default, ending with the current one
+_DEFAULT_BUCKETS = {"minute": 60, "hour": 24, "day": 30}
+
+# Most buckets one query may span
+MAX_BUCKETS = 10000
+
+
+def traffic_updates(rows: list[tuple[Any, ...]], bucket_ms: int) -> list[tuple[Any, ...]]:
+    """Aggregate message rows into UPSERT_TRAFFIC rows for one resolution.
+
+    Args:
+        rows: INSERT_MESSAGE parameters.
+        bucket_ms: Bucket length in milliseconds.
+
+    Returns:
+        (scope, key, bucket, messages, bytes) rows. Messages without an
+        integer timestamp are not counted, and messages without an
+        application EUI count only per device and for the gateway.
+    """
+    totals: dict[tuple[str, str, int], list[int]] = {}
+    for row in rows:
+        timestamp = row[6]
+        if type(timestamp) is not int:
+            continue
+        bucket = timestamp - timestamp % bucket_ms
+        size = row[5] or 0
+        scopes = [("deveui", row[1]), ("all", "")]
+        if row[2]:
+            scopes.append(("appeui", row[2]))
+        for scope, key in scopes:
+            total = totals.setdefault((scope, key, bucket), [0, 0])
+            total[0] += 1
+            total[1] += size
+    return [(*key, messages, size) for key, (messages, size) in totals.items()]
+
+
+def update_traffic(conn: sqlite3.Connection, rows: list[tuple[Any, ...]]) -> None:
+    """Add stored message rows to the rollups of every resolution.
+
+    Must run in the transaction that stores the rows.
+
+    Args:
+        conn: Database connection.
+        rows: INSERT_MESSAGE parameters of the stored rows.
+    """
+    for resolution, bucket_ms in TRAFFIC_RESOLUTIONS.items():
+        conn.executemany(UPSERT_TRAFFIC[resolution], traffic_updates(rows, bucket_ms))
+
+
+@dataclass(frozen=True)
+class TrafficQuery:
+    """Parameters of a traffic chart.
+
+    Attributes:
+        resolution: Bucket length, "minute", "hour" or "day".
+        scope: "deveui", "appeui" or "all" for the whole gateway.
+        key: Device or application EUI; "" for the whole gateway.
+        since: Start of the first bucket, epoch milliseconds.
+        until: End of the last bucket, epoch milliseconds.
+    """
+
+    resolution: str
+    scope: str
+    key: str
+    since: int
+    until: int
+
+    @classmethod
+    def from_query(
+        cls, query: Mapping[str, str], now: float | None = None
+    ) -> "TrafficQuery":
+        """Create a TrafficQuery from query parameters.
+
+        Args:
+            query: Query parameters: "resolution" (default "hour"), at most
+                one of "deveui" and "appeui", and "since" and "until" as
+                ISO 8601 timestamps. Both times are rounded down to a
+                bucket start; by default the range ends with the current
+                bucket and spans 60 minutes, 24 hours or 30 days.
+            now: Current time in seconds since the epoch, for tests.
+
+        Returns:
+            TrafficQuery instance.
+
+        Raises:
+            ValueError: If a parameter is invalid, both EUIs are given or
+                the range spans more than MAX_BUCKETS buckets.
+        """
+        resolution = query.get("resolution") or "hour"
+        bucket_ms = TRAFFIC_RESOLUTIONS.get(resolution)
+        if bucket_ms is None:
+            raise ValueError(f"resolution must be one of {', '.join(TRAFFIC_RESOLUTIONS)}")
+        deveui, appeui = query.get("deveui"), query.get("appeui")
+        if deveui and appeui:
+            raise ValueError("deveui and appeui are mutually exclusive")
+        scope, key = ("deveui", deveui) if deveui else ("appeui", appeui) if appeui else ("all", "")
+
+        until = timestamp_param(query, "until")
+        if until is None:
+            now_ms = int((time.time() if now is None else now) * 1000)
+            until = now_ms - now_ms % bucket_ms + bucket_ms
+        until -= until % bucket_ms
+        since = timestamp_param(query, "since")
+        if since is None:
+            since = until - _DEFAULT_BUCKETS[resolution] * bucket_ms
+        since -= since % bucket_ms
+        if since >= until:
+            raise ValueError("since must be before until")
+        if (until - since) // bucket_ms > MAX_BUCKETS:
+            raise ValueError(f"time range spans more than {MAX_BUCKETS} buckets")
+        return cls(resolution, scope, key or "", since, until)
+
+
+def traffic_series(conn: sqlite3.Connection, query: TrafficQuery) -> dict[str, Any]:
+    """Read a traffic chart from the rollups.
+
+    Args:
+        conn: Database connection.
+        query: Chart parameters.
+
+    Returns:
+        Response document: the resolution, the device or application EUI
+        if any, the range and the buckets that saw traffic, oldest first.
+    """
+    cur = conn.cursor()
+    cur.row_factory = None
+    try:
+        rows = cur.execute(
+            SELECT_TRAFFIC[query.resolution], (query.scope, query.key, query.since, query.until)
+        ).fetchall()
+    finally:
+        cur.close()
+    result: dict[str, Any] = {"resolution": query.resolution}
+    if query.scope != "all":
+        result[query.scope] = query.key
+    result["since"] = format_timestamp(query.since)
+    result["until"] = format_timestamp(query.until)
+    result["buckets"] = [
+        {"start": format_timestamp(bucket), "messages": messages, "bytes": size}
+        for bucket, messages, size in rows
+    ]
+    return result
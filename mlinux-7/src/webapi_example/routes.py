@@ -1,16 +1,87 @@
 """API route definitions."""
 
 import hashlib
+import itertools
 import logging
 from typing import Any
 
-from flask import Flask, jsonify, request
+from flask import Flask, Response, current_app, jsonify, request
 
 from webapi_example.app import get_db
+from webapi_example.cache import etag_matches
+from webapi_example.compression import choose_encoding, encoded_etag
+from webapi_example.database import (
+    DELETE_USER,
+    INSERT_USER,
+    SELECT_USER,
+    SELECT_USERS,
+)
+from webapi_example.ingest import (
+    batch_result,
+    decode_batch,
+    drop_duplicates,
+    insert_batch,
+    message_row,
+    validate_batch,
+    write_messages,
+)
 from webapi_example.models.data import LoraMessage, User
+from webapi_example.rollups import TrafficQuery
+from webapi_example.storage import MessageFilter, PageRequest, message_stream
 
 logger = logging.getLogger(__name__)
 
+# Seconds a client is asked to wait when the write-behind queue is full
+_RETRY_AFTER = 1
+
+
+def _page_request() -> PageRequest:
+    """Read the pagination parameters of the current request.
+
+    Raises:
+        ValueError: If a parameter is invalid.
+    """
+    server = current_app.extensions["state"].config.server
+    return PageRequest.from_query(
+        request.args, server.page_size, server.max_page_size, server.max_wait
+    )
+
+
+def _stream_messages(
+    page: PageRequest, where: MessageFilter, etag: str, deveui: str | None = None
+) -> Any:
+    """Stream every message after the page's cursor as one JSON document."""
+    chunks = current_app.extensions["state"].message_chunks(page, deveui, where)
+    try:
+        first = next(chunks)
+    except RuntimeError as e:
+        return jsonify({"error": str(e)}), 503
+    if deveui is not None and not first and not page.has_cursor:
+        return jsonify({"error": "No messages found for device"}), 404
+    body = message_stream(itertools.chain([first], chunks))
+    return Response(body, mimetype="application/json", headers={"ETag": etag})
+
+
+def _not_modified(etag: str) -> Response | None:
+    """Return a 304 response if the client's copy, named by If-None-Match, is current.
+
+    The client may hold the compressed or the uncompressed variant.
+    """
+    if_none_match = request.headers.get("If-None-Match")
+    encoding = None
+    if current_app.extensions["state"].config.server.compression.enabled:
+        encoding = choose_encoding(request.headers.get("Accept-Encoding"))
+    if encoding is not None and etag_matches(if_none_match, encoded_etag(etag, encoding)):
+        etag = encoded_etag(etag, encoding)
+    elif not etag_matches(if_none_match, etag):
+        return None
+    return Response(status=304, headers={"ETag": etag})
+
+
+def _queue_full() -> tuple[Any, int, dict[str, str]]:
+    """Ask the client to retry once the write-behind queue has drained."""
+    return jsonify({"error": "Ingest queue full"}), 503, {"Retry-After": str(_RETRY_AFTER)}
+
 
 def register_routes(app: Flask) -> None:
     """Register all API routes with the Flask application.
@@ -33,17 +104,18 @@ def register_routes(app: Flask) -> None:
     @app.route("/users", methods=["GET"])
     def get_users() -> Any:
         """Get all users."""
+        etag = current_app.extensions["state"].users_etag()
+        not_modified = _not_modified(etag)
+        if not_modified is not None:
+            return not_modified
+
         db = get_db()
-        cursor = db.execute("SELECT id, username, password_hash FROM users")
+        cursor = db.execute(SELECT_USERS)
         users = [
-            User(
-                id=row["id"],
-                username=row["username"],
-                password_hash=row["password_hash"],
-            ).to_dict()
+            User(id=row["id"], username=row["username"]).to_dict()
             for row in cursor.fetchall()
         ]
-        return jsonify({"users": users})
+        return jsonify({"users": users}), 200, {"ETag": etag}
 
     @app.route("/users", methods=["POST"])
     def create_user() -> tuple[Any, int]:
@@ -63,11 +135,9 @@ def register_routes(app: Flask) -> None:
 
         db = get_db()
         try:
-            db.execute(
-                "INSERT INTO users (username, password_hash) VALUES (?, ?)",
-                (username, password_hash),
-            )
+            db.execute(INSERT_USER, (username, password_hash))
             db.commit()
+            current_app.extensions["state"].users_changed()
             logger.info("Created user: %s", username)
             return jsonify({"message": "User created", "username": username}), 201
         except Exception as e:
@@ -78,120 +148,215 @@ def register_routes(app: Flask) -> None:
     def get_user(username: str) -> Any:
         """Get a specific user by username."""
         db = get_db()
-        cursor = db.execute(
-            "SELECT id, username, password_hash FROM users WHERE username = ?",
-            (username,),
-        )
+        cursor = db.execute(SELECT_USER, (username,))
         row = cursor.fetchone()
 
         if not row:
             return jsonify({"error": "User not found"}), 404
 
-        user = User(
-            id=row["id"],
-            username=row["username"],
-            password_hash=row["password_hash"],
-        )
+        user = User(id=row["id"], username=row["username"])
         return jsonify({"user": user.to_dict()})
 
     @app.route("/users/<username>", methods=["DELETE"])
     def delete_user(username: str) -> Any:
         """Delete a user by username."""
         db = get_db()
-        cursor = db.execute("DELETE FROM users WHERE username = ?", (username,))
+        cursor = db.execute(DELETE_USER, (username,))
         db.commit()
 
         if cursor.rowcount == 0:
             return jsonify({"error": "User not found"}), 404
 
+        current_app.extensions["state"].users_changed()
         logger.info("Deleted user: %s", username)
         return jsonify({"message": "User deleted"})
 
     # LoRa Message endpoints
     @app.route("/messages", methods=["GET"])
     def get_messages() -> Any:
-        """Get all LoRa messages."""
-        db = get_db()
-        cursor = db.execute("""
-            SELECT id, device_name, deveui, appeui, data, size, timestamp, sequence_number
-            FROM lora_messages
-            ORDER BY id DESC
-        """)
-        messages = [
-            LoraMessage(
-                id=row["id"],
-                device_name=row["device_name"],
-                deveui=row["deveui"],
-                appeui=row["appeui"],
-                data=row["data"],
-                size=row["size"],
-                timestamp=row["timestamp"],
-                sequence_number=row["sequence_number"],
-            ).to_dict()
-            for row in cursor.fetchall()
-        ]
-        return jsonify({"messages": messages})
+        """Get a page of LoRa messages, optionally filtered."""
+        try:
+            page = _page_request()
+            where = MessageFilter.from_query(request.args)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        etag = current_app.extensions["state"].messages_etag(where.deveui)
+        not_modified = _not_modified(etag)
+        if not_modified is not None:
+            return not_modified
+
+        if page.stream:
+            return _stream_messages(page, where, etag)
+        try:
+            body = current_app.extensions["state"].message_page(request.path, page, where=where)
+        except RuntimeError as e:
+            return jsonify({"error": str(e)}), 503
+        return Response(body, mimetype="application/json", headers={"ETag": etag})
 
     @app.route("/messages", methods=["POST"])
-    def create_message() -> tuple[Any, int]:
+    def create_message() -> tuple[Any, ...]:
         """Create a new LoRa message."""
         data = request.get_json()
         if not data:
             return jsonify({"error": "No data provided"}), 400
 
+        try:
+            row = message_row(data)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
         message = LoraMessage.from_dict(data)
+        state = current_app.extensions["state"]
+        if state.dedup is not None and not state.dedup.fresh([row])[0]:
+            return jsonify({"message": "Duplicate message ignored"}), 200
 
-        if not message.deveui:
-            return jsonify({"error": "deveui is required"}), 400
+        writer = state.writer
+        if writer is not None:
+            if not writer.submit([row]):
+                return _queue_full()
+            return jsonify({"message": "Message queued", "data": message.to_dict()}), 202
 
         db = get_db()
         try:
-            db.execute(
-                """INSERT INTO lora_messages 
-                   (device_name, deveui, appeui, data, size, timestamp, sequence_number)
-                   VALUES (?, ?, ?, ?, ?, ?, ?)""",
-                (
-                    message.device_name,
-                    message.deveui,
-                    message.appeui,
-                    message.data,
-                    message.size,
-                    message.timestamp,
-                    message.sequence_number,
-                ),
-            )
-            db.commit()
+            with state.commit_lock:
+                stored, ids, _ = write_messages(db, [row], state.partitions, state.dedup)
+                if stored:
+                    state.messages_committed(stored, ids)
+            if not stored:
+                return jsonify({"message": "Duplicate message ignored"}), 200
             logger.info("Created message from device: %s", message.deveui)
             return jsonify({"message": "Message created", "data": message.to_dict()}), 201
         except Exception as e:
             logger.error("Failed to create message: %s", e)
             return jsonify({"error": "Failed to create message"}), 500
 
+    @app.route("/messages/batch", methods=["POST"])
+    def create_messages_batch() -> tuple[Any, ...]:
+        """Create many LoRa messages in one transaction."""
+        try:
+            items = decode_batch(request.get_data(), request.content_type or "")
+        except (UnicodeDecodeError, ValueError) as e:
+            return jsonify({"error": str(e)}), 400
+        if not items:
+            return jsonify({"error": "No data provided"}), 400
+
+        limit = current_app.extensions["state"].config.server.max_batch_size
+        if len(items) > limit:
+            return jsonify({"error": f"Batch exceeds {limit} messages"}), 413
+
+        state = current_app.extensions["state"]
+        writer = state.writer
+        if writer is not None:
+            rows, results = validate_batch(items)
+            if state.dedup is not None:
+                rows = drop_duplicates(rows, results, state.dedup.fresh(rows))
+            if rows and not writer.submit(rows):
+                return _queue_full()
+            result = batch_result(results, "queued")
+            return jsonify(result), 202 if rows else 200 if result["duplicates"] else 400
+
+        try:
+            result = insert_batch(
+                get_db(),
+                items,
+                state.messages_committed,
+                state.partitions,
+                state.dedup,
+                state.commit_lock,
+            )
+        except Exception as e:
+            logger.error("Failed to create messages: %s", e)
+            return jsonify({"error": "Failed to create messages"}), 500
+        return jsonify(result), 201 if result["created"] else 200 if result["duplicates"] else 400
+
+    @app.route("/messages/stream", methods=["GET"])
+    def stream_messages() -> Any:
+        """Push new messages as Server-Sent Events until the client leaves."""
+        state = current_app.extensions["state"]
+        try:
+            subscription = state.subscribe(request.args, request.headers.get("Last-Event-ID"))
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        except RuntimeError as e:
+            return jsonify({"error": str(e)}), 503
+        response = Response(
+            state.message_events(subscription),
+            mimetype="text/event-stream",
+            headers={"Cache-Control": "no-cache"},
+        )
+        response.call_on_close(lambda: state.unsubscribe(subscription))
+        return response
+
     @app.route("/messages/<deveui>", methods=["GET"])
     def get_messages_by_device(deveui: str) -> Any:
-        """Get all messages for a specific device."""
-        db = get_db()
-        cursor = db.execute(
-            """SELECT id, device_name, deveui, appeui, data, size, timestamp, sequence_number
-               FROM lora_messages WHERE deveui = ?
-               ORDER BY id DESC""",
-            (deveui,),
-        )
-        messages = [
-            LoraMessage(
-                id=row["id"],
-                device_name=row["device_name"],
-                deveui=row["deveui"],
-                appeui=row["appeui"],
-                data=row["data"],
-                size=row["size"],
-                timestamp=row["timestamp"],
-                sequence_number=row["sequence_number"],
-            ).to_dict()
-            for row in cursor.fetchall()
-        ]
+        """Get a page of messages for a specific device."""
+        try:
+            page = _page_request()
+            where = MessageFilter.from_query(request.args)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        etag = current_app.extensions["state"].messages_etag(deveui)
+        not_modified = _not_modified(etag)
+        if not_modified is not None:
+            return not_modified
+
+        if page.stream:
+            return _stream_messages(page, where, etag, deveui)
 
-        if not messages:
+        try:
+            body = current_app.extensions["state"].message_page(
+                request.path, page, deveui, where
+            )
+        except RuntimeError as e:
+            return jsonify({"error": str(e)}), 503
+        if body is None:
             return jsonify({"error": "No messages found for device"}), 404
 
-        return jsonify({"messages": messages})
+        return Response(body, mimetype="application/json", headers={"ETag": etag})
+
+    # Device endpoints
+    @app.route("/devices", methods=["GET"])
+    def get_devices() -> Any:
+        """Summaries of all devices, from memory."""
+        state = current_app.extensions["state"]
+        etag = state.messages_etag()
+        not_modified = _not_modified(etag)
+        if not_modified is not None:
+            return not_modified
+        return jsonify({"devices": state.devices.list()}), 200, {"ETag": etag}
+
+    @app.route("/devices/<deveui>", methods=["GET"])
+    def get_device(deveui: str) -> Any:
+        """Summary of one device, from memory."""
+        state = current_app.extensions["state"]
+        etag = state.messages_etag(deveui)
+        not_modified = _not_modified(etag)
+        if not_modified is not None:
+            return not_modified
+        device = state.devices.get(deveui)
+        if device is None:
+            return jsonify({"error": "Device not found"}), 404
+        return jsonify({"device": device}), 200, {"ETag": etag}
+
+    @app.route("/stats/cache", methods=["GET"])
+    def cache_stats() -> Any:
+        """Response cache size and hit/miss/eviction counters."""
+        return jsonify(current_app.extensions["state"].cache_stats())
+
+    @app.route("/stats/traffic", methods=["GET"])
+    def traffic_stats() -> Any:
+        """Message and byte counts per time bucket, from the rollups."""
+        try:
+            query = TrafficQuery.from_query(request.args)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        return jsonify(current_app.extensions["state"].traffic(query))
+
+    @app.route("/stats/stream", methods=["GET"])
+    def stream_stats() -> Any:
+        """Live stream client and message counters."""
+        return jsonify(current_app.extensions["state"].stream_stats())
+
+    @app.route("/stats/ingest", methods=["GET"])
+    def ingest_stats() -> Any:
+        """Duplicate and write-behind counters."""
+        return jsonify(current_app.extensions["state"].ingest_stats())
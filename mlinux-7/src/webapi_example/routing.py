@@ -0,0 +1,158 @@
+"""Route table for the stdlib HTTP request handler."""
+
+import re
+from dataclasses import dataclass, field
+from typing import Any, Callable
+from urllib.parse import unquote
+
+# Path parameter converters: regex matching one path segment and a function
+# turning the decoded segment into the value passed to the handler
+_CONVERTERS: dict[str, tuple[str, Callable[[str], Any]]] = {
+    "str": (r"[^/]+", str),
+    "int": (r"\d+", int),
+}
+
+_PARAMETER = re.compile(r"<(?:(?P<type>\w+):)?(?P<name>\w+)>")
+
+Handler = Callable[..., None]
+
+
+@dataclass
+class RouteMatch:
+    """Result of looking up a request in a Router.
+
+    Attributes:
+        handler: Function registered for the method, or None if the path
+            exists but does not accept the method.
+        params: Converted path parameters, passed as keyword arguments.
+        allowed: Methods the path accepts, for the Allow header of a 405.
+    """
+
+    handler: Handler | None
+    params: dict[str, Any] = field(default_factory=dict)
+    allowed: tuple[str, ...] = ()
+
+
+@dataclass
+class _DynamicRoute:
+    """A pattern with path parameters, compiled once at registration."""
+
+    pattern: str
+    regex: re.Pattern[str]
+    converters: dict[str, Callable[[str], Any]]
+    handlers: dict[str, Handler] = field(default_factory=dict)
+
+
+class Router:
+    """Maps (method, path) to handler functions.
+
+    Patterns are registered once with the ``route()`` decorator. Static
+    paths are found with a single dict lookup; patterns with parameters,
+    e.g. ``/users/<username>`` or ``/messages/<int:message_id>``, are
+    compiled to regexes and grouped by their first path segment, so only a
+    handful are tried per request however many routes are registered.
+    """
+
+    def __init__(self) -> None:
+        """Initialize an empty route table."""
+        self._static: dict[str, dict[str, Handler]] = {}
+        self._dynamic: dict[str, list[_DynamicRoute]] = {}
+
+    def route(
+        self, pattern: str, methods: tuple[str, ...] = ("GET",)
+    ) -> Callable[[Handler], Handler]:
+        """Register the decorated function for a path pattern.
+
+        Args:
+            pattern: Path starting with "/"; segments may be parameters
+                written ``<name>`` or ``<type:name>`` with type "str" or "int".
+            methods: HTTP methods the function handles.
+
+        Returns:
+            Decorator registering the function and returning it unchanged.
+
+        Raises:
+            ValueError: If the pattern is invalid or a method is already
+                registered for it.
+        """
+
+        def decorator(func: Handler) -> Handler:
+            handlers = self._handlers_for(pattern)
+            for method in methods:
+                method = method.upper()
+                if method in handlers:
+                    raise ValueError(f"Duplicate route: {method} {pattern}")
+                handlers[method] = func
+            return func
+
+        return decorator
+
+    def _handlers_for(self, pattern: str) -> dict[str, Handler]:
+        """Return the method table for a pattern, creating it if needed."""
+        if not pattern.startswith("/"):
+            raise ValueError(f"Route pattern must start with '/': {pattern}")
+        if "<" not in pattern:
+            return self._static.setdefault(pattern, {})
+
+        prefix = _first_segment(pattern)
+        if "<" in prefix:
+            prefix = ""
+        routes = self._dynamic.setdefault(prefix, [])
+        for route in routes:
+            if route.pattern == pattern:
+                return route.handlers
+
+        regex = ["^"]
+        converters: dict[str, Callable[[str], Any]] = {}
+        position = 0
+        for match in _PARAMETER.finditer(pattern):
+            kind = match.group("type") or "str"
+            if kind not in _CONVERTERS:
+                raise ValueError(f"Unknown converter '{kind}' in route: {pattern}")
+            segment_regex, converter = _CONVERTERS[kind]
+            name = match.group("name")
+            regex.append(re.escape(pattern[position:match.start()]))
+            regex.append(f"(?P<{name}>{segment_regex})")
+            converters[name] = converter
+            position = match.end()
+        regex.append(re.escape(pattern[position:]) + "$")
+
+        route = _DynamicRoute(pattern, re.compile("".join(regex)), converters)
+        routes.append(route)
+        return route.handlers
+
+    def match(self, method: str, path: str) -> RouteMatch | None:
+        """Find the handler for a request.
+
+        Args:
+            method: HTTP method of the request.
+            path: Request path without the query string, still
+                percent-encoded; parameters are decoded after matching so an
+                encoded "/" stays inside its segment.
+
+        Returns:
+            The match, or None if no pattern matches the path.
+        """
+        handlers = self._static.get(path)
+        if handlers is not None:
+            return RouteMatch(handlers.get(method), {}, tuple(handlers))
+
+        for prefix in (_first_segment(path), ""):
+            for route in self._dynamic.get(prefix, ()):
+                found = route.regex.match(path)
+                if found is None:
+                    continue
+                try:
+                    params = {
+                        name: route.converters[name](unquote(value))
+                        for name, value in found.groupdict().items()
+                    }
+                except ValueError:
+                    continue
+                return RouteMatch(route.handlers.get(method), params, tuple(route.handlers))
+        return None
+
+
+def _first_segment(path: str) -> str:
+    """Return the first segment of a path, e.g. "users" for "/users/alice"."""
+    return path[1:].split("/", 1)[0]
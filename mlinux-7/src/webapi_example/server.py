@@ -1,118 +1,441 @@
 """Simple HTTP server using Python's built-in http.server module."""
 
+import io
+import itertools
 import json
 import logging
-import os
+import queue
+import select
+import socket
 import sqlite3
 import ssl
+import threading
+import time
 from http.server import HTTPServer, BaseHTTPRequestHandler
-from typing import Any
-from urllib.parse import parse_qs, urlparse
-
+from typing import Any, Iterable, cast
+from urllib.parse import parse_qsl
+
+from webapi_example.async_server import AsyncHTTPServer
+from webapi_example.cache import etag_matches
+from webapi_example.compression import (
+    body_slices,
+    choose_encoding,
+    compress_chunks,
+    encoded_etag,
+)
+from webapi_example.database import (
+    DELETE_USER,
+    INSERT_USER,
+    SELECT_USER,
+    SELECT_USERS,
+    init_db,
+)
+from webapi_example.ingest import (
+    batch_result,
+    decode_batch,
+    drop_duplicates,
+    insert_batch,
+    message_row,
+    validate_batch,
+    write_messages,
+)
 from webapi_example.models.config import AppConfig
+from webapi_example.rollups import TrafficQuery
+from webapi_example.routing import Router
+from webapi_example.state import AppState
+from webapi_example.utils.status_writer import StatusWriter
+from webapi_example.storage import (
+    MessageFilter,
+    PageRequest,
+    message_stream,
+)
 
 logger = logging.getLogger(__name__)
 
+# Seconds a pooled worker waits for a client to finish the TLS handshake
+_HANDSHAKE_TIMEOUT = 10.0
+
+# Seconds between checks whether an idle keep-alive connection should make
+# way for connections waiting for a worker
+_IDLE_POLL = 0.05
+
+# Largest unread request body skipped to keep a connection alive, in bytes
+_MAX_DISCARD = 64 * 1024
+
+# Seconds a client is asked to wait when the write-behind queue is full
+_RETRY_AFTER = 1
+
+# Route table of APIHandler; handlers are registered with @router.route()
+router = Router()
+
 
 class APIHandler(BaseHTTPRequestHandler):
-    """HTTP request handler for the REST API."""
+    """HTTP request handler for the REST API.
+
+    Speaks HTTP/1.1 with persistent connections: a connection serves
+    requests (pipelined or not) until the client closes it, it stays idle
+    for ``keepalive_timeout`` seconds, or ``keepalive_max_requests`` have
+    been served.
+
+    Requests are dispatched through the module-level ``router``: handlers
+    receive typed path parameters as keyword arguments and the parsed query
+    string (first value of each name) as ``self.query``.
+    """
 
-    def __init__(self, *args: Any, config: AppConfig, db_path: str, **kwargs: Any) -> None:
+    protocol_version = "HTTP/1.1"
+
+    # Headers and body are written separately; don't let Nagle delay the body
+    disable_nagle_algorithm = True
+
+    # Buffer writes so a small response goes out in a single segment
+    wbufsize = -1
+
+    def __init__(self, *args: Any, config: AppConfig, **kwargs: Any) -> None:
         """Initialize the handler with configuration."""
         self.config = config
-        self.db_path = db_path
+        self.max_requests = config.server.keepalive_max_requests
+        self._requests_served = 0
+        self._body_remaining = 0
+        self._connection_header_sent = False
+        self.request_path = ""
+        self.query: dict[str, str] = {}
+        self.content_encoding: str | None = None
         super().__init__(*args, **kwargs)
 
-    def _get_db(self) -> sqlite3.Connection:
-        """Get database connection."""
-        conn = sqlite3.connect(self.db_path)
-        conn.row_factory = sqlite3.Row
-        return conn
-
-    def _send_json(self, data: Any, status: int = 200) -> None:
+    def handle(self) -> None:
+        """Serve requests until the connection is closed, idles out or is used up."""
+        self.close_connection = True
+        self.handle_one_request()
+        while not self.close_connection:
+            self._discard_body()
+            if self.close_connection or not self._await_request():
+                self.close_connection = True
+                break
+            self.handle_one_request()
+
+    def _await_request(self) -> bool:
+        """Wait for the next request on a persistent connection.
+
+        The wait is a short poll, so an idle connection gives its worker up
+        as soon as another connection is waiting for one.
+
+        Returns:
+            True if the next request (or the end of the stream) can be read,
+            False if the connection idled out or should make way for others.
+        """
+        sock = self.connection
+        # StreamRequestHandler reads through a buffer (rbufsize -1)
+        rfile = cast(io.BufferedReader, self.rfile)
+        deadline = time.monotonic() + self.config.server.keepalive_timeout
+        while True:
+            # A pipelined request may already sit in the read buffer, where
+            # select() cannot see it
+            sock.settimeout(0)
+            try:
+                if rfile.peek(1):
+                    return True
+            except (BlockingIOError, ssl.SSLWantReadError):
+                pass
+            finally:
+                sock.settimeout(self.timeout)
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            readable, _, _ = select.select([sock], [], [], min(_IDLE_POLL, remaining))
+            if readable:
+                return True
+            if self._server_busy():
+                return False
+
+    def parse_request(self) -> bool:
+        """Parse the request and decide whether the connection stays open."""
+        self._connection_header_sent = False
+        if not super().parse_request():
+            return False
+
+        if "Transfer-Encoding" in self.headers:
+            # Only Content-Length framed bodies are supported
+            self.send_error(411)
+            return False
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+        except ValueError:
+            length = -1
+        if length < 0:
+            self.send_error(400, "Invalid Content-Length")
+            return False
+        self._body_remaining = length
+
+        self._requests_served += 1
+        if self._requests_served >= self.max_requests or self._server_busy():
+            self.close_connection = True
+        return True
+
+    def _server_busy(self) -> bool:
+        """Return True if keeping this connection open would hold up others.
+
+        An idle persistent connection ties up a worker thread, so it is
+        given up as soon as another connection is waiting, whether between
+        requests or while it idles (see _await_request()). Servers without
+        a busy() check handle one connection at a time and always count as
+        busy.
+        """
+        busy = getattr(self.server, "busy", None)
+        return busy() if busy is not None else True
+
+    def _discard_body(self) -> None:
+        """Skip a request body the handler did not read.
+
+        Keeps the next pipelined request aligned; very large leftovers
+        close the connection instead of being read.
+        """
+        if self._body_remaining <= 0:
+            return
+        if self._body_remaining > _MAX_DISCARD:
+            self.close_connection = True
+            return
+        self.rfile.read(self._body_remaining)
+        self._body_remaining = 0
+
+    def send_header(self, keyword: str, value: str) -> None:
+        """Send a header, noting an explicit Connection header."""
+        if keyword.lower() == "connection":
+            self._connection_header_sent = True
+        super().send_header(keyword, value)
+
+    def handle_expect_100(self) -> bool:
+        """Send ``100 Continue`` at once, as the client waits for it before its body."""
+        # Writes are buffered; without the flush the client would wait for
+        # its own timeout before sending the body
+        self.wfile.write(f"{self.protocol_version} 100 Continue\r\n\r\n".encode())
+        self.wfile.flush()
+        return True
+
+    def end_headers(self) -> None:
+        """Add connection management headers and finish the header block."""
+        if self.request_version != "HTTP/0.9" and not self._connection_header_sent:
+            if self.close_connection:
+                self.send_header("Connection", "close")
+            else:
+                if self.request_version == "HTTP/1.0":
+                    self.send_header("Connection", "keep-alive")
+                self.send_header(
+                    "Keep-Alive",
+                    f"timeout={int(self.config.server.keepalive_timeout)}, "
+                    f"max={self.max_requests - self._requests_served}",
+                )
+        super().end_headers()
+
+    @property
+    def state(self) -> AppState:
+        """Shared application state owned by the server."""
+        return self.server.state  # type: ignore[attr-defined, no-any-return]
+
+    def _send_json(
+        self, data: Any, status: int = 200, headers: dict[str, str] | None = None
+    ) -> None:
         """Send JSON response."""
-        body = json.dumps(data).encode("utf-8")
+        self._send_body(json.dumps(data).encode("utf-8"), status, headers)
+
+    def _send_body(
+        self, body: bytes, status: int = 200, headers: dict[str, str] | None = None
+    ) -> None:
+        """Send an already encoded JSON response body.
+
+        Bodies of at least ``compression.min_size`` bytes are compressed
+        for clients accepting it, and sent as a stream.
+        """
+        compression = self.config.server.compression
+        if self.content_encoding is not None and len(body) >= compression.min_size:
+            self._send_stream(body_slices(body), headers=headers, status=status, flush=False)
+            return
         self.send_response(status)
         self.send_header("Content-Type", "application/json")
+        for name, value in self._response_headers(headers).items():
+            self.send_header(name, value)
         self.send_header("Content-Length", str(len(body)))
         self.end_headers()
         self.wfile.write(body)
 
-    def _read_json(self) -> dict[str, Any] | None:
-        """Read JSON from request body."""
+    def _send_stream(
+        self,
+        chunks: Iterable[bytes | memoryview],
+        content_type: str = "application/json",
+        headers: dict[str, str] | None = None,
+        status: int = 200,
+        flush: bool = True,
+    ) -> None:
+        """Send a body of unknown length while it is being produced.
+
+        HTTP/1.1 clients get chunked transfer encoding and keep their
+        connection; older clients get a body ended by closing it. The body
+        is compressed on the fly for clients accepting it.
+
+        Args:
+            chunks: Pieces of the body.
+            content_type: Content-Type of the body.
+            headers: Extra response headers.
+            status: HTTP status code.
+            flush: Send each piece as soon as it is produced, so the
+                client starts receiving data at once.
+        """
+        headers = self._response_headers(headers)
+        if self.content_encoding is not None:
+            chunks = compress_chunks(
+                chunks, self.content_encoding, self.config.server.compression.level, flush
+            )
+            headers["Content-Encoding"] = self.content_encoding
+            if "ETag" in headers:
+                headers["ETag"] = encoded_etag(headers["ETag"], self.content_encoding)
+        chunked = self.request_version == "HTTP/1.1"
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        if chunked:
+            self.send_header("Transfer-Encoding", "chunked")
+        else:
+            self.close_connection = True
+        self.end_headers()
+        try:
+            for chunk in chunks:
+                if not chunk:
+                    continue
+                if chunked:
+                    self.wfile.write(b"%x\r\n%s\r\n" % (len(chunk), chunk))
+                else:
+                    self.wfile.write(chunk)
+                if flush:
+                    self.wfile.flush()
+            if chunked:
+                self.wfile.write(b"0\r\n\r\n")
+        except ConnectionError as e:
+            logger.debug("Client %s went away during a stream: %s", self.address_string(), e)
+            self.close_connection = True
+
+    def _response_headers(self, headers: dict[str, str] | None) -> dict[str, str]:
+        """Return a copy of extra response headers, adding Vary if responses are compressed."""
+        headers = dict(headers or {})
+        if self.config.server.compression.enabled:
+            headers["Vary"] = "Accept-Encoding"
+        return headers
+
+    def _not_modified(self, etag: str) -> bool:
+        """Answer 304 if the client's copy, named by If-None-Match, is current.
+
+        The client may hold the compressed or the uncompressed variant,
+        whichever it was sent last; either is current.
+
+        Args:
+            etag: Current entity tag of the uncompressed resource.
+
+        Returns:
+            True if the 304 was sent and the handler is done.
+        """
+        if_none_match = self.headers.get("If-None-Match")
+        if self.content_encoding is not None and etag_matches(
+            if_none_match, encoded_etag(etag, self.content_encoding)
+        ):
+            etag = encoded_etag(etag, self.content_encoding)
+        elif not etag_matches(if_none_match, etag):
+            return False
+        self.send_response(304)
+        for name, value in self._response_headers({"ETag": etag}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        return True
+
+    def _read_body(self) -> bytes:
+        """Read the request body."""
         content_length = int(self.headers.get("Content-Length", 0))
         if content_length == 0:
-            return None
+            return b""
         body = self.rfile.read(content_length)
-        return json.loads(body.decode("utf-8"))
-
-    def do_GET(self) -> None:
-        """Handle GET requests."""
-        parsed = urlparse(self.path)
-        path = parsed.path
-
-        if path == "/":
-            self._send_json({"message": "Welcome to the Web API Example"})
-        elif path == "/health":
-            self._send_json({"status": "ok"})
-        elif path == "/users":
-            self._get_users()
-        elif path.startswith("/users/"):
-            username = path[7:]
-            self._get_user(username)
-        elif path == "/messages":
-            self._get_messages()
-        elif path.startswith("/messages/"):
-            deveui = path[10:]
-            self._get_messages_by_device(deveui)
-        else:
-            self._send_json({"error": "Not found"}, 404)
+        self._body_remaining = 0
+        return body
 
-    def do_POST(self) -> None:
-        """Handle POST requests."""
-        if self.path == "/users":
-            self._create_user()
-        elif self.path == "/messages":
-            self._create_message()
-        else:
-            self._send_json({"error": "Not found"}, 404)
+    def _read_json(self) -> dict[str, Any] | None:
+        """Read a JSON object from the request body.
 
-    def do_DELETE(self) -> None:
-        """Handle DELETE requests."""
-        if self.path.startswith("/users/"):
-            username = self.path[7:]
-            self._delete_user(username)
-        else:
+        Returns:
+            The decoded object, or None if the body is empty.
+
+        Raises:
+            ValueError: If the body is not a JSON object.
+        """
+        body = self._read_body()
+        if not body:
+            return None
+        try:
+            data = json.loads(body.decode("utf-8"))
+        except (UnicodeDecodeError, json.JSONDecodeError) as e:
+            raise ValueError(f"Invalid JSON: {e}") from None
+        if not isinstance(data, dict):
+            raise ValueError("Request body must be a JSON object")
+        return data
+
+    def _dispatch(self) -> None:
+        """Route the request to its handler through the route table."""
+        path, _, query = self.path.partition("?")
+        self.request_path = path
+        self.query = {}
+        for name, value in parse_qsl(query, keep_blank_values=True):
+            self.query.setdefault(name, value)
+        self.content_encoding = None
+        if self.config.server.compression.enabled:
+            self.content_encoding = choose_encoding(self.headers.get("Accept-Encoding"))
+
+        match = router.match(self.command, path)
+        if match is None:
             self._send_json({"error": "Not found"}, 404)
+        elif match.handler is None:
+            self._send_json(
+                {"error": "Method not allowed"}, 405, {"Allow": ", ".join(match.allowed)}
+            )
+        else:
+            match.handler(self, **match.params)
+
+    do_GET = do_POST = do_PUT = do_PATCH = do_DELETE = _dispatch
 
+    @router.route("/")
+    def _index(self) -> None:
+        """Welcome message."""
+        self._send_json({"message": "Welcome to the Web API Example"})
+
+    @router.route("/health")
+    def _health(self) -> None:
+        """Health check."""
+        self._send_json({"status": "ok"})
+
+    @router.route("/users")
     def _get_users(self) -> None:
         """Get all users."""
-        conn = self._get_db()
-        try:
-            cursor = conn.execute("SELECT id, username FROM users")
+        etag = self.state.users_etag()
+        if self._not_modified(etag):
+            return
+        with self.state.pool.connection() as conn:
+            cursor = conn.execute(SELECT_USERS)
             users = [{"id": row["id"], "username": row["username"]} for row in cursor]
-            self._send_json({"users": users})
-        finally:
-            conn.close()
+        self._send_json({"users": users}, headers={"ETag": etag})
 
+    @router.route("/users/<username>")
     def _get_user(self, username: str) -> None:
         """Get a specific user."""
-        conn = self._get_db()
-        try:
-            cursor = conn.execute(
-                "SELECT id, username FROM users WHERE username = ?", (username,)
-            )
-            row = cursor.fetchone()
-            if row:
-                self._send_json({"user": {"id": row["id"], "username": row["username"]}})
-            else:
-                self._send_json({"error": "User not found"}, 404)
-        finally:
-            conn.close()
+        with self.state.pool.connection() as conn:
+            row = conn.execute(SELECT_USER, (username,)).fetchone()
+        if row:
+            self._send_json({"user": {"id": row["id"], "username": row["username"]}})
+        else:
+            self._send_json({"error": "User not found"}, 404)
 
+    @router.route("/users", methods=("POST",))
     def _create_user(self) -> None:
         """Create a new user."""
-        data = self._read_json()
+        try:
+            data = self._read_json()
+        except ValueError as e:
+            self._send_json({"error": str(e)}, 400)
+            return
         if not data:
             self._send_json({"error": "No data provided"}, 400)
             return
@@ -127,192 +450,515 @@ class APIHandler(BaseHTTPRequestHandler):
         import hashlib
         password_hash = hashlib.sha256(password.encode()).hexdigest()
 
-        conn = self._get_db()
         try:
-            conn.execute(
-                "INSERT INTO users (username, password_hash) VALUES (?, ?)",
-                (username, password_hash),
-            )
-            conn.commit()
-            logger.info("Created user: %s", username)
-            self._send_json({"message": "User created", "username": username}, 201)
+            with self.state.pool.connection() as conn:
+                conn.execute(INSERT_USER, (username, password_hash))
+                conn.commit()
         except sqlite3.IntegrityError:
             self._send_json({"error": "User already exists"}, 400)
-        finally:
-            conn.close()
+            return
+        self.state.users_changed()
+        logger.info("Created user: %s", username)
+        self._send_json({"message": "User created", "username": username}, 201)
 
+    @router.route("/users/<username>", methods=("DELETE",))
     def _delete_user(self, username: str) -> None:
         """Delete a user."""
-        conn = self._get_db()
-        try:
-            cursor = conn.execute("DELETE FROM users WHERE username = ?", (username,))
+        with self.state.pool.connection() as conn:
+            cursor = conn.execute(DELETE_USER, (username,))
             conn.commit()
-            if cursor.rowcount > 0:
-                logger.info("Deleted user: %s", username)
-                self._send_json({"message": "User deleted"})
-            else:
-                self._send_json({"error": "User not found"}, 404)
-        finally:
-            conn.close()
+        if cursor.rowcount > 0:
+            self.state.users_changed()
+            logger.info("Deleted user: %s", username)
+            self._send_json({"message": "User deleted"})
+        else:
+            self._send_json({"error": "User not found"}, 404)
 
+    @router.route("/messages")
     def _get_messages(self) -> None:
-        """Get all messages."""
-        conn = self._get_db()
+        """Get a page of messages."""
+        self._send_message_page()
+
+    @router.route("/messages/stream")
+    def _stream_messages(self) -> None:
+        """Push new messages as Server-Sent Events until the client leaves."""
+        if self.config.server.concurrency == "single":
+            # The stream would hold the only request slot
+            self._send_json({"error": "Live stream not available in single mode"}, 503)
+            return
         try:
-            cursor = conn.execute("""
-                SELECT id, device_name, deveui, appeui, data, size, timestamp, sequence_number
-                FROM lora_messages ORDER BY id DESC
-            """)
-            messages = [
-                {
-                    "id": row["id"],
-                    "deviceName": row["device_name"],
-                    "deveui": row["deveui"],
-                    "appeui": row["appeui"],
-                    "data": row["data"],
-                    "size": row["size"],
-                    "timestamp": row["timestamp"],
-                    "sqn": row["sequence_number"],
-                }
-                for row in cursor
-            ]
-            self._send_json({"messages": messages})
+            subscription = self.state.subscribe(self.query, self.headers.get("Last-Event-ID"))
+        except ValueError as e:
+            self._send_json({"error": str(e)}, 400)
+            return
+        except RuntimeError as e:
+            self._send_json({"error": str(e)}, 503)
+            return
+        try:
+            self._send_stream(
+                self.state.message_events(subscription),
+                content_type="text/event-stream",
+                headers={"Cache-Control": "no-cache"},
+            )
         finally:
-            conn.close()
+            self.state.unsubscribe(subscription)
+            # The stream only ends at shutdown or when the client was dropped
+            self.close_connection = True
 
+    @router.route("/messages/<deveui>")
     def _get_messages_by_device(self, deveui: str) -> None:
-        """Get messages for a specific device."""
-        conn = self._get_db()
+        """Get a page of messages for a specific device."""
+        self._send_message_page(deveui)
+
+    def _send_message_page(self, deveui: str | None = None) -> None:
+        """Send one page of messages selected by the filter, limit and cursor parameters.
+
+        With ``wait``, an empty page after ``after_id`` is held back until
+        messages arrive or the wait runs out.
+        """
+        server = self.config.server
+        # A waiting request would hold the only request slot
+        max_wait = 0.0 if server.concurrency == "single" else server.max_wait
         try:
-            cursor = conn.execute("""
-                SELECT id, device_name, deveui, appeui, data, size, timestamp, sequence_number
-                FROM lora_messages WHERE deveui = ? ORDER BY id DESC
-            """, (deveui,))
-            messages = [
-                {
-                    "id": row["id"],
-                    "deviceName": row["device_name"],
-                    "deveui": row["deveui"],
-                    "appeui": row["appeui"],
-                    "data": row["data"],
-                    "size": row["size"],
-                    "timestamp": row["timestamp"],
-                    "sqn": row["sequence_number"],
-                }
-                for row in cursor
-            ]
-            if messages:
-                self._send_json({"messages": messages})
-            else:
+            page = PageRequest.from_query(
+                self.query, server.page_size, server.max_page_size, max_wait
+            )
+            where = MessageFilter.from_query(self.query)
+        except ValueError as e:
+            self._send_json({"error": str(e)}, 400)
+            return
+        etag = self.state.messages_etag(deveui or where.deveui)
+        if self._not_modified(etag):
+            return
+
+        if page.stream:
+            chunks = self.state.message_chunks(page, deveui, where)
+            try:
+                first = next(chunks)
+            except RuntimeError as e:
+                self._send_json({"error": str(e)}, 503)
+                return
+            if deveui is not None and not first and not page.has_cursor:
                 self._send_json({"error": "No messages found"}, 404)
-        finally:
-            conn.close()
+                return
+            self._send_stream(
+                message_stream(itertools.chain([first], chunks)), headers={"ETag": etag}
+            )
+            return
+
+        try:
+            body = self.state.message_page(self.request_path, page, deveui, where)
+        except RuntimeError as e:
+            self._send_json({"error": str(e)}, 503)
+            return
+        if body is None:
+            self._send_json({"error": "No messages found"}, 404)
+        else:
+            self._send_body(body, headers={"ETag": etag})
 
+    @router.route("/messages", methods=("POST",))
     def _create_message(self) -> None:
         """Create a new message."""
-        data = self._read_json()
+        try:
+            data = self._read_json()
+        except ValueError as e:
+            self._send_json({"error": str(e)}, 400)
+            return
         if not data:
             self._send_json({"error": "No data provided"}, 400)
             return
 
-        deveui = data.get("deveui")
-        if not deveui:
-            self._send_json({"error": "deveui is required"}, 400)
+        try:
+            row = message_row(data)
+        except ValueError as e:
+            self._send_json({"error": str(e)}, 400)
+            return
+
+        dedup = self.state.dedup
+        if dedup is not None and not dedup.fresh([row])[0]:
+            self._send_json({"message": "Duplicate message ignored"})
             return
 
-        from datetime import datetime
-        timestamp = data.get("timestamp", datetime.utcnow().isoformat() + "Z")
+        writer = self.state.writer
+        if writer is not None:
+            if not writer.submit([row]):
+                self._send_queue_full()
+                return
+            self._send_json({"message": "Message queued"}, 202)
+            return
 
-        conn = self._get_db()
+        with self.state.pool.connection() as conn, self.state.commit_lock:
+            stored, ids, _ = write_messages(conn, [row], self.state.partitions, dedup)
+            if stored:
+                self.state.messages_committed(stored, ids)
+        if not stored:
+            self._send_json({"message": "Duplicate message ignored"})
+            return
+        logger.info("Created message from device: %s", row[1])
+        self._send_json({"message": "Message created"}, 201)
+
+    @router.route("/messages/batch", methods=("POST",))
+    def _create_messages_batch(self) -> None:
+        """Create many messages in one transaction."""
         try:
-            conn.execute(
-                """INSERT INTO lora_messages 
-                   (device_name, deveui, appeui, data, size, timestamp, sequence_number)
-                   VALUES (?, ?, ?, ?, ?, ?, ?)""",
-                (
-                    data.get("deviceName", ""),
-                    deveui,
-                    data.get("appeui", ""),
-                    data.get("data", ""),
-                    data.get("size", 0),
-                    timestamp,
-                    data.get("sqn", 0),
-                ),
-            )
-            conn.commit()
-            logger.info("Created message from device: %s", deveui)
-            self._send_json({"message": "Message created"}, 201)
-        finally:
-            conn.close()
+            items = decode_batch(self._read_body(), self.headers.get("Content-Type", ""))
+        except (UnicodeDecodeError, ValueError) as e:
+            self._send_json({"error": str(e)}, 400)
+            return
+        if not items:
+            self._send_json({"error": "No data provided"}, 400)
+            return
+        limit = self.config.server.max_batch_size
+        if len(items) > limit:
+            self._send_json({"error": f"Batch exceeds {limit} messages"}, 413)
+            return
+
+        writer = self.state.writer
+        if writer is not None:
+            rows, results = validate_batch(items)
+            if self.state.dedup is not None:
+                rows = drop_duplicates(rows, results, self.state.dedup.fresh(rows))
+            if rows and not writer.submit(rows):
+                self._send_queue_full()
+                return
+            result = batch_result(results, "queued")
+            self._send_json(result, 202 if rows else 200 if result["duplicates"] else 400)
+            return
+
+        try:
+            with self.state.pool.connection() as conn:
+                result = insert_batch(
+                    conn,
+                    items,
+                    self.state.messages_committed,
+                    self.state.partitions,
+                    self.state.dedup,
+                    self.state.commit_lock,
+                )
+        except Exception as e:
+            logger.error("Failed to create messages: %s", e)
+            self._send_json({"error": "Failed to create messages"}, 500)
+            return
+        self._send_json(
+            result, 201 if result["created"] else 200 if result["duplicates"] else 400
+        )
+
+    @router.route("/devices")
+    def _get_devices(self) -> None:
+        """Summaries of all devices, from memory."""
+        etag = self.state.messages_etag()
+        if self._not_modified(etag):
+            return
+        self._send_json({"devices": self.state.devices.list()}, headers={"ETag": etag})
+
+    @router.route("/devices/<deveui>")
+    def _get_device(self, deveui: str) -> None:
+        """Summary of one device, from memory."""
+        etag = self.state.messages_etag(deveui)
+        if self._not_modified(etag):
+            return
+        device = self.state.devices.get(deveui)
+        if device is None:
+            self._send_json({"error": "Device not found"}, 404)
+            return
+        self._send_json({"device": device}, headers={"ETag": etag})
+
+    @router.route("/stats/cache")
+    def _cache_stats(self) -> None:
+        """Response cache size and hit/miss/eviction counters."""
+        self._send_json(self.state.cache_stats())
+
+    @router.route("/stats/traffic")
+    def _traffic_stats(self) -> None:
+        """Message and byte counts per time bucket, from the rollups."""
+        try:
+            query = TrafficQuery.from_query(self.query)
+        except ValueError as e:
+            self._send_json({"error": str(e)}, 400)
+            return
+        self._send_json(self.state.traffic(query))
+
+    @router.route("/stats/stream")
+    def _stream_stats(self) -> None:
+        """Live stream client and message counters."""
+        self._send_json(self.state.stream_stats())
+
+    @router.route("/stats/ingest")
+    def _ingest_stats(self) -> None:
+        """Duplicate and write-behind counters."""
+        self._send_json(self.state.ingest_stats())
+
+    def _send_queue_full(self) -> None:
+        """Ask the client to retry once the write-behind queue has drained."""
+        self._send_json(
+            {"error": "Ingest queue full"}, 503, {"Retry-After": str(_RETRY_AFTER)}
+        )
 
     def log_message(self, format: str, *args: Any) -> None:
         """Log HTTP requests."""
         logger.debug("%s - %s", self.address_string(), format % args)
 
 
-def create_handler(config: AppConfig, db_path: str) -> type[APIHandler]:
+def create_handler(config: AppConfig) -> type[APIHandler]:
     """Create a handler class with the given configuration."""
 
     class ConfiguredHandler(APIHandler):
+        # Socket timeout, which doubles as the keep-alive idle timeout
+        timeout = config.server.keepalive_timeout
+
         def __init__(self, *args: Any, **kwargs: Any) -> None:
-            super().__init__(*args, config=config, db_path=db_path, **kwargs)
+            super().__init__(*args, config=config, **kwargs)
 
     return ConfiguredHandler
 
 
-def init_db(db_path: str) -> None:
-    """Initialize the database schema."""
-    os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
-    conn = sqlite3.connect(db_path)
+class APIServer(HTTPServer):
+    """HTTP server handling one connection at a time ("single" mode).
+
+    Owns the shared application state; request handlers reach it through
+    ``self.server.state`` and closing the server closes it.
+    """
+
+    def __init__(
+        self,
+        server_address: tuple[str, int],
+        handler_class: type[BaseHTTPRequestHandler],
+        state: AppState,
+    ) -> None:
+        """Initialize the server.
+
+        Args:
+            server_address: (host, port) to bind to.
+            handler_class: Request handler class.
+            state: Shared application state.
+        """
+        self.state = state
+        super().__init__(server_address, handler_class)
+
+    def server_close(self) -> None:
+        """Close the listening socket and the shared state."""
+        super().server_close()
+        self.state.close()
+
+
+class PooledHTTPServer(APIServer):
+    """HTTP server that serves connections from a bounded worker pool.
+
+    The thread running ``serve_forever()`` only accepts connections and
+    queues them for ``workers`` threads, so a slow client no longer stalls
+    every other request. At most ``workers + queue_depth`` connections are
+    in flight; beyond that the accept loop stops and new connections wait
+    in the ``listen_backlog``.
+    """
+
+    def __init__(
+        self,
+        server_address: tuple[str, int],
+        handler_class: type[BaseHTTPRequestHandler],
+        state: AppState,
+        workers: int = 4,
+        queue_depth: int = 16,
+        listen_backlog: int = 32,
+    ) -> None:
+        """Initialize the server and start the worker threads.
+
+        Args:
+            server_address: (host, port) to bind to.
+            handler_class: Request handler class.
+            state: Shared application state.
+            workers: Number of worker threads.
+            queue_depth: Connections allowed to wait for a free worker.
+            listen_backlog: Backlog passed to listen().
+        """
+        # Read by server_activate(), so it must be set before binding
+        self.request_queue_size = listen_backlog
+        self._pending: queue.Queue[tuple[socket.socket, Any]] = queue.Queue(
+            maxsize=max(queue_depth, 1)
+        )
+        self._closing = threading.Event()
+        super().__init__(server_address, handler_class, state)
+        self._workers = [
+            threading.Thread(target=self._worker_loop, name=f"http-worker-{i}", daemon=True)
+            for i in range(max(workers, 1))
+        ]
+        for worker in self._workers:
+            worker.start()
+
+    def process_request(self, request: Any, client_address: Any) -> None:
+        """Queue an accepted connection for the worker pool.
+
+        Blocks while the queue is full, so excess connections wait in the
+        kernel listen backlog instead of piling up in memory.
+        """
+        while not self._closing.is_set():
+            try:
+                self._pending.put((request, client_address), timeout=0.5)
+                return
+            except queue.Full:
+                continue
+        self.shutdown_request(request)
+
+    def busy(self) -> bool:
+        """Return True if connections are waiting for a free worker."""
+        return not self._pending.empty()
+
+    def _worker_loop(self) -> None:
+        """Serve queued connections until the server is closed."""
+        while not self._closing.is_set():
+            try:
+                request, client_address = self._pending.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            try:
+                if isinstance(request, ssl.SSLSocket):
+                    # Handshake here rather than in the accept loop
+                    request.settimeout(_HANDSHAKE_TIMEOUT)
+                    request.do_handshake()
+                    request.settimeout(None)
+                self.finish_request(request, client_address)
+            except (ssl.SSLError, OSError) as e:
+                logger.debug("Connection from %s failed: %s", client_address[0], e)
+            except Exception:
+                self.handle_error(request, client_address)
+            finally:
+                self.shutdown_request(request)
+
+    def shutdown(self) -> None:
+        """Stop the serve_forever() loop, releasing a blocked accept."""
+        self._closing.set()
+        super().shutdown()
+
+    def server_close(self) -> None:
+        """Stop the worker threads, then close the socket and shared state."""
+        self._closing.set()
+        # Live streams and long polls would otherwise hold their workers until
+        # the join times out
+        self.state.disconnect_clients()
+        for worker in self._workers:
+            worker.join(timeout=2.0)
+        # Drop connections that never reached a worker
+        while True:
+            try:
+                request, _ = self._pending.get_nowait()
+            except queue.Empty:
+                break
+            self.shutdown_request(request)
+        super().server_close()
+
+
+def create_ssl_context(config: AppConfig) -> ssl.SSLContext:
+    """Create the server-side TLS context from the TLS configuration.
+
+    Args:
+        config: Application configuration.
+
+    Returns:
+        SSL context with the certificate chain loaded.
+
+    Raises:
+        FileNotFoundError: If the certificate or key file is missing.
+        ssl.SSLError: If the certificate or key is invalid.
+    """
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
     try:
-        conn.execute("""
-            CREATE TABLE IF NOT EXISTS users (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                username TEXT UNIQUE NOT NULL,
-                password_hash TEXT NOT NULL
-            )
-        """)
-        conn.execute("""
-            CREATE TABLE IF NOT EXISTS lora_messages (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                device_name TEXT,
-                deveui TEXT NOT NULL,
-                appeui TEXT,
-                data TEXT,
-                size INTEGER,
-                timestamp TEXT,
-                sequence_number INTEGER
-            )
-        """)
-        conn.commit()
-        logger.info("Database initialized at %s", db_path)
-    finally:
-        conn.close()
-
-
-def run_server(config: AppConfig, db_path: str) -> None:
-    """Run the HTTP server with optional TLS support."""
-    init_db(db_path)
-    handler = create_handler(config, db_path)
-    server = HTTPServer((config.server.host, config.server.port), handler)
-
-    if config.server.tls.enabled:
-        # Create SSL context for TLS
-        context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
-        try:
-            context.load_cert_chain(
-                certfile=config.server.tls.cert_file,
-                keyfile=config.server.tls.key_file,
-            )
-            server.socket = context.wrap_socket(server.socket, server_side=True)
-            logger.info("TLS enabled with cert: %s", config.server.tls.cert_file)
-        except FileNotFoundError as e:
-            logger.error("TLS certificate not found: %s", e)
-            raise
-        except ssl.SSLError as e:
-            logger.error("TLS configuration error: %s", e)
-            raise
-
+        context.load_cert_chain(
+            certfile=config.server.tls.cert_file,
+            keyfile=config.server.tls.key_file,
+        )
+    except FileNotFoundError as e:
+        logger.error("TLS certificate not found: %s", e)
+        raise
+    except ssl.SSLError as e:
+        logger.error("TLS configuration error: %s", e)
+        raise
+    logger.info("TLS enabled with cert: %s", config.server.tls.cert_file)
+    return context
+
+
+def create_server(config: AppConfig, db_path: str) -> APIServer | AsyncHTTPServer:
+    """Create the HTTP server for the configured concurrency mode.
+
+    Args:
+        config: Application configuration.
+        db_path: Path to SQLite database file.
+
+    Returns:
+        Bound HTTP server, ready for ``serve_forever()``.
+
+    Raises:
+        ValueError: If the concurrency mode is unknown.
+    """
+    init_db(
+        db_path,
+        int(config.database.dedup_window * 1000),
+        config.database.partitioning != "none",
+    )
+    handler = create_handler(config)
+    address = (config.server.host, config.server.port)
+    context = create_ssl_context(config) if config.server.tls.enabled else None
+    state = AppState(config, db_path)
+
+    if config.server.concurrency == "asyncio":
+        return AsyncHTTPServer(
+            address,
+            handler,
+            state,
+            workers=config.server.workers,
+            listen_backlog=config.server.listen_backlog,
+            ssl_context=context,
+            idle_timeout=config.server.keepalive_timeout,
+        )
+
+    if config.server.concurrency == "threads":
+        server: APIServer = PooledHTTPServer(
+            address,
+            handler,
+            state,
+            workers=config.server.workers,
+            queue_depth=config.server.queue_depth,
+            listen_backlog=config.server.listen_backlog,
+        )
+    elif config.server.concurrency == "single":
+        server = APIServer(address, handler, state)
+    else:
+        state.close()
+        raise ValueError(f"Unknown concurrency mode: {config.server.concurrency}")
+
+    if context is not None:
+        # Pooled workers do the handshake so the accept loop never blocks on it
+        server.socket = context.wrap_socket(
+            server.socket,
+            server_side=True,
+            do_handshake_on_connect=not isinstance(server, PooledHTTPServer),
+        )
+
+    return server
+
+
+def run_server(
+    config: AppConfig, db_path: str, status_writer: StatusWriter | None = None
+) -> None:
+    """Run the HTTP server with optional TLS support.
+
+    Args:
+        config: Application configuration.
+        db_path: Path to SQLite database file.
+        status_writer: Status writer to report runtime details (such as
+            retention) through, if any.
+    """
+    server = create_server(config, db_path)
+    if status_writer is not None:
+        status_writer.add_source(server.state.status_summary)
     protocol = "https" if config.server.tls.enabled else "http"
-    logger.info("Server running on %s://%s:%d", protocol, config.server.host, config.server.port)
-    server.serve_forever()
+    logger.info(
+        "Server running on %s://%s:%d (%s, %d workers)",
+        protocol,
+        config.server.host,
+        config.server.port,
+        config.server.concurrency,
+        config.server.workers if config.server.concurrency != "single" else 1,
+    )
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
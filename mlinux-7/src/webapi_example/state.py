@@ -0,0 +1,472 @@
+"""Shared application state for the HTTP front-ends."""
+
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections.abc import Iterable, Iterator, Mapping
+from typing import Any
+
+from webapi_example.broker import MessageBroker, Subscription, sse_frame
+from webapi_example.cache import Generation, ResponseCache, WriteGenerations, make_etag
+from webapi_example.database import ConnectionPool, resolve_pragmas
+from webapi_example.devices import DeviceRegistry
+from webapi_example.ingest import DuplicateFilter, GroupCommitWriter
+from webapi_example.models.config import AppConfig
+from webapi_example.mqtt import MqttListener
+from webapi_example.partitions import PartitionLayout
+from webapi_example.retention import RetentionWorker
+from webapi_example.rollups import TrafficQuery, traffic_series
+from webapi_example.storage import (
+    MessageFilter,
+    PageRequest,
+    encode_message,
+    message_chunks,
+    message_page,
+)
+
+logger = logging.getLogger(__name__)
+
+
+class AppState:
+    """Long-lived resources shared by all request handlers.
+
+    Created once per process and used by both the stdlib servers and the
+    Flask app, so they share one connection pool.
+
+    Attributes:
+        config: Application configuration.
+        db_path: Path to SQLite database file.
+        pool: Shared SQLite connection pool.
+        partitions: Time partition layout of stored messages, or None if
+            they are kept in lora_messages alone.
+        dedup: Filter dropping duplicate uplinks, or None if disabled.
+        devices: In-memory mirror of the devices table.
+        writer: Write-behind message writer, or None if messages are
+            committed by the request that ingests them.
+        generations: Write generations of the stored messages.
+        user_generations: Write generation of the users table.
+        cache: Encoded response cache, or None if disabled.
+        broker: Fan-out of committed messages to live stream clients.
+        mqtt: Uplink ingest from the MQTT broker, or None if disabled.
+        retention: Retention worker, or None if no message limit or rollup
+            age is set.
+    """
+
+    def __init__(self, config: AppConfig, db_path: str) -> None:
+        """Create the shared resources.
+
+        Args:
+            config: Application configuration.
+            db_path: Path to SQLite database file.
+
+        Raises:
+            ValueError: If the database profile or partitioning is unknown.
+        """
+        self.config = config
+        self.db_path = db_path
+        self.pool = ConnectionPool(
+            db_path,
+            size=config.database.pool_size,
+            timeout=config.database.timeout,
+            pragmas=resolve_pragmas(
+                config.database.profile, config.database.pragmas, config.database.timeout
+            ),
+        )
+        self.dedup: DuplicateFilter | None = None
+        if config.database.dedup_window > 0:
+            self.dedup = DuplicateFilter(config.database.dedup_window)
+        dedup_window_ms = self.dedup.window_ms if self.dedup is not None else 0
+        self.partitions: PartitionLayout | None = None
+        if config.database.partitioning != "none":
+            self.partitions = PartitionLayout(
+                config.database.partitioning, dedup_window_ms=dedup_window_ms
+            )
+        self.devices = DeviceRegistry()
+        self.load_devices()
+        # Held by every writer from its write transaction until
+        # messages_committed() returns, so messages are published in id order
+        self.commit_lock = threading.Lock()
+        self.generations = WriteGenerations()
+        self.user_generations = WriteGenerations()
+        self._etag_prefix = os.urandom(4).hex()
+        self.cache: ResponseCache | None = None
+        if config.server.cache.enabled:
+            self.cache = ResponseCache(config.server.cache.max_bytes)
+        stream = config.server.stream
+        self.broker = MessageBroker(
+            history=stream.history,
+            max_subscribers=stream.max_clients,
+            queue_size=stream.queue_size,
+        )
+        # Streams and waiting requests hold a worker each; together they may
+        # take all workers but one, which is left for short requests
+        self._max_held = max(config.server.workers - 1, 0)
+        self._held = 0
+        self._waiting = 0
+        self._held_lock = threading.Lock()
+        self.writer: GroupCommitWriter | None = None
+        if config.database.write_behind:
+            self.writer = GroupCommitWriter(
+                self.pool,
+                max_rows=config.database.group_commit_rows,
+                max_delay=config.database.group_commit_ms / 1000,
+                queue_size=config.database.write_queue_size,
+                on_commit=self.messages_committed,
+                layout=self.partitions,
+                dedup=self.dedup,
+                commit_lock=self.commit_lock,
+            )
+            self.writer.start()
+        self.mqtt: MqttListener | None = None
+        if config.mqtt.enabled:
+            self.mqtt = MqttListener(
+                config.mqtt,
+                GroupCommitWriter(
+                    self.pool,
+                    max_rows=config.mqtt.batch_rows,
+                    max_delay=config.mqtt.batch_ms / 1000,
+                    queue_size=config.mqtt.queue_size,
+                    on_commit=self.messages_committed,
+                    layout=self.partitions,
+                    dedup=self.dedup,
+                    commit_lock=self.commit_lock,
+                ),
+            )
+            self.mqtt.start()
+        self.retention: RetentionWorker | None = None
+        database = config.database
+        rollup_max_age = {
+            "minute": database.rollups.minute_days * 86400,
+            "hour": database.rollups.hour_days * 86400,
+            "day": database.rollups.day_days * 86400,
+        }
+        if (
+            database.max_age_days > 0
+            or database.max_rows > 0
+            or database.max_bytes > 0
+            or any(age > 0 for age in rollup_max_age.values())
+        ):
+            self.retention = RetentionWorker(
+                self.pool,
+                db_path,
+                max_age=database.max_age_days * 86400,
+                max_rows=database.max_rows,
+                max_bytes=database.max_bytes,
+                interval=database.retention_interval,
+                chunk_rows=database.retention_chunk_rows,
+                on_delete=self.generations.bump_all,
+                layout=self.partitions,
+                rollup_max_age=rollup_max_age,
+            )
+            self.retention.start()
+
+    def messages_committed(self, rows: Iterable[tuple[Any, ...]], ids: list[int]) -> None:
+        """Record committed message inserts.
+
+        Must be called after the commit by every code path that stores
+        messages, so cached responses of the affected devices go stale and
+        live stream clients receive the messages. The caller holds
+        ``commit_lock`` across the write and this call.
+
+        Args:
+            rows: INSERT_MESSAGE parameters of the committed rows.
+            ids: Id of each row.
+        """
+        rows = list(rows)
+        # Before the bump, so an ETag taken before reading is never newer than the data
+        self.devices.update(rows)
+        self.generations.bump(row[1] for row in rows)
+        self.broker.publish(rows, ids)
+
+    def load_devices(self) -> None:
+        """Fill the device mirror from the devices table.
+
+        Called at startup, and again by the Flask app's init_db().
+        """
+        try:
+            with self.pool.connection() as conn:
+                self.devices.load(conn)
+        except sqlite3.OperationalError:
+            logger.debug("Devices table not created yet; starting with no devices")
+
+    def users_changed(self) -> None:
+        """Record a committed change to the users table."""
+        self.user_generations.bump(())
+
+    def messages_etag(self, deveui: str | None = None) -> str:
+        """Return the entity tag of the message listings.
+
+        Derived from the write generation alone, so checking it needs no
+        query. Must be taken before the response is read from the
+        database, like the generation itself.
+
+        Args:
+            deveui: Device EUI for a device's listing, or None for all
+                messages.
+
+        Returns:
+            Quoted strong entity tag.
+        """
+        return make_etag(self._etag_prefix, self.generations.get(deveui))
+
+    def users_etag(self) -> str:
+        """Return the entity tag of the user listing."""
+        return make_etag(self._etag_prefix, self.user_generations.get())
+
+    def message_page(
+        self,
+        path: str,
+        page: PageRequest,
+        deveui: str | None = None,
+        where: MessageFilter | None = None,
+    ) -> bytes | None:
+        """Return the encoded body of a message page, from the cache if current.
+
+        The write generation is read before querying, so a page cached
+        while a write commits is stale at the next lookup rather than
+        served as current. A page with a wait is read without the cache
+        and, while it is empty, again after each commit of its device.
+
+        Args:
+            path: Request path, used to build the link to the next page.
+            page: Pagination parameters; stream requests must not use this.
+            deveui: Only return messages of this device, if given.
+            where: Query filters.
+
+        Returns:
+            The JSON body, or None if the device given by ``deveui`` has no
+            messages and the page has no cursor.
+
+        Raises:
+            RuntimeError: If the page must wait but no more requests may
+                wait, see wait_for_messages().
+        """
+        key = (path, deveui, where, page.limit, page.before_id, page.after_id)
+        device = deveui or (where.deveui if where else None)
+        deadline = time.monotonic() + page.wait
+        generation = self.generations.get(device)
+        if self.cache is not None and not page.wait:
+            body = self.cache.get(key, generation)
+            if body is not None:
+                return body
+
+        with self.pool.connection() as conn:
+            result = message_page(conn, path, page, deveui, self.partitions, where)
+        while not result.rows and self.wait_for_messages(device, generation, deadline):
+            generation = self.generations.get(device)
+            with self.pool.connection() as conn:
+                result = message_page(conn, path, page, deveui, self.partitions, where)
+        if deveui is not None and not result.rows and not page.has_cursor:
+            return None
+        body = result.encode()
+        if self.cache is not None:
+            self.cache.put(key, generation, body)
+        return body
+
+    def message_chunks(
+        self, page: PageRequest, deveui: str | None = None, where: MessageFilter | None = None
+    ) -> Iterator[list[tuple[Any, ...]]]:
+        """Read every message after the page's cursor, a chunk at a time.
+
+        Like ``storage.message_chunks()``, except that with a wait the
+        first chunk is read again after each commit of the device while it
+        is empty.
+
+        Args:
+            page: Cursor, direction and wait; the limit is ignored.
+            deveui: Only return messages of this device, if given.
+            where: Query filters.
+
+        Yields:
+            Lists of rows; at least one, possibly empty.
+
+        Raises:
+            RuntimeError: If the first chunk must wait but no more
+                requests may wait, see wait_for_messages().
+        """
+        device = deveui or (where.deveui if where else None)
+        deadline = time.monotonic() + page.wait
+        while True:
+            generation = self.generations.get(device)
+            chunks = message_chunks(self.pool, page, deveui, layout=self.partitions, where=where)
+            first = next(chunks)
+            if first or not self.wait_for_messages(device, generation, deadline):
+                break
+        yield first
+        yield from chunks
+
+    def wait_for_messages(
+        self, deveui: str | None, generation: Generation, deadline: float
+    ) -> bool:
+        """Block until messages of a device, or of any device, are committed.
+
+        Woken by messages_committed() rather than by polling the database;
+        the request holds its worker thread meanwhile.
+
+        Args:
+            deveui: Device EUI, or None to wait for any message.
+            generation: Generation read before the query that found nothing.
+            deadline: ``time.monotonic()`` value to give up at.
+
+        Returns:
+            True if messages were committed since ``generation``; False once
+            the deadline has passed or the server is shutting down.
+
+        Raises:
+            RuntimeError: If max_waiters requests are waiting already, or
+                live streams and waiting requests hold all workers but one.
+        """
+        timeout = deadline - time.monotonic()
+        if timeout <= 0:
+            return False
+        with self._held_lock:
+            if self._waiting >= self.config.server.max_waiters or self._held >= self._max_held:
+                raise RuntimeError("Too many requests waiting for messages")
+            self._waiting += 1
+            self._held += 1
+        try:
+            return self.generations.wait(deveui, generation, timeout) != generation
+        finally:
+            with self._held_lock:
+                self._waiting -= 1
+                self._held -= 1
+
+    def traffic(self, query: TrafficQuery) -> dict[str, Any]:
+        """Return a traffic chart, read from the rollups.
+
+        Args:
+            query: Chart parameters.
+
+        Returns:
+            Response document, see traffic_series().
+        """
+        with self.pool.connection() as conn:
+            return traffic_series(conn, query)
+
+    def subscribe(self, query: Mapping[str, str], last_event_id: str | None) -> Subscription:
+        """Open a live stream subscription for a request.
+
+        Args:
+            query: Query parameters: "deveui" to follow one device, and
+                "after_id" to start after that message id.
+            last_event_id: Last-Event-ID header of a reconnecting client;
+                takes precedence over "after_id".
+
+        Returns:
+            Subscription to pass to message_events(), and to unsubscribe()
+            once the stream ends.
+
+        Raises:
+            ValueError: If the id to resume from is not an integer.
+            RuntimeError: If the stream is disabled or has too many clients,
+                or live streams and waiting requests hold all workers but one.
+        """
+        resume = last_event_id if last_event_id else query.get("after_id")
+        try:
+            last_id = int(resume) if resume else None
+        except ValueError:
+            raise ValueError("Last-Event-ID and after_id must be message ids") from None
+        with self._held_lock:
+            if self._held >= self._max_held:
+                raise RuntimeError("Too many live stream clients")
+            self._held += 1
+        try:
+            return self.broker.subscribe(query.get("deveui") or None, last_id)
+        except BaseException:
+            with self._held_lock:
+                self._held -= 1
+            raise
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        """Close a live stream subscription, freeing its worker for others.
+
+        Args:
+            subscription: Subscription returned by subscribe().
+        """
+        self.broker.unsubscribe(subscription)
+        with self._held_lock:
+            self._held -= 1
+
+    def message_events(self, subscription: Subscription) -> Iterator[bytes]:
+        """Produce the Server-Sent Events body of a live stream.
+
+        Messages the broker's history could not resume from are read from
+        the database first; after that every message comes from the
+        broker. An idle stream gets a comment every ``stream.keepalive``
+        seconds, so a closed connection is noticed.
+
+        Args:
+            subscription: Subscription returned by subscribe().
+
+        Yields:
+            Pieces of the body, until the subscription ends.
+        """
+        keepalive = self.config.server.stream.keepalive
+        yield b": connected\n\n"
+        caught_up = 0
+        if subscription.catch_up_after is not None:
+            page = PageRequest(limit=0, after_id=subscription.catch_up_after)
+            for rows in message_chunks(
+                self.pool, page, subscription.deveui, layout=self.partitions
+            ):
+                if rows:
+                    yield b"".join([sse_frame(row[0], encode_message(row)) for row in rows])
+                    caught_up = rows[-1][0]
+        while True:
+            events = subscription.get(keepalive)
+            if events is None:
+                return
+            if not events:
+                yield b": keepalive\n\n"
+                continue
+            # Messages committed during the catch-up were already read
+            yield b"".join([event.frame for event in events if event.id > caught_up])
+
+    def stream_stats(self) -> dict[str, Any]:
+        """Return the live stream counters, for the stats endpoint."""
+        return self.broker.stats()
+
+    def cache_stats(self) -> dict[str, Any]:
+        """Return the response cache counters, for the stats endpoint."""
+        if self.cache is None:
+            return {"enabled": False}
+        return {"enabled": True, **self.cache.stats()}
+
+    def ingest_stats(self) -> dict[str, Any]:
+        """Return the deduplication, write-behind and MQTT counters, for the stats endpoint."""
+        dedup = (
+            {"enabled": False} if self.dedup is None else {"enabled": True, **self.dedup.stats()}
+        )
+        writer = (
+            {"enabled": False} if self.writer is None else {"enabled": True, **self.writer.stats()}
+        )
+        mqtt = {"enabled": False} if self.mqtt is None else {"enabled": True, **self.mqtt.stats()}
+        return {"dedup": dedup, "write_behind": writer, "mqtt": mqtt}
+
+    def status_summary(self) -> str:
+        """Return runtime details for status.json, or "" if there are none."""
+        if self.retention is None:
+            return ""
+        return self.retention.summary()
+
+    def disconnect_clients(self) -> None:
+        """End live streams and waiting requests, so shutdown need not wait for them."""
+        self.broker.close()
+        self.generations.close()
+
+    def close(self) -> None:
+        """Release all shared resources, writing out queued messages first.
+
+        Safe to call more than once.
+        """
+        self.disconnect_clients()
+        if self.mqtt is not None:
+            self.mqtt.stop()
+        if self.retention is not None:
+            self.retention.stop()
+        if self.writer is not None:
+            self.writer.stop()
+        self.pool.close()
+        logger.debug("Application state closed")
@@ -0,0 +1,640 @@
+"""Read queries over stored messages, shared by both HTTP front-ends."""
+
+import sqlite3
+from collections.abc import Iterable, Iterator, Mapping
+from dataclasses import dataclass, replace
+from functools import lru_cache
+from typing import Any
+from urllib.parse import urlencode
+
+from webapi_example.compact import format_timestamp, parse_timestamp, unpack_payload
+from webapi_example.database import (
+    MESSAGE_COLUMN_EXPRESSIONS,
+    MESSAGE_COLUMNS,
+    SELECT_DEVICE_MESSAGES,
+    SELECT_DEVICE_MESSAGES_AFTER,
+    SELECT_DEVICE_MESSAGES_BEFORE,
+    SELECT_MESSAGES,
+    SELECT_MESSAGES_AFTER,
+    SELECT_MESSAGES_BEFORE,
+    ConnectionPool,
+)
+from webapi_example.encoding import RowEncoder, encode_string
+from webapi_example.partitions import PartitionLayout, table_sql
+
+# JSON key of each column in MESSAGE_COLUMNS order
+MESSAGE_FIELDS = ("id", "deviceName", "deveui", "appeui", "data", "size", "timestamp", "sqn")
+
+MESSAGE_ENCODER = RowEncoder(MESSAGE_FIELDS)
+
+
+def _has_json_functions() -> bool:
+    """Return True if the linked SQLite library has the JSON functions.
+
+    They are built in from SQLite 3.38; older builds may omit them.
+    """
+    conn = sqlite3.connect(":memory:")
+    try:
+        conn.execute("SELECT json_object('a', 1)")
+    except sqlite3.OperationalError:
+        return False
+    finally:
+        conn.close()
+    return True
+
+
+# With JSON functions SQLite renders each message object itself, so Python
+# only receives (id, json) pairs; otherwise rows are plain column tuples for
+# MESSAGE_ENCODER. Either way the first value of a row is its id.
+JSON_IN_SQLITE = _has_json_functions()
+
+_JSON_COLUMNS = "id, json_object({})".format(
+    ", ".join(
+        f"'{field}', {column}"
+        for field, column in zip(MESSAGE_FIELDS, MESSAGE_COLUMN_EXPRESSIONS, strict=True)
+    )
+)
+
+
+def _encode_rows(rows: list[tuple[Any, ...]]) -> str:
+    """Encode fetched message rows as comma-separated JSON objects."""
+    if JSON_IN_SQLITE:
+        return ",".join([row[1] for row in rows])
+    return MESSAGE_ENCODER.encode_rows(rows)
+
+
+def encode_message(row: tuple[Any, ...]) -> str:
+    """Encode one fetched message row as a JSON object."""
+    return row[1] if JSON_IN_SQLITE else MESSAGE_ENCODER.encode(row)
+
+
+def encode_stored_message(message_id: int, row: tuple[Any, ...]) -> str:
+    """Encode a just stored message as a JSON object, without reading it back.
+
+    Renders the payload and timestamp like MESSAGE_COLUMN_EXPRESSIONS, so
+    the object has the same fields and values as in a listing.
+
+    Args:
+        message_id: Id the message was stored under.
+        row: INSERT_MESSAGE parameters of the message.
+
+    Returns:
+        JSON text of the message.
+    """
+    device_name, deveui, appeui, data, data_format, size, timestamp, sqn = row
+    if type(timestamp) is int:
+        timestamp = format_timestamp(timestamp)
+    payload = unpack_payload(data, data_format)
+    return MESSAGE_ENCODER.encode(
+        (message_id, device_name, deveui, appeui, payload, size, timestamp, sqn)
+    )
+
+
+# Page query by (filtered by device, cursor direction)
+_PAGE_QUERIES = {
+    key: sql.replace(MESSAGE_COLUMNS, _JSON_COLUMNS, 1) if JSON_IN_SQLITE else sql
+    for key, sql in {
+        (False, ""): SELECT_MESSAGES,
+        (False, "before"): SELECT_MESSAGES_BEFORE,
+        (False, "after"): SELECT_MESSAGES_AFTER,
+        (True, ""): SELECT_DEVICE_MESSAGES,
+        (True, "before"): SELECT_DEVICE_MESSAGES_BEFORE,
+        (True, "after"): SELECT_DEVICE_MESSAGES_AFTER,
+    }.items()
+}
+
+
+# Upper bound of the time range when only "since" is given; together with
+# the lower bound it excludes timestamps stored as text (they sort above
+# every integer)
+_MAX_TIMESTAMP = 2**63 - 1
+
+
+@dataclass(frozen=True)
+class MessageFilter:
+    """Query filters of a message listing.
+
+    Attributes:
+        deveui: Only messages of this device.
+        appeui: Only messages of this application.
+        since: Only messages timestamped at or after this time, epoch
+            milliseconds.
+        until: Only messages timestamped before this time, epoch
+            milliseconds.
+        min_id: Lowest id of a message in the time range, as resolved for
+            an earlier page and carried in its next link.
+        max_id: Highest id of a message in the time range when it was
+            resolved; later messages may have higher ids.
+    """
+
+    deveui: str | None = None
+    appeui: str | None = None
+    since: int | None = None
+    until: int | None = None
+    min_id: int | None = None
+    max_id: int | None = None
+
+    @classmethod
+    def from_query(cls, query: Mapping[str, str]) -> "MessageFilter":
+        """Create a MessageFilter from query parameters.
+
+        Args:
+            query: Query parameters ("deveui", "appeui", "since" and
+                "until" as ISO 8601 timestamps, and "min_id" and "max_id"
+                from a next link).
+
+        Returns:
+            MessageFilter instance; empty parameters are ignored.
+
+        Raises:
+            ValueError: If a timestamp or id is invalid.
+        """
+        return cls(
+            deveui=query.get("deveui") or None,
+            appeui=query.get("appeui") or None,
+            since=timestamp_param(query, "since"),
+            until=timestamp_param(query, "until"),
+            min_id=_int_param(query, "min_id"),
+            max_id=_int_param(query, "max_id"),
+        )
+
+    @property
+    def has_time_range(self) -> bool:
+        """True if the listing is limited to a time range."""
+        return self.since is not None or self.until is not None
+
+    @property
+    def time_params(self) -> tuple[int, int]:
+        """Start and end of the time range; open ends are widened to every timestamp."""
+        since = self.since if self.since is not None else 0
+        until = self.until if self.until is not None else _MAX_TIMESTAMP
+        return since, until
+
+    def query_params(self) -> dict[str, str]:
+        """Return the filters as query parameters, for links to further pages."""
+        params = {"deveui": self.deveui, "appeui": self.appeui}
+        if self.since is not None:
+            params["since"] = format_timestamp(self.since)
+        if self.until is not None:
+            params["until"] = format_timestamp(self.until)
+        if self.has_time_range and self.min_id is not None and self.max_id is not None:
+            params["min_id"] = str(self.min_id)
+            params["max_id"] = str(self.max_id)
+        return {name: value for name, value in params.items() if value is not None}
+
+
+def timestamp_param(query: Mapping[str, str], name: str) -> int | None:
+    """Parse an optional ISO 8601 query parameter to epoch milliseconds.
+
+    Args:
+        query: Query parameters.
+        name: Parameter name.
+
+    Returns:
+        Epoch milliseconds, or None if the parameter is absent or empty.
+
+    Raises:
+        ValueError: If the value is not a valid timestamp.
+    """
+    value = query.get(name)
+    if not value:
+        return None
+    try:
+        return parse_timestamp(value)
+    except ValueError:
+        raise ValueError(f"{name} must be an ISO 8601 timestamp") from None
+
+
+@lru_cache(maxsize=64)
+def _filter_sql(deveui: bool, appeui: bool, time_range: bool, direction: str) -> str:
+    """Build the page query of a filtered listing.
+
+    The statement leaves the planner one index to drive it: the device
+    EUI, or failing that the application EUI, is the leading equality of
+    the (deveui, id) or (appeui, id) index, which yields the page in id
+    order without sorting; other terms are prefixed with unary "+", which
+    keeps SQLite from using an index for them. A time range bounds the id
+    range walked by the lowest and highest id in range, see
+    resolve_id_range(); messages arrive roughly in time order, so few rows
+    in those bounds fall outside the range. tests/test_storage.py checks
+    every plan.
+
+    Args:
+        deveui: Filter by device EUI.
+        appeui: Filter by application EUI.
+        time_range: Filter by timestamp range.
+        direction: "before", "after" or "" (newest first) cursor direction.
+
+    Returns:
+        Statement whose parameters are, in order: the device EUI, the
+        application EUI, the lowest and highest id in range, the range
+        start and end, the cursor and the limit, each if used.
+    """
+    terms = []
+    if deveui:
+        terms.append("deveui = ?")
+    if appeui:
+        terms.append("+appeui = ?" if deveui else "appeui = ?")
+    if time_range:
+        terms.append("id BETWEEN ? AND ?")
+        terms.append("+timestamp >= ? AND +timestamp < ?")
+    if direction:
+        terms.append(f"id {'<' if direction == 'before' else '>'} ?")
+    return f"""
+        SELECT {MESSAGE_COLUMNS}
+        FROM lora_messages WHERE {" AND ".join(terms)}
+        ORDER BY id {"ASC" if direction == "after" else "DESC"} LIMIT ?
+    """
+
+
+def filter_query(
+    where: MessageFilter, direction: str = "", cursor: int | None = None
+) -> tuple[str, tuple[Any, ...]]:
+    """Return the page query of a listing and its parameters, without the limit.
+
+    Listings filtered by device alone, or not at all, use the fixed page
+    statements; any other filter uses the statement built by _filter_sql().
+
+    Args:
+        where: Listing filters; with a time range, ``min_id`` and ``max_id``
+            must be set, see resolve_id_range().
+        direction: "before", "after" or "" (newest first).
+        cursor: Message id the page continues from, for a direction.
+
+    Returns:
+        The statement, with the limit as its last parameter, and the other
+        parameters in order.
+    """
+    if where.appeui is None and not where.has_time_range:
+        sql = _PAGE_QUERIES[where.deveui is not None, direction]
+    else:
+        sql = _filter_sql(
+            where.deveui is not None, where.appeui is not None, where.has_time_range, direction
+        )
+        if JSON_IN_SQLITE:
+            sql = sql.replace(MESSAGE_COLUMNS, _JSON_COLUMNS, 1)
+    params: tuple[Any, ...] = tuple(
+        value for value in (where.deveui, where.appeui) if value is not None
+    )
+    if where.has_time_range:
+        params += (where.min_id, where.max_id) + where.time_params
+    if cursor is not None:
+        params += (cursor,)
+    return sql, params
+
+
+_ID_RANGE_SQL = "SELECT min(id), max(id) FROM lora_messages WHERE timestamp >= ? AND timestamp < ?"
+
+
+def resolve_id_range(
+    conn: sqlite3.Connection,
+    where: MessageFilter,
+    after_id: int | None = None,
+    layout: PartitionLayout | None = None,
+) -> MessageFilter:
+    """Set the lowest and highest id of a filter's time range.
+
+    Finding them reads every timestamp index entry in the range, so they
+    are resolved for the first page only and carried in the next links.
+    Partitions whose catalogued timestamps lie outside the range are
+    skipped.
+    Bounds from an earlier page stay valid, as new messages only get
+    higher ids, except above ``max_id``: a page after an id at or beyond
+    it resolves them again, so messages stored since are found.
+
+    Args:
+        conn: Database connection.
+        where: Listing filters.
+        after_id: Cursor of a page of newer messages, if it is one.
+        layout: Partition layout, or None to read lora_messages.
+
+    Returns:
+        The filter with ``min_id`` and ``max_id`` set if it has a time
+        range; both are 0 if no message is in range.
+    """
+    if not where.has_time_range:
+        return where
+    if (
+        where.min_id is not None
+        and where.max_id is not None
+        and (after_id is None or after_id < where.max_id)
+    ):
+        return where
+    lows, highs = [], []
+    # Read the partitions in one snapshot, as retention may drop one meanwhile
+    own_transaction = layout is not None and not conn.in_transaction
+    if own_transaction:
+        conn.execute("BEGIN")
+    try:
+        tables = ["lora_messages"]
+        if layout is not None:
+            tables = [
+                partition.name
+                for partition in layout.partitions(conn)
+                if partition.overlaps(*where.time_params)
+            ]
+        for table in tables:
+            low, high = conn.execute(
+                table_sql(_ID_RANGE_SQL, table), where.time_params
+            ).fetchone()
+            if low is not None:
+                lows.append(low)
+                highs.append(high)
+    finally:
+        if own_transaction:
+            conn.commit()
+    if not lows:
+        return replace(where, min_id=0, max_id=0)
+    return replace(where, min_id=min(lows), max_id=max(highs))
+
+
+@dataclass
+class PageRequest:
+    """Keyset pagination parameters of a message listing.
+
+    Attributes:
+        limit: Most messages returned; 0 requests every matching message
+            as a stream.
+        before_id: Return messages older than this id, newest first.
+        after_id: Return messages newer than this id, oldest first.
+        wait: Seconds to wait for messages after ``after_id`` when there
+            are none yet; 0 answers at once.
+    """
+
+    limit: int
+    before_id: int | None = None
+    after_id: int | None = None
+    wait: float = 0.0
+
+    @classmethod
+    def from_query(
+        cls, query: Mapping[str, str], default_size: int, max_size: int, max_wait: float = 0.0
+    ) -> "PageRequest":
+        """Create a PageRequest from query parameters.
+
+        Args:
+            query: Query parameters ("limit", "before_id", "after_id", "wait").
+            default_size: Limit used when none is given.
+            max_size: Largest limit allowed; larger values are capped.
+            max_wait: Longest wait allowed; longer waits are capped.
+
+        Returns:
+            PageRequest instance.
+
+        Raises:
+            ValueError: If a parameter is not a valid number, the limit or
+                wait is negative, both cursors are given or a wait is given
+                without after_id.
+        """
+        limit = _int_param(query, "limit")
+        page = cls(
+            limit=min(limit if limit is not None else default_size, max_size),
+            before_id=_int_param(query, "before_id"),
+            after_id=_int_param(query, "after_id"),
+        )
+        if page.limit < 0:
+            raise ValueError("limit must not be negative")
+        if page.before_id is not None and page.after_id is not None:
+            raise ValueError("before_id and after_id are mutually exclusive")
+        wait = query.get("wait")
+        if wait:
+            try:
+                seconds = float(wait)
+            except ValueError:
+                raise ValueError("wait must be a number of seconds") from None
+            if not seconds >= 0:
+                raise ValueError("wait must not be negative")
+            if page.after_id is None:
+                raise ValueError("wait requires after_id")
+            page.wait = min(seconds, max_wait)
+        return page
+
+    @property
+    def stream(self) -> bool:
+        """True if every matching message is requested at once."""
+        return self.limit == 0
+
+    @property
+    def has_cursor(self) -> bool:
+        """True if the page continues from a cursor."""
+        return self.before_id is not None or self.after_id is not None
+
+
+def _int_param(query: Mapping[str, str], name: str) -> int | None:
+    """Parse an optional integer query parameter."""
+    value = query.get(name)
+    if value is None or value == "":
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        raise ValueError(f"{name} must be an integer") from None
+
+
+@dataclass
+class MessagePage:
+    """One page of a message listing.
+
+    Attributes:
+        rows: Fetched rows, each starting with the message id.
+        next: Link to the following page, if any.
+    """
+
+    rows: list[tuple[Any, ...]]
+    next: str | None = None
+
+    def encode(self) -> bytes:
+        """Encode the page as the JSON response body."""
+        body = '{"messages":[' + _encode_rows(self.rows) + "]"
+        if self.next is not None:
+            body += ',"next":' + encode_string(self.next)
+        return (body + "}").encode()
+
+
+def _fetch(
+    conn: sqlite3.Connection,
+    limit: int,
+    before_id: int | None,
+    after_id: int | None,
+    where: MessageFilter,
+    layout: PartitionLayout | None = None,
+) -> list[tuple[Any, ...]]:
+    """Run the page query matching the cursor and filters.
+
+    Rows are returned as plain tuples, see JSON_IN_SQLITE.
+    """
+    if after_id is not None:
+        direction, cursor = "after", after_id
+    elif before_id is not None:
+        direction, cursor = "before", before_id
+    else:
+        direction, cursor = "", None
+    sql, params = filter_query(where, direction, cursor)
+    params += (limit,)
+    cur = conn.cursor()
+    cur.row_factory = None
+    try:
+        if layout is None:
+            return cur.execute(sql, params).fetchall()
+        return _fetch_partitions(cur, layout, sql, params, before_id, after_id)
+    finally:
+        cur.close()
+
+
+def _fetch_partitions(
+    cur: sqlite3.Cursor,
+    layout: PartitionLayout,
+    sql: str,
+    params: tuple[Any, ...],
+    before_id: int | None,
+    after_id: int | None,
+) -> list[tuple[Any, ...]]:
+    """Run a page query over the partitions, in page order, until the page is full.
+
+    Partitions wholly outside the cursor's id range are skipped. The
+    partitions are read in one snapshot, so retention dropping one
+    meanwhile cannot break the page.
+    """
+    own_transaction = not cur.connection.in_transaction
+    if own_transaction:
+        cur.execute("BEGIN")
+    try:
+        partitions = layout.partitions(cur.connection)
+        if after_id is not None:
+            # Partition i holds the ids below partition i + 1's first_id
+            tables = [
+                partition.name
+                for partition, following in zip(partitions, partitions[1:] + [None], strict=True)
+                if following is None or following.first_id > after_id + 1
+            ]
+        else:
+            tables = [
+                partition.name
+                for partition in reversed(partitions)
+                if before_id is None or partition.first_id < before_id
+            ]
+        limit = params[-1]
+        rows: list[tuple[Any, ...]] = []
+        for table in tables:
+            rows += cur.execute(
+                table_sql(sql, table), params[:-1] + (limit - len(rows),)
+            ).fetchall()
+            if len(rows) >= limit:
+                break
+        return rows
+    finally:
+        if own_transaction:
+            cur.connection.commit()
+
+
+def _filters(deveui: str | None, where: MessageFilter | None) -> MessageFilter:
+    """Combine a device EUI taken from the path with query filters."""
+    where = where or MessageFilter()
+    return replace(where, deveui=deveui) if deveui is not None else where
+
+
+def message_page(
+    conn: sqlite3.Connection,
+    path: str,
+    page: PageRequest,
+    deveui: str | None = None,
+    layout: PartitionLayout | None = None,
+    where: MessageFilter | None = None,
+) -> MessagePage:
+    """Fetch one page of messages using keyset pagination.
+
+    Only ``page.limit + 1`` rows are read, whatever the size of the table,
+    and each page is an index range scan rather than an OFFSET skip. The
+    first page of a time range also reads the timestamp index entries of
+    the range, see resolve_id_range().
+
+    Args:
+        conn: Database connection.
+        path: Request path, used to build the link to the next page.
+        page: Pagination parameters.
+        deveui: Only return messages of this device, if given; overrides
+            the device filter of ``where``.
+        layout: Partition layout, or None to read lora_messages.
+        where: Query filters, repeated in the link to the next page.
+
+    Returns:
+        The page, with a "next" link when there is more to read. Pages
+        after ``after_id`` always link onwards, so clients can keep
+        following new messages.
+    """
+    resolved = resolve_id_range(conn, _filters(deveui, where), page.after_id, layout)
+    rows = _fetch(conn, page.limit + 1, page.before_id, page.after_id, resolved, layout)
+    has_more = len(rows) > page.limit
+    result = MessagePage(rows[: page.limit])
+
+    params: dict[str, str] = {}
+    if where is not None:
+        params = replace(where, min_id=resolved.min_id, max_id=resolved.max_id).query_params()
+    if page.after_id is not None:
+        last = result.rows[-1][0] if result.rows else page.after_id
+        result.next = f"{path}?{urlencode({**params, 'limit': page.limit, 'after_id': last})}"
+    elif has_more:
+        last = result.rows[-1][0]
+        result.next = f"{path}?{urlencode({**params, 'limit': page.limit, 'before_id': last})}"
+    return result
+
+
+def message_chunks(
+    pool: ConnectionPool,
+    page: PageRequest,
+    deveui: str | None = None,
+    chunk_size: int = 500,
+    layout: PartitionLayout | None = None,
+    where: MessageFilter | None = None,
+) -> Iterator[list[tuple[Any, ...]]]:
+    """Read every message after the page's cursor, a chunk at a time.
+
+    Each chunk is its own keyset query on a briefly borrowed connection, so
+    a slow reader neither holds a pooled connection nor keeps a read
+    transaction open between chunks, and memory stays at one chunk.
+
+    Args:
+        pool: Connection pool.
+        page: Cursor and direction; the limit is ignored.
+        deveui: Only return messages of this device, if given; overrides
+            the device filter of ``where``.
+        chunk_size: Rows read per query.
+        layout: Partition layout, or None to read lora_messages.
+        where: Query filters.
+
+    Yields:
+        Lists of up to ``chunk_size`` rows, in page order. The first chunk
+        is yielded even when empty.
+    """
+    where = _filters(deveui, where)
+    before_id, after_id = page.before_id, page.after_id
+    while True:
+        with pool.connection() as conn:
+            where = resolve_id_range(conn, where, after_id, layout)
+            rows = _fetch(conn, chunk_size, before_id, after_id, where, layout)
+        yield rows
+        if len(rows) < chunk_size:
+            return
+        if after_id is not None:
+            after_id = rows[-1][0]
+        else:
+            before_id = rows[-1][0]
+
+
+def message_stream(chunks: Iterable[list[tuple[Any, ...]]]) -> Iterator[bytes]:
+    """Encode a ``{"messages": [...]}`` document incrementally.
+
+    Args:
+        chunks: Lists of rows, as yielded by message_chunks().
+
+    Yields:
+        UTF-8 encoded pieces of the document, one per non-empty chunk plus
+        the opening and closing brackets.
+    """
+    yield b'{"messages":['
+    separator = ""
+    for rows in chunks:
+        if rows:
+            yield (separator + _encode_rows(rows)).encode()
+            separator = ","
+    yield b"]}"
@@ -5,6 +5,7 @@ import logging
 import os
 import threading
 from datetime import datetime
+from typing import Callable
 
 logger = logging.getLogger(__name__)
 
@@ -37,6 +38,7 @@ class StatusWriter:
         self._thread: threading.Thread | None = None
         self._lock = threading.Lock()
         self._status_info = "Starting..."
+        self._sources: list[Callable[[], str]] = []
 
     def start(self) -> None:
         """Start background status update thread."""
@@ -63,11 +65,25 @@ class StatusWriter:
         with self._lock:
             self._status_info = info
 
+    def add_source(self, source: Callable[[], str]) -> None:
+        """Append details to every periodic status update.
+
+        Args:
+            source: Returns the current details, or "" to add nothing.
+                Called from the status thread.
+        """
+        with self._lock:
+            self._sources.append(source)
+
     def _update_loop(self) -> None:
         """Background loop to periodically write status."""
         while self._running:
             with self._lock:
                 info = self._status_info
+                sources = list(self._sources)
+            details = [text for text in (source() for source in sources) if text]
+            if details:
+                info = " | ".join([info, *details])
             timestamp = datetime.now().strftime("%H:%M:%S")
             self._write_status(f"{info} @ {timestamp}")
             # Use Event.wait for interruptible sleep
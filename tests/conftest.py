@@ -3,6 +3,8 @@
 import os
 import sys
 import tempfile
+import threading
+from pathlib import Path
 from typing import TYPE_CHECKING, Generator
 
 import pytest
@@ -10,8 +12,10 @@ import pytest
 # Add mlinux-7 source to path for testing
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "mlinux-7", "src"))
 
+from webapi_example import database
 from webapi_example.app import create_app, init_db
 from webapi_example.models.config import AppConfig, DatabaseConfig, LogConfig, ServerConfig
+from webapi_example.server import create_server
 
 if TYPE_CHECKING:
     from flask import Flask
@@ -42,6 +46,7 @@ def app(app_config: AppConfig) -> Generator["Flask", None, None]:
         yield app
         
         # Cleanup
+        app.extensions["state"].close()
         if "APP_DIR" in os.environ:
             del os.environ["APP_DIR"]
 
@@ -50,3 +55,54 @@ def app(app_config: AppConfig) -> Generator["Flask", None, None]:
 def client(app: "Flask") -> "FlaskClient":
     """Create test client."""
     return app.test_client()
+
+
+@pytest.fixture
+def dedup_window_ms() -> int:
+    """Return the deduplication window of the test database; override to enable it."""
+    return 0
+
+
+@pytest.fixture
+def db_path(tmp_path: Path, dedup_window_ms: int) -> str:
+    """Create an initialized database and return its path."""
+    path = str(tmp_path / "test.db")
+    database.init_db(path, dedup_window_ms=dedup_window_ms)
+    return path
+
+
+@pytest.fixture
+def pool(db_path: str) -> Generator[database.ConnectionPool, None, None]:
+    """Create a connection pool on the test database."""
+    pool = database.ConnectionPool(db_path)
+    yield pool
+    pool.close()
+
+
+@pytest.fixture
+def server_config() -> AppConfig:
+    """Create configuration for the stdlib HTTP server on an ephemeral port."""
+    return AppConfig(
+        server=ServerConfig(host="127.0.0.1", port=0, workers=2, queue_depth=4),
+        database=DatabaseConfig(path="test.db"),
+        log=LogConfig(level="DEBUG", use_syslog=False),
+    )
+
+
+@pytest.fixture
+def api_server(server_config: AppConfig) -> Generator[tuple[str, int], None, None]:
+    """Run the stdlib HTTP server in a background thread.
+
+    Yields:
+        (host, port) the server is listening on.
+    """
+    with tempfile.TemporaryDirectory() as tmpdir:
+        server = create_server(server_config, os.path.join(tmpdir, "test.db"))
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+
+        yield server.server_address[0], server.server_address[1]
+
+        server.shutdown()
+        server.server_close()
+        thread.join(timeout=5.0)
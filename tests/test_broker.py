@@ -0,0 +1,120 @@
+"""Tests for the live message broker."""
+
+import json
+from typing import Any
+
+import pytest
+from webapi_example.broker import MessageBroker, MessageEvent
+from webapi_example.database import ConnectionPool
+from webapi_example.ingest import message_row, write_messages
+from webapi_example.storage import PageRequest, message_page
+
+
+def row(deveui: str = "a", sqn: int = 1) -> tuple[Any, ...]:
+    """Return INSERT_MESSAGE parameters of a message."""
+    return message_row(
+        {"deveui": deveui, "sqn": sqn, "data": "00ff", "timestamp": "2024-01-15T10:00:00Z"}
+    )
+
+
+def event_ids(events: list[MessageEvent] | None) -> list[int]:
+    """Return the ids of received events."""
+    assert events is not None
+    return [event.id for event in events]
+
+
+class TestMessageBroker:
+    """Tests for MessageBroker."""
+
+    def test_fan_out(self) -> None:
+        """Test that every subscription gets the events of its devices."""
+        broker = MessageBroker()
+        everything = broker.subscribe()
+        device_b = broker.subscribe("b")
+        broker.publish([row("a"), row("b"), row("a", 2)], [1, 2, 3])
+        assert event_ids(everything.get(0)) == [1, 2, 3]
+        assert event_ids(device_b.get(0)) == [2]
+        assert device_b.get(0) == []
+
+    def test_frame(self) -> None:
+        """Test that an event is a Server-Sent Events frame with the message id."""
+        broker = MessageBroker()
+        subscription = broker.subscribe()
+        broker.publish([row()], [7])
+        events = subscription.get(0)
+        assert events is not None
+        head, data = events[0].frame.decode().removesuffix("\n\n").split("\n")
+        assert head == "id: 7"
+        assert json.loads(data.removeprefix("data: "))["data"] == "00ff"
+
+    def test_slow_subscriber_dropped(self) -> None:
+        """Test that a subscription whose queue overflows is ended."""
+        broker = MessageBroker(max_subscribers=2, queue_size=2)
+        slow = broker.subscribe()
+        broker.publish([row(), row()], [1, 2])
+        fast = broker.subscribe()
+        broker.publish([row()], [3])
+        assert slow.get(0) is None
+        assert event_ids(fast.get(0)) == [3]
+        assert broker.stats()["clients"] == 1
+        assert broker.stats()["dropped"] == 1
+
+    def test_resume_from_history(self) -> None:
+        """Test that events after the client's last id are replayed from memory."""
+        broker = MessageBroker(history=3)
+        broker.publish([row("a", sqn) for sqn in range(5)], [1, 2, 3, 4, 5])
+        subscription = broker.subscribe(last_id=3)
+        assert subscription.catch_up_after is None
+        assert event_ids(subscription.get(0)) == [4, 5]
+        broker.publish([row("b")], [6])
+        assert event_ids(broker.subscribe("b", last_id=4).get(0)) == [6]
+
+    def test_resume_beyond_history(self) -> None:
+        """Test that a client further behind than the history must catch up elsewhere."""
+        broker = MessageBroker(history=3)
+        broker.publish([row("a", sqn) for sqn in range(5)], [1, 2, 3, 4, 5])
+        subscription = broker.subscribe(last_id=1)
+        assert subscription.catch_up_after == 1
+        assert subscription.get(0) == []
+
+    def test_client_limit(self) -> None:
+        """Test that subscriptions beyond max_subscribers are refused."""
+        broker = MessageBroker(max_subscribers=1)
+        first = broker.subscribe()
+        with pytest.raises(RuntimeError):
+            broker.subscribe()
+        broker.unsubscribe(first)
+        broker.subscribe()
+        with pytest.raises(RuntimeError):
+            MessageBroker(max_subscribers=0).subscribe()
+
+    def test_close(self) -> None:
+        """Test that closing ends every subscription and refuses new ones."""
+        broker = MessageBroker()
+        subscription = broker.subscribe()
+        broker.close()
+        assert subscription.get(5) is None
+        with pytest.raises(RuntimeError):
+            broker.subscribe()
+
+
+class TestEncodedMessages:
+    """Tests for the encoding of published messages."""
+
+    def test_matches_listing(self, pool: ConnectionPool) -> None:
+        """Test that a published message is the object the listing returns."""
+        rows = [
+            message_row({"deveui": "a", "deviceName": "s", "data": "SGVsbG8=", "size": 5}),
+            message_row({"deveui": "b", "data": "00FF", "timestamp": "2024-01-15T10:00:00Z"}),
+            message_row({"deveui": "c", "data": "plain text", "appeui": "x", "sqn": 3}),
+        ]
+        broker = MessageBroker()
+        subscription = broker.subscribe()
+        with pool.connection() as conn:
+            stored, ids, _ = write_messages(conn, rows)
+            listing = json.loads(message_page(conn, "/messages", PageRequest(10)).encode())
+        broker.publish(stored, ids)
+        events = subscription.get(0)
+        assert events is not None
+        published = [json.loads(event.frame.split(b"data: ")[1]) for event in events]
+        assert published == listing["messages"][::-1]
@@ -0,0 +1,115 @@
+"""Tests for write generations and the response cache."""
+
+import threading
+import time
+
+import pytest
+from webapi_example.cache import ResponseCache, WriteGenerations, etag_matches, make_etag
+
+
+class TestWriteGenerations:
+    """Tests for WriteGenerations."""
+
+    def test_bump_devices(self) -> None:
+        """Test that a bump changes the global and the touched devices only."""
+        generations = WriteGenerations()
+        before = (generations.get(), generations.get("a"), generations.get("b"))
+        generations.bump(["a", "a"])
+        assert generations.get() != before[0]
+        assert generations.get("a") == (0, 1)
+        assert generations.get("b") == before[2]
+
+    def test_bump_all(self) -> None:
+        """Test that a bulk change invalidates every device."""
+        generations = WriteGenerations()
+        generations.bump(["a"])
+        device, other = generations.get("a"), generations.get("b")
+        generations.bump_all()
+        assert generations.get("a") != device
+        assert generations.get("b") != other
+
+    def test_wait(self) -> None:
+        """Test that a wait ends when the device's generation moves on."""
+        generations = WriteGenerations()
+        seen = generations.get("a")
+        threading.Timer(0.05, generations.bump, [["b"]]).start()
+        threading.Timer(0.1, generations.bump, [["a"]]).start()
+        assert generations.wait("a", seen, 5) == (0, 1)
+        assert generations.wait("a", (0, 1), 0.01) == (0, 1)
+
+    def test_close_ends_waits(self) -> None:
+        """Test that closing wakes waiters and makes later waits return at once."""
+        generations = WriteGenerations()
+        threading.Timer(0.05, generations.close).start()
+        started = time.monotonic()
+        assert generations.wait(None, generations.get(), 5) == (0, 0)
+        assert generations.wait(None, generations.get(), 5) == (0, 0)
+        assert time.monotonic() - started < 1
+
+
+class TestResponseCache:
+    """Tests for ResponseCache."""
+
+    def test_hit_and_miss(self) -> None:
+        """Test that a stored body is returned for the same generation."""
+        cache = ResponseCache(1000)
+        assert cache.get("k", (0, 0)) is None
+        cache.put("k", (0, 0), b"body")
+        assert cache.get("k", (0, 0)) == b"body"
+        stats = cache.stats()
+        assert (stats["hits"], stats["misses"], stats["hit_ratio"]) == (1, 1, 0.5)
+
+    def test_stale_generation(self) -> None:
+        """Test that an entry from an older generation is dropped."""
+        cache = ResponseCache(1000)
+        cache.put("k", (0, 0), b"body")
+        assert cache.get("k", (0, 1)) is None
+        stats = cache.stats()
+        assert (stats["entries"], stats["bytes"], stats["invalidations"]) == (0, 0, 1)
+
+    def test_evicts_least_recently_used(self) -> None:
+        """Test that the byte limit evicts the least recently used entry."""
+        cache = ResponseCache(400)
+        cache.put("a", (0, 0), b"x" * 100)
+        cache.put("b", (0, 0), b"x" * 100)
+        cache.put("c", (0, 0), b"x" * 100)
+        cache.get("a", (0, 0))
+        cache.put("d", (0, 0), b"x" * 100)
+        cache.put("e", (0, 0), b"x" * 100)
+        assert cache.get("b", (0, 0)) is None
+        assert cache.get("a", (0, 0)) is not None
+        stats = cache.stats()
+        assert stats["bytes"] <= 400
+        assert stats["evictions"] == 1
+
+    def test_large_body_not_stored(self) -> None:
+        """Test that a body over a quarter of the cache is not stored."""
+        cache = ResponseCache(400)
+        cache.put("k", (0, 0), b"x" * 101)
+        assert cache.stats()["entries"] == 0
+
+
+class TestEtags:
+    """Tests for entity tags."""
+
+    def test_make_etag(self) -> None:
+        """Test that tags are quoted and change with the generation."""
+        assert make_etag("ab12", (0, 3)) == '"ab12-0-3"'
+        assert make_etag("ab12", (0, 3)) != make_etag("ab12", (1, 3))
+
+    @pytest.mark.parametrize(
+        "header, matches",
+        [
+            (None, False),
+            ("", False),
+            ('"ab12-0-3"', True),
+            ('W/"ab12-0-3"', True),
+            ('"x", "ab12-0-3"', True),
+            ("*", True),
+            ('"ab12-0-2"', False),
+            ("ab12-0-3", False),
+        ],
+    )
+    def test_etag_matches(self, header: str | None, matches: bool) -> None:
+        """Test If-None-Match parsing."""
+        assert etag_matches(header, '"ab12-0-3"') is matches
@@ -0,0 +1,87 @@
+"""Tests for the compact payload and timestamp representation."""
+
+import sqlite3
+
+import pytest
+from webapi_example.compact import (
+    PAYLOAD_BASE64,
+    PAYLOAD_HEX,
+    PAYLOAD_HEX_UPPER,
+    PAYLOAD_SQL,
+    PAYLOAD_TEXT,
+    TIMESTAMP_SQL,
+    format_timestamp,
+    pack_payload,
+    parse_timestamp,
+    unpack_payload,
+)
+from webapi_example.database import register_functions
+
+
+class TestPayload:
+    """Tests for pack_payload() and unpack_payload()."""
+
+    @pytest.mark.parametrize(
+        ("text", "value", "data_format"),
+        [
+            ("SGVsbG8=", b"Hello", PAYLOAD_BASE64),
+            ("deadbeef", b"\xde\xad\xbe\xef", PAYLOAD_HEX),
+            ("DEADBEEF", b"\xde\xad\xbe\xef", PAYLOAD_HEX_UPPER),
+            ("0123", b"\x01\x23", PAYLOAD_HEX),
+            ("DeadBeef", b"\r\xe6\x9d\x05\xe7\x9f", PAYLOAD_BASE64),
+            ("SGVsbG9=", "SGVsbG9=", PAYLOAD_TEXT),
+            ("hello world", "hello world", PAYLOAD_TEXT),
+            ("", "", PAYLOAD_TEXT),
+            (None, None, None),
+        ],
+    )
+    def test_round_trip(self, text: str | None, value: object, data_format: int | None) -> None:
+        """Test that payloads pack to the expected form and unpack unchanged."""
+        assert pack_payload(text) == (value, data_format)
+        assert unpack_payload(value, data_format) == text  # type: ignore[arg-type]
+
+    def test_sql_matches_python(self) -> None:
+        """Test that PAYLOAD_SQL renders stored payloads like unpack_payload()."""
+        conn = sqlite3.connect(":memory:")
+        register_functions(conn)
+        try:
+            for text in ("SGVsbG8=", "deadbeef", "DEADBEEF", "plain", "", None):
+                data, data_format = pack_payload(text)
+                sql = f"SELECT {PAYLOAD_SQL} FROM (SELECT ? AS data, ? AS data_format)"
+                assert conn.execute(sql, (data, data_format)).fetchone()[0] == text
+        finally:
+            conn.close()
+
+
+class TestTimestamp:
+    """Tests for parse_timestamp() and format_timestamp()."""
+
+    @pytest.mark.parametrize(
+        ("text", "ms"),
+        [
+            ("1970-01-01T00:00:00Z", 0),
+            ("2024-01-15T10:00:00.123456Z", 1705312800123),
+            ("2024-01-15T10:00:00", 1705312800000),
+            ("2024-01-15T12:00:00.5+02:00", 1705312800500),
+        ],
+    )
+    def test_parse(self, text: str, ms: int) -> None:
+        """Test parsing ISO 8601 timestamps, naive ones as UTC."""
+        assert parse_timestamp(text) == ms
+
+    @pytest.mark.parametrize("text", ["", "yesterday", "1969-12-31T23:59:59Z", 1705312800])
+    def test_invalid(self, text: object) -> None:
+        """Test that invalid or pre-1970 timestamps raise ValueError."""
+        with pytest.raises(ValueError):
+            parse_timestamp(text)  # type: ignore[arg-type]
+
+    @pytest.mark.parametrize("ms", [0, 999, 1705312800123, 253402300799999])
+    def test_sql_matches_python(self, ms: int) -> None:
+        """Test that TIMESTAMP_SQL renders like format_timestamp()."""
+        conn = sqlite3.connect(":memory:")
+        try:
+            sql = f"SELECT {TIMESTAMP_SQL} FROM (SELECT ? AS timestamp)"
+            assert conn.execute(sql, (ms,)).fetchone()[0] == format_timestamp(ms)
+        finally:
+            conn.close()
+        assert parse_timestamp(format_timestamp(ms)) == ms
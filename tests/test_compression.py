@@ -0,0 +1,65 @@
+"""Tests for negotiated response compression."""
+
+import gzip
+import zlib
+
+import pytest
+from webapi_example.compression import (
+    body_slices,
+    choose_encoding,
+    compress_chunks,
+    encoded_etag,
+)
+
+BODY = b'{"messages": [' + b", ".join([b'{"deveui": "0011223344556677"}'] * 5000) + b"]}"
+
+
+class TestChooseEncoding:
+    """Tests for Accept-Encoding negotiation."""
+
+    @pytest.mark.parametrize(
+        "header, expected",
+        [
+            (None, None),
+            ("", None),
+            ("gzip", "gzip"),
+            ("deflate", "deflate"),
+            ("br, deflate, gzip", "gzip"),
+            ("gzip;q=0.5, deflate", "deflate"),
+            ("GZIP", "gzip"),
+            ("gzip;q=0", None),
+            ("*", "gzip"),
+            ("*;q=0, deflate", "deflate"),
+            ("identity", None),
+            ("gzip;q=x", None),
+        ],
+    )
+    def test_choose_encoding(self, header: str | None, expected: str | None) -> None:
+        """Test that the client's best supported coding is chosen."""
+        assert choose_encoding(header) == expected
+
+
+class TestCompressChunks:
+    """Tests for incremental compression."""
+
+    def test_gzip_round_trip(self) -> None:
+        """Test that gzip output decodes to the body."""
+        data = b"".join(compress_chunks(body_slices(BODY), "gzip"))
+        assert gzip.decompress(data) == BODY
+        assert len(data) < len(BODY) // 20
+
+    def test_deflate_round_trip(self) -> None:
+        """Test that deflate output uses the zlib format."""
+        data = b"".join(compress_chunks([BODY[:100], BODY[100:]], "deflate", level=1))
+        assert zlib.decompress(data) == BODY
+
+    def test_flush_makes_each_piece_decodable(self) -> None:
+        """Test that flushed pieces decode without waiting for the end."""
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        pieces = compress_chunks([b"first", b"second"], "gzip", flush=True)
+        assert decompressor.decompress(next(pieces)) == b"first"
+        assert decompressor.decompress(next(pieces)) == b"second"
+
+    def test_encoded_etag(self) -> None:
+        """Test that compressed variants get their own tag."""
+        assert encoded_etag('"ab12-0-3"', "gzip") == '"ab12-0-3-gzip"'
@@ -0,0 +1,410 @@
+"""Tests for database helpers."""
+
+import os
+import sqlite3
+import sys
+import threading
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "mlinux-7", "src"))
+
+from webapi_example.database import (
+    MIGRATIONS,
+    SCHEMA_VERSION,
+    SELECT_DEVICE_MESSAGES,
+    SELECT_DEVICE_MESSAGES_AFTER,
+    SELECT_DEVICE_MESSAGES_BEFORE,
+    SELECT_MESSAGES,
+    ConnectionPool,
+    dedup_index_sql,
+    init_db,
+    register_functions,
+    resolve_pragmas,
+)
+
+
+class TestConnectionPool:
+    """Tests for ConnectionPool."""
+
+    def test_reuses_connections(self, db_path: str) -> None:
+        """Test that a released connection is handed out again."""
+        pool = ConnectionPool(db_path, size=2)
+        with pool.connection() as first:
+            pass
+        with pool.connection() as second:
+            assert second is first
+        pool.close()
+
+    def test_bounded(self, db_path: str) -> None:
+        """Test that acquire() times out when all connections are in use."""
+        pool = ConnectionPool(db_path, size=1, timeout=0.1)
+        conn = pool.acquire()
+        with pytest.raises(TimeoutError):
+            pool.acquire()
+        pool.release(conn)
+        pool.close()
+
+    def test_shared_between_threads(self, db_path: str) -> None:
+        """Test that a connection can be used from another thread."""
+        pool = ConnectionPool(db_path, size=1)
+        with pool.connection() as conn:
+            conn.execute("INSERT INTO users (username, password_hash) VALUES ('a', 'x')")
+            conn.commit()
+
+        result: list[int] = []
+
+        def count() -> None:
+            with pool.connection() as conn:
+                result.append(conn.execute("SELECT COUNT(*) FROM users").fetchone()[0])
+
+        thread = threading.Thread(target=count)
+        thread.start()
+        thread.join()
+        assert result == [1]
+        pool.close()
+
+    def test_release_rolls_back(self, db_path: str) -> None:
+        """Test that uncommitted work is discarded when a connection is returned."""
+        pool = ConnectionPool(db_path, size=1)
+        with pool.connection() as conn:
+            conn.execute("INSERT INTO users (username, password_hash) VALUES ('a', 'x')")
+        with pool.connection() as conn:
+            assert not conn.in_transaction
+            assert conn.execute("SELECT COUNT(*) FROM users").fetchone()[0] == 0
+        pool.close()
+
+    def test_pragmas_applied(self, db_path: str) -> None:
+        """Test that configured pragmas are applied to new connections."""
+        pool = ConnectionPool(db_path, pragmas={"cache_size": -512})
+        with pool.connection() as conn:
+            assert conn.execute("PRAGMA cache_size").fetchone()[0] == -512
+        pool.close()
+
+
+class TestProfiles:
+    """Tests for SQLite tuning profiles."""
+
+    def test_balanced(self, db_path: str) -> None:
+        """Test that the balanced profile enables WAL and relaxed syncing."""
+        pool = ConnectionPool(db_path, pragmas=resolve_pragmas("balanced", timeout=2.0))
+        with pool.connection() as conn:
+            assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+            assert conn.execute("PRAGMA synchronous").fetchone()[0] == 1
+            assert conn.execute("PRAGMA temp_store").fetchone()[0] == 2
+            assert conn.execute("PRAGMA busy_timeout").fetchone()[0] == 2000
+        pool.close()
+
+    def test_overrides_win(self) -> None:
+        """Test that configured pragmas take precedence over the profile."""
+        pragmas = resolve_pragmas("durable", {"synchronous": "NORMAL", "mmap_size": 4096})
+        assert pragmas["synchronous"] == "NORMAL"
+        assert pragmas["mmap_size"] == 4096
+        assert pragmas["journal_mode"] == "WAL"
+
+    def test_none(self) -> None:
+        """Test that the none profile only sets the busy timeout."""
+        assert resolve_pragmas("none") == {"busy_timeout": 5000}
+
+    def test_unknown(self) -> None:
+        """Test that an unknown profile is rejected."""
+        with pytest.raises(ValueError, match="Unknown database profile"):
+            resolve_pragmas("turbo")
+
+
+def query_plan(db_path: str, sql: str, params: tuple[object, ...]) -> str:
+    """Return the EXPLAIN QUERY PLAN details of a statement, one per line."""
+    conn = sqlite3.connect(db_path)
+    register_functions(conn)
+    try:
+        rows = conn.execute(f"EXPLAIN QUERY PLAN {sql}", params).fetchall()
+    finally:
+        conn.close()
+    return "\n".join(row[3] for row in rows)
+
+
+class TestMigrations:
+    """Tests for the schema migration runner."""
+
+    def test_fresh_database(self, db_path: str) -> None:
+        """Test that a new database gets the latest schema version."""
+        conn = sqlite3.connect(db_path)
+        try:
+            assert conn.execute("PRAGMA user_version").fetchone()[0] == SCHEMA_VERSION
+        finally:
+            conn.close()
+        # Running again is a no-op
+        init_db(db_path)
+
+    def test_adopts_unversioned_database(self, tmp_path: Path) -> None:
+        """Test that a database created before versioning is upgraded in place."""
+        path = str(tmp_path / "legacy.db")
+        conn = sqlite3.connect(path)
+        conn.execute(
+            "CREATE TABLE lora_messages (id INTEGER PRIMARY KEY AUTOINCREMENT, "
+            "device_name TEXT, deveui TEXT NOT NULL, appeui TEXT, data TEXT, "
+            "size INTEGER, timestamp TEXT, sequence_number INTEGER)"
+        )
+        conn.execute("INSERT INTO lora_messages (deveui) VALUES ('a')")
+        conn.commit()
+        conn.close()
+
+        init_db(path)
+        conn = sqlite3.connect(path)
+        try:
+            assert conn.execute("PRAGMA user_version").fetchone()[0] == SCHEMA_VERSION
+            assert conn.execute("SELECT COUNT(*) FROM lora_messages").fetchone()[0] == 1
+            assert conn.execute("SELECT COUNT(*) FROM users").fetchone()[0] == 0
+        finally:
+            conn.close()
+
+    def test_compacts_text_messages(self, tmp_path: Path) -> None:
+        """Test that migration 4 converts text payloads and timestamps, partitions included."""
+        path = str(tmp_path / "v3.db")
+        conn = sqlite3.connect(path, isolation_level=None)
+        for migration in MIGRATIONS[:3]:
+            migration(conn)
+        conn.execute("PRAGMA user_version = 3")
+        conn.execute(
+            "CREATE TABLE lora_messages_20240115 (id INTEGER PRIMARY KEY AUTOINCREMENT, "
+            "device_name TEXT, deveui TEXT NOT NULL, appeui TEXT, data TEXT, "
+            "size INTEGER, timestamp TEXT, sequence_number INTEGER)"
+        )
+        conn.execute("INSERT INTO message_partitions VALUES ('lora_messages_20240115', '', 3)")
+        rows = [
+            (1, "lora_messages", "SGVsbG8=", "2024-01-14T10:00:00.123456Z"),
+            (2, "lora_messages", "DEADBEEF", "not a time"),
+            (3, "lora_messages_20240115", "plain text", "2024-01-15T10:00:00+00:00"),
+            (4, "lora_messages_20240115", None, None),
+        ]
+        for id_, table, data, timestamp in rows:
+            conn.execute(
+                f"INSERT INTO {table} (id, deveui, data, timestamp) VALUES (?, 'a', ?, ?)",
+                (id_, data, timestamp),
+            )
+        conn.close()
+
+        init_db(path)
+        pool = ConnectionPool(path)
+        try:
+            with pool.connection() as conn:
+                stored = conn.execute(
+                    "SELECT typeof(data), typeof(timestamp) FROM lora_messages"
+                ).fetchall()
+                assert [tuple(row) for row in stored] == [("blob", "integer"), ("blob", "text")]
+                read = [
+                    tuple(row)[4::2]
+                    for table in ("lora_messages", "lora_messages_20240115")
+                    for row in conn.execute(SELECT_MESSAGES.replace("lora_messages", table), (9,))
+                ]
+                seq = conn.execute(
+                    "SELECT seq FROM sqlite_sequence WHERE name = 'lora_messages_20240115'"
+                ).fetchone()[0]
+        finally:
+            pool.close()
+        assert read == [
+            ("DEADBEEF", "not a time"),
+            ("SGVsbG8=", "2024-01-14T10:00:00.123Z"),
+            (None, None),
+            ("plain text", "2024-01-15T10:00:00.000Z"),
+        ]
+        assert seq == 4
+
+    def test_backfills_devices(self, tmp_path: Path) -> None:
+        """Test that migration 5 summarizes the stored messages of every table."""
+        path = str(tmp_path / "v4.db")
+        conn = sqlite3.connect(path, isolation_level=None)
+        for migration in MIGRATIONS[:4]:
+            migration(conn)
+        conn.execute("PRAGMA user_version = 4")
+        conn.execute(
+            "CREATE TABLE lora_messages_20240115 AS SELECT * FROM lora_messages WHERE false"
+        )
+        conn.execute("INSERT INTO message_partitions VALUES ('lora_messages_20240115', '', 3)")
+        rows = [
+            (1, "lora_messages", "old", "x", 4, 1705312800000, 1),
+            (2, "lora_messages", "", "", 2, "not a time", 2),
+            (3, "lora_messages_20240115", "", "", None, 1705226400000, 3),
+        ]
+        for id_, table, name, appeui, size, timestamp, sqn in rows:
+            conn.execute(
+                f"INSERT INTO {table} (id, device_name, deveui, appeui, data, data_format, "
+                "size, timestamp, sequence_number) VALUES (?, ?, 'a', ?, x'00ff', 2, ?, ?, ?)",
+                (id_, name, appeui, size, timestamp, sqn),
+            )
+        conn.close()
+
+        init_db(path)
+        conn = sqlite3.connect(path)
+        try:
+            device = conn.execute(
+                "SELECT device_name, appeui, first_seen, last_seen, message_count, total_bytes, "
+                "last_sqn, last_data, last_data_format FROM devices WHERE deveui = 'a'"
+            ).fetchone()
+        finally:
+            conn.close()
+        assert device == ("old", "x", 1705226400000, 1705312800000, 3, 6, 3, b"\x00\xff", 2)
+
+    def test_dedup_index(self, db_path: str) -> None:
+        """Test that init_db() creates, rebuilds and drops the deduplication index."""
+        conn = sqlite3.connect(db_path)
+        with conn:
+            conn.executemany(
+                "INSERT INTO lora_messages (deveui, sequence_number, timestamp) VALUES (?, ?, ?)",
+                [("a", 1, 1000), ("a", 1, 2000), ("a", 1, 61000), ("b", 1, 1000)],
+            )
+        conn.close()
+
+        def dedup_state() -> tuple[str | None, int]:
+            conn = sqlite3.connect(db_path)
+            try:
+                row = conn.execute(
+                    "SELECT sql FROM sqlite_master WHERE name = 'idx_lora_messages_dedup'"
+                ).fetchone()
+                count = conn.execute("SELECT COUNT(*) FROM lora_messages").fetchone()[0]
+            finally:
+                conn.close()
+            return row[0] if row else None, count
+
+        # The second copy in the first minute is deleted, the oldest kept
+        init_db(db_path, dedup_window_ms=60000)
+        assert dedup_state() == (dedup_index_sql("lora_messages", 60000), 3)
+        init_db(db_path, dedup_window_ms=60000)
+        init_db(db_path, dedup_window_ms=120000)
+        assert dedup_state() == (dedup_index_sql("lora_messages", 120000), 2)
+        init_db(db_path)
+        assert dedup_state() == (None, 2)
+
+    def test_adds_filter_indexes(self, tmp_path: Path) -> None:
+        """Test that migration 6 indexes lora_messages and existing partitions."""
+        path = str(tmp_path / "v5.db")
+        conn = sqlite3.connect(path, isolation_level=None)
+        for migration in MIGRATIONS[:5]:
+            migration(conn)
+        conn.execute("PRAGMA user_version = 5")
+        conn.execute(
+            "CREATE TABLE lora_messages_20240115 AS SELECT * FROM lora_messages WHERE false"
+        )
+        conn.execute("INSERT INTO message_partitions VALUES ('lora_messages_20240115', '', 1)")
+        query = "SELECT name FROM sqlite_master WHERE type = 'index' AND name LIKE '%appeui%'"
+        # Earlier migrations stay as released
+        assert conn.execute(query).fetchall() == []
+        conn.close()
+
+        init_db(path)
+        conn = sqlite3.connect(path)
+        try:
+            indexes = {name for (name,) in conn.execute(query)}
+        finally:
+            conn.close()
+        assert indexes == {
+            "idx_lora_messages_appeui_id",
+            "idx_lora_messages_20240115_appeui_id",
+        }
+
+    def test_backfills_traffic(self, tmp_path: Path) -> None:
+        """Test that migration 7 rolls up the stored messages of every table."""
+        path = str(tmp_path / "v6.db")
+        conn = sqlite3.connect(path, isolation_level=None)
+        for migration in MIGRATIONS[:6]:
+            migration(conn)
+        conn.execute("PRAGMA user_version = 6")
+        conn.execute(
+            "CREATE TABLE lora_messages_20240115 AS SELECT * FROM lora_messages WHERE false"
+        )
+        conn.execute("INSERT INTO message_partitions VALUES ('lora_messages_20240115', '', 4)")
+        rows = [
+            (1, "lora_messages", "a", "x", 4, 1705312800000),
+            (2, "lora_messages", "a", "", 2, 1705312860000),
+            (3, "lora_messages", "a", "x", 8, "not a time"),
+            (4, "lora_messages_20240115", "b", "x", None, 1705316399999),
+        ]
+        for id_, table, deveui, appeui, size, timestamp in rows:
+            conn.execute(
+                f"INSERT INTO {table} (id, deveui, appeui, size, timestamp, sequence_number) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (id_, deveui, appeui, size, timestamp, id_),
+            )
+        conn.close()
+
+        init_db(path)
+        conn = sqlite3.connect(path)
+        try:
+            hours = conn.execute("SELECT * FROM traffic_hour ORDER BY scope, key").fetchall()
+            minutes = conn.execute(
+                "SELECT key, bucket, messages FROM traffic_minute WHERE scope = 'deveui'"
+            ).fetchall()
+        finally:
+            conn.close()
+        assert hours == [
+            ("all", "", 1705312800000, 3, 6),
+            ("appeui", "x", 1705312800000, 2, 4),
+            ("deveui", "a", 1705312800000, 2, 6),
+            ("deveui", "b", 1705312800000, 1, 0),
+        ]
+        assert minutes == [
+            ("a", 1705312800000, 1),
+            ("a", 1705312860000, 1),
+            ("b", 1705316340000, 1),
+        ]
+
+    def test_records_partition_timestamps(self, tmp_path: Path) -> None:
+        """Test that migration 8 records the integer timestamp range of each partition."""
+        path = str(tmp_path / "v7.db")
+        conn = sqlite3.connect(path, isolation_level=None)
+        for migration in MIGRATIONS[:7]:
+            migration(conn)
+        conn.execute("PRAGMA user_version = 7")
+        for name, first_id in (("lora_messages_20240115", 1), ("lora_messages_20240116", 4)):
+            conn.execute(f"CREATE TABLE {name} AS SELECT * FROM lora_messages WHERE false")
+            conn.execute("INSERT INTO message_partitions VALUES (?, '', ?)", (name, first_id))
+        conn.executemany(
+            "INSERT INTO lora_messages_20240115 (id, deveui, timestamp) VALUES (?, 'a', ?)",
+            [(1, 3000), (2, "not a time"), (3, 1000)],
+        )
+        conn.close()
+
+        init_db(path)
+        conn = sqlite3.connect(path)
+        try:
+            bounds = conn.execute(
+                "SELECT name, min_timestamp, max_timestamp FROM message_partitions ORDER BY name"
+            ).fetchall()
+        finally:
+            conn.close()
+        assert bounds == [
+            ("lora_messages_20240115", 1000, 3000),
+            ("lora_messages_20240116", None, None),
+        ]
+
+    def test_newer_schema_rejected(self, db_path: str) -> None:
+        """Test that a database from a newer release is not touched."""
+        conn = sqlite3.connect(db_path)
+        conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION + 1}")
+        conn.close()
+        with pytest.raises(RuntimeError, match="newer"):
+            init_db(db_path)
+
+    @pytest.mark.parametrize(
+        ("sql", "params", "search"),
+        [
+            (SELECT_DEVICE_MESSAGES, ("a", 10), "(deveui=?)"),
+            (SELECT_DEVICE_MESSAGES_BEFORE, ("a", 5, 10), "(deveui=? AND "),
+            (SELECT_DEVICE_MESSAGES_AFTER, ("a", 5, 10), "(deveui=? AND "),
+        ],
+    )
+    def test_device_query_uses_index(
+        self, db_path: str, sql: str, params: tuple[object, ...], search: str
+    ) -> None:
+        """Test that per-device pages search the index without sorting."""
+        plan = query_plan(db_path, sql, params)
+        assert f"USING INDEX idx_lora_messages_deveui_id {search}" in plan
+        assert "TEMP B-TREE" not in plan
+
+    def test_timestamp_query_uses_index(self, db_path: str) -> None:
+        """Test that time range queries use the timestamp index."""
+        plan = query_plan(
+            db_path, "SELECT id FROM lora_messages WHERE timestamp >= ?", ("2024-01-01",)
+        )
+        assert "idx_lora_messages_timestamp" in plan
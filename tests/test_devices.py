@@ -0,0 +1,114 @@
+"""Tests for device summaries."""
+
+import sqlite3
+from pathlib import Path
+
+import pytest
+from webapi_example.compact import PAYLOAD_BASE64, PAYLOAD_HEX
+from webapi_example.database import ConnectionPool
+from webapi_example.devices import DeviceRegistry, device_updates
+from webapi_example.ingest import DuplicateFilter, message_row, write_messages
+from webapi_example.partitions import PartitionLayout
+
+
+def uplink(
+    sqn: int,
+    timestamp: str = "2024-01-15T10:00:00.000Z",
+    deveui: str = "a",
+    data: str = "SGVsbG8=",
+    **fields: object,
+) -> dict[str, object]:
+    """Return a message object."""
+    message = {"deveui": deveui, "sqn": sqn, "timestamp": timestamp, "data": data}
+    return {**message, "size": len(data), **fields}
+
+
+@pytest.fixture
+def dedup_window_ms() -> int:
+    """Create the test database with a one minute dedup index."""
+    return 60000
+
+
+class TestDeviceUpdates:
+    """Tests for device_updates()."""
+
+    def test_aggregates_per_device(self) -> None:
+        """Test that rows are summed per device, keeping the last row's sqn and payload."""
+        rows = [
+            message_row(uplink(1, "2024-01-15T10:00:00.000Z", deviceName="one", appeui="x")),
+            message_row(uplink(1, "2024-01-15T09:00:00.000Z", deveui="b", data="00ff")),
+            message_row(uplink(2, "2024-01-15T09:30:00.000Z", appeui="y")),
+        ]
+        assert device_updates(rows) == [
+            ("a", "one", "y", 1705311000000, 1705312800000, 2, 16, 2, b"Hello", PAYLOAD_BASE64),
+            ("b", "", "", 1705309200000, 1705309200000, 1, 4, 1, b"\x00\xff", PAYLOAD_HEX),
+        ]
+
+    def test_missing_timestamps(self) -> None:
+        """Test that rows without an integer timestamp leave first and last seen alone."""
+        rows = [
+            ("", "a", "", None, None, 0, None, 1),
+            message_row(uplink(2)),
+            message_row(uplink(3, "yesterday")),
+        ]
+        assert device_updates(rows)[0][3:6] == (1705312800000, 1705312800000, 3)
+
+
+class TestDeviceRegistry:
+    """Tests for DeviceRegistry."""
+
+    def test_mirrors_table(self, pool: ConnectionPool) -> None:
+        """Test that updating the mirror matches reloading it from the table."""
+        registry = DeviceRegistry()
+        batches = [
+            [message_row(uplink(1, deviceName="sensor")), message_row(uplink(1, deveui="b"))],
+            [message_row(uplink(2, "2024-01-14T10:00:00.000Z", data="plain"))],
+        ]
+        with pool.connection() as conn:
+            for rows in batches:
+                registry.update(write_messages(conn, rows)[0])
+            loaded = DeviceRegistry()
+            loaded.load(conn)
+        assert registry.list() == loaded.list()
+        assert loaded.get("a") == {
+            "deveui": "a",
+            "deviceName": "sensor",
+            "appeui": "",
+            "firstSeen": "2024-01-14T10:00:00.000Z",
+            "lastSeen": "2024-01-15T10:00:00.000Z",
+            "messageCount": 2,
+            "totalBytes": 13,
+            "lastSqn": 2,
+            "lastData": "plain",
+        }
+        assert [device["deveui"] for device in loaded.list()] == ["a", "b"]
+        assert loaded.get("c") is None
+
+    def test_duplicates_not_counted(self, pool: ConnectionPool) -> None:
+        """Test that rows dropped as duplicates do not reach the summary."""
+        registry = DeviceRegistry()
+        with pool.connection() as conn:
+            write_messages(conn, [message_row(uplink(1))])
+            stored, _, _ = write_messages(
+                conn, [message_row(uplink(1)), message_row(uplink(2))], dedup=DuplicateFilter(60)
+            )
+            registry.load(conn)
+        assert len(stored) == 1
+        assert registry.get("a")["messageCount"] == 2  # type: ignore[index]
+
+    def test_partitioned_writes(self, pool: ConnectionPool) -> None:
+        """Test that writes to partitions update the summary too."""
+        registry = DeviceRegistry()
+        with pool.connection() as conn:
+            write_messages(conn, [message_row(uplink(1))], PartitionLayout("day"))
+            registry.load(conn)
+        assert registry.get("a")["lastSqn"] == 1  # type: ignore[index]
+
+    def test_load_without_table(self, tmp_path: Path) -> None:
+        """Test that loading before the schema exists raises OperationalError."""
+        pool = ConnectionPool(str(tmp_path / "empty.db"))
+        try:
+            with pool.connection() as conn, pytest.raises(sqlite3.OperationalError):
+                DeviceRegistry().load(conn)
+        finally:
+            pool.close()
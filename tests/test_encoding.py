@@ -0,0 +1,41 @@
+"""Tests for direct row-to-JSON encoding."""
+
+import json
+
+import pytest
+from webapi_example.encoding import RowEncoder, encode_value
+
+ROWS = [
+    (1, "Sensor1", "0011223344556677", "", "SGVsbG8=", 5, "2024-01-15T10:00:00Z", 1),
+    (2, 'quo"te\\back\nslash', "é✓🙂", None, "\x00\x1f", -3, "", 2**70),
+    (3, "", "", "", "", 0, 1.5, 0),
+]
+
+
+class TestRowEncoder:
+    """Tests for RowEncoder."""
+
+    @pytest.mark.parametrize("row", ROWS)
+    def test_matches_json_dumps(self, row: tuple[object, ...]) -> None:
+        """Test that output is byte-identical to compact json.dumps of the dict."""
+        keys = ["id", "deviceName", "deveui", "appeui", "data", "size", "timestamp", "sqn"]
+        encoder = RowEncoder(keys)
+        expected = json.dumps(
+            dict(zip(keys, row, strict=True)), separators=(",", ":"), ensure_ascii=False
+        )
+        assert encoder.encode(row) == expected
+
+    def test_encode_rows(self) -> None:
+        """Test that rows join into valid JSON array members."""
+        encoder = RowEncoder(["a", "%s", "c"])
+        rows = [(1, "x", None), (2, "y", 0.25)]
+        assert json.loads("[" + encoder.encode_rows(rows) + "]") == [
+            {"a": 1, "%s": "x", "c": None},
+            {"a": 2, "%s": "y", "c": 0.25},
+        ]
+        assert encoder.encode_rows([]) == ""
+
+    def test_unsupported_value(self) -> None:
+        """Test that values SQLite cannot return are rejected."""
+        with pytest.raises(TypeError):
+            encode_value(b"blob")
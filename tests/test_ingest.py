@@ -0,0 +1,355 @@
+"""Tests for message ingest helpers."""
+
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Any
+
+import pytest
+from webapi_example.compact import PAYLOAD_BASE64, epoch_ms
+from webapi_example.database import ConnectionPool
+from webapi_example.ingest import (
+    DuplicateFilter,
+    GroupCommitWriter,
+    decode_batch,
+    insert_batch,
+    message_row,
+    write_messages,
+)
+
+
+class TestDecodeBatch:
+    """Tests for decode_batch()."""
+
+    def test_array(self) -> None:
+        """Test decoding a JSON array."""
+        assert decode_batch(b'[{"deveui": "a"}, {"deveui": "b"}]') == [
+            {"deveui": "a"},
+            {"deveui": "b"},
+        ]
+
+    def test_messages_object(self) -> None:
+        """Test decoding an object with a messages array."""
+        assert decode_batch(b'{"messages": [{"deveui": "a"}]}') == [{"deveui": "a"}]
+
+    def test_ndjson_detected(self) -> None:
+        """Test that NDJSON is recognised without a content type."""
+        assert decode_batch(b'{"deveui": "a"}\n\n{"deveui": "b"}\n') == [
+            {"deveui": "a"},
+            {"deveui": "b"},
+        ]
+
+    def test_ndjson_bad_line(self) -> None:
+        """Test that an invalid NDJSON line names its line number."""
+        with pytest.raises(ValueError, match="line 2"):
+            decode_batch(b'{"deveui": "a"}\n{oops', "application/x-ndjson")
+
+    def test_invalid(self) -> None:
+        """Test that malformed JSON is rejected."""
+        with pytest.raises(ValueError):
+            decode_batch(b"[{")
+
+
+class TestMessageRow:
+    """Tests for message_row()."""
+
+    def test_defaults(self) -> None:
+        """Test that optional fields get their defaults."""
+        row = message_row({"deveui": "a", "timestamp": "2024-01-15T10:00:00.000Z"})
+        assert row == ("", "a", "", "", 0, 0, 1705312800000, 0)
+
+    def test_default_timestamp(self) -> None:
+        """Test that a message without a timestamp gets the current time in compact form."""
+        before = epoch_ms(datetime.now(timezone.utc))
+        timestamp = message_row({"deveui": "a"})[6]
+        assert isinstance(timestamp, int)
+        assert before <= timestamp <= epoch_ms(datetime.now(timezone.utc))
+
+    def test_compact_fields(self) -> None:
+        """Test that the payload is decoded and the timestamp made epoch milliseconds."""
+        row = message_row({"deveui": "a", "data": "AQID", "timestamp": "1970-01-01T00:00:01.500Z"})
+        assert row[3:7] == (b"\x01\x02\x03", PAYLOAD_BASE64, 0, 1500)
+
+    @pytest.mark.parametrize(
+        "timestamp",
+        ["yesterday", "2024-01-15T10:00:00Z", "2024-01-15T12:00:00.5+02:00", "2024-01-15"],
+    )
+    def test_timestamp_kept_as_text(self, timestamp: str) -> None:
+        """Test that a timestamp the compact form cannot give back exactly is stored as text."""
+        assert message_row({"deveui": "a", "timestamp": timestamp})[6] == timestamp
+
+    @pytest.mark.parametrize(
+        "item",
+        [
+            [],
+            {"deviceName": "x"},
+            {"deveui": 5},
+            {"deveui": "a", "sqn": True},
+            {"deveui": "a", "data": 5},
+            {"deveui": "a", "timestamp": 1705312800},
+            {"deveui": "a", "deviceName": {"x": 1}},
+            {"deveui": "a", "appeui": ["x"]},
+            {"deveui": "a", "sqn": 2**63},
+            {"deveui": "a", "size": -(2**63) - 1},
+        ],
+    )
+    def test_invalid(self, item: object) -> None:
+        """Test that invalid messages raise ValueError."""
+        with pytest.raises(ValueError):
+            message_row(item)
+
+
+def count_messages(pool: ConnectionPool) -> int:
+    """Return the number of stored messages."""
+    with pool.connection() as conn:
+        return int(conn.execute("SELECT COUNT(*) FROM lora_messages").fetchone()[0])
+
+
+class TestWriteMessages:
+    """Tests for write_messages()."""
+
+    def test_returns_ids(self, pool: ConnectionPool) -> None:
+        """Test that the stored rows are returned with the id of each."""
+        rows = [message_row({"deveui": "a", "sqn": sqn}) for sqn in range(5)]
+        with pool.connection() as conn:
+            assert write_messages(conn, rows[:2]) == (rows[:2], [1, 2], [True, True])
+            stored, ids, _ = write_messages(conn, rows[2:])
+            stored_ids = [
+                row[0] for row in conn.execute("SELECT id FROM lora_messages ORDER BY id")
+            ]
+        assert stored == rows[2:]
+        assert ids == stored_ids[2:] == [3, 4, 5]
+
+
+class TestGroupCommitWriter:
+    """Tests for GroupCommitWriter."""
+
+    def test_groups_by_size(self, pool: ConnectionPool) -> None:
+        """Test that full groups are committed in one transaction each."""
+        writer = GroupCommitWriter(pool, max_rows=10, max_delay=60.0)
+        writer.start()
+        assert writer.submit([message_row({"deveui": "a", "sqn": i}) for i in range(25)])
+        writer.flush(timeout=5)
+        assert count_messages(pool) == 25
+        # Two full groups, then the flushed remainder
+        assert writer.stats()["groups"] == 3
+        writer.stop()
+
+    def test_commits_after_delay(self, pool: ConnectionPool) -> None:
+        """Test that a partial group is committed once max_delay has passed."""
+        writer = GroupCommitWriter(pool, max_rows=100, max_delay=0.05)
+        writer.start()
+        assert writer.submit([message_row({"deveui": "a"})])
+        deadline = time.monotonic() + 5
+        while count_messages(pool) == 0 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert count_messages(pool) == 1
+        writer.stop()
+
+    def test_backpressure(self, pool: ConnectionPool) -> None:
+        """Test that submit() refuses rows beyond queue_size."""
+        writer = GroupCommitWriter(pool, max_rows=100, max_delay=60.0, queue_size=5)
+        row = message_row({"deveui": "a"})
+        # Not started: nothing is accepted
+        assert not writer.submit([row])
+        writer.start()
+        assert not writer.submit([row] * 6)
+        assert writer.submit([row] * 5)
+        assert not writer.submit([row])
+        writer.stop()
+        assert count_messages(pool) == 5
+
+    def test_stop_drains_queue(self, pool: ConnectionPool) -> None:
+        """Test that stop() writes out rows still waiting."""
+        writer = GroupCommitWriter(pool, max_rows=100, max_delay=60.0)
+        writer.start()
+        assert writer.submit([message_row({"deveui": "a"})] * 3)
+        writer.stop()
+        assert count_messages(pool) == 3
+        assert not writer.submit([message_row({"deveui": "a"})])
+
+    def test_on_commit(self, pool: ConnectionPool) -> None:
+        """Test that on_commit gets each committed group with its ids."""
+        committed: list[tuple[int, list[int]]] = []
+        writer = GroupCommitWriter(
+            pool,
+            max_rows=2,
+            max_delay=60.0,
+            on_commit=lambda rows, ids: committed.append((len(rows), ids)),
+        )
+        writer.start()
+        assert writer.submit([message_row({"deveui": "a", "sqn": i}) for i in range(3)])
+        writer.stop()
+        assert committed == [(2, [1, 2]), (1, [3])]
+
+    def test_poisoned_group(self, pool: ConnectionPool) -> None:
+        """Test that a group that cannot be written is counted and later groups written."""
+        writer = GroupCommitWriter(pool, max_rows=100, max_delay=60.0)
+        writer.start()
+        poisoned = message_row({"deveui": "a"})[:7] + (2**70,)
+        assert writer.submit([poisoned, message_row({"deveui": "a"})])
+        assert writer.flush(timeout=5)
+        assert writer.submit([message_row({"deveui": "b"})])
+        writer.stop()
+        assert count_messages(pool) == 1
+        assert (writer.stats()["failed"], writer.stats()["committed"]) == (2, 1)
+
+    def test_failing_callback(self, pool: ConnectionPool) -> None:
+        """Test that an on_commit error does not stop the writer."""
+
+        def on_commit(rows: list[tuple[Any, ...]], ids: list[int]) -> None:
+            raise KeyError("boom")
+
+        writer = GroupCommitWriter(pool, max_rows=1, max_delay=60.0, on_commit=on_commit)
+        writer.start()
+        assert writer.submit([message_row({"deveui": "a"})])
+        assert writer.flush(timeout=5)
+        assert writer.submit([message_row({"deveui": "b"})])
+        writer.stop()
+        assert count_messages(pool) == 2
+
+    @pytest.mark.filterwarnings("ignore::pytest.PytestUnhandledThreadExceptionWarning")
+    def test_dead_thread_refuses_rows(self, pool: ConnectionPool) -> None:
+        """Test that submit() refuses rows once the writer thread has died."""
+
+        def on_commit(rows: list[tuple[Any, ...]], ids: list[int]) -> None:
+            raise SystemExit
+
+        writer = GroupCommitWriter(pool, max_rows=1, max_delay=60.0, on_commit=on_commit)
+        writer.start()
+        assert writer.submit([message_row({"deveui": "a"})])
+        assert writer.flush(timeout=5)
+        assert not writer.submit([message_row({"deveui": "b"})])
+        writer.stop()
+
+    def test_commits_reported_in_id_order(self, pool: ConnectionPool) -> None:
+        """Test that writers sharing a commit lock report their commits in id order."""
+        lock = threading.Lock()
+        reported: list[int] = []
+
+        def on_commit(rows: list[tuple[Any, ...]], ids: list[int]) -> None:
+            # Give later commits the chance to overtake every other one
+            time.sleep(0.002 if ids[0] % 2 else 0)
+            reported.extend(ids)
+
+        writer = GroupCommitWriter(
+            pool, max_rows=1, max_delay=60.0, on_commit=on_commit, commit_lock=lock
+        )
+        writer.start()
+
+        def insert(deveui: str) -> None:
+            for sqn in range(20):
+                assert writer.submit([message_row({"deveui": deveui, "sqn": sqn})])
+                with pool.connection() as conn:
+                    insert_batch(
+                        conn, [{"deveui": deveui, "sqn": sqn}], on_commit, commit_lock=lock
+                    )
+
+        threads = [threading.Thread(target=insert, args=(deveui,)) for deveui in "abc"]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        writer.stop()
+        assert len(reported) == 120
+        assert reported == sorted(reported)
+
+
+def uplink(
+    sqn: int, timestamp: str = "2024-01-15T10:00:00.000Z", deveui: str = "a"
+) -> dict[str, object]:
+    """Return a message object."""
+    return {"deveui": deveui, "sqn": sqn, "timestamp": timestamp}
+
+
+class TestDuplicateFilter:
+    """Tests for DuplicateFilter."""
+
+    def test_repeats_within_window(self) -> None:
+        """Test that repeats of a stored uplink are dropped, also within one call."""
+        dedup = DuplicateFilter(60)
+        first = message_row(uplink(1))
+        assert dedup.fresh([first, first, message_row(uplink(1, deveui="b"))]) == [
+            True,
+            False,
+            True,
+        ]
+        dedup.record([first])
+        # Another forwarder stamped the same uplink a few seconds later
+        assert dedup.fresh([message_row(uplink(1, "2024-01-15T10:00:05.000Z"))]) == [False]
+        assert dedup.stats()["dropped_in_memory"] == 2
+
+    def test_counter_restart(self) -> None:
+        """Test that a sequence number coming back after the window is stored."""
+        dedup = DuplicateFilter(60)
+        dedup.record([message_row(uplink(0))])
+        # Device reset, or a 16-bit frame counter rolled over
+        assert dedup.fresh([message_row(uplink(0, "2024-01-15T11:00:00.000Z"))]) == [True]
+
+    def test_bounded(self) -> None:
+        """Test that only max_entries messages are remembered."""
+        dedup = DuplicateFilter(60, max_entries=10)
+        dedup.record([message_row(uplink(sqn)) for sqn in range(25)])
+        assert dedup.stats()["tracked"] == 10
+        assert dedup.fresh([message_row(uplink(0)), message_row(uplink(24))]) == [True, False]
+
+
+class TestDeduplicatedWrites:
+    """Tests for writes with deduplication enabled."""
+
+    @pytest.fixture
+    def dedup_window_ms(self) -> int:
+        """Create the test database with a one minute dedup index."""
+        return 60000
+
+    def test_index_backs_filter(self, pool: ConnectionPool) -> None:
+        """Test that the unique index drops duplicates the filter does not know."""
+        with pool.connection() as conn:
+            write_messages(conn, [message_row(uplink(1))])
+            dedup = DuplicateFilter(60)
+            stored, ids, fresh = write_messages(
+                conn, [message_row(uplink(1)), message_row(uplink(2))], dedup=dedup
+            )
+            # The ignored row may use up an id, so look the stored one up
+            stored_id = conn.execute(
+                "SELECT id FROM lora_messages WHERE sequence_number = 2"
+            ).fetchone()[0]
+        assert [row[7] for row in stored] == [2]
+        assert ids == [stored_id]
+        assert fresh == [False, True]
+        assert count_messages(pool) == 2
+        assert dedup.stats()["dropped_by_index"] == 1
+
+    def test_text_timestamps(self, pool: ConnectionPool) -> None:
+        """Test that a text timestamp only duplicates the identical text."""
+        rows = [message_row(uplink(1, timestamp)) for timestamp in ("a", "b", "b")]
+        with pool.connection() as conn:
+            for row in rows:
+                write_messages(conn, [row], dedup=DuplicateFilter(60))
+        assert count_messages(pool) == 2
+
+    def test_insert_batch_results(self, pool: ConnectionPool) -> None:
+        """Test that batch results mark duplicates."""
+        dedup = DuplicateFilter(60)
+        with pool.connection() as conn:
+            insert_batch(conn, [uplink(1)], dedup=dedup)
+            result = insert_batch(conn, [uplink(1), uplink(2), {}, uplink(2)], dedup=dedup)
+        assert (result["created"], result["duplicates"], result["failed"]) == (1, 2, 1)
+        assert [item["status"] for item in result["results"]] == [
+            "duplicate",
+            "created",
+            "error",
+            "duplicate",
+        ]
+        assert dedup.stats()["duplicates"] == 2
+
+    def test_writer(self, pool: ConnectionPool) -> None:
+        """Test that the write-behind writer skips and counts duplicates."""
+        dedup = DuplicateFilter(60)
+        writer = GroupCommitWriter(pool, max_rows=100, max_delay=60.0, dedup=dedup)
+        writer.start()
+        assert writer.submit([message_row(uplink(1))] * 3)
+        writer.stop()
+        assert count_messages(pool) == 1
+        assert writer.stats()["committed"] == 1
+        assert dedup.stats()["dropped_by_index"] == 2
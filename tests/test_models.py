@@ -37,6 +37,14 @@ class TestServerConfig:
         assert config.host == "0.0.0.0"  # Default
         assert config.port == 8080
 
+    def test_concurrency_settings(self) -> None:
+        """Test worker pool settings and their defaults."""
+        config = ServerConfig.from_dict({"workers": 8, "queue_depth": 32})
+        assert config.concurrency == "threads"  # Default
+        assert config.workers == 8
+        assert config.queue_depth == 32
+        assert config.listen_backlog == 32  # Default
+
 
 class TestAppConfig:
     """Tests for AppConfig model."""
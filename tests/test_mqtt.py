@@ -0,0 +1,296 @@
+"""Tests for MQTT uplink ingest, against a local stand-in broker."""
+
+import json
+import socket
+import struct
+import threading
+import time
+from pathlib import Path
+from typing import Any, Callable, Generator
+
+import pytest
+from webapi_example.database import ConnectionPool, init_db
+from webapi_example.ingest import GroupCommitWriter
+from webapi_example.models.config import AppConfig, DatabaseConfig, LogConfig, MqttConfig
+from webapi_example.mqtt import MqttListener, uplink_row
+from webapi_example.state import AppState
+
+# An uplink as the mPower LoRa network server publishes it
+UPLINK = {
+    "tmst": 2477176188,
+    "time": "2024-01-15T10:00:00.123456Z",
+    "freq": 904.3,
+    "datr": "SF7BW125",
+    "rssi": -45,
+    "lsnr": 9.8,
+    "size": 5,
+    "fcnt": 42,
+    "port": 1,
+    "data": "SGVsbG8=",
+    "appeui": "16-ea-76-f6-ab-66-3d-80",
+    "deveui": "00-80-00-00-00-00-aa-bb",
+    "name": "sensor-1",
+}
+
+
+def wait_until(condition: Callable[[], bool], timeout: float = 5.0) -> None:
+    """Poll until the condition holds, failing after the timeout."""
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+class StandInBroker:
+    """Minimal MQTT 3.1.1 broker serving one client connection at a time.
+
+    Answers CONNECT, SUBSCRIBE and PINGREQ, publishes what the test asks it
+    to and records every packet the client sends.
+    """
+
+    def __init__(self, return_code: int = 0) -> None:
+        """Listen on an ephemeral port.
+
+        Args:
+            return_code: CONNACK return code sent to clients.
+        """
+        self.return_code = return_code
+        self.server = socket.create_server(("127.0.0.1", 0))
+        self.port = self.server.getsockname()[1]
+        self.received: list[tuple[int, bytes]] = []
+        self.connections = 0
+        self.client: socket.socket | None = None
+        self.cond = threading.Condition()
+        self.thread = threading.Thread(target=self.serve, daemon=True)
+        self.thread.start()
+
+    def serve(self) -> None:
+        """Accept clients until closed."""
+        while True:
+            try:
+                client, _ = self.server.accept()
+            except OSError:
+                return
+            with client:
+                self.serve_client(client)
+
+    def serve_client(self, client: socket.socket) -> None:
+        """Answer one client's packets until it disconnects."""
+        stream = client.makefile("rb")
+        try:
+            while first := stream.read(1):
+                length, shift = 0, 0
+                while True:
+                    byte = stream.read(1)[0]
+                    length |= (byte & 0x7F) << shift
+                    shift += 7
+                    if not byte & 0x80:
+                        break
+                body = stream.read(length)
+                kind = first[0] >> 4
+                with self.cond:
+                    self.received.append((first[0], body))
+                    if kind == 1:
+                        self.client = client
+                        self.connections += 1
+                    self.cond.notify_all()
+                if kind == 1:
+                    client.sendall(bytes([0x20, 2, 0, self.return_code]))
+                elif kind == 8:
+                    client.sendall(bytes([0x90, 3]) + body[:2] + body[-1:])
+                elif kind == 12:
+                    client.sendall(bytes([0xD0, 0]))
+        except OSError:
+            pass
+        finally:
+            stream.close()
+            with self.cond:
+                self.client = None
+                self.cond.notify_all()
+
+    def packets(self, kind: int) -> list[tuple[int, bytes]]:
+        """Return the packets of one type received so far."""
+        with self.cond:
+            return [packet for packet in self.received if packet[0] >> 4 == kind]
+
+    def wait_subscribed(self, connections: int = 1) -> None:
+        """Wait until the given number of clients has subscribed."""
+        with self.cond:
+            assert self.cond.wait_for(
+                lambda: self.client is not None and len(self.packets(8)) >= connections, 5
+            )
+
+    def publish(self, topic: str, payload: Any, qos: int = 0, packet_id: int = 0) -> None:
+        """Publish a message to the connected client."""
+        data = payload if isinstance(payload, bytes) else json.dumps(payload).encode()
+        body = struct.pack("!H", len(topic)) + topic.encode()
+        if qos:
+            body += struct.pack("!H", packet_id)
+        body += data
+        header = bytearray([0x30 | qos << 1])
+        length = len(body)
+        while True:
+            byte, length = length % 128, length // 128
+            header.append(byte | 0x80 if length else byte)
+            if not length:
+                break
+        assert self.client is not None
+        self.client.sendall(bytes(header) + body)
+
+    def drop_client(self) -> None:
+        """Close the client connection from the broker side."""
+        assert self.client is not None
+        self.client.shutdown(socket.SHUT_RDWR)
+
+    def close(self) -> None:
+        """Stop listening."""
+        try:
+            # Wake the blocked accept()
+            self.server.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.server.close()
+        self.thread.join(timeout=5)
+
+
+@pytest.fixture
+def broker() -> Generator[StandInBroker, None, None]:
+    """Run a stand-in broker."""
+    broker = StandInBroker()
+    yield broker
+    broker.close()
+
+
+def stored_messages(pool: ConnectionPool) -> list[tuple[Any, ...]]:
+    """Return (deveui, device_name, sequence_number) of the stored messages."""
+    with pool.connection() as conn:
+        rows = conn.execute(
+            "SELECT deveui, device_name, sequence_number FROM lora_messages ORDER BY id"
+        ).fetchall()
+        return [tuple(row) for row in rows]
+
+
+class TestUplinkRow:
+    """Tests for uplink_row()."""
+
+    def test_network_server_fields(self) -> None:
+        """Test that the network server's field names are mapped."""
+        row = uplink_row("lora/+/up", "lora/x/up", json.dumps(UPLINK).encode())
+        assert row[:3] == ("sensor-1", "00-80-00-00-00-00-aa-bb", "16-ea-76-f6-ab-66-3d-80")
+        assert row[5:] == (5, 1705312800123, 42)
+
+    def test_api_fields_and_topic_deveui(self) -> None:
+        """Test that API fields win and a missing deveui comes from the topic."""
+        payload = {"deviceName": "a", "name": "b", "sqn": 7, "data": "00ff"}
+        row = uplink_row("lora/+/up", "lora/00-11/up", json.dumps(payload).encode())
+        assert (row[0], row[1], row[7]) == ("a", "00-11", 7)
+
+    @pytest.mark.parametrize("payload", [b"not json", b"[]", b'{"data": "00ff"}'])
+    def test_invalid(self, payload: bytes) -> None:
+        """Test that invalid uplinks raise ValueError."""
+        with pytest.raises(ValueError):
+            uplink_row("lora/up", "lora/up", payload)
+
+
+class TestMqttListener:
+    """Tests for MqttListener."""
+
+    def listener(self, broker: StandInBroker, pool: ConnectionPool, **config: Any) -> MqttListener:
+        """Start a listener connected to the stand-in broker."""
+        writer = GroupCommitWriter(pool, max_rows=100, max_delay=0.01)
+        listener = MqttListener(MqttConfig(enabled=True, port=broker.port, **config), writer)
+        listener.start()
+        broker.wait_subscribed()
+        return listener
+
+    def test_ingests_uplinks(self, broker: StandInBroker, pool: ConnectionPool) -> None:
+        """Test that published uplinks are stored and invalid ones counted."""
+        listener = self.listener(broker, pool)
+        try:
+            broker.publish("lora/00-80-00-00-00-00-aa-bb/up", UPLINK)
+            broker.publish("lora/00-11/up", {"fcnt": 1})
+            broker.publish("lora/00-11/up", b"garbage")
+            wait_until(lambda: len(stored_messages(pool)) == 2)
+            stats = listener.stats()
+        finally:
+            listener.stop()
+        assert stored_messages(pool) == [
+            ("00-80-00-00-00-00-aa-bb", "sensor-1", 42),
+            ("00-11", "", 1),
+        ]
+        assert stats["connected"]
+        assert (stats["received"], stats["invalid"], stats["committed"]) == (3, 1, 2)
+        (_, connect), = broker.packets(1)
+        # Clean session, 60 s keepalive, client id
+        assert connect[6:10] == b"\x04\x02\x00\x3c"
+        assert connect.endswith(b"webapi-example")
+        assert broker.packets(8)[0][1][4:] == b"lora/+/up\x00"
+        wait_until(lambda: len(broker.packets(14)) == 1)
+
+    def test_qos1_acknowledged(self, broker: StandInBroker, pool: ConnectionPool) -> None:
+        """Test that QoS 1 uplinks are acknowledged in a kept session."""
+        listener = self.listener(broker, pool, qos=1)
+        try:
+            broker.publish("lora/a/up", {"fcnt": 1}, qos=1, packet_id=7)
+            broker.publish("lora/a/up", {"fcnt": 2}, qos=1, packet_id=8)
+            wait_until(lambda: len(broker.packets(4)) == 2)
+        finally:
+            listener.stop()
+        assert [body for _, body in broker.packets(4)] == [b"\x00\x07", b"\x00\x08"]
+        assert broker.packets(1)[0][1][7] == 0
+        assert broker.packets(8)[0][1][-1] == 1
+
+    def test_keepalive(self, broker: StandInBroker, pool: ConnectionPool) -> None:
+        """Test that an idle session is kept alive with pings."""
+        listener = self.listener(broker, pool, keepalive=1)
+        try:
+            wait_until(lambda: len(broker.packets(12)) > 0, timeout=2)
+        finally:
+            listener.stop()
+
+    def test_reconnects(self, broker: StandInBroker, pool: ConnectionPool) -> None:
+        """Test that the listener reconnects after losing the broker."""
+        listener = self.listener(broker, pool)
+        try:
+            broker.drop_client()
+            broker.wait_subscribed(connections=2)
+            broker.publish("lora/a/up", {"fcnt": 1})
+            wait_until(lambda: len(stored_messages(pool)) == 1)
+            assert listener.stats()["connections"] == 2
+        finally:
+            listener.stop()
+
+    def test_refused(self, pool: ConnectionPool) -> None:
+        """Test that a refused connection is retried without ingesting."""
+        broker = StandInBroker(return_code=5)
+        writer = GroupCommitWriter(pool)
+        listener = MqttListener(MqttConfig(enabled=True, port=broker.port), writer)
+        listener.start()
+        try:
+            wait_until(lambda: len(broker.packets(1)) == 1)
+            time.sleep(0.1)
+            assert not listener.stats()["connected"]
+            assert broker.packets(8) == []
+        finally:
+            listener.stop()
+            broker.close()
+
+
+def test_app_state(broker: StandInBroker, tmp_path: Path) -> None:
+    """Test that the application state runs the listener from the configuration."""
+    path = str(tmp_path / "test.db")
+    init_db(path)
+    config = AppConfig(
+        database=DatabaseConfig(path=path),
+        log=LogConfig(level="DEBUG", use_syslog=False),
+        mqtt=MqttConfig(enabled=True, port=broker.port, batch_ms=10),
+    )
+    state = AppState(config, path)
+    try:
+        broker.wait_subscribed()
+        broker.publish("lora/a/up", {"fcnt": 1, "size": 3})
+        wait_until(lambda: state.devices.get("a") is not None)
+        assert state.ingest_stats()["mqtt"]["committed"] == 1
+    finally:
+        state.close()
+    assert state.ingest_stats()["mqtt"]["connected"] is False
@@ -0,0 +1,312 @@
+"""Tests for time-partitioned message storage."""
+
+from datetime import datetime, timedelta, timezone
+from urllib.parse import parse_qsl, urlsplit
+
+import pytest
+from webapi_example.database import ConnectionPool, init_db
+from webapi_example.ingest import DuplicateFilter, write_messages
+from webapi_example.partitions import PartitionLayout
+from webapi_example.retention import RetentionWorker
+from webapi_example.storage import (
+    MessageFilter,
+    PageRequest,
+    message_chunks,
+    message_page,
+    resolve_id_range,
+)
+
+
+class Clock:
+    """Settable UTC clock."""
+
+    def __init__(self) -> None:
+        """Start on Wednesday 2024-01-03."""
+        self.now = datetime(2024, 1, 3, 12, tzinfo=timezone.utc)
+
+    def __call__(self) -> datetime:
+        """Return the current time."""
+        return self.now
+
+
+@pytest.fixture
+def clock() -> Clock:
+    """Create a clock for the layout."""
+    return Clock()
+
+
+@pytest.fixture
+def layout(clock: Clock) -> PartitionLayout:
+    """Create a daily layout on the test clock."""
+    return PartitionLayout("day", clock=clock)
+
+
+def store_days(
+    pool: ConnectionPool, layout: PartitionLayout, clock: Clock, days: int, per_day: int = 3
+) -> None:
+    """Store per_day messages on each of the next days, sqn and timestamp counting up."""
+    sqn = 0
+    for _ in range(days):
+        rows = [
+            ("", "a" if n % 2 else "b", "", "", 0, 0, sqn + n, sqn + n) for n in range(per_day)
+        ]
+        with pool.connection() as conn:
+            write_messages(conn, rows, layout)
+        sqn += per_day
+        clock.now += timedelta(days=1)
+
+
+class TestPartitionLayout:
+    """Tests for PartitionLayout."""
+
+    def test_unknown_period(self) -> None:
+        """Test that an unknown partitioning is rejected."""
+        with pytest.raises(ValueError, match="month"):
+            PartitionLayout("month")
+
+    def test_period_start(self, clock: Clock) -> None:
+        """Test that weeks start on Monday."""
+        assert PartitionLayout("day").period_start(clock.now) == "2024-01-03"
+        assert PartitionLayout("week").period_start(clock.now) == "2024-01-01"
+
+    def test_partition_per_day(
+        self, pool: ConnectionPool, layout: PartitionLayout, clock: Clock
+    ) -> None:
+        """Test that each day gets a table and ids continue across tables."""
+        store_days(pool, layout, clock, 3)
+        with pool.connection() as conn:
+            partitions = layout.partitions(conn)
+            ids = [
+                [row[0] for row in conn.execute(f"SELECT id FROM {partition.name} ORDER BY id")]
+                for partition in partitions
+            ]
+        assert [partition.name for partition in partitions] == [
+            "lora_messages",
+            "lora_messages_20240103",
+            "lora_messages_20240104",
+            "lora_messages_20240105",
+        ]
+        assert [partition.first_id for partition in partitions] == [0, 1, 4, 7]
+        assert ids == [[], [1, 2, 3], [4, 5, 6], [7, 8, 9]]
+
+    def test_existing_messages_stay_oldest(
+        self, pool: ConnectionPool, layout: PartitionLayout, clock: Clock
+    ) -> None:
+        """Test that partitions continue after the ids already in lora_messages."""
+        with pool.connection() as conn:
+            write_messages(conn, [("", "a", "", "", 0, 0, 0, 0)] * 5)
+        store_days(pool, layout, clock, 1)
+        with pool.connection() as conn:
+            assert [p.first_id for p in layout.partitions(conn)] == [0, 6]
+
+    def test_new_partition_deduplicates(self, pool: ConnectionPool, clock: Clock) -> None:
+        """Test that partitions get the deduplication index of the layout."""
+        layout = PartitionLayout("day", clock=clock, dedup_window_ms=60000)
+        row = ("", "a", "", "", 0, 0, 1000, 1)
+        with pool.connection() as conn:
+            assert write_messages(conn, [row, row], layout, DuplicateFilter(60)) == (
+                [row],
+                [1],
+                [True, False],
+            )
+            assert conn.execute("SELECT COUNT(*) FROM lora_messages_20240103").fetchone()[0] == 1
+
+    def test_clock_set_back(
+        self, pool: ConnectionPool, layout: PartitionLayout, clock: Clock
+    ) -> None:
+        """Test that an earlier clock keeps writing to the newest partition."""
+        store_days(pool, layout, clock, 2)
+        clock.now -= timedelta(days=10)
+        store_days(pool, layout, clock, 1)
+        with pool.connection() as conn:
+            assert len(layout.partitions(conn)) == 3
+
+
+class TestPartitionedReads:
+    """Tests for message queries over partitions."""
+
+    @pytest.fixture(autouse=True)
+    def messages(self, pool: ConnectionPool, layout: PartitionLayout, clock: Clock) -> None:
+        """Store three messages on each of four days, ids 1 to 12."""
+        store_days(pool, layout, clock, 4)
+
+    def test_pages_span_partitions(self, pool: ConnectionPool, layout: PartitionLayout) -> None:
+        """Test that pages fill up from several partitions in id order."""
+        with pool.connection() as conn:
+            page = message_page(conn, "/messages", PageRequest(5), None, layout)
+            assert [row[0] for row in page.rows] == [12, 11, 10, 9, 8]
+            page = message_page(conn, "/messages", PageRequest(5, before_id=8), None, layout)
+            assert [row[0] for row in page.rows] == [7, 6, 5, 4, 3]
+            page = message_page(conn, "/messages", PageRequest(5, after_id=2), None, layout)
+            assert [row[0] for row in page.rows] == [3, 4, 5, 6, 7]
+            page = message_page(conn, "/messages/a", PageRequest(3), "a", layout)
+            assert [row[0] for row in page.rows] == [11, 8, 5]
+
+    def test_cursor_prunes_partitions(
+        self, pool: ConnectionPool, layout: PartitionLayout
+    ) -> None:
+        """Test that partitions outside the cursor's range are not queried."""
+        queries: list[str] = []
+        with pool.connection() as conn:
+            conn.set_trace_callback(queries.append)
+            try:
+                message_page(conn, "/messages", PageRequest(1, before_id=6), None, layout)
+                message_page(conn, "/messages", PageRequest(1, after_id=9), None, layout)
+            finally:
+                conn.set_trace_callback(None)
+        tables = [
+            table
+            for query in queries
+            for table in ("20240103", "20240104", "20240105", "20240106")
+            if f"lora_messages_{table}" in query
+        ]
+        assert tables == ["20240104", "20240106"]
+
+    def test_time_range(self, pool: ConnectionPool, layout: PartitionLayout) -> None:
+        """Test that a time range is resolved to ids over every partition."""
+        where = MessageFilter(since=4, until=10)
+        ids: list[int] = []
+        with pool.connection() as conn:
+            page = PageRequest(4)
+            while True:
+                result = message_page(conn, "/messages", page, None, layout, where)
+                ids += [row[0] for row in result.rows]
+                if result.next is None:
+                    break
+                query = dict(parse_qsl(urlsplit(result.next).query))
+                page = PageRequest.from_query(query, 100, 1000)
+                where = MessageFilter.from_query(query)
+        assert (where.min_id, where.max_id) == (5, 10)
+        assert ids == [10, 9, 8, 7, 6, 5]
+
+    def test_time_range_prunes_partitions(
+        self, pool: ConnectionPool, layout: PartitionLayout
+    ) -> None:
+        """Test that partitions without a timestamp in range are not searched."""
+        queries: list[str] = []
+        with pool.connection() as conn:
+            assert [(p.min_timestamp, p.max_timestamp) for p in layout.partitions(conn)] == [
+                (None, None),
+                (0, 2),
+                (3, 5),
+                (6, 8),
+                (9, 11),
+            ]
+            conn.set_trace_callback(queries.append)
+            try:
+                where = resolve_id_range(conn, MessageFilter(since=5, until=6), layout=layout)
+            finally:
+                conn.set_trace_callback(None)
+        tables = [
+            table
+            for query in queries
+            for table in ("20240103", "20240104", "20240105", "20240106")
+            if f"lora_messages_{table}" in query
+        ]
+        assert tables == ["20240104"]
+        assert (where.min_id, where.max_id) == (6, 6)
+
+    def test_stream(self, pool: ConnectionPool, layout: PartitionLayout) -> None:
+        """Test that streamed chunks cover every partition once."""
+        chunks = message_chunks(pool, PageRequest(0), chunk_size=5, layout=layout)
+        assert [row[0] for chunk in chunks for row in chunk] == list(range(12, 0, -1))
+
+
+class TestLayoutSwitch:
+    """Tests for switching partitioning off and on again."""
+
+    def test_messages_move_to_partition(
+        self, db_path: str, pool: ConnectionPool, layout: PartitionLayout, clock: Clock
+    ) -> None:
+        """Test that messages stored without partitioning keep ids above the partitions'."""
+        store_days(pool, layout, clock, 2)
+        init_db(db_path)
+        with pool.connection() as conn:
+            _, ids, _ = write_messages(conn, [("", "c", "", "", 0, 0, 20, 20)] * 2)
+        assert ids == [7, 8]
+        init_db(db_path, partitioned=True)
+        store_days(pool, layout, clock, 1)
+        with pool.connection() as conn:
+            partitions = layout.partitions(conn)
+            assert conn.execute("SELECT COUNT(*) FROM lora_messages").fetchone()[0] == 0
+            moved = conn.execute("SELECT id FROM lora_messages_20240104 ORDER BY id").fetchall()
+            page = message_page(conn, "/messages", PageRequest(20), None, layout)
+        assert [row[0] for row in moved] == [4, 5, 6, 7, 8]
+        assert (partitions[2].min_timestamp, partitions[2].max_timestamp) == (3, 20)
+        assert [partition.first_id for partition in partitions] == [0, 1, 4, 9]
+        assert [row[0] for row in page.rows] == list(range(11, 0, -1))
+
+    def test_overlapping_ids_rejected(
+        self, db_path: str, pool: ConnectionPool, layout: PartitionLayout, clock: Clock
+    ) -> None:
+        """Test that ids partitions also use stop the switch instead of being moved."""
+        store_days(pool, layout, clock, 1)
+        with pool.connection() as conn:
+            write_messages(conn, [("", "c", "", "", 0, 0, 20, 20)])
+        with pytest.raises(RuntimeError, match="from 1 on"):
+            init_db(db_path, partitioned=True)
+
+
+class TestPartitionedRetention:
+    """Tests for retention over partitions."""
+
+    def test_max_age_drops_partitions(
+        self, pool: ConnectionPool, db_path: str, clock: Clock
+    ) -> None:
+        """Test that partitions older than the cutoff are dropped whole."""
+        now = datetime.now(timezone.utc)
+        clock.now = now - timedelta(days=5)
+        layout = PartitionLayout("day", clock=clock)
+        store_days(pool, layout, clock, 5)
+        worker = RetentionWorker(pool, db_path, max_age=2.5 * 86400, layout=layout)
+        assert worker.run_once() == 6
+        with pool.connection() as conn:
+            starts = [p.period_start for p in layout.partitions(conn)]
+        expected = [(now - timedelta(days=days)).date().isoformat() for days in (3, 2, 1)]
+        assert starts == ["", *expected]
+
+    def test_emptied_legacy_table_skipped(
+        self, pool: ConnectionPool, db_path: str, clock: Clock
+    ) -> None:
+        """Test that a pass with nothing to expire drops nothing again."""
+        clock.now = datetime.now(timezone.utc) - timedelta(days=5)
+        layout = PartitionLayout("day", clock=clock)
+        store_days(pool, layout, clock, 5)
+        deletes: list[None] = []
+        worker = RetentionWorker(
+            pool,
+            db_path,
+            max_age=2.5 * 86400,
+            layout=layout,
+            on_delete=lambda: deletes.append(None),
+        )
+        assert worker.run_once() == 6
+        deletes.clear()
+        assert worker.run_once() == 0
+        assert deletes == []
+
+    def test_max_rows_drops_then_trims(
+        self, pool: ConnectionPool, db_path: str, layout: PartitionLayout, clock: Clock
+    ) -> None:
+        """Test that whole partitions go first and the rest is trimmed by row."""
+        store_days(pool, layout, clock, 4)
+        worker = RetentionWorker(pool, db_path, max_rows=5, layout=layout)
+        assert worker.run_once() == 7
+        chunks = message_chunks(pool, PageRequest(0), layout=layout)
+        assert [row[0] for chunk in chunks for row in chunk] == [12, 11, 10, 9, 8]
+        with pool.connection() as conn:
+            assert len(layout.partitions(conn)) == 3
+
+    def test_newest_partition_kept(
+        self, pool: ConnectionPool, db_path: str, layout: PartitionLayout, clock: Clock
+    ) -> None:
+        """Test that the partition receiving messages is only ever trimmed."""
+        store_days(pool, layout, clock, 2)
+        worker = RetentionWorker(pool, db_path, max_rows=1, layout=layout)
+        worker.run_once()
+        with pool.connection() as conn:
+            partitions = layout.partitions(conn)
+        assert [p.period_start for p in partitions] == ["", "2024-01-04"]
+        assert [
+            row[0] for chunk in message_chunks(pool, PageRequest(0), layout=layout) for row in chunk
+        ] == [6]
@@ -0,0 +1,149 @@
+"""Tests for message retention."""
+
+import time
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from webapi_example.compact import epoch_ms
+from webapi_example.database import INSERT_MESSAGE, ConnectionPool
+from webapi_example.retention import RetentionWorker
+
+
+def store(pool: ConnectionPool, count: int, age_days: float = 0, data: str = "") -> None:
+    """Store messages with sqn 0 to count - 1, timestamped age_days ago."""
+    timestamp = epoch_ms(datetime.now(timezone.utc) - timedelta(days=age_days))
+    rows = [("", "a", "", data, 0, 0, timestamp, sqn) for sqn in range(count)]
+    with pool.connection() as conn:
+        with conn:
+            conn.executemany(INSERT_MESSAGE, rows)
+
+
+def stored_sqns(pool: ConnectionPool) -> list[int]:
+    """Return the sqn of every stored message, oldest first."""
+    with pool.connection() as conn:
+        rows = conn.execute("SELECT sequence_number FROM lora_messages ORDER BY id").fetchall()
+    return [row[0] for row in rows]
+
+
+class TestRetentionWorker:
+    """Tests for RetentionWorker."""
+
+    def test_max_age(self, pool: ConnectionPool, db_path: str) -> None:
+        """Test that messages older than max_age are deleted in chunks."""
+        store(pool, 25, age_days=3)
+        store(pool, 5)
+        deletes: list[None] = []
+        worker = RetentionWorker(
+            pool, db_path, max_age=86400, chunk_rows=10, on_delete=lambda: deletes.append(None)
+        )
+        assert worker.run_once() == 25
+        assert stored_sqns(pool) == [0, 1, 2, 3, 4]
+        assert len(deletes) == 3
+
+    def test_max_rows(self, pool: ConnectionPool, db_path: str) -> None:
+        """Test that only the newest max_rows messages are kept."""
+        store(pool, 23)
+        worker = RetentionWorker(pool, db_path, max_rows=5, chunk_rows=4)
+        assert worker.run_once() == 18
+        assert stored_sqns(pool) == [18, 19, 20, 21, 22]
+        assert worker.run_once() == 0
+
+    def test_max_bytes(self, pool: ConnectionPool, db_path: str) -> None:
+        """Test that the oldest messages go until the data fits in max_bytes."""
+        store(pool, 400, data="x" * 1000)
+        worker = RetentionWorker(pool, db_path, max_bytes=200 * 1024, chunk_rows=20)
+        purged = worker.run_once()
+        assert 0 < purged < 400
+        with pool.connection() as conn:
+            page_size, pages, free = (
+                conn.execute(f"PRAGMA {name}").fetchone()[0]
+                for name in ("page_size", "page_count", "freelist_count")
+            )
+        assert (pages - free) * page_size <= 200 * 1024
+        assert stored_sqns(pool)[-1] == 399
+
+    def test_rollup_max_age(self, pool: ConnectionPool, db_path: str) -> None:
+        """Test that rollup buckets expire per resolution and messages stay."""
+        store(pool, 3, age_days=3)
+        now = epoch_ms(datetime.now(timezone.utc))
+        with pool.connection() as conn:
+            with conn:
+                for resolution in ("minute", "hour"):
+                    conn.executemany(
+                        f"INSERT INTO traffic_{resolution} VALUES ('deveui', 'a', ?, 1, 0)",
+                        [(now - days * 86_400_000,) for days in (0, 1, 3, 5)],
+                    )
+        deletes: list[None] = []
+        worker = RetentionWorker(
+            pool,
+            db_path,
+            chunk_rows=1,
+            on_delete=lambda: deletes.append(None),
+            rollup_max_age={"minute": 2 * 86400, "hour": 4 * 86400, "day": 0},
+        )
+        assert worker.run_once() == 0
+        with pool.connection() as conn:
+            counts = [
+                conn.execute(f"SELECT count(*) FROM traffic_{resolution}").fetchone()[0]
+                for resolution in ("minute", "hour")
+            ]
+        assert counts == [2, 3]
+        assert stored_sqns(pool) == [0, 1, 2]
+        assert worker.stats()["rollup_buckets_purged"] == 3
+        assert deletes == []
+
+    def test_no_limits(self, pool: ConnectionPool, db_path: str) -> None:
+        """Test that a limit of 0 is not enforced."""
+        store(pool, 5, age_days=1000)
+        assert RetentionWorker(pool, db_path).run_once() == 0
+
+    def test_stats(self, pool: ConnectionPool, db_path: str) -> None:
+        """Test that purged messages and database size are reported."""
+        store(pool, 10)
+        worker = RetentionWorker(pool, db_path, max_rows=4)
+        worker.run_once()
+        stats = worker.stats()
+        assert (stats["purged"], stats["passes"]) == (6, 1)
+        assert stats["db_bytes"] > 0
+        assert worker.summary().startswith("purged 6 msgs, db ")
+
+    def test_thread(self, pool: ConnectionPool, db_path: str) -> None:
+        """Test that the thread runs a pass at start and stops promptly."""
+        store(pool, 10)
+        worker = RetentionWorker(pool, db_path, max_rows=4, interval=3600)
+        worker.start()
+        try:
+            for _ in range(500):
+                if worker.stats()["passes"]:
+                    break
+                time.sleep(0.01)
+        finally:
+            worker.stop()
+        assert stored_sqns(pool) == [6, 7, 8, 9]
+
+    def test_thread_survives_failure(
+        self, pool: ConnectionPool, db_path: str, monkeypatch: pytest.MonkeyPatch
+    ) -> None:
+        """Test that an unexpected error is logged and the next pass still runs."""
+        store(pool, 10)
+        worker = RetentionWorker(pool, db_path, max_rows=4, interval=0.01)
+        run_once = worker.run_once
+        calls: list[int] = []
+
+        def failing_once() -> int:
+            calls.append(1)
+            if len(calls) == 1:
+                raise KeyError("boom")
+            return run_once()
+
+        monkeypatch.setattr(worker, "run_once", failing_once)
+        worker.start()
+        try:
+            for _ in range(500):
+                if worker.stats()["passes"]:
+                    break
+                time.sleep(0.01)
+        finally:
+            worker.stop()
+        assert len(calls) >= 2
+        assert stored_sqns(pool) == [6, 7, 8, 9]
@@ -0,0 +1,150 @@
+"""Tests for traffic rollups."""
+
+import pytest
+from webapi_example.database import SELECT_TRAFFIC, ConnectionPool
+from webapi_example.ingest import DuplicateFilter, message_row, write_messages
+from webapi_example.partitions import PartitionLayout
+from webapi_example.rollups import TrafficQuery, traffic_series, traffic_updates
+
+# 2024-01-15T10:00:00Z
+HOUR = 1705312800000
+
+
+def uplink(
+    sqn: int, timestamp: str = "2024-01-15T10:00:00.000Z", deveui: str = "a", **fields: object
+) -> dict[str, object]:
+    """Return a message object of size 10."""
+    message = {"deveui": deveui, "sqn": sqn, "timestamp": timestamp, "size": 10}
+    return {**message, **fields}
+
+
+@pytest.fixture
+def dedup_window_ms() -> int:
+    """Create the test database with a one minute dedup index."""
+    return 60000
+
+
+class TestTrafficUpdates:
+    """Tests for traffic_updates()."""
+
+    def test_aggregates_per_scope_and_bucket(self) -> None:
+        """Test that rows are counted per device, application and gateway."""
+        rows = [
+            message_row(uplink(1, appeui="x")),
+            message_row(uplink(2, "2024-01-15T10:59:59.999Z")),
+            message_row(uplink(1, "2024-01-15T11:00:00.000Z", deveui="b", appeui="x")),
+        ]
+        assert sorted(traffic_updates(rows, 3_600_000)) == [
+            ("all", "", HOUR, 2, 20),
+            ("all", "", HOUR + 3_600_000, 1, 10),
+            ("appeui", "x", HOUR, 1, 10),
+            ("appeui", "x", HOUR + 3_600_000, 1, 10),
+            ("deveui", "a", HOUR, 2, 20),
+            ("deveui", "b", HOUR + 3_600_000, 1, 10),
+        ]
+
+    def test_skips_rows_without_timestamp(self) -> None:
+        """Test that rows without an epoch millisecond timestamp are not counted."""
+        rows = [("", "a", "", None, None, 5, None, 1), ("", "a", "", None, None, 5, "x", 2)]
+        assert traffic_updates(rows, 60_000) == []
+
+
+class TestWriteMessages:
+    """Tests for the rollups kept by write_messages()."""
+
+    def series(
+        self, pool: ConnectionPool, resolution: str, **query: str
+    ) -> list[tuple[str, int, int]]:
+        """Return (start, messages, bytes) of each bucket on 2024-01-15."""
+        params = {"resolution": resolution, "since": "2024-01-15T00:00:00Z", **query}
+        params.setdefault("until", "2024-01-16T00:00:00Z")
+        with pool.connection() as conn:
+            result = traffic_series(conn, TrafficQuery.from_query(params))
+        return [(b["start"], b["messages"], b["bytes"]) for b in result["buckets"]]
+
+    def test_counts_every_resolution(self, pool: ConnectionPool) -> None:
+        """Test that a batch is added to the minute, hour and day rollups."""
+        with pool.connection() as conn:
+            write_messages(conn, [message_row(uplink(1)), message_row(uplink(2))])
+            write_messages(conn, [message_row(uplink(3, "2024-01-15T10:01:30.000Z"))])
+        assert self.series(pool, "minute") == [
+            ("2024-01-15T10:00:00.000Z", 2, 20),
+            ("2024-01-15T10:01:00.000Z", 1, 10),
+        ]
+        assert self.series(pool, "hour", deveui="a") == [("2024-01-15T10:00:00.000Z", 3, 30)]
+        assert self.series(pool, "day") == [("2024-01-15T00:00:00.000Z", 3, 30)]
+        assert self.series(pool, "day", deveui="b") == []
+
+    def test_duplicates_not_counted(self, pool: ConnectionPool) -> None:
+        """Test that rows the partitioned, deduplicating path skips are not counted."""
+        layout = PartitionLayout("day", dedup_window_ms=60000)
+        with pool.connection() as conn:
+            rows = [message_row(uplink(1, appeui="x")), message_row(uplink(1, appeui="x"))]
+            write_messages(conn, rows, layout, DuplicateFilter(60))
+        assert self.series(pool, "hour", appeui="x") == [("2024-01-15T10:00:00.000Z", 1, 10)]
+
+
+class TestTrafficQuery:
+    """Tests for TrafficQuery."""
+
+    def test_defaults(self) -> None:
+        """Test that the default range is the last 24 hours, current hour included."""
+        query = TrafficQuery.from_query({}, now=(HOUR + 1234) / 1000)
+        assert query == TrafficQuery("hour", "all", "", HOUR - 23 * 3_600_000, HOUR + 3_600_000)
+
+    def test_aligns_to_buckets(self) -> None:
+        """Test that since and until are rounded down to a bucket start."""
+        query = TrafficQuery.from_query(
+            {
+                "resolution": "day",
+                "appeui": "x",
+                "since": "2024-01-10T12:00:00Z",
+                "until": "2024-01-15T10:00:00Z",
+            }
+        )
+        assert query == TrafficQuery("day", "appeui", "x", 1704844800000, 1705276800000)
+
+    @pytest.mark.parametrize(
+        "params",
+        [
+            {"resolution": "week"},
+            {"deveui": "a", "appeui": "x"},
+            {"since": "yesterday"},
+            {"since": "2024-01-15T10:00:00Z", "until": "2024-01-15T10:30:00Z"},
+            {"resolution": "minute", "since": "2000-01-01T00:00:00Z"},
+        ],
+    )
+    def test_invalid(self, params: dict[str, str]) -> None:
+        """Test that invalid parameters raise ValueError."""
+        with pytest.raises(ValueError):
+            TrafficQuery.from_query(params)
+
+
+class TestTrafficSeries:
+    """Tests for traffic_series()."""
+
+    def test_document(self, pool: ConnectionPool) -> None:
+        """Test the response document of a device chart."""
+        with pool.connection() as conn:
+            write_messages(conn, [message_row(uplink(1))])
+            query = TrafficQuery("hour", "deveui", "a", HOUR - 3_600_000, HOUR + 3_600_000)
+            assert traffic_series(conn, query) == {
+                "resolution": "hour",
+                "deveui": "a",
+                "since": "2024-01-15T09:00:00.000Z",
+                "until": "2024-01-15T11:00:00.000Z",
+                "buckets": [{"start": "2024-01-15T10:00:00.000Z", "messages": 1, "bytes": 10}],
+            }
+
+    @pytest.mark.parametrize("resolution", ["minute", "hour", "day"])
+    def test_reads_primary_key_range(self, pool: ConnectionPool, resolution: str) -> None:
+        """Test that a chart is one primary key search, without scans or sorting."""
+        with pool.connection() as conn:
+            plan = " | ".join(
+                row[3]
+                for row in conn.execute(
+                    "EXPLAIN QUERY PLAN " + SELECT_TRAFFIC[resolution], ("all", "", 0, 1)
+                )
+            )
+        assert plan.startswith(f"SEARCH traffic_{resolution} USING PRIMARY KEY"), plan
+        assert "SCAN" not in plan and "TEMP B-TREE" not in plan, plan
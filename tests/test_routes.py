@@ -1,13 +1,45 @@
 """Tests for API routes."""
 
+import gc
+import gzip
+import logging
+import time
+from pathlib import Path
 from typing import TYPE_CHECKING
 
 import pytest
+from webapi_example.app import create_app, init_db
+from webapi_example.devices import DeviceRegistry
+from webapi_example.models.config import AppConfig, DatabaseConfig, LogConfig, ServerConfig
 
 if TYPE_CHECKING:
+    from flask import Flask
     from flask.testing import FlaskClient
 
 
+class TestCreateApp:
+    """Tests for the application factory."""
+
+    def test_schema_before_state(self, tmp_path: Path, caplog: pytest.LogCaptureFixture) -> None:
+        """Test that the first retention pass runs on a migrated schema."""
+        config = AppConfig(
+            database=DatabaseConfig(path=str(tmp_path / "test.db")),
+            log=LogConfig(level="DEBUG", use_syslog=False),
+        )
+        with caplog.at_level(logging.DEBUG):
+            app = create_app(config)
+            retention = app.extensions["state"].retention
+            assert retention is not None
+            deadline = time.monotonic() + 5
+            while retention.stats()["passes"] == 0:
+                assert time.monotonic() < deadline, "no retention pass"
+                time.sleep(0.01)
+            del app
+            gc.collect()
+        assert "Retention pass failed" not in caplog.text
+        assert "Application state closed" in caplog.text
+
+
 class TestHealthEndpoint:
     """Tests for the health check endpoint."""
 
@@ -123,6 +155,61 @@ class TestMessageEndpoints:
         assert response.status_code == 400
         assert "error" in response.json
 
+    def test_message_round_trip(self, client: "FlaskClient") -> None:
+        """Test that payloads and timestamps read back unchanged."""
+        timestamps = ["2024-01-15T10:00:00.500Z", "2024-01-15T12:00:00.5+02:00", "yesterday"]
+        for data, timestamp in zip(("SGVsbG8=", "0a1b", "not encoded"), timestamps, strict=True):
+            client.post("/messages", json={"deveui": "a", "data": data, "timestamp": timestamp})
+        messages = client.get("/messages").json["messages"]
+        assert [message["data"] for message in messages] == ["not encoded", "0a1b", "SGVsbG8="]
+        assert [message["timestamp"] for message in messages] == timestamps[::-1]
+
+    def test_create_message_invalid_timestamp(self, client: "FlaskClient") -> None:
+        """Test that a timestamp that is not a string is rejected."""
+        response = client.post("/messages", json={"deveui": "a", "timestamp": 1705312800})
+        assert response.status_code == 400
+        assert "timestamp" in response.json["error"]
+
+    def test_filtered_messages(self, client: "FlaskClient") -> None:
+        """Test filtering by application and time range, with the filters kept in links."""
+        batch = [
+            {
+                "deveui": "a",
+                "appeui": f"app{n % 2}",
+                "sqn": n,
+                "timestamp": f"2024-01-15T1{n}:00:00.000Z",
+            }
+            for n in range(6)
+        ]
+        client.post("/messages/batch", json=batch)
+        response = client.get(
+            "/messages?appeui=app0&since=2024-01-15T11:00:00Z&until=2024-01-15T15:00:00Z&limit=1"
+        )
+        assert response.status_code == 200
+        assert [message["sqn"] for message in response.json["messages"]] == [4]
+        assert "appeui=app0" in response.json["next"]
+        assert "since=2024-01-15T11%3A00%3A00.000Z" in response.json["next"]
+        response = client.get(response.json["next"])
+        assert [message["sqn"] for message in response.json["messages"]] == [2]
+        assert "next" not in response.json
+
+        response = client.get("/messages?deveui=unknown")
+        assert (response.status_code, response.json) == (200, {"messages": []})
+        response = client.get("/messages/a?since=2024-01-15T15:00:00Z")
+        assert [message["sqn"] for message in response.json["messages"]] == [5]
+
+    def test_invalid_filter(self, client: "FlaskClient") -> None:
+        """Test that a malformed time bound is rejected."""
+        response = client.get("/messages?since=yesterday")
+        assert response.status_code == 400
+        assert "since" in response.json["error"]
+
+    def test_ingest_stats(self, client: "FlaskClient") -> None:
+        """Test that ingest counters report deduplication as disabled by default."""
+        response = client.get("/stats/ingest")
+        assert response.status_code == 200
+        assert response.json["dedup"] == {"enabled": False}
+
     def test_get_messages_by_device(self, client: "FlaskClient") -> None:
         """Test getting messages for a specific device."""
         # Create message first
@@ -144,3 +231,235 @@ class TestMessageEndpoints:
         """Test getting messages for non-existent device."""
         response = client.get("/messages/non-existent-device")
         assert response.status_code == 404
+
+    def test_create_messages_batch(self, client: "FlaskClient") -> None:
+        """Test creating several messages in one request."""
+        response = client.post(
+            "/messages/batch",
+            json=[
+                {"deveui": "00-11-22-33-44-55-66-77", "sqn": 1},
+                {"deviceName": "NoEui"},
+                {"deveui": "00-11-22-33-44-55-66-77", "sqn": 2},
+            ],
+        )
+        assert response.status_code == 201
+        assert response.json["created"] == 2
+        assert response.json["failed"] == 1
+        assert response.json["results"][1] == {
+            "index": 1,
+            "status": "error",
+            "error": "deveui is required",
+        }
+        response = client.get("/messages/00-11-22-33-44-55-66-77")
+        assert len(response.json["messages"]) == 2
+
+    def test_get_messages_paginated(self, client: "FlaskClient") -> None:
+        """Test that message listings are paged with a next link."""
+        client.post("/messages/batch", json=[{"deveui": "a", "sqn": sqn} for sqn in range(3)])
+        response = client.get("/messages?limit=2")
+        assert [message["sqn"] for message in response.json["messages"]] == [2, 1]
+        response = client.get(response.json["next"])
+        assert [message["sqn"] for message in response.json["messages"]] == [0]
+        assert "next" not in response.json
+
+    def test_get_messages_streamed(self, client: "FlaskClient") -> None:
+        """Test that limit=0 returns every message in one streamed document."""
+        client.post("/messages/batch", json=[{"deveui": "a", "sqn": sqn} for sqn in range(3)])
+        response = client.get("/messages/a?limit=0")
+        assert response.is_streamed
+        assert [message["sqn"] for message in response.json["messages"]] == [2, 1, 0]
+
+    def test_cached_page_invalidated_by_write(self, client: "FlaskClient") -> None:
+        """Test that a cached device page reflects later writes."""
+        client.post("/messages", json={"deveui": "a", "sqn": 1})
+        client.get("/messages/a")
+        client.get("/messages/a")
+        client.post("/messages", json={"deveui": "a", "sqn": 2})
+        response = client.get("/messages/a")
+        assert [message["sqn"] for message in response.json["messages"]] == [2, 1]
+        stats = client.get("/stats/cache").json
+        assert (stats["hits"], stats["invalidations"]) == (1, 1)
+
+    def test_get_messages_not_modified(self, client: "FlaskClient") -> None:
+        """Test that a current ETag gets 304 until a message is written."""
+        client.post("/messages", json={"deveui": "a"})
+        etag = client.get("/messages/a").headers["ETag"]
+        response = client.get("/messages/a", headers={"If-None-Match": etag})
+        assert response.status_code == 304
+        assert response.data == b""
+        client.post("/messages", json={"deveui": "a"})
+        response = client.get("/messages/a", headers={"If-None-Match": etag})
+        assert response.status_code == 200
+
+    def test_get_messages_compressed(self, client: "FlaskClient") -> None:
+        """Test that large listings are gzip compressed when accepted."""
+        client.post("/messages/batch", json=[{"deveui": "a", "sqn": sqn} for sqn in range(50)])
+        plain = client.get("/messages")
+        response = client.get("/messages", headers={"Accept-Encoding": "gzip"})
+        assert response.headers["Content-Encoding"] == "gzip"
+        assert response.headers["ETag"] == plain.headers["ETag"][:-1] + '-gzip"'
+        assert gzip.decompress(response.data) == plain.data
+
+
+class TestDeviceEndpoints:
+    """Tests for device summary endpoints."""
+
+    def test_summaries(self, client: "FlaskClient") -> None:
+        """Test that stored messages show up in the device summaries."""
+        client.post(
+            "/messages/batch",
+            json=[
+                {"deveui": "b", "sqn": 1, "size": 5, "timestamp": "2024-01-15T10:00:00.000Z"},
+                {"deveui": "a", "deviceName": "s", "sqn": 1, "data": "00ff", "size": 2},
+                {"deveui": "a", "sqn": 2, "data": "SGVsbG8=", "size": 5},
+            ],
+        )
+        response = client.get("/devices")
+        assert response.status_code == 200
+        assert [device["deveui"] for device in response.json["devices"]] == ["a", "b"]
+
+        response = client.get("/devices/a")
+        assert response.status_code == 200
+        device = response.json["device"]
+        assert (device["deviceName"], device["messageCount"], device["totalBytes"]) == ("s", 2, 7)
+        assert (device["lastSqn"], device["lastData"]) == (2, "SGVsbG8=")
+        assert client.get("/devices/b").json["device"]["lastSeen"] == "2024-01-15T10:00:00.000Z"
+
+    def test_unknown_device(self, client: "FlaskClient") -> None:
+        """Test that an unknown device is a 404."""
+        response = client.get("/devices/missing")
+        assert response.status_code == 404
+        assert response.json == {"error": "Device not found"}
+
+    def test_not_modified(self, client: "FlaskClient") -> None:
+        """Test that the listing ETag changes only when messages are stored."""
+        etag = client.get("/devices").headers["ETag"]
+        response = client.get("/devices", headers={"If-None-Match": etag})
+        assert response.status_code == 304
+        client.post("/messages", json={"deveui": "a"})
+        response = client.get("/devices", headers={"If-None-Match": etag})
+        assert response.status_code == 200
+
+    def test_loaded_at_startup(self, app: "Flask", client: "FlaskClient") -> None:
+        """Test that summaries are read back from the database by init_db()."""
+        client.post("/messages", json={"deveui": "a", "sqn": 3})
+        app.extensions["state"].devices = DeviceRegistry()
+        init_db(app)
+        assert client.get("/devices/a").json["device"]["lastSqn"] == 3
+
+
+class TestTrafficEndpoint:
+    """Tests for the traffic chart endpoint."""
+
+    def test_chart(self, client: "FlaskClient") -> None:
+        """Test that an application's messages are counted per day."""
+        client.post(
+            "/messages/batch",
+            json=[
+                {"deveui": "a", "appeui": "x", "size": 4, "timestamp": "2024-01-15T10:00:00.000Z"},
+                {"deveui": "b", "appeui": "x", "size": 6, "timestamp": "2024-01-16T23:59:59.000Z"},
+                {"deveui": "c", "appeui": "y", "size": 1, "timestamp": "2024-01-16T10:00:00.000Z"},
+            ],
+        )
+        response = client.get(
+            "/stats/traffic",
+            query_string={
+                "resolution": "day",
+                "appeui": "x",
+                "since": "2024-01-01T00:00:00Z",
+                "until": "2024-02-01T00:00:00Z",
+            },
+        )
+        assert response.status_code == 200
+        assert response.json == {
+            "resolution": "day",
+            "appeui": "x",
+            "since": "2024-01-01T00:00:00.000Z",
+            "until": "2024-02-01T00:00:00.000Z",
+            "buckets": [
+                {"start": "2024-01-15T00:00:00.000Z", "messages": 1, "bytes": 4},
+                {"start": "2024-01-16T00:00:00.000Z", "messages": 1, "bytes": 6},
+            ],
+        }
+
+    def test_default_range(self, client: "FlaskClient") -> None:
+        """Test that by default the last 24 hours of the whole gateway are charted."""
+        client.post("/messages", json={"deveui": "a", "timestamp": "2000-01-01T00:00:00.000Z"})
+        response = client.get("/stats/traffic")
+        assert response.status_code == 200
+        assert (response.json["resolution"], response.json["buckets"]) == ("hour", [])
+
+    def test_invalid(self, client: "FlaskClient") -> None:
+        """Test that conflicting filters are a 400."""
+        response = client.get("/stats/traffic?deveui=a&appeui=x")
+        assert response.status_code == 400
+        assert response.json == {"error": "deveui and appeui are mutually exclusive"}
+
+
+class TestLongPoll:
+    """Tests for waiting for new messages in the Flask app."""
+
+    def test_wait(self, client: "FlaskClient") -> None:
+        """Test that existing messages are returned and a timeout gives an empty page."""
+        client.post("/messages", json={"deveui": "a"})
+        response = client.get("/messages/a?after_id=0&wait=5")
+        assert [m["id"] for m in response.json["messages"]] == [1]
+        response = client.get("/messages?after_id=1&wait=0.05")
+        assert response.json == {"messages": [], "next": "/messages?limit=100&after_id=1"}
+
+    def test_wait_requires_after_id(self, client: "FlaskClient") -> None:
+        """Test that a wait without after_id is a 400."""
+        response = client.get("/messages?limit=0&wait=5")
+        assert response.status_code == 400
+        assert response.json == {"error": "wait requires after_id"}
+
+
+class TestLiveStream:
+    """Tests for the Server-Sent Events live feed."""
+
+    def test_stream(self, client: "FlaskClient") -> None:
+        """Test that new messages of the device are streamed until the client leaves."""
+        client.post("/messages", json={"deveui": "a", "sqn": 1})
+        response = client.get(
+            "/messages/stream?deveui=a", headers={"Last-Event-ID": "0"}, buffered=False
+        )
+        assert response.status_code == 200
+        assert response.mimetype == "text/event-stream"
+        chunks = iter(response.response)
+        assert next(chunks) == b": connected\n\n"
+        assert next(chunks).startswith(b"id: 1\ndata: ")
+        client.post("/messages/batch", json=[{"deveui": "b"}, {"deveui": "a", "sqn": 2}])
+        assert next(chunks).startswith(b"id: 3\ndata: ")
+        assert client.get("/stats/stream").json["clients"] == 1
+        response.close()
+        assert client.get("/stats/stream").json["clients"] == 0
+
+    def test_invalid_last_event_id(self, client: "FlaskClient") -> None:
+        """Test that a malformed resume id is a 400."""
+        response = client.get("/messages/stream?after_id=x")
+        assert response.status_code == 400
+
+
+class TestDeduplication:
+    """Tests for dropping duplicate uplinks in the Flask app."""
+
+    @pytest.fixture
+    def app_config(self) -> AppConfig:
+        """Enable deduplication over one minute."""
+        return AppConfig(
+            server=ServerConfig(host="127.0.0.1", port=5000, debug=True),
+            database=DatabaseConfig(path="test.db", dedup_window=60),
+            log=LogConfig(level="DEBUG", use_syslog=False),
+        )
+
+    def test_duplicate_ignored(self, client: "FlaskClient") -> None:
+        """Test that a repeated uplink is acknowledged but stored once."""
+        uplink = {"deveui": "a", "sqn": 1, "timestamp": "2024-01-15T10:00:00.000Z"}
+        assert client.post("/messages", json=uplink).status_code == 201
+        response = client.post("/messages", json=uplink)
+        assert response.status_code == 200
+        assert response.json == {"message": "Duplicate message ignored"}
+        response = client.post("/messages/batch", json=[uplink, dict(uplink, sqn=2)])
+        assert response.json["duplicates"] == 1
+        assert len(client.get("/messages").json["messages"]) == 2
+        assert client.get("/stats/ingest").json["dedup"]["duplicates"] == 2
@@ -0,0 +1,59 @@
+"""Tests for the stdlib server route table."""
+
+import pytest
+from webapi_example.routing import Router
+
+
+def handler(*args: object, **kwargs: object) -> None:
+    """Placeholder route handler."""
+
+
+class TestRouter:
+    """Tests for Router."""
+
+    def test_static_route(self) -> None:
+        """Test that static paths match exactly."""
+        router = Router()
+        router.route("/health")(handler)
+        match = router.match("GET", "/health")
+        assert match is not None
+        assert match.handler is handler
+        assert match.params == {}
+        assert router.match("GET", "/health/x") is None
+
+    def test_typed_parameters(self) -> None:
+        """Test that parameters are converted to their declared type."""
+        router = Router()
+        router.route("/messages/<int:message_id>")(handler)
+        router.route("/messages/<deveui>/latest")(handler)
+        match = router.match("GET", "/messages/42")
+        assert match is not None
+        assert match.params == {"message_id": 42}
+        match = router.match("GET", "/messages/0011%3A22/latest")
+        assert match is not None
+        assert match.params == {"deveui": "0011:22"}
+        assert router.match("GET", "/messages/abc") is None
+
+    def test_method_not_allowed(self) -> None:
+        """Test that a path match with the wrong method reports allowed methods."""
+        router = Router()
+        router.route("/users", methods=("GET", "POST"))(handler)
+        match = router.match("DELETE", "/users")
+        assert match is not None
+        assert match.handler is None
+        assert match.allowed == ("GET", "POST")
+
+    def test_duplicate_route(self) -> None:
+        """Test that registering a method twice for a pattern fails."""
+        router = Router()
+        router.route("/users/<username>")(handler)
+        with pytest.raises(ValueError, match="Duplicate route"):
+            router.route("/users/<username>")(handler)
+
+    def test_invalid_pattern(self) -> None:
+        """Test that unknown converters and relative patterns are rejected."""
+        router = Router()
+        with pytest.raises(ValueError):
+            router.route("/users/<uuid:id>")(handler)
+        with pytest.raises(ValueError):
+            router.route("users")(handler)
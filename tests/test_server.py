@@ -0,0 +1,1293 @@
+"""Tests for the stdlib HTTP server."""
+
+import gzip
+import http.client
+import json
+import re
+import socket
+import sqlite3
+import threading
+import time
+import zlib
+from typing import Any
+
+import pytest
+from webapi_example.models.config import (
+    AppConfig,
+    DatabaseConfig,
+    LogConfig,
+    ServerConfig,
+    StreamConfig,
+)
+from webapi_example.server import create_server
+
+
+def request(
+    address: tuple[str, int],
+    method: str,
+    path: str,
+    body: Any = None,
+    headers: dict[str, str] | None = None,
+) -> tuple[int, Any]:
+    """Send a request on a new connection and decode the JSON response."""
+    conn = http.client.HTTPConnection(*address, timeout=5)
+    try:
+        payload = json.dumps(body) if body is not None else None
+        conn.request(method, path, body=payload, headers=headers or {})
+        response = conn.getresponse()
+        data = response.read()
+        return response.status, json.loads(data) if data else None
+    finally:
+        conn.close()
+
+
+class TestConcurrency:
+    """Tests for the pooled request handling mode."""
+
+    def test_health(self, api_server: tuple[str, int]) -> None:
+        """Test that the pooled server answers requests."""
+        status, data = request(api_server, "GET", "/health")
+        assert status == 200
+        assert data == {"status": "ok"}
+
+    def test_slow_client_does_not_block_others(self, api_server: tuple[str, int]) -> None:
+        """Test that a client stuck mid-request does not stall other requests."""
+        # Open a connection and send only part of the request line
+        stalled = socket.create_connection(api_server, timeout=5)
+        stalled.sendall(b"GET /health HTTP/1.1\r\n")
+        try:
+            status, _ = request(api_server, "POST", "/messages", {"deveui": "0011223344556677"})
+            assert status == 201
+        finally:
+            stalled.close()
+
+    def test_parallel_ingest(self, api_server: tuple[str, int]) -> None:
+        """Test that concurrent POST /messages requests are all stored."""
+        statuses: list[int] = []
+        lock = threading.Lock()
+
+        def post(sqn: int) -> None:
+            status, _ = request(
+                api_server, "POST", "/messages", {"deveui": "0011223344556677", "sqn": sqn}
+            )
+            with lock:
+                statuses.append(status)
+
+        threads = [threading.Thread(target=post, args=(i,)) for i in range(10)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert statuses == [201] * 10
+        _, data = request(api_server, "GET", "/messages")
+        assert len(data["messages"]) == 10
+
+    def test_single_mode(self, server_config: AppConfig, tmp_path: Any) -> None:
+        """Test that the single-threaded mode still serves requests."""
+        server_config.server.concurrency = "single"
+        server = create_server(server_config, str(tmp_path / "test.db"))
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        try:
+            status, _ = request(server.server_address, "GET", "/health")
+            assert status == 200
+        finally:
+            server.shutdown()
+            server.server_close()
+
+    def test_unknown_mode(self, server_config: AppConfig, tmp_path: Any) -> None:
+        """Test that an unknown concurrency mode is rejected."""
+        server_config.server.concurrency = "bogus"
+        with pytest.raises(ValueError):
+            create_server(server_config, str(tmp_path / "test.db"))
+
+
+class TestAsyncEngine:
+    """Tests for the asyncio engine."""
+
+    @pytest.fixture
+    def server_config(self) -> AppConfig:
+        """Configure the asyncio engine on an ephemeral port."""
+        return AppConfig(
+            server=ServerConfig(host="127.0.0.1", port=0, concurrency="asyncio", workers=2),
+            log=LogConfig(level="DEBUG", use_syslog=False),
+        )
+
+    def test_serves_same_routes(self, api_server: tuple[str, int]) -> None:
+        """Test that the asyncio engine serves the APIHandler routes."""
+        status, _ = request(api_server, "POST", "/messages", {"deveui": "0011223344556677"})
+        assert status == 201
+        status, data = request(api_server, "GET", "/messages/0011223344556677")
+        assert status == 200
+        assert data["messages"][0]["deveui"] == "0011223344556677"
+        status, _ = request(api_server, "GET", "/nope")
+        assert status == 404
+
+    def test_keep_alive(self, api_server: tuple[str, int]) -> None:
+        """Test that several requests are served on one connection."""
+        conn = http.client.HTTPConnection(*api_server, timeout=5)
+        try:
+            for _ in range(3):
+                conn.request("GET", "/health")
+                response = conn.getresponse()
+                assert response.status == 200
+                assert json.loads(response.read()) == {"status": "ok"}
+        finally:
+            conn.close()
+
+    def test_idle_connections_do_not_block(self, api_server: tuple[str, int]) -> None:
+        """Test that many idle connections leave the engine responsive."""
+        idle = [socket.create_connection(api_server, timeout=5) for _ in range(50)]
+        try:
+            status, _ = request(api_server, "GET", "/health")
+            assert status == 200
+        finally:
+            for sock in idle:
+                sock.close()
+
+    def test_chunked_request_rejected(self, api_server: tuple[str, int]) -> None:
+        """Test that bodies without Content-Length are refused."""
+        with socket.create_connection(api_server, timeout=5) as sock:
+            sock.sendall(
+                b"POST /messages HTTP/1.1\r\nHost: x\r\nTransfer-Encoding: chunked\r\n\r\n"
+            )
+            assert sock.recv(1024).startswith(b"HTTP/1.1 411")
+
+
+class TestKeepAlive:
+    """Tests for HTTP/1.1 persistent connections."""
+
+    @pytest.fixture
+    def server_config(self) -> AppConfig:
+        """Configure a short per-connection request limit."""
+        return AppConfig(
+            server=ServerConfig(host="127.0.0.1", port=0, workers=2, keepalive_max_requests=3),
+            log=LogConfig(level="DEBUG", use_syslog=False),
+        )
+
+    def test_connection_reused(self, api_server: tuple[str, int]) -> None:
+        """Test that requests share a connection until the request limit."""
+        conn = http.client.HTTPConnection(*api_server, timeout=5)
+        try:
+            conn.request("GET", "/health")
+            response = conn.getresponse()
+            response.read()
+            assert response.version == 11
+            assert response.getheader("Keep-Alive") == "timeout=5, max=2"
+            sock = conn.sock
+
+            conn.request("GET", "/health")
+            response = conn.getresponse()
+            response.read()
+            assert conn.sock is sock
+
+            conn.request("GET", "/health")
+            response = conn.getresponse()
+            response.read()
+            assert response.getheader("Connection") == "close"
+        finally:
+            conn.close()
+
+    def test_idle_connections_make_way(self, api_server: tuple[str, int]) -> None:
+        """Test that connections idling on every worker do not delay the next client."""
+        idle = [http.client.HTTPConnection(*api_server, timeout=5) for _ in range(2)]
+        try:
+            for conn in idle:
+                conn.request("GET", "/health")
+                response = conn.getresponse()
+                response.read()
+                assert response.getheader("Connection") is None
+            started = time.monotonic()
+            status, _ = request(api_server, "POST", "/messages", {"deveui": "a"})
+            assert status == 201
+            assert time.monotonic() - started < 1.0
+            # The idle connections were closed to free their workers
+            for conn in idle:
+                assert conn.sock is not None
+                assert conn.sock.recv(1) == b""
+        finally:
+            for conn in idle:
+                conn.close()
+
+    def test_pipelined_requests(self, api_server: tuple[str, int]) -> None:
+        """Test that pipelined requests are answered in order."""
+        body = b'{"deveui": "0011223344556677"}'
+        with socket.create_connection(api_server, timeout=5) as sock:
+            # The unknown route leaves its body unread; it must not leak
+            # into the following request
+            sock.sendall(
+                b"POST /unknown HTTP/1.1\r\nHost: x\r\nContent-Length: "
+                + str(len(body)).encode()
+                + b"\r\n\r\n"
+                + body
+                + b"POST /messages HTTP/1.1\r\nHost: x\r\nContent-Length: "
+                + str(len(body)).encode()
+                + b"\r\n\r\n"
+                + body
+                + b"GET /health HTTP/1.1\r\nHost: x\r\n\r\n"
+            )
+            data = b""
+            while True:
+                chunk = sock.recv(65536)
+                if not chunk:
+                    break
+                data += chunk
+
+        assert re.findall(rb"HTTP/1\.1 (\d{3})", data) == [b"404", b"201", b"200"]
+
+    def test_http10_closes(self, api_server: tuple[str, int]) -> None:
+        """Test that HTTP/1.0 requests without keep-alive close the connection."""
+        with socket.create_connection(api_server, timeout=5) as sock:
+            sock.sendall(b"GET /health HTTP/1.0\r\n\r\n")
+            data = sock.recv(65536)
+            assert b"Connection: close" in data
+            assert sock.recv(65536) == b""
+
+    def test_single_mode_closes(self, server_config: AppConfig, tmp_path: Any) -> None:
+        """Test that single mode never holds a connection open between requests."""
+        server_config.server.concurrency = "single"
+        server = create_server(server_config, str(tmp_path / "test.db"))
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        try:
+            conn = http.client.HTTPConnection(*server.server_address, timeout=5)
+            conn.request("GET", "/health")
+            response = conn.getresponse()
+            response.read()
+            assert response.getheader("Connection") == "close"
+            conn.close()
+        finally:
+            server.shutdown()
+            server.server_close()
+
+
+class TestRouting:
+    """Tests for request dispatch through the route table."""
+
+    def test_method_not_allowed(self, api_server: tuple[str, int]) -> None:
+        """Test that a known path with the wrong method gets 405 and Allow."""
+        conn = http.client.HTTPConnection(*api_server, timeout=5)
+        try:
+            conn.request("PUT", "/users")
+            response = conn.getresponse()
+            assert response.status == 405
+            assert response.getheader("Allow") == "GET, POST"
+            assert json.loads(response.read()) == {"error": "Method not allowed"}
+        finally:
+            conn.close()
+
+    def test_path_parameter_decoded(self, api_server: tuple[str, int]) -> None:
+        """Test that percent-encoded path parameters reach handlers decoded."""
+        status, _ = request(api_server, "POST", "/users", {"username": "a b/c", "password": "x"})
+        assert status == 201
+        status, data = request(api_server, "GET", "/users/a%20b%2Fc")
+        assert status == 200
+        assert data["user"]["username"] == "a b/c"
+        status, _ = request(api_server, "DELETE", "/users/a%20b%2Fc?force=1")
+        assert status == 200
+
+    def test_query_string_ignored_by_static_routes(self, api_server: tuple[str, int]) -> None:
+        """Test that a query string does not break matching of POST routes."""
+        status, _ = request(
+            api_server, "POST", "/messages?source=test", {"deveui": "0011223344556677"}
+        )
+        assert status == 201
+
+    def test_unknown_path(self, api_server: tuple[str, int]) -> None:
+        """Test that unknown paths still get 404."""
+        status, data = request(api_server, "DELETE", "/nope/1")
+        assert status == 404
+        assert data == {"error": "Not found"}
+
+
+class TestBatchIngest:
+    """Tests for POST /messages/batch."""
+
+    def test_json_array(self, api_server: tuple[str, int]) -> None:
+        """Test that a JSON array is stored in one request."""
+        batch = [{"deveui": "0011223344556677", "sqn": sqn} for sqn in range(200)]
+        status, data = request(api_server, "POST", "/messages/batch", batch)
+        assert status == 201
+        assert data["created"] == 200
+        assert data["failed"] == 0
+        status, data = request(api_server, "GET", "/messages/0011223344556677?limit=200")
+        assert len(data["messages"]) == 200
+
+    def test_ndjson(self, api_server: tuple[str, int]) -> None:
+        """Test that newline-delimited JSON is accepted."""
+        body = "\n".join(json.dumps({"deveui": "0011223344556677", "sqn": i}) for i in range(3))
+        conn = http.client.HTTPConnection(*api_server, timeout=5)
+        try:
+            conn.request(
+                "POST",
+                "/messages/batch",
+                body=body,
+                headers={"Content-Type": "application/x-ndjson"},
+            )
+            response = conn.getresponse()
+            assert response.status == 201
+            assert json.loads(response.read())["created"] == 3
+        finally:
+            conn.close()
+
+    def test_per_item_results(self, api_server: tuple[str, int]) -> None:
+        """Test that invalid items are reported without failing the batch."""
+        batch = {"messages": [{"deveui": "0011223344556677"}, {"deveui": "x", "size": "big"}]}
+        status, data = request(api_server, "POST", "/messages/batch", batch)
+        assert status == 201
+        assert data["results"] == [
+            {"index": 0, "status": "created"},
+            {"index": 1, "status": "error", "error": "size must be an integer"},
+        ]
+
+    def test_unstorable_items(self, api_server: tuple[str, int]) -> None:
+        """Test that values SQLite cannot bind are rejected per item."""
+        batch = [
+            {"deveui": "a"},
+            {"deveui": "a", "deviceName": {"x": 1}},
+            {"deveui": "a", "appeui": ["x"]},
+            {"deveui": "a", "sqn": 2**70},
+            {"deveui": "a", "size": -(2**63) - 1},
+        ]
+        status, data = request(api_server, "POST", "/messages/batch", batch)
+        assert status == 201
+        assert (data["created"], data["failed"]) == (1, 4)
+        assert [result["status"] for result in data["results"]][1:] == ["error"] * 4
+
+    def test_database_error(self, server_config: AppConfig, tmp_path: Any) -> None:
+        """Test that a failing insert is answered with 500."""
+        path = str(tmp_path / "test.db")
+        server = create_server(server_config, path)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        try:
+            with sqlite3.connect(path) as conn:
+                conn.execute("DROP TABLE devices")
+            status, data = request(
+                server.server_address, "POST", "/messages/batch", [{"deveui": "a"}]
+            )
+            assert status == 500
+            assert data == {"error": "Failed to create messages"}
+        finally:
+            server.shutdown()
+            server.server_close()
+
+    def test_all_invalid(self, api_server: tuple[str, int]) -> None:
+        """Test that a batch without valid messages is rejected."""
+        status, data = request(api_server, "POST", "/messages/batch", [{}, 5])
+        assert status == 400
+        assert data["created"] == 0
+        assert data["failed"] == 2
+
+    def test_too_large(self, api_server: tuple[str, int]) -> None:
+        """Test that batches above max_batch_size are refused."""
+        batch = [{"deveui": "0011223344556677"}] * 1001
+        status, _ = request(api_server, "POST", "/messages/batch", batch)
+        assert status == 413
+
+    def test_invalid_json(self, api_server: tuple[str, int]) -> None:
+        """Test that a malformed body gets 400."""
+        conn = http.client.HTTPConnection(*api_server, timeout=5)
+        try:
+            conn.request("POST", "/messages/batch", body="[{")
+            assert conn.getresponse().status == 400
+        finally:
+            conn.close()
+
+
+class TestWriteBehind:
+    """Tests for write-behind message ingest."""
+
+    @pytest.fixture
+    def server_config(self) -> AppConfig:
+        """Enable write-behind with a tiny queue."""
+        return AppConfig(
+            server=ServerConfig(host="127.0.0.1", port=0, workers=2),
+            database=DatabaseConfig(
+                path="test.db", write_behind=True, group_commit_ms=20, write_queue_size=10
+            ),
+            log=LogConfig(level="DEBUG", use_syslog=False),
+        )
+
+    def test_queued_messages_are_written(self, api_server: tuple[str, int]) -> None:
+        """Test that queued messages become readable after the commit window."""
+        status, data = request(api_server, "POST", "/messages", {"deveui": "0011223344556677"})
+        assert status == 202
+        assert data == {"message": "Message queued"}
+        status, data = request(
+            api_server, "POST", "/messages/batch", [{"deveui": "0011223344556677"}] * 3
+        )
+        assert status == 202
+        assert data["queued"] == 3
+
+        deadline = time.monotonic() + 5
+        count = 0
+        while count < 4 and time.monotonic() < deadline:
+            status, data = request(api_server, "GET", "/messages/0011223344556677")
+            count = len(data["messages"]) if status == 200 else 0
+        assert count == 4
+
+    def test_queue_full(self, api_server: tuple[str, int]) -> None:
+        """Test that a batch larger than the queue is refused with Retry-After."""
+        conn = http.client.HTTPConnection(*api_server, timeout=5)
+        try:
+            body = json.dumps([{"deveui": "0011223344556677"}] * 11)
+            conn.request("POST", "/messages/batch", body=body)
+            response = conn.getresponse()
+            assert response.status == 503
+            assert response.getheader("Retry-After") == "1"
+            response.read()
+        finally:
+            conn.close()
+
+
+class TestDeduplication:
+    """Tests for dropping duplicate uplinks."""
+
+    @pytest.fixture
+    def server_config(self) -> AppConfig:
+        """Enable deduplication over one minute."""
+        return AppConfig(
+            server=ServerConfig(host="127.0.0.1", port=0, workers=2),
+            database=DatabaseConfig(path="test.db", dedup_window=60),
+            log=LogConfig(level="DEBUG", use_syslog=False),
+        )
+
+    def test_duplicates_dropped(self, api_server: tuple[str, int]) -> None:
+        """Test that repeated uplinks are acknowledged but stored once."""
+        uplink = {"deveui": "0011223344556677", "sqn": 7, "timestamp": "2024-01-15T10:00:00.000Z"}
+        assert request(api_server, "POST", "/messages", uplink)[0] == 201
+        status, data = request(api_server, "POST", "/messages", uplink)
+        assert status == 200
+        assert data == {"message": "Duplicate message ignored"}
+
+        later = dict(uplink, sqn=8)
+        status, data = request(api_server, "POST", "/messages/batch", [uplink, later, later])
+        assert status == 201
+        assert [item["status"] for item in data["results"]] == ["duplicate", "created", "duplicate"]
+        status, data = request(api_server, "POST", "/messages/batch", [uplink])
+        assert (status, data["created"], data["duplicates"]) == (200, 0, 1)
+
+        _, data = request(api_server, "GET", "/messages")
+        assert [message["sqn"] for message in data["messages"]] == [8, 7]
+        _, data = request(api_server, "GET", "/stats/ingest")
+        assert data["dedup"]["enabled"]
+        assert data["dedup"]["duplicates"] == 4
+        assert data["write_behind"] == {"enabled": False}
+
+
+class TestFilteredMessages:
+    """Tests for filtered message listings."""
+
+    def test_filters(self, api_server: tuple[str, int]) -> None:
+        """Test device, application and time filters, paged and streamed."""
+        batch = [
+            {
+                "deveui": f"d{n % 2}",
+                "appeui": "app",
+                "sqn": n,
+                "timestamp": f"2024-01-15T1{n}:00:00.000Z",
+            }
+            for n in range(6)
+        ]
+        assert request(api_server, "POST", "/messages/batch", batch)[0] == 201
+        query = "deveui=d1&appeui=app&until=2024-01-15T15:00:00Z"
+        status, data = request(api_server, "GET", f"/messages?{query}&limit=1")
+        assert status == 200
+        assert [message["sqn"] for message in data["messages"]] == [3]
+        status, data = request(api_server, "GET", data["next"])
+        assert [message["sqn"] for message in data["messages"]] == [1]
+        status, data = request(api_server, "GET", f"/messages?{query}&limit=0")
+        assert [message["sqn"] for message in data["messages"]] == [3, 1]
+        assert request(api_server, "GET", "/messages?until=soon")[0] == 400
+
+
+class TestDevices:
+    """Tests for device summary endpoints."""
+
+    def test_summaries(self, api_server: tuple[str, int]) -> None:
+        """Test that stored messages update the summaries, which support 304."""
+        status, data = request(api_server, "GET", "/devices")
+        assert (status, data) == (200, {"devices": []})
+        assert request(api_server, "GET", "/devices/a") == (404, {"error": "Device not found"})
+
+        batch = [{"deveui": "a", "sqn": sqn, "data": "00ff", "size": 2} for sqn in range(3)]
+        assert request(api_server, "POST", "/messages/batch", batch)[0] == 201
+        assert request(api_server, "POST", "/messages", {"deveui": "b", "sqn": 9})[0] == 201
+        status, data = request(api_server, "GET", "/devices")
+        assert [(d["deveui"], d["messageCount"]) for d in data["devices"]] == [("a", 3), ("b", 1)]
+        status, data = request(api_server, "GET", "/devices/a")
+        assert (data["device"]["totalBytes"], data["device"]["lastSqn"]) == (6, 2)
+        assert data["device"]["lastData"] == "00ff"
+
+        conn = http.client.HTTPConnection(*api_server, timeout=5)
+        try:
+            conn.request("GET", "/devices/a")
+            response = conn.getresponse()
+            response.read()
+            conn.request("GET", "/devices/a", headers={"If-None-Match": response.getheader("ETag")})
+            assert conn.getresponse().status == 304
+        finally:
+            conn.close()
+
+
+class TestTraffic:
+    """Tests for the traffic chart endpoint."""
+
+    def test_chart(self, api_server: tuple[str, int]) -> None:
+        """Test that stored messages are counted in the rollups."""
+        batch = [
+            {"deveui": "a", "sqn": sqn, "size": 3, "timestamp": f"2024-01-15T10:0{sqn}:00.000Z"}
+            for sqn in range(3)
+        ]
+        assert request(api_server, "POST", "/messages/batch", batch)[0] == 201
+        path = "/stats/traffic?resolution=minute&deveui=a&since=2024-01-15T10:01:00Z"
+        status, data = request(api_server, "GET", path + "&until=2024-01-15T11:00:00Z")
+        assert status == 200
+        assert (data["deveui"], data["since"]) == ("a", "2024-01-15T10:01:00.000Z")
+        assert [(b["start"], b["messages"], b["bytes"]) for b in data["buckets"]] == [
+            ("2024-01-15T10:01:00.000Z", 1, 3),
+            ("2024-01-15T10:02:00.000Z", 1, 3),
+        ]
+
+    def test_invalid(self, api_server: tuple[str, int]) -> None:
+        """Test that invalid parameters are a 400."""
+        status, data = request(api_server, "GET", "/stats/traffic?resolution=week")
+        assert status == 400
+        assert "resolution" in data["error"]
+
+
+class TestPagination:
+    """Tests for keyset pagination of message listings."""
+
+    @pytest.fixture
+    def server_config(self) -> AppConfig:
+        """Use small pages."""
+        return AppConfig(
+            server=ServerConfig(host="127.0.0.1", port=0, page_size=3, max_page_size=5),
+            log=LogConfig(level="DEBUG", use_syslog=False),
+        )
+
+    @pytest.fixture
+    def messages(self, api_server: tuple[str, int]) -> tuple[str, int]:
+        """Store seven messages, sqn 0 to 6, and return the server address."""
+        batch = [{"deveui": "0011223344556677", "sqn": sqn} for sqn in range(7)]
+        status, _ = request(api_server, "POST", "/messages/batch", batch)
+        assert status == 201
+        return api_server
+
+    def test_follow_next(self, messages: tuple[str, int]) -> None:
+        """Test that following next visits every message once, newest first."""
+        seen: list[int] = []
+        path: str | None = "/messages/0011223344556677"
+        while path is not None:
+            status, data = request(messages, "GET", path)
+            assert status == 200
+            assert len(data["messages"]) <= 3
+            seen.extend(message["sqn"] for message in data["messages"])
+            path = data.get("next")
+        assert seen == [6, 5, 4, 3, 2, 1, 0]
+
+    def test_after_id(self, messages: tuple[str, int]) -> None:
+        """Test that after_id pages run oldest first and always link onwards."""
+        _, data = request(messages, "GET", "/messages?after_id=0&limit=5")
+        assert [message["sqn"] for message in data["messages"]] == [0, 1, 2, 3, 4]
+        _, data = request(messages, "GET", data["next"])
+        assert [message["sqn"] for message in data["messages"]] == [5, 6]
+        last_id = data["messages"][-1]["id"]
+        _, data = request(messages, "GET", data["next"])
+        assert data["messages"] == []
+        assert data["next"] == f"/messages?limit=5&after_id={last_id}"
+
+    def test_limit_capped(self, messages: tuple[str, int]) -> None:
+        """Test that the limit is capped at max_page_size."""
+        _, data = request(messages, "GET", "/messages?limit=1000")
+        assert len(data["messages"]) == 5
+        assert data["next"].startswith("/messages?limit=5&before_id=")
+
+    def test_last_page_has_no_next(self, messages: tuple[str, int]) -> None:
+        """Test that the final page carries no next link."""
+        _, data = request(messages, "GET", "/messages?limit=5")
+        _, data = request(messages, "GET", data["next"])
+        assert len(data["messages"]) == 2
+        assert "next" not in data
+
+    def test_empty_page_after_cursor(self, messages: tuple[str, int]) -> None:
+        """Test that an exhausted cursor gives an empty page rather than 404."""
+        status, data = request(messages, "GET", "/messages/0011223344556677?before_id=1")
+        assert status == 200
+        assert data == {"messages": []}
+
+    @pytest.mark.parametrize(
+        "query", ["limit=-1", "limit=x", "before_id=x", "before_id=1&after_id=1"]
+    )
+    def test_invalid_parameters(self, api_server: tuple[str, int], query: str) -> None:
+        """Test that invalid pagination parameters get 400."""
+        status, _ = request(api_server, "GET", f"/messages?{query}")
+        assert status == 400
+
+
+class TestPartitionedPagination(TestPagination):
+    """Run the pagination tests against daily partitioned storage."""
+
+    @pytest.fixture
+    def server_config(self) -> AppConfig:
+        """Use small pages and daily partitions."""
+        return AppConfig(
+            server=ServerConfig(host="127.0.0.1", port=0, page_size=3, max_page_size=5),
+            database=DatabaseConfig(partitioning="day"),
+            log=LogConfig(level="DEBUG", use_syslog=False),
+        )
+
+
+class TestResponseCache:
+    """Tests for the encoded message page cache."""
+
+    def test_hit_then_invalidated_by_write(self, api_server: tuple[str, int]) -> None:
+        """Test that a repeated page is cached and a write to the device evicts it."""
+        request(api_server, "POST", "/messages", {"deveui": "0011223344556677", "sqn": 1})
+        _, first = request(api_server, "GET", "/messages/0011223344556677")
+        _, second = request(api_server, "GET", "/messages/0011223344556677")
+        assert first == second
+        _, stats = request(api_server, "GET", "/stats/cache")
+        assert stats["enabled"] is True
+        assert (stats["hits"], stats["misses"], stats["entries"]) == (1, 1, 1)
+
+        request(api_server, "POST", "/messages", {"deveui": "0011223344556677", "sqn": 2})
+        _, data = request(api_server, "GET", "/messages/0011223344556677")
+        assert [message["sqn"] for message in data["messages"]] == [2, 1]
+        _, stats = request(api_server, "GET", "/stats/cache")
+        assert stats["invalidations"] == 1
+
+    def test_other_device_stays_cached(self, api_server: tuple[str, int]) -> None:
+        """Test that writes to one device leave other devices' pages cached."""
+        request(api_server, "POST", "/messages", {"deveui": "aaaa", "sqn": 1})
+        request(api_server, "GET", "/messages/aaaa")
+        request(api_server, "POST", "/messages/batch", [{"deveui": "bbbb"}])
+        request(api_server, "GET", "/messages/aaaa")
+        _, stats = request(api_server, "GET", "/stats/cache")
+        assert stats["hits"] == 1
+
+    def test_disabled(self, server_config: AppConfig, tmp_path: Any) -> None:
+        """Test that the stats endpoint reports a disabled cache."""
+        server_config.server.cache.enabled = False
+        server = create_server(server_config, str(tmp_path / "test.db"))
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        try:
+            address = server.server_address[0], server.server_address[1]
+            status, data = request(address, "GET", "/stats/cache")
+            assert status == 200
+            assert data == {"enabled": False}
+        finally:
+            server.shutdown()
+            server.server_close()
+
+
+class TestConditionalGet:
+    """Tests for ETag and If-None-Match handling."""
+
+    @staticmethod
+    def get(
+        conn: http.client.HTTPConnection, path: str, etag: str | None = None
+    ) -> http.client.HTTPResponse:
+        """Send a GET on a persistent connection and read the response."""
+        conn.request("GET", path, headers={"If-None-Match": etag} if etag else {})
+        response = conn.getresponse()
+        response.read()
+        return response
+
+    @pytest.mark.parametrize("path", ["/messages", "/messages/0011223344556677", "/users"])
+    def test_not_modified_until_write(self, api_server: tuple[str, int], path: str) -> None:
+        """Test that a current tag gets an empty 304 and a write changes the tag."""
+        request(api_server, "POST", "/messages", {"deveui": "0011223344556677"})
+        request(api_server, "POST", "/users", {"username": "alice", "password": "secret"})
+        conn = http.client.HTTPConnection(*api_server, timeout=5)
+        try:
+            etag = self.get(conn, path).getheader("ETag")
+            assert etag and etag.startswith('"')
+
+            response = self.get(conn, path, etag)
+            assert response.status == 304
+            assert response.getheader("ETag") == etag
+            # The connection stays usable after a body-less 304
+            assert self.get(conn, "/health").status == 200
+
+            request(api_server, "POST", "/messages", {"deveui": "0011223344556677"})
+            request(api_server, "POST", "/users", {"username": "bob", "password": "secret"})
+            response = self.get(conn, path, etag)
+            assert response.status == 200
+            assert response.getheader("ETag") != etag
+        finally:
+            conn.close()
+
+    def test_other_device_keeps_tag(self, api_server: tuple[str, int]) -> None:
+        """Test that writes to another device leave a device's tag unchanged."""
+        request(api_server, "POST", "/messages", {"deveui": "aaaa"})
+        conn = http.client.HTTPConnection(*api_server, timeout=5)
+        try:
+            etag = self.get(conn, "/messages/aaaa").getheader("ETag")
+            request(api_server, "POST", "/messages/batch", [{"deveui": "bbbb"}])
+            assert self.get(conn, "/messages/aaaa", etag).status == 304
+            assert self.get(conn, "/messages", etag).status == 200
+        finally:
+            conn.close()
+
+
+class TestCompression:
+    """Tests for negotiated response compression."""
+
+    @staticmethod
+    def get(
+        address: tuple[str, int], path: str, headers: dict[str, str]
+    ) -> tuple[http.client.HTTPResponse, bytes]:
+        """Send a GET and return the response with its raw body."""
+        conn = http.client.HTTPConnection(*address, timeout=5)
+        try:
+            conn.request("GET", path, headers=headers)
+            response = conn.getresponse()
+            return response, response.read()
+        finally:
+            conn.close()
+
+    @pytest.fixture
+    def messages(self, api_server: tuple[str, int]) -> tuple[str, int]:
+        """Store enough messages for a page above the size threshold."""
+        batch = [{"deveui": "0011223344556677", "sqn": sqn} for sqn in range(50)]
+        request(api_server, "POST", "/messages/batch", batch)
+        return api_server
+
+    @pytest.mark.parametrize("encoding", ["gzip", "deflate"])
+    def test_page_compressed(self, messages: tuple[str, int], encoding: str) -> None:
+        """Test that a large page is compressed and decodes to the plain body."""
+        plain, plain_body = self.get(messages, "/messages", {})
+        assert plain.getheader("Content-Encoding") is None
+        response, body = self.get(messages, "/messages", {"Accept-Encoding": encoding})
+        assert response.getheader("Content-Encoding") == encoding
+        assert response.getheader("Vary") == "Accept-Encoding"
+        assert response.getheader("ETag") == plain.getheader("ETag")[:-1] + f'-{encoding}"'
+        wbits = 16 + zlib.MAX_WBITS if encoding == "gzip" else zlib.MAX_WBITS
+        assert zlib.decompress(body, wbits) == plain_body
+        assert len(body) < len(plain_body) // 4
+
+    def test_small_response_not_compressed(self, api_server: tuple[str, int]) -> None:
+        """Test that bodies under min_size are sent as they are."""
+        response, body = self.get(api_server, "/health", {"Accept-Encoding": "gzip"})
+        assert response.getheader("Content-Encoding") is None
+        assert json.loads(body) == {"status": "ok"}
+
+    def test_stream_compressed(self, messages: tuple[str, int]) -> None:
+        """Test that streamed listings are compressed too."""
+        response, body = self.get(messages, "/messages?limit=0", {"Accept-Encoding": "gzip"})
+        assert response.getheader("Transfer-Encoding") == "chunked"
+        assert response.getheader("Content-Encoding") == "gzip"
+        assert len(json.loads(gzip.decompress(body))["messages"]) == 50
+
+    def test_not_modified_either_variant(self, messages: tuple[str, int]) -> None:
+        """Test that compressed and uncompressed tags both validate."""
+        plain, _ = self.get(messages, "/messages", {})
+        compressed, _ = self.get(messages, "/messages", {"Accept-Encoding": "gzip"})
+        for etag in (plain.getheader("ETag"), compressed.getheader("ETag")):
+            response, body = self.get(
+                messages, "/messages", {"Accept-Encoding": "gzip", "If-None-Match": etag}
+            )
+            assert response.status == 304
+            assert response.getheader("ETag") == etag
+            assert body == b""
+
+    def test_disabled(self, server_config: AppConfig, tmp_path: Any) -> None:
+        """Test that nothing is compressed when compression is disabled."""
+        server_config.server.compression.enabled = False
+        server = create_server(server_config, str(tmp_path / "test.db"))
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        try:
+            address = server.server_address[0], server.server_address[1]
+            request(address, "POST", "/messages/batch", [{"deveui": "aaaa"}] * 50)
+            response, _ = self.get(address, "/messages", {"Accept-Encoding": "gzip"})
+            assert response.getheader("Content-Encoding") is None
+            assert response.getheader("Vary") is None
+        finally:
+            server.shutdown()
+            server.server_close()
+
+
+class TestStreaming:
+    """Tests for streamed full-history message listings."""
+
+    def test_chunked_stream(self, api_server: tuple[str, int]) -> None:
+        """Test that limit=0 streams every message with chunked encoding."""
+        batch = [{"deveui": "0011223344556677", "sqn": sqn} for sqn in range(1200)]
+        status, _ = request(api_server, "POST", "/messages/batch", batch[:1000])
+        assert status == 201
+        status, _ = request(api_server, "POST", "/messages/batch", batch[1000:])
+        assert status == 201
+
+        conn = http.client.HTTPConnection(*api_server, timeout=5)
+        try:
+            conn.request("GET", "/messages/0011223344556677?limit=0")
+            response = conn.getresponse()
+            assert response.status == 200
+            assert response.getheader("Transfer-Encoding") == "chunked"
+            data = json.loads(response.read())
+            assert [m["sqn"] for m in data["messages"]] == list(range(1199, -1, -1))
+            assert "next" not in data
+
+            # The connection stays usable after the stream
+            conn.request("GET", "/messages?limit=0&after_id=1199")
+            response = conn.getresponse()
+            assert [m["sqn"] for m in json.loads(response.read())["messages"]] == [1199]
+        finally:
+            conn.close()
+
+    def test_http10_stream(self, api_server: tuple[str, int]) -> None:
+        """Test that HTTP/1.0 clients get a body ended by closing the connection."""
+        status, _ = request(api_server, "POST", "/messages", {"deveui": "0011223344556677"})
+        assert status == 201
+        with socket.create_connection(api_server, timeout=5) as sock:
+            sock.sendall(b"GET /messages?limit=0 HTTP/1.0\r\n\r\n")
+            response = b""
+            while chunk := sock.recv(65536):
+                response += chunk
+        head, _, body = response.partition(b"\r\n\r\n")
+        assert b"Transfer-Encoding" not in head
+        assert b"Connection: close" in head
+        assert len(json.loads(body)["messages"]) == 1
+
+    def test_unknown_device(self, api_server: tuple[str, int]) -> None:
+        """Test that streaming an unknown device still gets 404."""
+        status, _ = request(api_server, "GET", "/messages/ffff?limit=0")
+        assert status == 404
+
+
+class TestAsyncStreaming(TestStreaming):
+    """Run the streaming tests on the asyncio engine."""
+
+    @pytest.fixture
+    def server_config(self) -> AppConfig:
+        """Configure the asyncio engine on an ephemeral port."""
+        return AppConfig(
+            server=ServerConfig(host="127.0.0.1", port=0, concurrency="asyncio", workers=2),
+            log=LogConfig(level="DEBUG", use_syslog=False),
+        )
+
+
+class TestLongPoll:
+    """Tests for waiting for new messages with after_id and wait."""
+
+    @pytest.fixture
+    def server_config(self) -> AppConfig:
+        """Allow one waiting request."""
+        return AppConfig(
+            server=ServerConfig(host="127.0.0.1", port=0, workers=3, max_waiters=1),
+            log=LogConfig(level="DEBUG", use_syslog=False),
+        )
+
+    def post_later(self, address: tuple[str, int], deveui: str, delay: float) -> threading.Timer:
+        """Post a message of the device after a delay."""
+        timer = threading.Timer(
+            delay, request, [address, "POST", "/messages", {"deveui": deveui}]
+        )
+        timer.start()
+        return timer
+
+    def test_woken_by_new_message(self, api_server: tuple[str, int]) -> None:
+        """Test that a waiting request returns as soon as its device gets a message."""
+        request(api_server, "POST", "/messages", {"deveui": "a"})
+        timers = [self.post_later(api_server, "b", 0.1), self.post_later(api_server, "a", 0.3)]
+        started = time.monotonic()
+        status, data = request(api_server, "GET", "/messages/a?after_id=1&wait=5")
+        elapsed = time.monotonic() - started
+        for timer in timers:
+            timer.join()
+        assert status == 200
+        assert [m["id"] for m in data["messages"]] == [3]
+        assert data["next"] == "/messages/a?limit=100&after_id=3"
+        assert 0.3 <= elapsed < 2
+
+    def test_existing_messages_returned_at_once(self, api_server: tuple[str, int]) -> None:
+        """Test that a page with messages is not held back."""
+        request(api_server, "POST", "/messages", {"deveui": "a"})
+        started = time.monotonic()
+        _, data = request(api_server, "GET", "/messages?after_id=0&wait=5")
+        assert len(data["messages"]) == 1
+        assert time.monotonic() - started < 1
+
+    def test_timeout(self, api_server: tuple[str, int]) -> None:
+        """Test that an empty page is returned when the wait runs out."""
+        started = time.monotonic()
+        status, data = request(api_server, "GET", "/messages?after_id=0&wait=0.2")
+        assert status == 200
+        assert data["messages"] == []
+        assert time.monotonic() - started >= 0.2
+
+    def test_stream(self, api_server: tuple[str, int]) -> None:
+        """Test that a streamed listing waits for its first message too."""
+        timer = self.post_later(api_server, "a", 0.1)
+        status, data = request(api_server, "GET", "/messages?limit=0&after_id=0&wait=5")
+        timer.join()
+        assert status == 200
+        assert [m["deveui"] for m in data["messages"]] == ["a"]
+
+    def test_too_many_waiting(self, api_server: tuple[str, int]) -> None:
+        """Test that requests beyond max_waiters get 503 instead of a worker."""
+        timer = self.post_later(api_server, "a", 0.5)
+        waiting = threading.Thread(
+            target=request, args=(api_server, "GET", "/messages?after_id=0&wait=5")
+        )
+        waiting.start()
+        time.sleep(0.2)
+        status, data = request(api_server, "GET", "/messages?after_id=0&wait=5")
+        timer.join()
+        waiting.join()
+        assert status == 503
+        assert data == {"error": "Too many requests waiting for messages"}
+
+    def test_wait_requires_after_id(self, api_server: tuple[str, int]) -> None:
+        """Test that a wait without after_id is a 400."""
+        status, data = request(api_server, "GET", "/messages?wait=5")
+        assert status == 400
+        assert data == {"error": "wait requires after_id"}
+
+
+class TestAsyncLongPoll(TestLongPoll):
+    """Run the long-poll tests on the asyncio engine."""
+
+    @pytest.fixture
+    def server_config(self) -> AppConfig:
+        """Configure the asyncio engine with one waiting request."""
+        return AppConfig(
+            server=ServerConfig(
+                host="127.0.0.1", port=0, concurrency="asyncio", workers=3, max_waiters=1
+            ),
+            log=LogConfig(level="DEBUG", use_syslog=False),
+        )
+
+
+def read_events(response: http.client.HTTPResponse, count: int) -> list[tuple[int, Any]]:
+    """Read Server-Sent Events frames until count messages arrived.
+
+    Returns:
+        (id, message) of each message event; comments are skipped.
+    """
+    buffer = b""
+    events: list[tuple[int, Any]] = []
+    while len(events) < count:
+        chunk = response.read1(65536)
+        assert chunk, "stream ended"
+        *frames, buffer = (buffer + chunk).split(b"\n\n")
+        for frame in frames:
+            fields = dict(
+                line.split(": ", 1)
+                for line in frame.decode().splitlines()
+                if not line.startswith(":")
+            )
+            if "data" in fields:
+                events.append((int(fields["id"]), json.loads(fields["data"])))
+    return events
+
+
+class TestLiveStream:
+    """Tests for the Server-Sent Events live feed."""
+
+    @pytest.fixture
+    def server_config(self) -> AppConfig:
+        """Configure one stream client and a two-message history."""
+        return AppConfig(
+            server=ServerConfig(
+                host="127.0.0.1",
+                port=0,
+                workers=2,
+                stream=StreamConfig(max_clients=1, history=2, keepalive=0.2),
+            ),
+            log=LogConfig(level="DEBUG", use_syslog=False),
+        )
+
+    def open_stream(
+        self, address: tuple[str, int], path: str, headers: dict[str, str] | None = None
+    ) -> tuple[http.client.HTTPConnection, http.client.HTTPResponse]:
+        """Open a live stream and read up to its first comment."""
+        conn = http.client.HTTPConnection(*address, timeout=5)
+        conn.request("GET", path, headers=headers or {})
+        response = conn.getresponse()
+        assert response.status == 200
+        assert response.getheader("Content-Type") == "text/event-stream"
+        assert response.read1(65536).startswith(b": connected")
+        return conn, response
+
+    def post(self, address: tuple[str, int], deveuis: list[str]) -> None:
+        """Post one message per device EUI."""
+        batch = [{"deveui": deveui, "data": "00ff"} for deveui in deveuis]
+        status, _ = request(address, "POST", "/messages/batch", batch)
+        assert status == 201
+
+    def test_live_messages(self, api_server: tuple[str, int]) -> None:
+        """Test that new messages of the device arrive as they are committed."""
+        conn, response = self.open_stream(api_server, "/messages/stream?deveui=a")
+        try:
+            self.post(api_server, ["a", "b", "a"])
+            events = read_events(response, 2)
+        finally:
+            conn.close()
+        _, listing = request(api_server, "GET", "/messages/a")
+        assert events == [(m["id"], m) for m in reversed(listing["messages"])]
+
+    def test_keepalive(self, api_server: tuple[str, int]) -> None:
+        """Test that an idle stream sends keepalive comments."""
+        conn, response = self.open_stream(api_server, "/messages/stream")
+        try:
+            assert response.read1(65536) == b": keepalive\n\n"
+        finally:
+            conn.close()
+
+    def test_resume_from_history(self, api_server: tuple[str, int]) -> None:
+        """Test that Last-Event-ID replays the messages missed since."""
+        self.post(api_server, ["a", "a", "a"])
+        conn, response = self.open_stream(
+            api_server, "/messages/stream", {"Last-Event-ID": "2"}
+        )
+        try:
+            assert [id_ for id_, _ in read_events(response, 1)] == [3]
+        finally:
+            conn.close()
+
+    def test_resume_from_database(self, api_server: tuple[str, int]) -> None:
+        """Test that a client further behind than the history catches up from the database."""
+        self.post(api_server, ["a", "b", "a", "a", "b"])
+        conn, response = self.open_stream(api_server, "/messages/stream?deveui=a&after_id=1")
+        try:
+            assert [id_ for id_, _ in read_events(response, 2)] == [3, 4]
+            self.post(api_server, ["a"])
+            assert [id_ for id_, _ in read_events(response, 1)] == [6]
+        finally:
+            conn.close()
+
+    def test_invalid_last_event_id(self, api_server: tuple[str, int]) -> None:
+        """Test that a malformed resume id is rejected."""
+        status, _ = request(
+            api_server, "GET", "/messages/stream", headers={"Last-Event-ID": "x"}
+        )
+        assert status == 400
+
+    def test_client_limit(self, api_server: tuple[str, int]) -> None:
+        """Test that clients beyond max_clients get 503 and show in /stats/stream."""
+        conn, _ = self.open_stream(api_server, "/messages/stream")
+        try:
+            status, _ = request(api_server, "GET", "/messages/stream")
+            assert status == 503
+            status, stats = request(api_server, "GET", "/stats/stream")
+            assert status == 200
+            assert stats["clients"] == 1
+            assert stats["max_clients"] == 1
+        finally:
+            conn.close()
+
+
+class TestAsyncLiveStream(TestLiveStream):
+    """Run the live stream tests on the asyncio engine."""
+
+    @pytest.fixture
+    def server_config(self) -> AppConfig:
+        """Configure the asyncio engine with one stream client."""
+        return AppConfig(
+            server=ServerConfig(
+                host="127.0.0.1",
+                port=0,
+                concurrency="asyncio",
+                workers=2,
+                stream=StreamConfig(max_clients=1, history=2, keepalive=0.2),
+            ),
+            log=LogConfig(level="DEBUG", use_syslog=False),
+        )
+
+
+@pytest.mark.parametrize("concurrency", ["threads", "asyncio"])
+def test_clients_released_at_shutdown(tmp_path: Any, concurrency: str) -> None:
+    """Test that shutting down ends live streams and long polls instead of waiting for them."""
+    config = AppConfig(
+        server=ServerConfig(host="127.0.0.1", port=0, concurrency=concurrency, workers=3),
+        log=LogConfig(level="DEBUG", use_syslog=False),
+    )
+    server = create_server(config, str(tmp_path / "test.db"))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    conn = http.client.HTTPConnection(*server.server_address, timeout=5)
+    waiting = threading.Thread(
+        target=request, args=(server.server_address, "GET", "/messages?after_id=0&wait=30")
+    )
+    try:
+        conn.request("GET", "/messages/stream")
+        response = conn.getresponse()
+        assert response.read1(65536).startswith(b": connected")
+        waiting.start()
+        time.sleep(0.1)
+        started = time.monotonic()
+        server.shutdown()
+        server.server_close()
+        assert time.monotonic() - started < 1.0
+        assert response.read() == b""
+    finally:
+        conn.close()
+        waiting.join(timeout=5.0)
+        thread.join(timeout=5.0)
+
+
+@pytest.mark.parametrize("concurrency", ["threads", "asyncio"])
+def test_ingest_while_streaming(tmp_path: Any, concurrency: str) -> None:
+    """Test that live streams leave a worker free for ingest."""
+    config = AppConfig(
+        server=ServerConfig(
+            host="127.0.0.1",
+            port=0,
+            concurrency=concurrency,
+            workers=2,
+            stream=StreamConfig(max_clients=2),
+        ),
+        log=LogConfig(level="DEBUG", use_syslog=False),
+    )
+    server = create_server(config, str(tmp_path / "test.db"))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    address = server.server_address
+    conn = http.client.HTTPConnection(*address, timeout=5)
+    try:
+        conn.request("GET", "/messages/stream")
+        response = conn.getresponse()
+        assert response.read1(65536).startswith(b": connected")
+        # max_clients has room, but only one worker is left
+        status, data = request(address, "GET", "/messages/stream")
+        assert (status, data) == (503, {"error": "Too many live stream clients"})
+        started = time.monotonic()
+        status, _ = request(address, "POST", "/messages", {"deveui": "a"})
+        assert status == 201
+        assert time.monotonic() - started < 1.0
+    finally:
+        server.shutdown()
+        server.server_close()
+        conn.close()
+        thread.join(timeout=5.0)
+
+
+@pytest.mark.parametrize("concurrency", ["threads", "asyncio"])
+def test_ingest_while_clients_wait(tmp_path: Any, concurrency: str) -> None:
+    """Test that live streams and long polls leave a worker free for ingest."""
+    config = AppConfig(
+        server=ServerConfig(
+            host="127.0.0.1",
+            port=0,
+            concurrency=concurrency,
+            workers=3,
+            max_waiters=2,
+            stream=StreamConfig(max_clients=2),
+        ),
+        log=LogConfig(level="DEBUG", use_syslog=False),
+    )
+    server = create_server(config, str(tmp_path / "test.db"))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    address = server.server_address
+    conn = http.client.HTTPConnection(*address, timeout=5)
+    waiting = threading.Thread(
+        target=request, args=(address, "GET", "/messages/b?after_id=0&wait=30")
+    )
+    try:
+        conn.request("GET", "/messages/stream")
+        response = conn.getresponse()
+        assert response.read1(65536).startswith(b": connected")
+        waiting.start()
+        time.sleep(0.2)
+        # Both limits have room, but only one worker is left
+        status, data = request(address, "GET", "/messages/stream")
+        assert (status, data) == (503, {"error": "Too many live stream clients"})
+        status, _ = request(address, "GET", "/messages?after_id=0&wait=30")
+        assert status == 503
+        started = time.monotonic()
+        status, _ = request(address, "POST", "/messages", {"deveui": "a"})
+        assert status == 201
+        assert time.monotonic() - started < 1.0
+    finally:
+        server.shutdown()
+        server.server_close()
+        conn.close()
+        waiting.join(timeout=5.0)
+        thread.join(timeout=5.0)
+
+
+@pytest.mark.parametrize("concurrency", ["threads", "asyncio", "single"])
+def test_expect_continue(tmp_path: Any, concurrency: str) -> None:
+    """Test that a client expecting 100 Continue gets it before sending its body."""
+    config = AppConfig(
+        server=ServerConfig(host="127.0.0.1", port=0, concurrency=concurrency, workers=2),
+        log=LogConfig(level="DEBUG", use_syslog=False),
+    )
+    server = create_server(config, str(tmp_path / "test.db"))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    body = b'{"deveui": "0011223344556677"}'
+    try:
+        with socket.create_connection(server.server_address, timeout=5) as sock:
+            sock.sendall(
+                b"POST /messages HTTP/1.1\r\nHost: x\r\nExpect: 100-continue\r\n"
+                b"Content-Length: " + str(len(body)).encode() + b"\r\n\r\n"
+            )
+            sock.settimeout(0.5)
+            assert sock.recv(65536) == b"HTTP/1.1 100 Continue\r\n\r\n"
+            sock.settimeout(5)
+            sock.sendall(body)
+            assert sock.recv(65536).startswith(b"HTTP/1.1 201 Created\r\n")
+    finally:
+        server.shutdown()
+        server.server_close()
+        thread.join(timeout=5.0)
+
+
+@pytest.mark.parametrize("concurrency", ["threads", "asyncio"])
+@pytest.mark.parametrize("length", [b"-1", b"abc"])
+def test_invalid_content_length(tmp_path: Any, concurrency: str, length: bytes) -> None:
+    """Test that both engines refuse a malformed Content-Length at once."""
+    config = AppConfig(
+        server=ServerConfig(host="127.0.0.1", port=0, concurrency=concurrency, workers=2),
+        log=LogConfig(level="DEBUG", use_syslog=False),
+    )
+    server = create_server(config, str(tmp_path / "test.db"))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        with socket.create_connection(server.server_address, timeout=5) as sock:
+            sock.sendall(
+                b"POST /messages HTTP/1.1\r\nHost: x\r\nContent-Length: " + length + b"\r\n\r\n"
+            )
+            sock.settimeout(1)
+            assert sock.recv(1024).startswith(b"HTTP/1.1 400 Invalid Content-Length\r\n")
+    finally:
+        server.shutdown()
+        server.server_close()
+        thread.join(timeout=5.0)
+
+
+@pytest.mark.parametrize("concurrency", ["threads", "asyncio"])
+@pytest.mark.parametrize("path", ["/messages", "/users"])
+@pytest.mark.parametrize("body", [b"{", b"\xff", b"[1]"])
+def test_invalid_json_body(tmp_path: Any, concurrency: str, path: str, body: bytes) -> None:
+    """Test that both engines answer a malformed JSON body with 400 and keep the connection."""
+    config = AppConfig(
+        server=ServerConfig(host="127.0.0.1", port=0, concurrency=concurrency, workers=2),
+        log=LogConfig(level="DEBUG", use_syslog=False),
+    )
+    server = create_server(config, str(tmp_path / "test.db"))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    conn = http.client.HTTPConnection(*server.server_address[:2], timeout=5)
+    try:
+        conn.request("POST", path, body=body, headers={"Content-Type": "application/json"})
+        response = conn.getresponse()
+        assert response.status == 400
+        assert "error" in json.loads(response.read())
+        conn.request("GET", "/health")
+        assert conn.getresponse().status == 200
+    finally:
+        conn.close()
+        server.shutdown()
+        server.server_close()
+        thread.join(timeout=5.0)
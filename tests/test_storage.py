@@ -0,0 +1,367 @@
+"""Tests for message read queries."""
+
+import itertools
+import json
+import re
+import sqlite3
+from pathlib import Path
+from typing import Generator
+from urllib.parse import parse_qsl, urlsplit
+
+import pytest
+from webapi_example.database import (
+    SELECT_MESSAGES,
+    ConnectionPool,
+    create_message_table,
+    init_db,
+    register_functions,
+)
+from webapi_example.ingest import insert_batch, message_row, write_messages
+from webapi_example.partitions import table_sql
+from webapi_example.storage import (
+    MESSAGE_ENCODER,
+    MESSAGE_FIELDS,
+    MessageFilter,
+    PageRequest,
+    encode_message,
+    encode_stored_message,
+    filter_query,
+    message_chunks,
+    message_page,
+    message_stream,
+    resolve_id_range,
+)
+
+
+@pytest.fixture
+def stored_pool(pool: ConnectionPool) -> ConnectionPool:
+    """Return the test pool holding ten messages, sqn 0 to 9."""
+    with pool.connection() as conn:
+        insert_batch(conn, [{"deveui": "a", "sqn": sqn} for sqn in range(10)])
+    return pool
+
+
+class TestMessageChunks:
+    """Tests for message_chunks()."""
+
+    def test_newest_first(self, stored_pool: ConnectionPool) -> None:
+        """Test that chunks cover every message newest first."""
+        chunks = list(message_chunks(stored_pool, PageRequest(limit=0), chunk_size=4))
+        assert [len(chunk) for chunk in chunks] == [4, 4, 2]
+        # Messages were inserted in order, so id is sqn + 1
+        assert [row[0] for chunk in chunks for row in chunk] == list(range(10, 0, -1))
+
+    def test_after_cursor(self, stored_pool: ConnectionPool) -> None:
+        """Test that an after_id cursor reads oldest first."""
+        chunks = message_chunks(stored_pool, PageRequest(limit=0, after_id=5), "a", chunk_size=5)
+        assert [row[0] for chunk in chunks for row in chunk] == [6, 7, 8, 9, 10]
+
+    def test_empty(self, stored_pool: ConnectionPool) -> None:
+        """Test that an empty result still yields one chunk."""
+        assert list(message_chunks(stored_pool, PageRequest(limit=0), "b")) == [[]]
+
+
+class TestMessageStream:
+    """Tests for message_stream()."""
+
+    def test_valid_document(self, stored_pool: ConnectionPool) -> None:
+        """Test that the pieces join into one JSON document."""
+        chunks = message_chunks(stored_pool, PageRequest(limit=0), chunk_size=4)
+        data = json.loads(b"".join(message_stream(chunks)))
+        assert [message["sqn"] for message in data["messages"]] == list(range(9, -1, -1))
+        assert set(data["messages"][0]) == set(MESSAGE_FIELDS)
+
+    def test_empty(self) -> None:
+        """Test that no rows give an empty list."""
+        assert b"".join(message_stream([[]])) == b'{"messages":[]}'
+
+
+class TestMessagePage:
+    """Tests for message_page()."""
+
+    def test_encoders_agree(self, stored_pool: ConnectionPool) -> None:
+        """Test that the SQLite and Python encodings give the same bytes."""
+        with stored_pool.connection() as conn:
+            conn.execute(
+                "UPDATE lora_messages SET device_name = ?, size = NULL, data = ? WHERE id = 1",
+                ('quo"te\\ é🙂\n', "\x01"),
+            )
+            page = message_page(conn, "/messages", PageRequest(limit=20))
+            cursor = conn.cursor()
+            cursor.row_factory = None
+            rows = cursor.execute(SELECT_MESSAGES, (20,)).fetchall()
+        expected = '{"messages":[' + MESSAGE_ENCODER.encode_rows(rows) + "]}"
+        assert page.encode() == expected.encode()
+        assert json.loads(expected)["messages"][-1]["deviceName"] == 'quo"te\\ é🙂\n'
+
+    def test_stored_message_matches_listing(self, pool: ConnectionPool) -> None:
+        """Test that a just stored message encodes to the same bytes as when listed."""
+        row = message_row({"deveui": "b", "deviceName": "é", "data": "AQID", "sqn": 3})
+        with pool.connection() as conn:
+            _, ids, _ = write_messages(conn, [row])
+        (listed,) = next(message_chunks(pool, PageRequest(limit=0), "b"))
+        assert encode_message(listed) == encode_stored_message(ids[0], row)
+
+
+def filtered_pool(tmp_path: Path) -> ConnectionPool:
+    """Create a pool on a database with messages of two devices and applications.
+
+    Message n (id n + 1) is from device "d<n % 3>" of application "a<n % 2>",
+    timestamped n minutes after 2024-01-15T10:00:00.000Z.
+    """
+    path = str(tmp_path / "filtered.db")
+    init_db(path)
+    pool = ConnectionPool(path)
+    batch = [
+        {
+            "deveui": f"d{n % 3}",
+            "appeui": f"a{n % 2}",
+            "sqn": n,
+            "timestamp": f"2024-01-15T10:{n:02d}:00.000Z",
+        }
+        for n in range(30)
+    ]
+    with pool.connection() as conn:
+        insert_batch(conn, batch)
+    return pool
+
+
+class TestPageRequest:
+    """Tests for PageRequest."""
+
+    def test_wait(self) -> None:
+        """Test that a wait is parsed as seconds and capped."""
+        page = PageRequest.from_query({"after_id": "5", "wait": "2.5"}, 100, 1000, 30)
+        assert page == PageRequest(100, after_id=5, wait=2.5)
+        assert PageRequest.from_query({"after_id": "5", "wait": "60"}, 100, 1000, 30).wait == 30
+        assert PageRequest.from_query({"after_id": "5", "wait": "60"}, 100, 1000).wait == 0
+
+    @pytest.mark.parametrize(
+        "query",
+        [{"after_id": "5", "wait": "soon"}, {"after_id": "5", "wait": "-1"}, {"wait": "5"}],
+    )
+    def test_invalid_wait(self, query: dict[str, str]) -> None:
+        """Test that a wait that is not a duration after a cursor raises ValueError."""
+        with pytest.raises(ValueError, match="wait"):
+            PageRequest.from_query(query, 100, 1000, 30)
+
+
+class TestMessageFilter:
+    """Tests for MessageFilter and filtered listings."""
+
+    def test_from_query(self) -> None:
+        """Test parsing filters, with timestamps as epoch milliseconds."""
+        where = MessageFilter.from_query(
+            {"deveui": "d1", "appeui": "", "since": "2024-01-15T10:00:00Z", "limit": "5"}
+        )
+        assert where == MessageFilter("d1", None, 1705312800000, None)
+        assert where.query_params() == {"deveui": "d1", "since": "2024-01-15T10:00:00.000Z"}
+
+    def test_invalid_timestamp(self) -> None:
+        """Test that a malformed time bound names the parameter."""
+        with pytest.raises(ValueError, match="until"):
+            MessageFilter.from_query({"until": "yesterday"})
+
+    @pytest.mark.parametrize(
+        "where",
+        [
+            MessageFilter(appeui="a1"),
+            MessageFilter(deveui="d0", appeui="a0"),
+            MessageFilter(since=1705313100000),
+            MessageFilter(until=1705313400000),
+            MessageFilter(deveui="d2", since=1705313100000, until=1705314000000),
+            MessageFilter(appeui="a0", since=1705313100000, until=1705314000000),
+            MessageFilter("d1", "a1", 1705313100000, 1705314000000),
+        ],
+    )
+    def test_pages_match_filter(self, tmp_path: Path, where: MessageFilter) -> None:
+        """Test that following next links returns exactly the matching messages, newest first."""
+        pool = filtered_pool(tmp_path)
+        start = 1705312800000
+        expected = [
+            n + 1
+            for n in range(29, -1, -1)
+            if where.deveui in (None, f"d{n % 3}")
+            and where.appeui in (None, f"a{n % 2}")
+            and (where.since or 0) <= start + n * 60000 < (where.until or 2**62)
+        ]
+        ids: list[int] = []
+        page = PageRequest(limit=2)
+        try:
+            with pool.connection() as conn:
+                while True:
+                    result = message_page(conn, "/messages", page, where=where)
+                    ids += [row[0] for row in result.rows]
+                    if result.next is None:
+                        break
+                    assert "since" in result.next or where.since is None
+                    page = PageRequest(limit=2, before_id=ids[-1])
+                after = message_page(conn, "/messages", PageRequest(3, after_id=0), where=where)
+            streamed = message_chunks(pool, PageRequest(limit=0), chunk_size=4, where=where)
+            assert [row[0] for chunk in streamed for row in chunk] == expected
+        finally:
+            pool.close()
+        assert ids == expected
+        assert [row[0] for row in after.rows] == expected[::-1][:3]
+
+    def test_path_device_overrides(self, tmp_path: Path) -> None:
+        """Test that the device of the path wins over a deveui parameter."""
+        pool = filtered_pool(tmp_path)
+        try:
+            with pool.connection() as conn:
+                result = message_page(
+                    conn, "/messages/d0", PageRequest(20), "d0", where=MessageFilter("d1", "a1")
+                )
+        finally:
+            pool.close()
+        assert [row[0] for row in result.rows] == [28, 22, 16, 10, 4]
+
+    def test_next_links_carry_id_range(self, tmp_path: Path) -> None:
+        """Test that the id range of a time range is resolved for the first page only."""
+        pool = filtered_pool(tmp_path)
+        statements: list[str] = []
+        ids: list[int] = []
+        query = {"since": "2024-01-15T10:05:00Z", "until": "2024-01-15T10:15:00Z", "limit": "4"}
+        try:
+            with pool.connection() as conn:
+                conn.set_trace_callback(statements.append)
+                while True:
+                    page = PageRequest.from_query(query, 100, 1000)
+                    result = message_page(
+                        conn, "/messages", page, where=MessageFilter.from_query(query)
+                    )
+                    ids += [row[0] for row in result.rows]
+                    if result.next is None:
+                        break
+                    query = dict(parse_qsl(urlsplit(result.next).query))
+                    assert (query["min_id"], query["max_id"]) == ("6", "15")
+                conn.set_trace_callback(None)
+        finally:
+            pool.close()
+        assert ids == list(range(15, 5, -1))
+        assert sum("min(id)" in statement for statement in statements) == 1
+
+    def test_new_messages_after_id_range(self, tmp_path: Path) -> None:
+        """Test that following a time range past its resolved max_id finds new messages."""
+        pool = filtered_pool(tmp_path)
+        where = MessageFilter(since=1705314000000)
+        try:
+            with pool.connection() as conn:
+                result = message_page(conn, "/messages", PageRequest(10, after_id=0), where=where)
+                assert [row[0] for row in result.rows] == [21, 22, 23, 24, 25, 26, 27, 28, 29, 30]
+                assert result.next is not None
+                insert_batch(conn, [{"deveui": "d0", "timestamp": "2024-01-15T11:00:00.000Z"}])
+                query = dict(parse_qsl(urlsplit(result.next).query))
+                assert query["max_id"] == "30"
+                result = message_page(
+                    conn,
+                    "/messages",
+                    PageRequest.from_query(query, 100, 1000),
+                    where=MessageFilter.from_query(query),
+                )
+        finally:
+            pool.close()
+        assert [row[0] for row in result.rows] == [31]
+
+    def test_empty_range(self, tmp_path: Path) -> None:
+        """Test that a time range without messages resolves to an empty id range."""
+        pool = filtered_pool(tmp_path)
+        try:
+            with pool.connection() as conn:
+                where = resolve_id_range(conn, MessageFilter(until=1))
+                result = message_page(conn, "/messages", PageRequest(10), where=where)
+        finally:
+            pool.close()
+        assert (where.min_id, where.max_id) == (0, 0)
+        assert result.rows == []
+
+
+# Every filter combination of the query builder, by (deveui, appeui, time range)
+_SHAPES = [
+    shape for shape in itertools.product((False, True), repeat=3) if shape != (False, False, False)
+]
+
+
+def filter_of(shape: tuple[bool, bool, bool]) -> MessageFilter:
+    """Return a filter of one shape, with the id bounds of its time range resolved."""
+    deveui, appeui, time_range = shape
+    return MessageFilter(
+        "d1" if deveui else None,
+        "a" if appeui else None,
+        0 if time_range else None,
+        min_id=1 if time_range else None,
+        max_id=100 if time_range else None,
+    )
+
+
+class TestFilterQueryPlans:
+    """EXPLAIN QUERY PLAN checks keeping filtered listings on their indexes.
+
+    A filtered listing must never scan a message table or sort rows.
+    """
+
+    @pytest.fixture
+    def conn(self, tmp_path: Path) -> Generator[sqlite3.Connection, None, None]:
+        """Open a fresh database; the application never runs ANALYZE."""
+        path = str(tmp_path / "test.db")
+        init_db(path)
+        conn = sqlite3.connect(path)
+        register_functions(conn)
+        yield conn
+        conn.close()
+
+    @staticmethod
+    def plan(conn: sqlite3.Connection, shape: tuple[bool, bool, bool], direction: str) -> str:
+        """Return the plan of a filtered page query, one detail per line."""
+        sql, params = filter_query(filter_of(shape), direction, 5 if direction else None)
+        rows = conn.execute(f"EXPLAIN QUERY PLAN {sql}", params + (10,)).fetchall()
+        return "\n".join(row[3] for row in rows)
+
+    @pytest.mark.parametrize("direction", ["", "before", "after"])
+    @pytest.mark.parametrize("shape", _SHAPES)
+    def test_no_scan(
+        self, conn: sqlite3.Connection, shape: tuple[bool, bool, bool], direction: str
+    ) -> None:
+        """Test that each filter combination walks the index led by its best filter."""
+        deveui, appeui, time_range = shape
+        plan = self.plan(conn, shape, direction)
+        assert "SCAN" not in plan
+        assert "TEMP B-TREE" not in plan
+        lead = plan.splitlines()[0]
+        if deveui or appeui:
+            index = "deveui" if deveui else "appeui"
+            assert lead.startswith(f"SEARCH lora_messages USING INDEX idx_lora_messages_{index}_id")
+        else:
+            assert lead.startswith("SEARCH lora_messages USING INTEGER PRIMARY KEY")
+        if time_range:
+            assert "id>? AND id<?" in lead or "rowid>? AND rowid<?" in lead
+
+    def test_id_range(self, conn: sqlite3.Connection) -> None:
+        """Test that the id bounds of a time range come from the timestamp index alone."""
+        statements: list[str] = []
+        conn.set_trace_callback(statements.append)
+        resolve_id_range(conn, MessageFilter(since=0))
+        conn.set_trace_callback(None)
+        (statement,) = statements
+        rows = conn.execute(f"EXPLAIN QUERY PLAN {statement}").fetchall()
+        assert [row[3] for row in rows] == [
+            "SEARCH lora_messages USING COVERING INDEX idx_lora_messages_timestamp "
+            "(timestamp>? AND timestamp<?)"
+        ]
+
+    @pytest.mark.parametrize("shape", _SHAPES)
+    def test_partition_tables(
+        self, conn: sqlite3.Connection, shape: tuple[bool, bool, bool]
+    ) -> None:
+        """Test that the statements rewritten for a partition search its own indexes."""
+        create_message_table(conn, "lora_messages_20240115")
+        sql, params = filter_query(filter_of(shape))
+        sql = table_sql(sql, "lora_messages_20240115")
+        rows = conn.execute(f"EXPLAIN QUERY PLAN {sql}", params + (10,)).fetchall()
+        plan = "\n".join(row[3] for row in rows)
+        assert "SCAN" not in plan
+        assert "TEMP B-TREE" not in plan
+        indexes = re.findall(r"INDEX (\w+)", plan)
+        # A time range alone walks the table's id range
+        assert indexes or "INTEGER PRIMARY KEY" in plan
+        assert all(index.startswith("idx_lora_messages_20240115_") for index in indexes)